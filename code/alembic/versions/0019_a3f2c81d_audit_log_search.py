@@ -0,0 +1,42 @@
+"""HTTP/SOAP audit log search index
+
+Revision ID: 0019_a3f2c81d
+Revises: 0018_ed18fc6a
+Create Date: 2014-08-04 11:20:41
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0019_a3f2c81d'
+down_revision = '0018_ed18fc6a'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateSequence, DropSequence
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.create_index('http_soap_audit_conn_time_idx', model.HTTSOAPAudit.__tablename__, ['conn_id', 'req_time', 'id'])
+
+    op.execute(CreateSequence(sa.Sequence('http_soap_au_tok_seq')))
+
+    op.create_table(
+        model.HTTSOAPAuditToken.__tablename__,
+        sa.Column('id', sa.Integer(), sa.Sequence('http_soap_au_tok_seq'), primary_key=True),
+        sa.Column('token', sa.String(200), nullable=False),
+        sa.Column('cid', sa.String(200), nullable=False),
+        sa.Column('event_time', sa.DateTime(), nullable=False),
+        sa.Column('cluster_id', sa.Integer(), sa.ForeignKey('cluster.id', ondelete='CASCADE'), nullable=False),
+        )
+    op.create_index('http_soap_au_tok_tok_idx', model.HTTSOAPAuditToken.__tablename__, ['token', 'cluster_id', 'cid'])
+    op.create_index('ix_http_soap_au_tok_event_time', model.HTTSOAPAuditToken.__tablename__, ['event_time'])
+
+def downgrade():
+    op.drop_table(model.HTTSOAPAuditToken.__tablename__)
+    op.execute(DropSequence(sa.Sequence('http_soap_au_tok_seq')))
+
+    op.drop_index('http_soap_audit_conn_time_idx', model.HTTSOAPAudit.__tablename__)
@@ -0,0 +1,44 @@
+"""Guaranteed delivery per-state counters and keyset pagination index
+
+Revision ID: 0020_5b7e09c4
+Revises: 0019_a3f2c81d
+Create Date: 2014-08-05 10:02:17
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0020_5b7e09c4'
+down_revision = '0019_a3f2c81d'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateSequence, DropSequence
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.create_index('delivery_def_state_used_idx', model.Delivery.__tablename__,
+        ['definition_id', 'state', 'last_used', 'task_id'])
+
+    op.execute(CreateSequence(sa.Sequence('deliv_state_cnt_seq')))
+
+    # Counters are populated by zato.pattern.delivery.reconcile-counters the next time a server starts
+    op.create_table(
+        model.DeliveryStateCount.__tablename__,
+        sa.Column('id', sa.Integer(), sa.Sequence('deliv_state_cnt_seq'), primary_key=True),
+        sa.Column('state', sa.String(200), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.Column('definition_id', sa.Integer(), sa.ForeignKey('delivery_def_base.id', ondelete='CASCADE'), nullable=False),
+        )
+    op.create_unique_constraint(
+        'delivery_state_count_definition_id_state_key', model.DeliveryStateCount.__tablename__, ['definition_id', 'state']
+        )
+
+def downgrade():
+    op.drop_table(model.DeliveryStateCount.__tablename__)
+    op.execute(DropSequence(sa.Sequence('deliv_state_cnt_seq')))
+
+    op.drop_index('delivery_def_state_used_idx', model.Delivery.__tablename__)
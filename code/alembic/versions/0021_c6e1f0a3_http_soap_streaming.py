@@ -0,0 +1,27 @@
+"""HTTP channels reading request bodies in streaming mode and maximum body sizes
+
+Revision ID: 0021_c6e1f0a3
+Revises: 0020_5b7e09c4
+Create Date: 2014-08-12 14:21:40
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0021_c6e1f0a3'
+down_revision = '0020_5b7e09c4'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('needs_streaming', sa.Boolean(), nullable=True, default=False))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('max_body_size', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column(model.HTTPSOAP.__tablename__, 'max_body_size')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'needs_streaming')
@@ -0,0 +1,29 @@
+"""Response cache configuration of HTTP channels
+
+Revision ID: 0022_8d2b4e17
+Revises: 0021_c6e1f0a3
+Create Date: 2014-08-14 09:47:05
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0022_8d2b4e17'
+down_revision = '0021_c6e1f0a3'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('cache_ttl', sa.Integer(), nullable=True))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('cache_query_params', sa.String(400), nullable=True))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('cache_headers', sa.String(400), nullable=True))
+
+def downgrade():
+    op.drop_column(model.HTTPSOAP.__tablename__, 'cache_headers')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'cache_query_params')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'cache_ttl')
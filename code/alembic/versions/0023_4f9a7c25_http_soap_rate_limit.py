@@ -0,0 +1,29 @@
+"""Rate limits of HTTP channels
+
+Revision ID: 0023_4f9a7c25
+Revises: 0022_8d2b4e17
+Create Date: 2014-08-18 11:05:32
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0023_4f9a7c25'
+down_revision = '0022_8d2b4e17'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Zato
+from zato.common.odb import model
+
+# ################################################################################################################################
+
+def upgrade():
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('rate_limit', sa.Integer(), nullable=True))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('rate_limit_period', sa.Integer(), nullable=True))
+    op.add_column(model.HTTPSOAP.__tablename__, sa.Column('rate_limit_per_client', sa.Boolean(), nullable=True, default=False))
+
+def downgrade():
+    op.drop_column(model.HTTPSOAP.__tablename__, 'rate_limit_per_client')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'rate_limit_period')
+    op.drop_column(model.HTTPSOAP.__tablename__, 'rate_limit')
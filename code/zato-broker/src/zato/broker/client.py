@@ -15,9 +15,6 @@ from traceback import format_exc
 # anyjson
 from anyjson import dumps, loads
 
-# gevent
-from gevent import spawn
-
 # Bunch
 from bunch import Bunch
 
@@ -25,8 +22,11 @@ from bunch import Bunch
 import redis
 
 # Zato
-from zato.common import BROKER, TRACE1, ZATO_NONE
-from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
+from zato.broker.pool import DispatchPool
+from zato.common import BROKER, KVDB, TRACE1, ZATO_NONE
+from zato.common.broker_message import CHANNEL, CLOUD, DEFINITION, EMAIL, HOT_DEPLOY, KEYS, MESSAGE_TYPE, \
+     MSG_JSON_POINTER, MSG_NS, MSG_XPATH, NOTIF, OUTGOING, PUB_SUB_CONSUMER, PUB_SUB_PRODUCER, PUB_SUB_TOPIC, QUERY, SEARCH, \
+     SECURITY, SERVICE, TOPICS
 from zato.common.kvdb import LuaContainer
 from zato.common.util import new_cid
 
@@ -38,6 +38,68 @@ FILE_DESCR_CLOSED_IN_ANOTHER_GREENLET = "Error while reading from socket: (9, 'F
 # We use textual messages because some error may have codes whereas different won't.
 EXPECTED_CONNECTION_ERRORS = [REMOTE_END_CLOSED_SOCKET, FILE_DESCR_CLOSED_IN_ANOTHER_GREENLET]
 
+# Actions that follow changes to configuration stored in the ODB - each one of them bumps the cluster-wide config version.
+CONFIG_CHANGE_ACTIONS = frozenset(elem.value for elem in (
+
+    SECURITY.BASIC_AUTH_CREATE, SECURITY.BASIC_AUTH_EDIT, SECURITY.BASIC_AUTH_DELETE, SECURITY.BASIC_AUTH_CHANGE_PASSWORD,
+    SECURITY.TECH_ACC_CREATE, SECURITY.TECH_ACC_EDIT, SECURITY.TECH_ACC_DELETE, SECURITY.TECH_ACC_CHANGE_PASSWORD,
+    SECURITY.WSS_CREATE, SECURITY.WSS_EDIT, SECURITY.WSS_DELETE, SECURITY.WSS_CHANGE_PASSWORD,
+    SECURITY.OAUTH_CREATE, SECURITY.OAUTH_EDIT, SECURITY.OAUTH_DELETE, SECURITY.OAUTH_CHANGE_PASSWORD,
+    SECURITY.NTLM_CREATE, SECURITY.NTLM_EDIT, SECURITY.NTLM_DELETE, SECURITY.NTLM_CHANGE_PASSWORD,
+    SECURITY.AWS_CREATE, SECURITY.AWS_EDIT, SECURITY.AWS_DELETE, SECURITY.AWS_CHANGE_PASSWORD,
+    SECURITY.OPENSTACK_CREATE, SECURITY.OPENSTACK_EDIT, SECURITY.OPENSTACK_DELETE, SECURITY.OPENSTACK_CHANGE_PASSWORD,
+    SECURITY.APIKEY_CREATE, SECURITY.APIKEY_EDIT, SECURITY.APIKEY_DELETE, SECURITY.APIKEY_CHANGE_PASSWORD,
+    SECURITY.XPATH_SEC_CREATE, SECURITY.XPATH_SEC_EDIT, SECURITY.XPATH_SEC_DELETE, SECURITY.XPATH_SEC_CHANGE_PASSWORD,
+    SECURITY.TLS_KEY_CERT_CREATE, SECURITY.TLS_KEY_CERT_EDIT, SECURITY.TLS_KEY_CERT_DELETE,
+
+    DEFINITION.AMQP_CREATE, DEFINITION.AMQP_EDIT, DEFINITION.AMQP_DELETE, DEFINITION.AMQP_CHANGE_PASSWORD,
+    DEFINITION.JMS_WMQ_CREATE, DEFINITION.JMS_WMQ_EDIT, DEFINITION.JMS_WMQ_DELETE,
+    DEFINITION.ZMQ_CREATE, DEFINITION.ZMQ_EDIT, DEFINITION.ZMQ_DELETE,
+    DEFINITION.CASSANDRA_CREATE, DEFINITION.CASSANDRA_EDIT, DEFINITION.CASSANDRA_DELETE, DEFINITION.CASSANDRA_CHANGE_PASSWORD,
+
+    OUTGOING.AMQP_CREATE, OUTGOING.AMQP_EDIT, OUTGOING.AMQP_DELETE,
+    OUTGOING.JMS_WMQ_CREATE, OUTGOING.JMS_WMQ_EDIT, OUTGOING.JMS_WMQ_DELETE,
+    OUTGOING.ZMQ_CREATE, OUTGOING.ZMQ_EDIT, OUTGOING.ZMQ_DELETE,
+    OUTGOING.SQL_CREATE_EDIT, OUTGOING.SQL_CHANGE_PASSWORD, OUTGOING.SQL_DELETE,
+    OUTGOING.HTTP_SOAP_CREATE_EDIT, OUTGOING.HTTP_SOAP_DELETE,
+    OUTGOING.FTP_CREATE_EDIT, OUTGOING.FTP_DELETE, OUTGOING.FTP_CHANGE_PASSWORD,
+
+    CHANNEL.AMQP_CREATE, CHANNEL.AMQP_EDIT, CHANNEL.AMQP_DELETE,
+    CHANNEL.JMS_WMQ_CREATE, CHANNEL.JMS_WMQ_EDIT, CHANNEL.JMS_WMQ_DELETE,
+    CHANNEL.ZMQ_CREATE, CHANNEL.ZMQ_EDIT, CHANNEL.ZMQ_DELETE,
+    CHANNEL.HTTP_SOAP_CREATE_EDIT, CHANNEL.HTTP_SOAP_DELETE,
+    CHANNEL.HTTP_SOAP_AUDIT_PATTERNS, CHANNEL.HTTP_SOAP_AUDIT_STATE, CHANNEL.HTTP_SOAP_AUDIT_CONFIG,
+
+    SERVICE.EDIT, SERVICE.DELETE,
+    HOT_DEPLOY.CREATE,
+
+    MSG_NS.CREATE, MSG_NS.EDIT, MSG_NS.DELETE,
+    MSG_XPATH.CREATE, MSG_XPATH.EDIT, MSG_XPATH.DELETE,
+    MSG_JSON_POINTER.CREATE, MSG_JSON_POINTER.EDIT, MSG_JSON_POINTER.DELETE,
+
+    PUB_SUB_TOPIC.CREATE, PUB_SUB_TOPIC.EDIT, PUB_SUB_TOPIC.DELETE,
+    PUB_SUB_TOPIC.ADD_DEFAULT_PRODUCER, PUB_SUB_TOPIC.DELETE_DEFAULT_PRODUCER,
+    PUB_SUB_PRODUCER.CREATE, PUB_SUB_PRODUCER.EDIT, PUB_SUB_PRODUCER.DELETE,
+    PUB_SUB_CONSUMER.CREATE, PUB_SUB_CONSUMER.EDIT, PUB_SUB_CONSUMER.DELETE,
+
+    CLOUD.OPENSTACK_SWIFT_CREATE_EDIT, CLOUD.OPENSTACK_SWIFT_DELETE,
+    CLOUD.AWS_S3_CREATE_EDIT, CLOUD.AWS_S3_DELETE,
+    NOTIF.CLOUD_OPENSTACK_SWIFT_CREATE_EDIT, NOTIF.CLOUD_OPENSTACK_SWIFT_DELETE,
+
+    SEARCH.ES_CREATE, SEARCH.ES_EDIT, SEARCH.ES_DELETE, SEARCH.ES_CHANGE_PASSWORD,
+    SEARCH.SOLR_CREATE, SEARCH.SOLR_EDIT, SEARCH.SOLR_DELETE, SEARCH.SOLR_CHANGE_PASSWORD,
+
+    QUERY.CASSANDRA_CREATE, QUERY.CASSANDRA_EDIT, QUERY.CASSANDRA_DELETE, QUERY.CASSANDRA_CHANGE_PASSWORD,
+
+    EMAIL.SMTP_CREATE, EMAIL.SMTP_EDIT, EMAIL.SMTP_DELETE, EMAIL.SMTP_CHANGE_PASSWORD,
+    EMAIL.IMAP_CREATE, EMAIL.IMAP_EDIT, EMAIL.IMAP_DELETE, EMAIL.IMAP_CHANGE_PASSWORD,
+))
+
+def is_config_change(msg):
+    """ Returns True if a broker message is about configuration of a cluster having changed.
+    """
+    return msg.get('action') in CONFIG_CHANGE_ACTIONS
+
 NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
     MESSAGE_TYPE.TO_PARALLEL_ANY,
 )]
@@ -45,7 +107,7 @@ NEEDS_TMP_KEY = [v for k,v in TOPICS.items() if k in(
 CODE_RENAMED = 10
 CODE_NO_SUCH_FROM_KEY = 11
 
-def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
+def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, dispatch_config=None):
     
     # Imported here so it's guaranteed to be monkey-patched using gevent.monkey.patch_all by whoever called us
     from thread import start_new_thread
@@ -116,18 +178,32 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
            that bad as it may seem, there will be at most as many clients as there
            are servers in the cluster and truth to be told, Zero MQ < 3.x also would
            do client-side PUB/SUB filtering and it did scale nicely.
+
+        Messages received are not handled in greenlets of their own - they are given
+        to a bounded DispatchPool which is configured through dispatch_config.
         """
-        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs):
+        def __init__(self, kvdb, client_type, topic_callbacks, initial_lua_programs, dispatch_config=None):
             self.kvdb = kvdb
             self.decrypt_func = kvdb.decrypt_func
             self.name = '{}-{}'.format(client_type, new_cid())
             self.topic_callbacks = topic_callbacks
             self.lua_container = LuaContainer(self.kvdb.conn, initial_lua_programs)
 
+            dispatch_config = dispatch_config or {}
+            self.dispatch_pool = DispatchPool(
+                int(dispatch_config.get('pool_size', BROKER.DISPATCH.POOL_SIZE)),
+                int(dispatch_config.get('max_queue_size', BROKER.DISPATCH.MAX_QUEUE_SIZE)),
+                dispatch_config.get('overload_policy', BROKER.DISPATCH.OVERLOAD_POLICY.BLOCK),
+                float(dispatch_config.get('block_timeout', BROKER.DISPATCH.BLOCK_TIMEOUT)),
+                self.spill,
+                int(dispatch_config.get('max_spills', BROKER.DISPATCH.MAX_SPILLS)))
+
         def run(self):
             logger.info('Starting broker client, host:[{}], port:[{}], name:[{}], topics:[{}]'.format(
                 self.kvdb.config.host, self.kvdb.config.port, self.name, sorted(self.topic_callbacks)))
 
+            self.dispatch_pool.start()
+
             self.pub_client = _ClientThread(self.kvdb.copy(), 'pub', self.name)
             self.sub_client = _ClientThread(self.kvdb.copy(), 'sub', self.name, self.topic_callbacks, self.on_message)
 
@@ -141,6 +217,11 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
         def publish(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ALL):
             msg['msg_type'] = msg_type
             topic = TOPICS[msg_type]
+
+            # Anything that cached configuration, such as config snapshots of servers, is stale now
+            if is_config_change(msg):
+                self.kvdb.conn.incr(KVDB.CONFIG_VERSION)
+
             self.pub_client.publish(topic, dumps(msg))
 
         def invoke_async(self, msg, msg_type=MESSAGE_TYPE.TO_PARALLEL_ANY, expiration=BROKER.DEFAULT_EXPIRATION):
@@ -161,6 +242,20 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
 
                 self.pub_client.publish(topic, broker_msg)
 
+        def spill(self, payload, expiration):
+            """ Returns a message to Redis so that another worker, possibly in another server, can handle it,
+            keeping it there for no longer than expiration seconds. Only messages meant for any worker can be spilled,
+            the rest must be handled by all workers they were sent to.
+            """
+            if payload.get('msg_type') != MESSAGE_TYPE.TO_PARALLEL_ANY:
+                return False
+
+            self.invoke_async(payload, MESSAGE_TYPE.TO_PARALLEL_ANY, expiration)
+            return True
+
+        def get_dispatch_stats(self):
+            return self.dispatch_pool.get_stats()
+
         def on_message(self, msg):
             if logger.isEnabledFor(logging.DEBUG):
                 logger.debug('Got broker message:[{}]'.format(msg))
@@ -189,18 +284,20 @@ def BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs):
                         logger.debug('Got broker message payload [{}]'.format(payload))
                         
                     callback = self.topic_callbacks[msg.channel]
-                    spawn(callback, payload)
+                    self.dispatch_pool.put(callback, payload)
 
                 else:
                     if logger.isEnabledFor(logging.DEBUG):
                         logger.debug('No payload in msg:[{}]'.format(msg))
 
         def close(self):
+            self.dispatch_pool.stop()
+
             for client in(self.pub_client, self.sub_client):
                 client.keep_running = False
                 client.kvdb.close()
 
-    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs)
+    client = _BrokerClient(kvdb, client_type, topic_callbacks, _initial_lua_programs, dispatch_config)
     start_new_thread(client.run, ())
     
     return client
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from itertools import count
+from math import ceil
+from time import time
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import spawn
+from gevent.lock import BoundedSemaphore
+from gevent.queue import PriorityQueue
+
+# Zato
+from zato.common import BROKER
+from zato.common.broker_message import code_to_name
+
+logger = logging.getLogger(__name__)
+
+# Config-change messages are always handled before service invocations
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+# Only actions which invoke services or carry messages in bulk may wait in line and be shed under load. Anything else,
+# e.g. SECURITY_BASIC_AUTH_CHANGE_PASSWORD or HOT_DEPLOY_CREATE, updates configuration of a worker and is never shed.
+NORMAL_PRIORITY_ACTIONS = ('SERVICE_PUBLISH', 'SCHEDULER_JOB_EXECUTED', 'CHANNEL_AMQP_MESSAGE_RECEIVED',
+    'CHANNEL_JMS_WMQ_MESSAGE_RECEIVED', 'CHANNEL_ZMQ_MESSAGE_RECEIVED', 'OUTGOING_AMQP_PUBLISH', 'NOTIF_RUN_NOTIFIER')
+
+# ################################################################################################################################
+
+def get_priority(payload):
+    """ Returns priority a given broker message should be dispatched with.
+    """
+    if code_to_name.get(payload.get('action')) in NORMAL_PRIORITY_ACTIONS:
+        return PRIORITY_NORMAL
+    return PRIORITY_HIGH
+
+# Keys spilled messages carry so that they are not passed on among overloaded workers forever
+SPILL_COUNT = 'zato_spill_count'
+SPILL_DEADLINE = 'zato_spill_deadline'
+
+def get_spilled(payload, max_spills, now=None):
+    """ Returns a copy of a message to be spilled along with for how many seconds it may still be kept in Redis,
+    or (None, None) if it's been spilled max_spills times already or its lifetime is over. Each message's lifetime
+    starts when it's first spilled, each next hop only uses up what is left of it.
+    """
+    now = now or time()
+    spill_count = payload.get(SPILL_COUNT, 0)
+    deadline = payload.get(SPILL_DEADLINE) or now + BROKER.DEFAULT_EXPIRATION
+    expiration = int(ceil(deadline - now))
+
+    if spill_count >= max_spills or expiration <= 0:
+        return None, None
+
+    payload = dict(payload)
+    payload[SPILL_COUNT] = spill_count + 1
+    payload[SPILL_DEADLINE] = deadline
+
+    return payload, expiration
+
+# ################################################################################################################################
+
+class DispatchPool(object):
+    """ A bounded pool of greenlets broker messages are handed over to. Instead of spawning a new greenlet for each
+    message received, messages are put on a priority queue and a fixed number of greenlets consume it.
+
+    High-priority messages, i.e. config changes, are always admitted. Normal-priority ones may wait in the queue
+    only up to max_queue_size messages at a time - if there are more of them, overload_policy decides what to do:
+
+    * block - the caller (subscriber reading messages off Redis) waits until there's room in the queue,
+              for up to block_timeout seconds, after which the message is shed,
+    * shed  - the message is dropped immediately,
+    * spill - the message is given to spill_func, along with for how many seconds it may still be kept, which can
+              return it to Redis for another worker to pick it up, if spill_func cannot do it (returns False),
+              or if the message has already been spilled max_spills times, e.g. because all the workers are overloaded,
+              the message is shed.
+    """
+    def __init__(self, size=BROKER.DISPATCH.POOL_SIZE, max_queue_size=BROKER.DISPATCH.MAX_QUEUE_SIZE,
+            overload_policy=BROKER.DISPATCH.OVERLOAD_POLICY.BLOCK, block_timeout=BROKER.DISPATCH.BLOCK_TIMEOUT,
+            spill_func=None, max_spills=BROKER.DISPATCH.MAX_SPILLS):
+        self.size = size
+        self.max_queue_size = max_queue_size
+        self.overload_policy = overload_policy
+        self.block_timeout = block_timeout
+        self.spill_func = spill_func
+        self.max_spills = max_spills
+
+        self.queue = PriorityQueue()
+        self.admission = BoundedSemaphore(max_queue_size)
+        self.seq = count()
+        self.keep_running = True
+
+        self.stats = Bunch()
+        self.stats.depth_high = 0
+        self.stats.depth_normal = 0
+        self.stats.max_depth = 0
+        self.stats.accepted = 0
+        self.stats.dispatched = 0
+        self.stats.errors = 0
+        self.stats.shed = 0
+        self.stats.spilled = 0
+        self.stats.wait_time_total = 0.0
+        self.stats.wait_time_max = 0.0
+        self.stats.wait_time_last = 0.0
+
+        if self.overload_policy not in BROKER.DISPATCH.OVERLOAD_POLICY:
+            raise ValueError('Unrecognized overload_policy `{}`, expected one of `{}`'.format(
+                self.overload_policy, list(BROKER.DISPATCH.OVERLOAD_POLICY)))
+
+    def start(self):
+        for x in xrange(self.size):
+            spawn(self._consume)
+
+    def stop(self):
+        self.keep_running = False
+
+        # Wake up all the consumers so they notice they should stop
+        for x in xrange(self.size):
+            self.queue.put((PRIORITY_HIGH, -1, None, None, None))
+
+# ################################################################################################################################
+
+    def _on_overload(self, callback, payload):
+        """ Invoked when a normal-priority message cannot be admitted to the queue right away.
+        Returns True if the message should be enqueued after all, False otherwise.
+        """
+        policy = self.overload_policy
+
+        if policy == BROKER.DISPATCH.OVERLOAD_POLICY.BLOCK:
+            if self.admission.acquire(timeout=self.block_timeout):
+                return True
+
+        elif policy == BROKER.DISPATCH.OVERLOAD_POLICY.SPILL and self.spill_func:
+            spilled, expiration = get_spilled(payload, self.max_spills)
+            if spilled:
+                try:
+                    if self.spill_func(spilled, expiration):
+                        self.stats.spilled += 1
+                        return False
+                except Exception, e:
+                    logger.warn('Could not spill broker message, e:`%s`', format_exc(e))
+
+        self.stats.shed += 1
+        logger.warn('Shedding broker message (%s), queue depth:`%s`, action:`%s`',
+            policy, self.stats.depth_normal, code_to_name.get(payload.get('action')))
+
+        return False
+
+    def put(self, callback, payload):
+        """ Enqueues a message for a callback to be invoked with it, subject to admission control.
+        Returns True if the message has been enqueued, False otherwise.
+        """
+        priority = get_priority(payload)
+
+        if priority == PRIORITY_NORMAL:
+            if not self.admission.acquire(blocking=False):
+                if not self._on_overload(callback, payload):
+                    return False
+            self.stats.depth_normal += 1
+        else:
+            self.stats.depth_high += 1
+
+        self.stats.accepted += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.stats.depth_high + self.stats.depth_normal)
+
+        self.queue.put((priority, next(self.seq), time(), callback, payload))
+
+        return True
+
+# ################################################################################################################################
+
+    def _consume(self):
+        while self.keep_running:
+            priority, _, enqueued_at, callback, payload = self.queue.get()
+
+            # A sentinel from self.stop
+            if not callback:
+                continue
+
+            if priority == PRIORITY_NORMAL:
+                self.stats.depth_normal -= 1
+                self.admission.release()
+            else:
+                self.stats.depth_high -= 1
+
+            wait_time = time() - enqueued_at
+            self.stats.dispatched += 1
+            self.stats.wait_time_total += wait_time
+            self.stats.wait_time_last = wait_time
+            self.stats.wait_time_max = max(self.stats.wait_time_max, wait_time)
+
+            try:
+                callback(payload)
+            except Exception, e:
+                self.stats.errors += 1
+                logger.warn('Could not invoke broker callback `%s`, e:`%s`', callback, format_exc(e))
+
+# ################################################################################################################################
+
+    def get_stats(self):
+        """ Returns a copy of current metrics, including the average time messages waited in the queue, in seconds.
+        """
+        stats = Bunch(self.stats)
+        stats.depth = stats.depth_high + stats.depth_normal
+        stats.wait_time_avg = stats.wait_time_total / stats.dispatched if stats.dispatched else 0.0
+        stats.size = self.size
+        stats.max_queue_size = self.max_queue_size
+        stats.overload_policy = self.overload_policy
+
+        return stats
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Zato
+from zato.broker.client import is_config_change
+from zato.common.broker_message import CHANNEL, DATA_DICT, OUTGOING, PUB_SUB_TOPIC, SCHEDULER, SECURITY, SERVICE, STATS
+
+# ################################################################################################################################
+
+class IsConfigChangeTestCase(TestCase):
+
+    def test_config_changes(self):
+        for action in (SECURITY.BASIC_AUTH_CREATE, SECURITY.WSS_CHANGE_PASSWORD, OUTGOING.SQL_CREATE_EDIT,
+                CHANNEL.HTTP_SOAP_DELETE, SERVICE.EDIT):
+            self.assertTrue(is_config_change({'action': action.value}), action)
+
+    def test_audit_and_default_producer_changes(self):
+        for action in (CHANNEL.HTTP_SOAP_AUDIT_CONFIG, CHANNEL.HTTP_SOAP_AUDIT_STATE, CHANNEL.HTTP_SOAP_AUDIT_PATTERNS,
+                PUB_SUB_TOPIC.ADD_DEFAULT_PRODUCER, PUB_SUB_TOPIC.DELETE_DEFAULT_PRODUCER):
+            self.assertTrue(is_config_change({'action': action.value}), action)
+
+    def test_not_config_changes(self):
+        for action in (CHANNEL.HTTP_SOAP_AUDIT_RESPONSE, CHANNEL.HTTP_SOAP_CACHE_INVALIDATE, SERVICE.PUBLISH,
+                OUTGOING.AMQP_PUBLISH, OUTGOING.CIRCUIT_BREAKER_RESET, SCHEDULER.CREATE, SCHEDULER.EXECUTE,
+                STATS.DELETE, DATA_DICT.TRANSLATION_CHANGED):
+            self.assertFalse(is_config_change({'action': action.value}), action)
+
+        self.assertFalse(is_config_change({}))
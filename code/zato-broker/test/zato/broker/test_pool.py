@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.broker.pool import DispatchPool, get_priority, get_spilled, PRIORITY_HIGH, PRIORITY_NORMAL, SPILL_COUNT, \
+     SPILL_DEADLINE
+from zato.common import BROKER
+from zato.common.broker_message import CHANNEL, HOT_DEPLOY, MSG_NS, SCHEDULER, SECURITY, SERVICE
+
+# ################################################################################################################################
+
+class GetPriorityTestCase(TestCase):
+
+    def test_config_changes_are_high_priority(self):
+        for action in (SECURITY.BASIC_AUTH_CHANGE_PASSWORD, HOT_DEPLOY.CREATE, MSG_NS.EDIT, SERVICE.EDIT,
+                CHANNEL.HTTP_SOAP_CREATE_EDIT):
+            eq_(get_priority({'action':action.value}), PRIORITY_HIGH)
+
+    def test_bulk_actions_are_normal_priority(self):
+        for action in (SERVICE.PUBLISH, SCHEDULER.JOB_EXECUTED, CHANNEL.ZMQ_MESSAGE_RECEIVED):
+            eq_(get_priority({'action':action.value}), PRIORITY_NORMAL)
+
+    def test_unknown_actions_are_high_priority(self):
+        eq_(get_priority({'action':'-1'}), PRIORITY_HIGH)
+        eq_(get_priority({}), PRIORITY_HIGH)
+
+# ################################################################################################################################
+
+class DispatchPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+
+    def callback(self, payload):
+        self.dispatched.append(payload['id'])
+
+    def get_msg(self, id, action):
+        return {'id':id, 'action':action.value}
+
+    def test_priority_ordering(self):
+        pool = DispatchPool(size=1)
+
+        # Nothing is consumed until the pool starts so config changes overtake messages enqueued before them
+        pool.put(self.callback, self.get_msg(1, SERVICE.PUBLISH))
+        pool.put(self.callback, self.get_msg(2, SERVICE.PUBLISH))
+        pool.put(self.callback, self.get_msg(3, SECURITY.BASIC_AUTH_CHANGE_PASSWORD))
+        pool.put(self.callback, self.get_msg(4, HOT_DEPLOY.CREATE))
+
+        pool.start()
+        gevent.sleep(0.01)
+        pool.stop()
+
+        eq_(self.dispatched, [3, 4, 1, 2])
+
+        stats = pool.get_stats()
+        eq_(stats.dispatched, 4)
+        eq_(stats.depth, 0)
+        eq_(stats.max_depth, 4)
+
+    def test_shed(self):
+        pool = DispatchPool(size=1, max_queue_size=1, overload_policy=BROKER.DISPATCH.OVERLOAD_POLICY.SHED)
+
+        self.assertTrue(pool.put(self.callback, self.get_msg(1, SERVICE.PUBLISH)))
+        self.assertFalse(pool.put(self.callback, self.get_msg(2, SERVICE.PUBLISH)))
+
+        # Config changes are admitted even if the queue is full
+        self.assertTrue(pool.put(self.callback, self.get_msg(3, SECURITY.BASIC_AUTH_CHANGE_PASSWORD)))
+
+        pool.start()
+        gevent.sleep(0.01)
+        pool.stop()
+
+        eq_(self.dispatched, [3, 1])
+        eq_(pool.get_stats().shed, 1)
+
+    def test_block_times_out(self):
+        pool = DispatchPool(size=1, max_queue_size=1, overload_policy=BROKER.DISPATCH.OVERLOAD_POLICY.BLOCK,
+            block_timeout=0.01)
+
+        self.assertTrue(pool.put(self.callback, self.get_msg(1, SERVICE.PUBLISH)))
+        self.assertFalse(pool.put(self.callback, self.get_msg(2, SERVICE.PUBLISH)))
+        eq_(pool.get_stats().shed, 1)
+
+    def test_spill(self):
+        spilled = []
+
+        def spill_func(payload, expiration):
+            spilled.append(payload['id'])
+            return True
+
+        pool = DispatchPool(size=1, max_queue_size=1, overload_policy=BROKER.DISPATCH.OVERLOAD_POLICY.SPILL,
+            spill_func=spill_func)
+
+        pool.put(self.callback, self.get_msg(1, SERVICE.PUBLISH))
+        self.assertFalse(pool.put(self.callback, self.get_msg(2, SERVICE.PUBLISH)))
+
+        eq_(spilled, [2])
+
+        stats = pool.get_stats()
+        eq_(stats.spilled, 1)
+        eq_(stats.shed, 0)
+
+    def test_spill_overloaded_everywhere(self):
+        max_spills = 3
+        pools = [DispatchPool(size=1, max_queue_size=1, overload_policy=BROKER.DISPATCH.OVERLOAD_POLICY.SPILL,
+            max_spills=max_spills) for x in range(2)]
+        hops = []
+
+        # Each pool passes what it cannot handle on to the other one, both of them are full
+        def get_spill_func(pool):
+            def spill_func(payload, expiration):
+                hops.append((payload[SPILL_COUNT], expiration))
+                pool.put(self.callback, payload)
+                return True
+            return spill_func
+
+        pools[0].spill_func = get_spill_func(pools[1])
+        pools[1].spill_func = get_spill_func(pools[0])
+
+        for pool in pools:
+            pool.put(self.callback, self.get_msg(0, SERVICE.PUBLISH))
+
+        self.assertFalse(pools[0].put(self.callback, self.get_msg(1, SERVICE.PUBLISH)))
+
+        # The message went back and forth max_spills times, never with its lifetime renewed, and was then shed
+        eq_([spill_count for spill_count, _ in hops], [1, 2, 3])
+        for _, expiration in hops:
+            self.assertTrue(0 < expiration <= BROKER.DEFAULT_EXPIRATION)
+
+        eq_(sum(pool.get_stats().spilled for pool in pools), max_spills)
+        eq_(sum(pool.get_stats().shed for pool in pools), 1)
+
+# ################################################################################################################################
+
+class GetSpilledTestCase(TestCase):
+
+    def test_get_spilled(self):
+        payload = {'id':1}
+
+        spilled, expiration = get_spilled(payload, 2, 1000)
+        eq_(spilled[SPILL_COUNT], 1)
+        eq_(spilled[SPILL_DEADLINE], 1000 + BROKER.DEFAULT_EXPIRATION)
+        eq_(expiration, BROKER.DEFAULT_EXPIRATION)
+        self.assertNotIn(SPILL_COUNT, payload)
+
+        # What is left of the lifetime is kept on the next hop
+        spilled, expiration = get_spilled(spilled, 2, 1010)
+        eq_(spilled[SPILL_COUNT], 2)
+        eq_(expiration, BROKER.DEFAULT_EXPIRATION - 10)
+
+        # Too many hops
+        eq_(get_spilled(spilled, 2, 1011), (None, None))
+
+    def test_get_spilled_expired(self):
+        spilled, _ = get_spilled({'id':1}, 10, 1000)
+        eq_(get_spilled(spilled, 10, 1000 + BROKER.DEFAULT_EXPIRATION), (None, None))
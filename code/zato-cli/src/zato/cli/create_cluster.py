@@ -72,6 +72,7 @@ zato_services = {
     'zato.definition.cassandra.edit':'zato.server.service.internal.definition.cassandra.Edit',
     'zato.definition.cassandra.get-by-id':'zato.server.service.internal.definition.cassandra.GetByID',
     'zato.definition.cassandra.get-list':'zato.server.service.internal.definition.cassandra.GetList',
+    'zato.definition.cassandra.get-statement-list':'zato.server.service.internal.definition.cassandra.GetStatementList',
 
     # Definitions - JMS WebSphere MQ
     'zato.definition.jms-wmq.create':'zato.server.service.internal.definition.jms_wmq.Create',
@@ -84,8 +85,11 @@ zato_services = {
     'zato.http-soap.create':'zato.server.service.internal.http_soap.Create',
     'zato.http-soap.delete':'zato.server.service.internal.http_soap.Delete',
     'zato.http-soap.edit':'zato.server.service.internal.http_soap.Edit',
+    'zato.http-soap.get-cache-stats':'zato.server.service.internal.http_soap.GetCacheStats',
     'zato.http-soap.get-list':'zato.server.service.internal.http_soap.GetList',
+    'zato.http-soap.invalidate-cache':'zato.server.service.internal.http_soap.InvalidateCache',
     'zato.http-soap.ping':'zato.server.service.internal.http_soap.Ping',
+    'zato.http-soap.prune-audit-log':'zato.server.service.internal.http_soap.PruneAuditLog',
 
     # Key/value DB
     'zato.kvdb.data-dict.dictionary.create':'zato.server.service.internal.kvdb.data_dict.dictionary.Create',
@@ -111,6 +115,10 @@ zato_services = {
     'zato.outgoing.amqp.edit':'zato.server.service.internal.outgoing.amqp.Edit',
     'zato.outgoing.amqp.get-list':'zato.server.service.internal.outgoing.amqp.GetList',
     
+    # Outgoing connections - circuit breakers
+    'zato.outgoing.circuit-breaker.get-list':'zato.server.service.internal.outgoing.circuit_breaker.GetList',
+    'zato.outgoing.circuit-breaker.reset':'zato.server.service.internal.outgoing.circuit_breaker.Reset',
+
     # Outgoing connections - FTP
     'zato.outgoing.ftp.change-password':'zato.server.service.internal.outgoing.ftp.ChangePassword',
     'zato.outgoing.ftp.create':'zato.server.service.internal.outgoing.ftp.Create',
@@ -143,9 +151,19 @@ zato_services = {
     'zato.pattern.delivery.definition.delete':'zato.server.service.internal.pattern.delivery.definition.Delete',
     'zato.pattern.delivery.definition.edit':'zato.server.service.internal.pattern.delivery.definition.Edit',
     'zato.pattern.delivery.definition.get-list':'zato.server.service.internal.pattern.delivery.definition.GetList',
+    'zato.pattern.delivery.reconcile-counters':'zato.server.service.internal.pattern.delivery.ReconcileCounters',
+    'zato.pattern.delivery.reconcile-delivery-counters':'zato.server.service.internal.pattern.delivery.ReconcileDeliveryCounters',
     
     # Ping services are added in Create.add_ping_services
 
+    # Profiler
+    'zato.profiler.get-list':'zato.server.service.internal.profiler.GetList',
+    'zato.profiler.get-overhead':'zato.server.service.internal.profiler.GetOverhead',
+    'zato.profiler.get-stacks':'zato.server.service.internal.profiler.GetStacks',
+    'zato.profiler.get-top-functions':'zato.server.service.internal.profiler.GetTopFunctions',
+    'zato.profiler.start':'zato.server.service.internal.profiler.Start',
+    'zato.profiler.stop':'zato.server.service.internal.profiler.Stop',
+
     # Scheduler
     'zato.scheduler.job.create':'zato.server.service.internal.scheduler.Create',
     'zato.scheduler.job.delete':'zato.server.service.internal.scheduler.Delete',
@@ -217,6 +235,7 @@ zato_services = {
     # Servers
     'zato.server.delete':'zato.server.service.internal.server.Delete',
     'zato.server.edit':'zato.server.service.internal.server.Edit',
+    'zato.server.get-broker-dispatch-stats':'zato.server.service.internal.server.GetBrokerDispatchStats',
     'zato.server.get-by-id':'zato.server.service.internal.server.GetByID',
 
     # Services
@@ -238,8 +257,16 @@ zato_services = {
     'zato.service.upload-package':'zato.server.service.internal.service.UploadPackage',
 
     # Statistics
+    'zato.stats.connections.get-list':'zato.server.service.internal.stats.connections.GetList',
+    'zato.stats.connections.reset':'zato.server.service.internal.stats.connections.Reset',
+    'zato.stats.apply-retention':'zato.server.service.internal.stats.ApplyRetention',
     'zato.stats.delete':'zato.server.service.internal.stats.Delete',
     'zato.stats.get-by-service':'zato.server.service.internal.stats.GetByService',
+    'zato.stats.hub-monitor.get-blocks':'zato.server.service.internal.stats.hub_monitor.GetBlocks',
+    'zato.stats.hub-monitor.get-greenlets':'zato.server.service.internal.stats.hub_monitor.GetGreenlets',
+    'zato.stats.hub-monitor.get-hub-time':'zato.server.service.internal.stats.hub_monitor.GetHubTime',
+    'zato.stats.hub-monitor.get-lag':'zato.server.service.internal.stats.hub_monitor.GetLag',
+    'zato.stats.hub-monitor.reset':'zato.server.service.internal.stats.hub_monitor.Reset',
     'zato.stats.summary.get-summary-by-day':'zato.server.service.internal.stats.summary.GetSummaryByDay',
     'zato.stats.summary.get-summary-by-month':'zato.server.service.internal.stats.summary.GetSummaryByMonth',
     'zato.stats.summary.get-summary-by-range':'zato.server.service.internal.stats.summary.GetSummaryByRange',
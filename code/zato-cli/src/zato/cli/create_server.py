@@ -96,6 +96,8 @@ queue_build_cap = 30 # All queue-based connections need to initialize in that ma
 http_proxy=
 locale=
 ensure_sql_connections_exist=True
+deploy_services_in_bulk=True
+cache_config_snapshot=True
 
 [kvdb]
 host={kvdb_host}
@@ -112,10 +114,110 @@ redis_sentinels_master=
 shadow_password_in_logs=True
 log_connection_info_sleep_time=5 # In seconds
 
+[audit_queue]
+max_size=10000
+batch_size=500
+flush_interval=1 # In seconds
+overflow_policy=drop # One of drop or block
+block_timeout=5 # In seconds
+needs_tokens=True # Whether words found in requests and responses should be indexed, audit log search looks them up in the index
+
+[audit_log]
+retention_days=30 # Entries older than that, or than audit_back_log hours of their connection, are deleted, 0 means they're never deleted
+partition_hours=1 # Old entries are deleted in windows of that many hours, each in a separate transaction
+
+[wsdl_cache]
+needs_disk_cache=True # Whether parsed WSDLs of suds outgoing connections should be kept in work_dir/wsdl-cache
+days=30 # For how many days parsed WSDLs are kept on disk
+
+[http_streaming]
+spill_threshold=1048576 # In bytes, request bodies of channels in streaming mode bigger than that are kept in temporary files
+chunk_size=65536
+
+[http_cache]
+max_size=10000 # How many responses of HTTP channels with cache_ttl set to keep, 0 disables the cache
+max_item_size=1048576 # In bytes, responses bigger than that are not cached
+
+[rate_limit]
+sync_interval=1.0 # In seconds, how often each worker adds its usage of channels' rate limits to cluster-wide counters
+max_buckets=100000 # How many per-channel and per-client buckets each worker keeps at most
+trusted_proxies=0 # How many proxies in front of servers append client addresses to X-Forwarded-For
+
+[circuit_breaker]
+is_enabled=False
+window_size=100 # Error and slow call rates of each outgoing connection are computed over that many of its most recent calls
+min_calls=20
+error_rate=0.5
+slow_call_time=5.0 # In seconds
+slow_call_rate=0.8
+open_time=30.0 # In seconds, for how long an open breaker rejects calls before letting probes through
+probes=3
+max_concurrency=0 # How many calls to each outgoing connection may be in progress at a time, 0 means there is no limit
+needs_adaptive_timeout=False
+timeout_percentile=99
+timeout_multiplier=2.0
+min_timeout=1.0 # In seconds
+
+[conn_metrics]
+is_enabled=True # Whether to keep latency histograms and pool utilisation of outgoing connections, searches and Cassandra
+
+[cassandra]
+statement_cache_size=1000 # How many prepared statements each Cassandra connection keeps
+concurrency=50 # How many statements execute_many and execute_batch may have in progress at a time
+batch_size=100 # How many statements to the same partition go into a single unlogged batch, at most
+fetch_size=1000 # How many rows each page fetched by iter_rows has
+stats_size=1000 # Statistics of how many statements each Cassandra connection keeps, 0 means none are kept
+
+[search]
+bulk_batch_size=500 # Bulk indexers send buffered documents once there are that many of them ..
+bulk_flush_interval=5.0 # .. or, in seconds, once the oldest of them has been buffered for that long
+bulk_retries=3 # How many times documents that could not be indexed are sent again
+bulk_retry_delay=1.0 # In seconds, doubled with each retry
+scroll_size=500 # How many documents each page fetched by scroll iterators has
+es_scroll_keep_alive=1m
+
+[stats]
+retention_by_minute=7 # In days, for how long per-minute aggregated statistics are kept, 0 means forever
+retention_by_hour=90
+retention_by_day=1095
+retention_by_month=0
+
+[sampling_profiler]
+max_depth=128 # Frames deeper than that are not included in stacks
+flush_interval=5 # In seconds, how often each worker adds the stacks it sampled to the ones in the KVDB
+result_ttl=86400 # In seconds, for how long profiling sessions and their results are kept
+
+[hub_monitor]
+is_enabled=True # Whether each worker should measure how late its event loop is and record calls blocking it
+interval=0.01 # In seconds, how often the loop's lag is measured
+threshold=0.1 # In seconds, the loop late by more than that is blocked and the call blocking it is recorded
+max_blocks=50 # How many most recent blocking calls each worker keeps
+max_depth=64 # Frames deeper than that are not included in stacks of blocking calls
+hub_time=False # Whether to count how long each service holds the loop for, adds a few microseconds to each greenlet switch
+
+[credentials_cache]
+max_size=10000 # How many verified HTTP Basic Auth and technical account credentials to keep, 0 disables the cache
+ttl=300 # In seconds
+
+[delivery]
+needs_batching=True # Whether new guaranteed deliveries should be stored and checked in batches
+batch_size=200
+flush_interval=0.05 # In seconds
+check_batch_size=200
+check_interval=1 # In seconds
+
+[broker_dispatch]
+pool_size=100
+max_queue_size=5000
+overload_policy=block # One of block, shed or spill
+block_timeout=10 # In seconds
+max_spills=3 # How many times a message may be passed on to other workers with overload_policy=spill before it's shed
+
 [startup_services]
 zato.helpers.input-logger=Sample payload for a startup service
 zato.notif.init-notifiers=
 zato.pattern.delivery.dispatch-auto-resubmit=
+zato.pattern.delivery.reconcile-counters=
 zato.pubsub.move-to-target-queues=
 zato.pubsub.delete-expired=
 zato.pubsub.invoke-callbacks=
@@ -204,6 +204,18 @@ class SEARCH:
             TIMEOUT = ValueConstant('10')
             POOL_SIZE = ValueConstant('5')
 
+    # New in 2.0
+    class BULK:
+        BATCH_SIZE = 500 # A bulk indexer sends its buffered documents once there are that many of them ..
+        FLUSH_INTERVAL = 5.0 # .. or, in seconds, once the oldest of them has been buffered for that long, 0 disables it
+        RETRIES = 3 # How many times documents that could not be indexed are sent again
+        RETRY_DELAY = 1.0 # In seconds, doubled with each retry
+
+    # New in 2.0
+    class SCROLL:
+        SIZE = 500 # How many documents each page fetched has
+        ES_KEEP_ALIVE = '1m' # For how long ElasticSearch keeps a scroll's context in between fetching pages
+
 class SEC_DEF_TYPE:
     APIKEY = 'apikey'
     AWS = 'aws'
@@ -241,6 +253,43 @@ DEFAULT_STATS_SETTINGS = {
     'atttention_top_threshold':10,
 }
 
+# New in 2.0
+class STATS_RETENTION:
+    BY_MINUTE = 7 # In days, for how long per-minute aggregated statistics are kept before expiring, 0 means forever
+    BY_HOUR = 90
+    BY_DAY = 1095
+    BY_MONTH = 0
+    SCAN_BATCH_SIZE = 1000 # How many keys are fetched and then expired or deleted at a time during maintenance
+
+# New in 2.0
+class STATS_HISTOGRAM:
+    FIELD = 'hist' # Under what key in hashes of aggregated statistics their histograms are kept
+    SUB_BUCKET_BITS = 5 # Each power of two is split into 2 ** 5 buckets so values are precise to within 1/32 of themselves
+    PERCENTILES = ((50, 'p50_resp_time'), (90, 'p90_resp_time'), (99, 'p99_resp_time'), (99.9, 'p99_9_resp_time'))
+
+# New in 2.0
+class PROFILER:
+    INTERVAL = 0.005 # In seconds, how often stacks of greenlets running a service being profiled are sampled ..
+    MIN_INTERVAL = 0.001 # .. but not more often than that ..
+    MAX_INTERVAL = 1.0 # .. nor less often than that
+    DURATION = 60 # In seconds, for how long a service is profiled unless told otherwise ..
+    MAX_DURATION = 3600 # .. and for how long at most
+    SAMPLE_RATE = 1.0 # What fraction of invocations of a service being profiled are actually sampled
+    MAX_DEPTH = 128 # Frames deeper than that are not included in stacks
+    FLUSH_INTERVAL = 5 # In seconds, how often each worker adds the stacks it sampled to the ones in the KVDB
+    RESULT_TTL = 86400 # In seconds, for how long sessions and their results are kept
+    MAX_SESSIONS = 100 # How many most recent sessions are listed
+    TOP_N = 25 # How many functions with the most samples are returned by default
+    WAIT_FRAME = '[greenlet-switch]' # Ends stacks of greenlets sampled while suspended, e.g. waiting for I/O
+
+# New in 2.0
+class HUB_MONITOR:
+    INTERVAL = 0.01 # In seconds, how often each worker checks how late its event loop is
+    THRESHOLD = 0.1 # In seconds, a loop late by more than that is blocked and the call blocking it is recorded
+    MAX_BLOCKS = 50 # How many most recent blocking calls each worker keeps
+    MAX_DEPTH = 64 # Frames deeper than that are not included in stacks of blocking calls
+    RUNNING_FRAME = '[running]' # Stands for the frame of the greenlet taking a census of all the greenlets
+
 class BATCH_DEFAULTS:
     PAGE_NO = 1
     SIZE = 25
@@ -331,9 +380,20 @@ class KVDB(Attrs):
 
     LOCK_SERVICE_PREFIX = '{}service:'.format(LOCK_PREFIX)
 
+    LOCK_CONFIG_SNAPSHOT = '{}config-snapshot:'.format(LOCK_SERVER_PREFIX)
+
+    # Bumped each time configuration of anything in a cluster changes ..
+    CONFIG_VERSION = 'zato:config:version'
+
+    # .. and created anew, under a random ID, each time the counter itself is lost
+    CONFIG_GENERATION = 'zato:config:generation'
+
     TRANSLATION = 'zato:kvdb:data-dict:translation'
     TRANSLATION_ID = TRANSLATION + ':id'
 
+    # Bumped each time any translation is created, updated or deleted
+    TRANSLATION_VERSION = TRANSLATION + ':version'
+
     SERVICE_USAGE = 'zato:stats:service:usage:'
     SERVICE_TIME_BASIC = 'zato:stats:service:time:basic:'
     SERVICE_TIME_RAW = 'zato:stats:service:time:raw:'
@@ -350,12 +410,24 @@ class KVDB(Attrs):
     SERVICE_SUMMARY_BY_MONTH = 'zato:stats:service:summary:by-month:'
     SERVICE_SUMMARY_BY_YEAR = 'zato:stats:service:summary:by-year:'
 
+    SERVICE_CATALOGUE = 'zato:server:service-catalogue:'
+
     REQ_RESP_SAMPLE = 'zato:req-resp:sample:'
     RESP_SLOW = 'zato:resp:slow:'
 
     DELIVERY_PREFIX = 'zato:delivery:'
+
+    # Cluster-wide number of requests each channel, or each client of a channel, sent in a given period
+    RATE_LIMIT_PREFIX = 'zato:rate-limit:'
     DELIVERY_BY_TARGET_PREFIX = '{}by-target:'.format(DELIVERY_PREFIX)
 
+    # Sampling profiler sessions and stacks collected by all the workers during each of them
+    PROFILER_PREFIX = 'zato:profiler:'
+    PROFILER_SESSIONS = '{}sessions'.format(PROFILER_PREFIX)
+    PROFILER_SESSION = '{}session:'.format(PROFILER_PREFIX)
+    PROFILER_STACKS = '{}stacks:'.format(PROFILER_PREFIX)
+    PROFILER_WORKERS = '{}workers:'.format(PROFILER_PREFIX)
+
 class SCHEDULER:
 
     class JOB_TYPE(Attrs):
@@ -429,9 +501,32 @@ class DELIVERY_CALLBACK_INVOKER(Attrs):
     SOURCE = 'source'
     TARGET = 'target'
 
+# New in 2.0
+class DELIVERY_BATCH:
+    SIZE = 200 # How many new deliveries are stored in the ODB in one transaction, at most
+    FLUSH_INTERVAL = 0.05 # In seconds, how long to wait for more deliveries before storing the ones already enqueued
+    CHECK_SIZE = 200 # How many deliveries are checked in one transaction, at most
+    CHECK_INTERVAL = 1 # In seconds, how often to look for deliveries whose targets should be checked
+
 class BROKER:
     DEFAULT_EXPIRATION = 15 # In seconds
 
+    # New in 2.0
+    class DISPATCH:
+        POOL_SIZE = 100 # How many greenlets process broker messages in a worker
+        MAX_QUEUE_SIZE = 5000 # How many normal-priority messages may wait in a worker's queue
+        BLOCK_TIMEOUT = 10 # In seconds
+        MAX_SPILLS = 3 # How many times a message may be spilled to other workers before it's shed
+
+        class OVERLOAD_POLICY(Attrs):
+            BLOCK = 'block'
+            SHED = 'shed'
+            SPILL = 'spill'
+
+            class __metaclass__(type):
+                def __iter__(self):
+                    return iter((self.BLOCK, self.SHED, self.SPILL))
+
 class MISC:
     DEFAULT_HTTP_TIMEOUT=10
     DEFAULT_AUDIT_BACK_LOG = 24 * 60 # 24 hours * 60 days ≅ 2 months
@@ -444,9 +539,106 @@ class ADAPTER_PARAMS:
     APPLY_BEFORE_REQUST = 'apply-before-request'
     APPLY_AFTER_REQUEST = 'apply-after-request'
 
+# New in 2.0
+class WSDL_CACHE:
+    DIR_NAME = 'wsdl-cache' # Relative to hot_deploy.work_dir
+    DAYS = 30 # For how many days parsed WSDLs are kept on disk
+
+# New in 2.0
+class HTTP_STREAMING:
+    SPILL_THRESHOLD = 1048576 # In bytes, request bodies of streaming channels bigger than that are kept in temporary files
+    CHUNK_SIZE = 65536 # In bytes, how much of a request body is read from a socket at a time
+
+# New in 2.0
+class HTTP_CACHE:
+    MAX_SIZE = 10000 # How many responses of HTTP channels are kept by each worker, 0 disables the cache
+    MAX_ITEM_SIZE = 1048576 # In bytes, responses bigger than that are not cached
+    METHODS = ('GET', 'HEAD')
+
+# New in 2.0
+class RATE_LIMIT:
+    PERIOD = 1 # In seconds, what period a channel's rate_limit applies to unless it's given explicitly
+    SYNC_INTERVAL = 1.0 # In seconds, how often each worker adds its local usage to cluster-wide counters in Redis
+    IDLE_TIME = 300 # In seconds, for how long buckets of clients that don't send any requests are kept
+    MAX_BUCKETS = 100000 # How many buckets a worker keeps at most, least recently used ones are deleted first
+    TRUSTED_PROXIES = 0 # How many proxies in front of servers append to X-Forwarded-For, 0 means it is not trusted at all
+
+# New in 2.0
+class FAN_OUT:
+    CONCURRENCY = 10 # How many calls of a fan-out may be in progress at a time
+
+    class MODE:
+        ALL = 'all' # Complete once all the calls succeed
+        FIRST = 'first' # Complete once the first N calls succeed
+        QUORUM = 'quorum' # Complete once a majority of the calls succeeds
+
+# New in 2.0
+class CIRCUIT_BREAKER:
+    WINDOW_SIZE = 100 # Error and slow call rates are computed over that many of the most recent calls ..
+    MIN_CALLS = 20 # .. though only once there have been at least that many of them
+    ERROR_RATE = 0.5 # A breaker opens if at least that fraction of calls fails ..
+    SLOW_CALL_TIME = 5.0 # .. or, in seconds, if calls taking longer than that ..
+    SLOW_CALL_RATE = 0.8 # .. make up at least that fraction of them
+    OPEN_TIME = 30.0 # In seconds, for how long an open breaker rejects calls before letting probes through
+    PROBES = 3 # How many probes in a row need to succeed for a half-open breaker to close
+    MAX_CONCURRENCY = 0 # How many calls to a connection may be in progress at a time, 0 means there is no limit
+    TIMEOUT_PERCENTILE = 99 # Adaptive timeouts are based on this percentile of latencies observed ..
+    TIMEOUT_MULTIPLIER = 2.0 # .. multiplied by that ..
+    MIN_TIMEOUT = 1.0 # .. but, in seconds, never lower than that nor higher than a connection's own timeout
+
+    class STATE:
+        CLOSED = 'closed'
+        OPEN = 'open'
+        HALF_OPEN = 'half-open'
+
+    class CONN_TYPE:
+        PLAIN_HTTP = 'plain_http'
+        SOAP = 'soap'
+        SQL = 'sql'
+
+# New in 2.0
+class CONN_METRICS:
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000) # In milliseconds, upper bounds of buckets
+
+    class CONN_TYPE(CIRCUIT_BREAKER.CONN_TYPE):
+        CASSANDRA = 'cassandra'
+        SEARCH_ES = 'search_es'
+        SEARCH_SOLR = 'search_solr'
+
+# New in 2.0
+class CREDENTIALS_CACHE:
+    MAX_SIZE = 10000 # How many successfully verified credentials are kept by each worker, 0 disables the cache
+    TTL = 300 # In seconds, for how long verified credentials are not checked again
+
 class AUDIT_LOG:
     REPLACE_WITH = '******'
 
+    # New in 2.0
+    class QUEUE:
+        MAX_SIZE = 10000 # How many rows may wait to be stored in the ODB
+        BATCH_SIZE = 500 # How many rows are stored in the ODB at a time, at most
+        FLUSH_INTERVAL = 1 # In seconds
+        BLOCK_TIMEOUT = 5 # In seconds
+
+        class OVERFLOW_POLICY(Attrs):
+            BLOCK = 'block'
+            DROP = 'drop'
+
+            class __metaclass__(type):
+                def __iter__(self):
+                    return iter((self.BLOCK, self.DROP))
+
+    # New in 2.0
+    class SEARCH:
+        MIN_TOKEN_LENGTH = 2
+        MAX_TOKEN_LENGTH = 200 # Same as the size of the column tokens are stored in
+        MAX_TOKENS = 1000 # How many distinct tokens of a single request or response are indexed, at most
+
+    # New in 2.0
+    class RETENTION:
+        DAYS = 0 # Entries are never deleted unless retention is configured explicitly
+        PARTITION_HOURS = 1 # Old entries are deleted one such time window at a time, each in its own transaction
+
 class INFO_FORMAT:
     DICT = 'dict'
     TEXT = 'text'
@@ -611,6 +803,14 @@ class CASSANDRA:
         ENABLED_LZ4 = ValueConstant('enabled-lz4')
         ENABLED_SNAPPY = ValueConstant('enabled-snappy')
 
+    # New in 2.0
+    class CLIENT:
+        STATEMENT_CACHE_SIZE = 1000 # How many prepared statements each connection keeps, least recently used ones are evicted
+        CONCURRENCY = 50 # How many statements execute_many and execute_batch may have in progress at a time
+        BATCH_SIZE = 100 # How many statements to the same partition go into a single unlogged batch, at most
+        FETCH_SIZE = 1000 # How many rows each page fetched by iter_rows has
+        STATS_SIZE = 1000 # Statistics of how many statements each connection keeps, least recently used ones are evicted
+
 class TLS:
     class DEFAULT(Constants):
         PREFIX_KEYS = 'tls/keys/'
@@ -735,6 +935,7 @@ class StatsElem(object):
     mean_trend_int - a list of integers representing mean response times (in ms)
     min_resp_time - minimum service response time (in ms)
     max_resp_time - maximum service response time (in ms)
+    p50_resp_time, p90_resp_time, p99_resp_time, p99_9_resp_time - response time percentiles (in ms)
     all_services_usage - how many times all the services have been invoked
     all_services_time - how much time all the services spent on processing the messages (in ms)
     mean_all_services - an arithmetical average of all the mean response times  of all services (in ms)
@@ -744,6 +945,7 @@ class StatsElem(object):
     temp_rate - a temporary place for keeping request rates, needed to get a weighted mean of uneven execution periods
     temp_mean - just like temp_rate but for mean response times
     temp_mean_count - how many periods containing a mean rate there were
+    temp_histogram - a histogram of response times, merged with ones of other periods before computing percentiles
     """
     def __init__(self, service_name=None, mean=None):
         self.service_name = service_name
@@ -755,6 +957,10 @@ class StatsElem(object):
         self.mean_trend_int = []
         self.min_resp_time = maxint # Assuming that there sure will be at least one response time lower than that
         self.max_resp_time = 0
+        self.p50_resp_time = 0
+        self.p90_resp_time = 0
+        self.p99_resp_time = 0
+        self.p99_9_resp_time = 0
         self.all_services_usage = 0
         self.all_services_time = 0
         self.mean_all_services = 0
@@ -764,6 +970,7 @@ class StatsElem(object):
         self.temp_rate = 0
         self.temp_mean = 0
         self.temp_mean_count = 0
+        self.temp_histogram = None
 
     def get_attrs(self, ignore=[]):
         for attr in dir(self):
@@ -188,6 +188,8 @@ class OUTGOING(Constants):
     FTP_DELETE = ValueConstant('')
     FTP_CHANGE_PASSWORD = ValueConstant('')
 
+    CIRCUIT_BREAKER_RESET = ValueConstant('') # New in 2.0
+
 class CHANNEL(Constants):
     code_start = 101000
 
@@ -212,6 +214,7 @@ class CHANNEL(Constants):
     HTTP_SOAP_AUDIT_PATTERNS = ValueConstant('') # New in 2.0
     HTTP_SOAP_AUDIT_STATE = ValueConstant('') # New in 2.0
     HTTP_SOAP_AUDIT_CONFIG = ValueConstant('') # New in 2.0
+    HTTP_SOAP_CACHE_INVALIDATE = ValueConstant('') # New in 2.0
 
 class AMQP_CONNECTOR(Constants):
     code_start = 101200
@@ -232,11 +235,16 @@ class SERVICE(Constants):
     DELETE = ValueConstant('')
     PUBLISH = ValueConstant('')
 
+    # New in 2.0
+    PROFILER_START = ValueConstant('')
+    PROFILER_STOP = ValueConstant('')
+
 class STATS(Constants):
     code_start = 102000
 
     DELETE = ValueConstant('')
     DELETE_DAY = ValueConstant('')
+    APPLY_RETENTION = ValueConstant('')
 
 class HOT_DEPLOY(Constants):
     code_start = 102200
@@ -354,6 +362,12 @@ class EMAIL(Constants):
     IMAP_DELETE = ValueConstant('')
     IMAP_CHANGE_PASSWORD = ValueConstant('')
 
+class DATA_DICT(Constants):
+    code_start = 105000
+
+    # New in 2.0
+    TRANSLATION_CHANGED = ValueConstant('')
+
 code_to_name = {}
 
 # To prevent 'RuntimeError: dictionary changed size during iteration'
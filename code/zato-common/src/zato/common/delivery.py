@@ -11,33 +11,43 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from contextlib import closing
 from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from itertools import count
 from json import dumps
 from logging import getLogger
 from sys import maxint
+from time import time
 from traceback import format_exc
 
 # Bunch
 from bunch import Bunch
 
+# dateutil
+from dateutil.parser import parse
+
 # gevent
-from gevent import sleep, spawn_later
+from gevent import sleep, spawn, spawn_later
+from gevent.event import AsyncResult
+from gevent.queue import Empty, Queue
 
 # retools
 from retools.lock import Lock
 
 # SQLAlchemy
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.query import orm_exc
 
 # WebHelpers
 from webhelpers.paginate import Page
 
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, DELIVERY_CALLBACK_INVOKER, DELIVERY_COUNTERS, \
+from zato.common import CHANNEL, DATA_FORMAT, DELIVERY_BATCH, DELIVERY_CALLBACK_INVOKER, DELIVERY_COUNTERS, \
      DELIVERY_HISTORY_ENTRY, DELIVERY_STATE, INVOCATION_TARGET, KVDB
 from zato.common.broker_message import SERVICE
 from zato.common.odb.model import Delivery, DeliveryDefinitionBase, DeliveryDefinitionOutconnWMQ, \
-     DeliveryHistory, DeliveryPayload
-from zato.common.odb.query import delivery, delivery_list
+     DeliveryHistory, DeliveryPayload, DeliveryStateCount
+from zato.common.odb.query import delivery, delivery_count_by_state, delivery_list
 from zato.common.util import new_cid
 
 NULL_BASIC_DATA = {
@@ -62,6 +72,25 @@ PAYLOAD_ALL_KEYS = PAYLOAD_KEYS + ('target',)
 LOCK_TIMEOUT = 0.2
 RETRY_SLEEP = 5
 
+IN_PROGRESS_STATES = (DELIVERY_STATE.IN_PROGRESS_STARTED, DELIVERY_STATE.IN_PROGRESS_RESUBMITTED,
+    DELIVERY_STATE.IN_PROGRESS_RESUBMITTED_AUTO, DELIVERY_STATE.IN_PROGRESS_TARGET_OK, DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE)
+
+# What a scheduled entry is to do once its deadline passes
+_CHECK = 'check'
+_RETRY = 'retry'
+
+def add_state_change(changes, def_id, old_state, new_state):
+    """ Records in changes, a dictionary of (def_id, state) -> delta, that a delivery moved from old_state to new_state.
+    old_state is None for deliveries that have just been created and new_state is None for deleted ones.
+    """
+    if old_state == new_state:
+        return
+
+    for state, delta in((old_state, -1), (new_state, 1)):
+        if state:
+            key = (def_id, state)
+            changes[key] = changes.get(key, 0) + delta
+
 def _item_from_api(delivery_def_base, target, payload, task_id, invoke_func, args, kwargs):
     """ Creates an invocation context. 
     """
@@ -86,14 +115,68 @@ def _item_from_api(delivery_def_base, target, payload, task_id, invoke_func, arg
 
 class DeliveryStore(object):
     """ Stores messages in a persistent storage until they are confirmed to have been delivered.
+
+    Once started, new deliveries are stored in the ODB by a background greenlet in batches of up to batch_size,
+    each batch in a single transaction, and callers wait until the batch their delivery belongs to is committed.
+    Instead of a greenlet per delivery, targets are checked by a single greenlet which keeps a deadline-ordered heap
+    of deliveries to check and looks for due ones each check_interval seconds. If the store is not started,
+    each delivery is stored and checked on its own.
     """
-    def __init__(self, kvdb=None, broker_client=None, odb=None, delivery_lock_timeout=None):
+    def __init__(self, kvdb=None, broker_client=None, odb=None, delivery_lock_timeout=None, batch_size=DELIVERY_BATCH.SIZE,
+            flush_interval=DELIVERY_BATCH.FLUSH_INTERVAL, check_batch_size=DELIVERY_BATCH.CHECK_SIZE,
+            check_interval=DELIVERY_BATCH.CHECK_INTERVAL):
         self.kvdb = kvdb
         self.broker_client = broker_client
         self.odb = odb
         self.delivery_lock_timeout = delivery_lock_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.check_batch_size = check_batch_size
+        self.check_interval = check_interval
         self.logger = getLogger(self.__class__.__name__)
-        
+
+        self.queue = Queue()
+        self.schedule = [] # A heap of (deadline, seq, action, item) tuples
+        self.seq = count()
+        self.keep_running = False
+        self.greenlets = []
+
+        self.stats = Bunch()
+        self.stats.registered = 0
+        self.stats.stored = 0
+        self.stats.insert_batches = 0
+        self.stats.insert_errors = 0
+        self.stats.checked = 0
+        self.stats.check_batches = 0
+        self.stats.check_errors = 0
+        self.stats.skipped = 0
+        self.stats.conflicts = 0
+
+    def start(self):
+        self.keep_running = True
+        self.greenlets = [spawn(self._run_inserts), spawn(self._run_checks)]
+
+    def stop(self):
+        """ Stops background greenlets and stores in the ODB all the deliveries that are still enqueued.
+        """
+        self.keep_running = False
+
+        for greenlet in self.greenlets:
+            greenlet.join(max(self.flush_interval, self.check_interval) * 2)
+
+        while True:
+            batch = self._collect(False)
+            if not batch:
+                break
+            self._insert_batch(batch)
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.queue_depth = self.queue.qsize()
+        stats.scheduled = len(self.schedule)
+
+        return stats
+
 # ##############################################################################
 
     def _history_from_source(self, delivery, item, now, entry_type):
@@ -107,6 +190,22 @@ class DeliveryStore(object):
         
         return history
 
+    def _history_row(self, delivery_id, task_id, entry_type, now, resubmit_count=0):
+        """ Same as _history_from_source but returns a dictionary for bulk inserts.
+        """
+        return {
+            'task_id': task_id,
+            'entry_type': entry_type,
+            'entry_time': now,
+            'entry_ctx': DELIVERY_HISTORY_ENTRY.NONE,
+            'resubmit_count': resubmit_count,
+            'delivery_id': delivery_id,
+        }
+
+    def _set_def_last_used(self, session, def_ids, now):
+        table = DeliveryDefinitionBase.__table__
+        session.execute(update(table).where(table.c.id.in_(list(def_ids))).values(last_used=now))
+
     def _validate_register(self, item):
         if not(item.check_after and item.retry_repeats and item.retry_seconds):
             msg = 'check_after:[{}], retry_repeats:[{}] and retry_seconds:[{}] are all required'.format(
@@ -122,20 +221,19 @@ class DeliveryStore(object):
             delivery_req[name] = item[name]
             
         item.invoke_func('zato.pattern.delivery.dispatch', delivery_req)
-        
-    def register_invoke_schedule(self, item, is_resubmit=False, is_auto=False):
-        """ Registers the task, invokes target and schedules a check to find out if the invocation was OK.
+
+    def _register(self, item, is_resubmit, is_auto):
+        """ Saves a single delivery in the ODB in its own transaction. Returns its resubmit_count.
         """
         now = datetime.utcnow()
-        
-        # Sanity check - did we get everything that was needed?
-        self._validate_register(item)
 
-        # First, save everything in the ODB
         with closing(self.odb.session()) as session:
             
+            changes = {}
+
             if is_resubmit:
                 delivery = session.merge(self.get_delivery(item.task_id))
+                old_state = delivery.state
                 delivery.state = DELIVERY_STATE.IN_PROGRESS_RESUBMITTED_AUTO if is_auto else DELIVERY_STATE.IN_PROGRESS_RESUBMITTED
                 delivery.resubmit_count += 1
                 delivery.last_used = now
@@ -147,6 +245,8 @@ class DeliveryStore(object):
                     self._history_from_source(
                         delivery, item, now, 
                         DELIVERY_HISTORY_ENTRY.SENT_FROM_SOURCE_RESUBMIT_AUTO if is_auto else DELIVERY_HISTORY_ENTRY.SENT_FROM_SOURCE_RESUBMIT))
+
+                add_state_change(changes, delivery.definition_id, old_state, delivery.state)
                 
             else:
                 delivery = Delivery()
@@ -174,11 +274,130 @@ class DeliveryStore(object):
                 # .. update time the delivery was last used ..
                 delivery.last_used = now
                 delivery.definition.last_used = now
+
+                add_state_change(changes, item.def_id, None, delivery.state)
+
+            self.update_state_counts(session, changes)
                 
             resubmit_count = delivery.resubmit_count
             
             # .. and commit the whole transaction.
             session.commit()
+
+        return resubmit_count
+
+    def _insert_many(self, items):
+        """ Saves new deliveries in the ODB using one transaction and a bulk INSERT per table.
+        """
+        now = datetime.utcnow()
+        task_ids = [item.task_id for item in items]
+
+        with closing(self.odb.session()) as session:
+            session.execute(Delivery.__table__.insert(), [{
+                'task_id': item.task_id,
+                'name': '{}/{}/{}'.format(item.def_name, item.target, item.target_type),
+                'creation_time': now,
+                'args': item.args,
+                'kwargs': item.kwargs,
+                'last_used': now,
+                'resubmit_count': 0,
+                'state': DELIVERY_STATE.IN_PROGRESS_STARTED,
+                'source_count': 1,
+                'target_count': 0,
+                'definition_id': item.def_id,
+            } for item in items])
+
+            # Payload and history rows need to point to deliveries just inserted
+            delivery_ids = dict(session.query(Delivery.task_id, Delivery.id).filter(Delivery.task_id.in_(task_ids)).all())
+
+            session.execute(DeliveryPayload.__table__.insert(), [{
+                'task_id': item.task_id,
+                'creation_time': now,
+                'payload': item.payload,
+                'delivery_id': delivery_ids[item.task_id],
+            } for item in items])
+
+            session.execute(DeliveryHistory.__table__.insert(), [
+                self._history_row(delivery_ids[item.task_id], item.task_id, DELIVERY_HISTORY_ENTRY.SENT_FROM_SOURCE, now)
+                    for item in items])
+
+            self._set_def_last_used(session, set(item.def_id for item in items), now)
+
+            changes = {}
+            for item in items:
+                add_state_change(changes, item.def_id, None, DELIVERY_STATE.IN_PROGRESS_STARTED)
+            self.update_state_counts(session, changes)
+
+            session.commit()
+
+    def _collect(self, needs_wait=True):
+        """ Returns up to batch_size enqueued deliveries, waiting for no longer than flush_interval seconds for them
+        to arrive, unless needs_wait is False in which case only deliveries already in the queue are returned.
+        """
+        batch = []
+        deadline = time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            try:
+                if needs_wait:
+                    timeout = deadline - time()
+                    if timeout <= 0:
+                        break
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _insert_batch(self, batch):
+        """ Stores a batch of (item, AsyncResult) pairs and lets their callers know that the batch has been committed.
+        Should the batch as a whole fail, each delivery is stored on its own so that a single invalid one
+        does not affect any other.
+        """
+        try:
+            self._insert_many([item for item, _ in batch])
+        except Exception, e:
+            self.stats.insert_errors += 1
+            self.logger.warn('Could not store %s deliveries in one batch, storing them one by one, e:`%s`',
+                len(batch), format_exc(e))
+
+            for item, result in batch:
+                try:
+                    result.set(self._register(item, False, False))
+                except Exception, e:
+                    result.set_exception(e)
+                else:
+                    self.stats.stored += 1
+        else:
+            self.stats.insert_batches += 1
+            self.stats.stored += len(batch)
+
+            for item, result in batch:
+                result.set(0)
+
+    def _run_inserts(self):
+        while self.keep_running:
+            batch = self._collect()
+            if batch:
+                self._insert_batch(batch)
+
+    def register_invoke_schedule(self, item, is_resubmit=False, is_auto=False):
+        """ Registers the task, invokes target and schedules a check to find out if the invocation was OK.
+        """
+        # Sanity check - did we get everything that was needed?
+        self._validate_register(item)
+
+        self.stats.registered += 1
+
+        # First, save everything in the ODB, either in a batch with other new deliveries or on its own.
+        if self.keep_running and not is_resubmit:
+            result = AsyncResult()
+            self.queue.put((item, result))
+            resubmit_count = result.get()
+        else:
+            resubmit_count = self._register(item, is_resubmit, is_auto)
             
         self.logger.info(
           'Submitting delivery [%s] for target:[%s] (%s/%s), resubmit:[%s], expire_after:[%s], check_after:[%s], retry_repeats:[%s], retry_seconds:[%s]',
@@ -188,26 +407,79 @@ class DeliveryStore(object):
         # Invoke the target now that things are in the ODB
         self._invoke_delivery_service(item)
 
-        # Spawn a greenlet to check whether target confirmed delivery
+        # Schedule a check whether target confirmed delivery
         self.spawn_check_target(item, item.check_after)
 
 # ##############################################################################
         
     def spawn_check_target(self, item, check_after):
-        """ Spawns a greenlet that checks whether the target replied and acts accordingly.
+        """ Schedules a check whether the target replied and acts accordingly.
         """
-        spawn_later(check_after, self.check_target, item)
+        if self.keep_running:
+            self._schedule(_CHECK, item, check_after)
+        else:
+            spawn_later(check_after, self.check_target, item)
+
+    def _schedule(self, action, item, after):
+        heappush(self.schedule, (time() + after, next(self.seq), action, item))
+
+    def _get_due(self, now):
+        """ Returns up to check_batch_size scheduled entries whose deadline has already passed, earliest first.
+        """
+        due = []
+        while self.schedule and self.schedule[0][0] <= now and len(due) < self.check_batch_size:
+            due.append(heappop(self.schedule))
+
+        return due
+
+    def _run_checks(self):
+        while self.keep_running:
+            sleep(self.check_interval)
+
+            while True:
+                due = self._get_due(time())
+                if not due:
+                    break
+
+                to_check = []
+                for _, _, action, item in due:
+                    if action == _RETRY:
+                        spawn(self._resend, item)
+                    else:
+                        to_check.append(item)
+
+                if to_check:
+                    try:
+                        self.check_targets(to_check)
+                    except Exception, e:
+                        # Most likely the ODB is not available so let's try again in a moment
+                        self.stats.check_errors += 1
+                        self.logger.warn('Could not check %s deliveries, will retry in %ss, e:`%s`',
+                            len(to_check), RETRY_SLEEP, format_exc(e))
+
+                        for item in to_check:
+                            self._schedule(_CHECK, item, RETRY_SLEEP)
+                        break
+
+    def _resend(self, item):
+        self.logger.info('Retrying delivery [%s] (%s/%s)', item.log_name, item.source_count, item.retry_repeats)
+        
+        self._invoke_delivery_service(item)
+        self._schedule(_CHECK, item, item.retry_seconds)
         
     def _invoke_callbacks(self, target, target_type, delivery, target_ok, in_doubt, invoker):
         """ Asynchronously notifies all callback services of the outcome of the target's invocation.
         """
-        callback_list = delivery.definition.callback_list
-        callback_list = callback_list.split(',') or []
+        self._publish_callbacks(
+            delivery.definition.callback_list, delivery.task_id, target, target_type, target_ok, in_doubt, invoker)
+
+    def _publish_callbacks(self, callback_list, task_id, target, target_type, target_ok, in_doubt, invoker):
+        callback_list = (callback_list or '').split(',')
         
         payload = dumps({
             'target_ok': target_ok,
             'in_doubt': in_doubt,
-            'task_id': delivery.task_id,
+            'task_id': task_id,
             'target': target,
             'target_type': target_type,
             'invoker': invoker
@@ -217,7 +489,7 @@ class DeliveryStore(object):
             if service:
                 broker_msg = {}
                 broker_msg['action'] = SERVICE.PUBLISH.value
-                broker_msg['task_id'] = delivery.task_id
+                broker_msg['task_id'] = task_id
                 broker_msg['channel'] = CHANNEL.DELIVERY
                 broker_msg['data_format'] = DATA_FORMAT.JSON
                 broker_msg['service'] = service
@@ -228,7 +500,7 @@ class DeliveryStore(object):
                     self.broker_client.invoke_async(broker_msg)
                 except Exception, e:
                     msg = 'Could not invoke callback:[%s], task_id:[%s], e:[%s]'.format(
-                        service, delivery.task_id, format_exc(e))
+                        service, task_id, format_exc(e))
                     self.logger.warn(msg)
         
 # ##############################################################################
@@ -238,6 +510,11 @@ class DeliveryStore(object):
         """
         with closing(self.odb.session()) as session:
             delivery = session.merge(delivery)
+
+            changes = {}
+            add_state_change(changes, delivery.definition_id, delivery.state, DELIVERY_STATE.IN_DOUBT)
+            self.update_state_counts(session, changes)
+
             delivery.state = DELIVERY_STATE.IN_DOUBT
             delivery.last_used = now
             delivery.definition.last_used = now
@@ -267,18 +544,18 @@ class DeliveryStore(object):
             delivery = session.merge(delivery)
             
             if target_ok:
-                msg_prefix = 'Confirmed delivery'
-                log_func = self.logger.info
                 expires = delivery.definition.expire_arch_succ_after
                 delivery_state = DELIVERY_STATE.CONFIRMED
                 history_entry_type = DELIVERY_HISTORY_ENTRY.ENTERED_CONFIRMED
             else:
-                msg_prefix = 'Delivery failed'
-                log_func = self.logger.warn
                 expires = delivery.definition.expire_arch_fail_after
                 delivery_state = DELIVERY_STATE.FAILED
                 history_entry_type = DELIVERY_HISTORY_ENTRY.ENTERED_FAILED
             
+            changes = {}
+            add_state_change(changes, delivery.definition_id, delivery.state, delivery_state)
+            self.update_state_counts(session, changes)
+
             delivery.state = delivery_state
             delivery.last_used = now_dt
             delivery.definition.last_used = now_dt
@@ -297,12 +574,15 @@ class DeliveryStore(object):
             session.commit()
             
             self._invoke_callbacks(item.target, item.target_type, delivery, target_ok, False, DELIVERY_CALLBACK_INVOKER.SOURCE)
-                
-            msg = '{} [{}] after {}/{} attempts, archive expires in {} hour(s) ({} UTC)'.format(
-                msg_prefix, item.log_name, delivery.source_count, delivery.definition.retry_repeats, 
-                expires, now_dt + timedelta(hours=expires))
-            
-            log_func(msg)
+            self._log_finished(item, target_ok, delivery.source_count, delivery.definition.retry_repeats, expires, now_dt)
+
+    def _log_finished(self, item, target_ok, source_count, retry_repeats, expires, now_dt):
+        msg_prefix, log_func = ('Confirmed delivery', self.logger.info) if target_ok else ('Delivery failed', self.logger.warn)
+
+        msg = '{} [{}] after {}/{} attempts, archive expires in {} hour(s) ({} UTC)'.format(
+            msg_prefix, item.log_name, source_count, retry_repeats, expires, now_dt + timedelta(hours=expires))
+        
+        log_func(msg)
             
     def retry(self, delivery, item, now):
         with closing(self.odb.session()) as session:
@@ -382,6 +662,155 @@ class DeliveryStore(object):
                     else:
                         self.finish_delivery(delivery, target_ok, now_dt, item)
 
+    def check_targets(self, items):
+        """ Checks a batch of deliveries whose time to be checked has come. Deliveries still in progress are read
+        with a single query and each of them is then claimed with an UPDATE that only succeeds if the delivery has not
+        changed since it was read. This doesn't depend on row locks, which not every ODB supports, so a delivery
+        confirmed by its target in the meantime is never overwritten - it is checked again in a moment instead.
+        """
+        now_dt = datetime.utcnow()
+        by_task_id = {}
+        is_deleted = {}
+
+        for item in items:
+            if item.def_name not in is_deleted:
+                is_deleted[item.def_name] = self.is_deleted(item.def_name)
+
+            if is_deleted[item.def_name]:
+                self.logger.info('Stopping [%s] (definition.is_deleted->True)', item.log_name)
+            else:
+                by_task_id[item.task_id] = item
+
+        if not by_task_id:
+            return
+
+        task_ids = list(by_task_id)
+        table = Delivery.__table__
+        in_doubt, confirmed, failed, retried = [], [], [], []
+
+        with closing(self.odb.session()) as session:
+            session.execute(update(table).\
+                where(table.c.task_id.in_(task_ids)).\
+                where(table.c.state.in_(IN_PROGRESS_STATES)).\
+                values(last_used=now_dt))
+
+            rows = session.query(Delivery.id, Delivery.task_id, Delivery.state, Delivery.source_count, Delivery.target_count,
+                    Delivery.resubmit_count, Delivery.args, Delivery.kwargs, DeliveryPayload.payload).\
+                filter(DeliveryPayload.delivery_id==Delivery.id).\
+                filter(Delivery.task_id.in_(task_ids)).\
+                filter(Delivery.state.in_(IN_PROGRESS_STATES)).\
+                all()
+
+            for row in rows:
+                item = by_task_id[row.task_id]
+
+                # Fetch new values because it's possible they have been changed since the last time we were invoked
+                item['payload'] = row.payload
+                item['args'] = row.args
+                item['kwargs'] = row.kwargs
+                item['delivery_id'] = row.id
+                item['resubmit_count'] = row.resubmit_count
+                item['source_count'] = row.source_count
+                item['target_count'] = row.target_count
+                item['state'] = row.state
+
+                # Same decisions as in check_target
+                if row.source_count > row.target_count:
+                    in_doubt.append(item)
+                elif row.state == DELIVERY_STATE.IN_PROGRESS_TARGET_OK:
+                    confirmed.append(item)
+                elif row.source_count < item.retry_repeats:
+                    retried.append(item)
+                else:
+                    failed.append(item)
+
+            history = []
+            changes = {}
+            conflicts = []
+
+            for state, entry_type, batch in(
+                    (DELIVERY_STATE.IN_DOUBT, DELIVERY_HISTORY_ENTRY.ENTERED_IN_DOUBT, in_doubt),
+                    (DELIVERY_STATE.CONFIRMED, DELIVERY_HISTORY_ENTRY.ENTERED_CONFIRMED, confirmed),
+                    (DELIVERY_STATE.FAILED, DELIVERY_HISTORY_ENTRY.ENTERED_FAILED, failed),
+                    (None, DELIVERY_HISTORY_ENTRY.ENTERED_RETRY, retried)):
+
+                values = {'state':state} if state else {'source_count':table.c.source_count + 1}
+                claimed = []
+
+                for item in batch:
+                    (claimed if self._claim(session, item, values) else conflicts).append(item)
+
+                # Only deliveries that have been claimed are carried on with below
+                batch[:] = claimed
+
+                history.extend(self._history_row(
+                    item.delivery_id, item.task_id, entry_type, now_dt, item.resubmit_count) for item in batch)
+
+                if state:
+                    for item in batch:
+                        add_state_change(changes, item.def_id, item.state, state)
+
+            self.update_state_counts(session, changes)
+
+            definitions = {}
+
+            if history:
+                session.execute(DeliveryHistory.__table__.insert(), history)
+
+                def_ids = set(item.def_id for item in in_doubt + confirmed + failed + retried)
+                self._set_def_last_used(session, def_ids, now_dt)
+
+                for definition in session.query(DeliveryDefinitionBase.id, DeliveryDefinitionBase.callback_list,
+                        DeliveryDefinitionBase.retry_repeats, DeliveryDefinitionBase.expire_arch_succ_after,
+                        DeliveryDefinitionBase.expire_arch_fail_after).\
+                        filter(DeliveryDefinitionBase.id.in_(list(def_ids))).\
+                        all():
+                    definitions[definition.id] = definition
+
+            session.commit()
+
+        self.stats.check_batches += 1
+        self.stats.checked += len(rows)
+        self.stats.skipped += len(by_task_id) - len(rows)
+        self.stats.conflicts += len(conflicts)
+
+        # Changed by their targets after they were read so what to do with them needs to be decided anew
+        for item in conflicts:
+            self._schedule(_CHECK, item, RETRY_SLEEP)
+
+        # Notify callbacks and schedule retries now that everything is in the ODB
+        for item in in_doubt:
+            self._publish_callbacks(definitions[item.def_id].callback_list, item.task_id, item.target, item.target_type,
+                False, True, DELIVERY_CALLBACK_INVOKER.SOURCE)
+            self.logger.warn('Delivery [%s] is in-doubt (source/target %s/%s)', item.log_name, item.source_count, item.target_count)
+
+        for target_ok, batch in((True, confirmed), (False, failed)):
+            for item in batch:
+                definition = definitions[item.def_id]
+                expires = definition.expire_arch_succ_after if target_ok else definition.expire_arch_fail_after
+
+                self._publish_callbacks(definition.callback_list, item.task_id, item.target, item.target_type,
+                    target_ok, False, DELIVERY_CALLBACK_INVOKER.SOURCE)
+                self._log_finished(item, target_ok, item.source_count, definition.retry_repeats, expires, now_dt)
+
+        # Wait a constant time before invoking the target again, same as retry does
+        for item in retried:
+            item['source_count'] += 1
+            self._schedule(_RETRY, item, RETRY_SLEEP)
+
+    def _claim(self, session, item, values):
+        """ Updates a delivery with values given on input unless it's changed since it was read in check_targets.
+        Returns True if the delivery has been updated.
+        """
+        table = Delivery.__table__
+
+        return session.execute(update(table).\
+            where(table.c.id==item.delivery_id).\
+            where(table.c.state==item.state).\
+            where(table.c.source_count==item.source_count).\
+            where(table.c.target_count==item.target_count).\
+            values(**values)).rowcount == 1
+
 # ##############################################################################
 
     def get_delivery(self, task_id):
@@ -437,6 +866,68 @@ class DeliveryStore(object):
         
         return dict(zip(keys, values))
 
+    def update_state_counts(self, session, changes):
+        """ Applies changes, a dictionary of (def_id, state) -> delta, to per-state counters of delivery definitions.
+        Must be called with the session state transitions themselves are carried out in so that counters are committed
+        or rolled back along with them.
+        """
+        table = DeliveryStateCount.__table__
+
+        # Sorted so that concurrent transactions always lock counter rows in the same order
+        for (def_id, state), delta in sorted(changes.items()):
+            if not delta:
+                continue
+
+            update_counter = update(table).\
+                where(table.c.definition_id==def_id).\
+                where(table.c.state==state).\
+                values(value=table.c.value + delta)
+
+            if session.execute(update_counter).rowcount:
+                continue
+
+            # There was no such counter yet so it needs to be created, unless another transaction has just done it
+            savepoint = session.begin_nested()
+            try:
+                session.execute(table.insert().values(definition_id=def_id, state=state, value=delta))
+            except IntegrityError:
+                savepoint.rollback()
+                session.execute(update_counter)
+            else:
+                savepoint.commit()
+
+    def get_state_counts(self, def_id):
+        """ Returns a dictionary of state -> number of deliveries of a given definition in that state.
+        """
+        with closing(self.odb.session()) as session:
+            return dict(session.query(DeliveryStateCount.state, DeliveryStateCount.value).\
+                filter(DeliveryStateCount.definition_id==def_id).\
+                all())
+
+    def reconcile_state_counts(self, def_id):
+        """ Recomputes per-state counters of a given definition from the deliveries themselves. Counter rows
+        are locked first so that transitions committed while deliveries are being counted wait until counters
+        are overwritten and only then apply their own changes on top of them. Returns counters that have been fixed.
+        """
+        with closing(self.odb.session()) as session:
+            current = dict(session.query(DeliveryStateCount.state, DeliveryStateCount.value).\
+                filter(DeliveryStateCount.definition_id==def_id).\
+                with_for_update().\
+                all())
+
+            actual = dict(delivery_count_by_state(session, def_id).all())
+
+            changes = {}
+            for state in set(current) | set(actual):
+                delta = actual.get(state, 0) - current.get(state, 0)
+                if delta:
+                    changes[(def_id, state)] = delta
+
+            self.update_state_counts(session, changes)
+            session.commit()
+
+        return dict((state, actual.get(state, 0)) for _, state in changes)
+
 # ##############################################################################
 
     def deliver(self, cluster_id, def_name, payload, task_id, invoke_func, is_resubmit=False, is_auto=False, *args, **kwargs):
@@ -479,8 +970,18 @@ class DeliveryStore(object):
             })
             
             with closing(self.odb.session()) as session:
-                delivery = session.merge(self.get_delivery(task_id))
-                delivery.state = DELIVERY_STATE.IN_PROGRESS_TARGET_OK if target_ok else DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE
+
+                # Waits for the checker if it's deciding what to do with this very delivery right now
+                delivery = session.query(Delivery).\
+                    filter(Delivery.task_id==task_id).\
+                    with_for_update().\
+                    one()
+                changes = {}
+                new_state = DELIVERY_STATE.IN_PROGRESS_TARGET_OK if target_ok else DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE
+                add_state_change(changes, delivery.definition_id, delivery.state, new_state)
+                self.update_state_counts(session, changes)
+
+                delivery.state = new_state
                 delivery.last_used = now
                 delivery.definition.last_used = now
                 delivery.target_count += 1
@@ -523,12 +1024,27 @@ class DeliveryStore(object):
                 'previous_batch_number': page.previous_page,
             }
 
+    def _get_keyset_page(self, session, cluster_id, params, state):
+        """ Returns up to batch_size instances used before the one pointed to by last_used_utc and last_task_id
+        or the most recently used ones if these are not given. Unlike _get_page, doesn't need to count all the instances.
+        """
+        last_used = params.get('last_used_utc')
+
+        return delivery_list(session, cluster_id, params.def_name, state, params.start, params.stop,
+            params.get('needs_payload', False), parse(last_used) if last_used else None, params.get('last_task_id')).\
+            limit(params.batch_size).\
+            all()
+
     def get_delivery_instance_list(self, cluster_id, params, state):
         """ Returns a batch of instances that are in the in-doubt state.
         """
         with closing(self.odb.session()) as session:
-            page = self._get_page(session, cluster_id, params, state)
-            for values in page.items:
+            if params.get('keyset_pagination'):
+                items = self._get_keyset_page(session, cluster_id, params, state)
+            else:
+                items = self._get_page(session, cluster_id, params, state).items
+
+            for values in items:
                 out = dict(zip((PAYLOAD_KEYS if params.get('needs_payload') else DELIVERY_KEYS), values))
                 for name in('creation_time_utc', 'last_used_utc'):
                     out[name] = out[name].isoformat()
@@ -597,10 +1113,5 @@ class DeliveryStore(object):
             'batch_size': maxint,
             'needs_payload': True,
         })
-        for item in self.get_delivery_instance_list(
-                cluster_id, params, [DELIVERY_STATE.IN_PROGRESS_STARTED, 
-                                      DELIVERY_STATE.IN_PROGRESS_RESUBMITTED,
-                                      DELIVERY_STATE.IN_PROGRESS_RESUBMITTED_AUTO,
-                                      DELIVERY_STATE.IN_PROGRESS_TARGET_OK, 
-                                      DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE]):
+        for item in self.get_delivery_instance_list(cluster_id, params, list(IN_PROGRESS_STATES)):
             yield item
@@ -13,7 +13,12 @@ from calendar import timegm
 from importlib import import_module
 from logging import getLogger
 from string import punctuation
-from time import gmtime
+from threading import RLock
+from time import gmtime, time
+from uuid import uuid4
+
+# Bunch
+from bunch import Bunch
 
 # PyParsing
 from pyparsing import alphanums, oneOf, OneOrMore, Optional, White, Word
@@ -65,6 +70,129 @@ class LuaContainer(object):
 
 # ################################################################################################################################
 
+def get_config_version(conn):
+    """ Returns the cluster-wide config version, i.e. a generation ID followed by a counter bumped each time configuration
+    of anything in the cluster changes. If the KVDB loses both keys, e.g. after it has been flushed or failed over,
+    the counter starts from 0 again but a new generation ID is created along with it, so versions read before that,
+    and anything cached under them, never match versions read afterwards.
+    """
+    generation = None
+
+    while not generation:
+        conn.setnx(_KVDB.CONFIG_GENERATION, uuid4().hex)
+        generation, counter = conn.mget(_KVDB.CONFIG_GENERATION, _KVDB.CONFIG_VERSION)
+
+    return '{}.{}'.format(generation, counter or 0)
+
+# ################################################################################################################################
+
+# How many names of translations are fetched, and then their values read in one pipeline, at a time
+TRANSLATION_LOAD_BATCH_SIZE = 1000
+
+class TranslationCache(object):
+    """ An in-process snapshot of all the data dictionary translations kept in KVDB. Once loaded, translating
+    values doesn't need to access KVDB at all. The snapshot is versioned - each change to translations bumps
+    the version in KVDB and is announced to all the workers so they can load the snapshot anew.
+    """
+    def __init__(self, conn=None, batch_size=TRANSLATION_LOAD_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.translations = {} # (system1, key1, value1, system2, key2) -> value2
+        self.version = None
+        self.lock = RLock()
+
+        self.stats = Bunch()
+        self.stats.hits = 0
+        self.stats.misses = 0
+        self.stats.loads = 0
+        self.stats.load_time = 0.0
+
+    def load(self):
+        """ Reads all the translations from KVDB and replaces the current snapshot with them. Names of translations
+        are iterated over with SCAN, so that Redis is never blocked for long, and values of each batch of them
+        are read in a single pipeline.
+        """
+        with self.lock:
+            start = time()
+
+            # The version is read first so that if anything changes while we are loading,
+            # the change's message will carry a newer version and we will simply load everything again.
+            version = int(self.conn.get(_KVDB.TRANSLATION_VERSION) or 0)
+            match = _KVDB.TRANSLATION + _KVDB.SEPARATOR + '*'
+
+            translations = {}
+            cursor = 0
+
+            while True:
+
+                # The cursor is returned as a string, it's 0 once the whole keyspace has been iterated over
+                cursor, names = self.conn.scan(cursor, match=match, count=self.batch_size)
+
+                if names:
+                    with self.conn.pipeline() as p:
+                        for name in names:
+                            p.hget(name, 'value2')
+                        values = p.execute()
+
+                    for name, value2 in zip(names, values):
+
+                        # Deleted in between our reading the names and values
+                        if value2 is None:
+                            continue
+
+                        translations[tuple(name.decode('utf-8').split(_KVDB.SEPARATOR)[1:])] = value2
+
+                if not int(cursor):
+                    break
+
+            self.translations = translations
+            self.version = version
+
+            load_time = time() - start
+            self.stats.loads += 1
+            self.stats.load_time += load_time
+
+            logger.info('Loaded %d translation(s) in %.3fs, version:`%s`', len(translations), load_time, version)
+
+    def on_version(self, version):
+        """ Invoked when translations have changed to a given version - loads them anew unless the snapshot is
+        already at that version or a newer one, e.g. because messages about changes arrived out of order.
+        """
+        with self.lock:
+            if self.version is None or int(version) > self.version:
+                self.load()
+
+    def translate(self, system1, key1, value1, system2, key2, default=''):
+        key = (system1, key1, value1, system2, key2)
+        value2 = self.translations.get(key)
+
+        # Byte strings with non-ASCII characters won't match unicode keys in the snapshot
+        if value2 is None:
+            value2 = self.translations.get(tuple(elem.decode('utf-8') if isinstance(elem, bytes) else elem for elem in key))
+
+        if value2 is None:
+            self.stats.misses += 1
+            return default
+
+        self.stats.hits += 1
+        return value2
+
+    def translate_many(self, items, default=''):
+        """ Translates each of the (system1, key1, value1, system2, key2) tuples on input, returns a list of results
+        in the same order.
+        """
+        translate = self.translate
+        return [translate(system1, key1, value1, system2, key2, default) for system1, key1, value1, system2, key2 in items]
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.size = len(self.translations)
+        stats.version = self.version
+
+        return stats
+
+# ################################################################################################################################
+
 class KVDB(object):
     """ A wrapper around the Zato's key-value database.
     """
@@ -16,7 +16,7 @@ from json import dumps
 from dictalchemy import make_class_dictable
 
 # SQLAlchemy
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Sequence, \
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Sequence, \
      Boolean, LargeBinary, UniqueConstraint, Enum, SmallInteger
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref, relationship
@@ -462,6 +462,30 @@ class HTTPSOAP(Base):
     # New in 2.0
     timeout = Column(Integer(), nullable=False, default=MISC.DEFAULT_HTTP_TIMEOUT)
 
+    # New in 2.0
+    needs_streaming = Column(Boolean, nullable=True, default=False)
+
+    # New in 2.0
+    max_body_size = Column(Integer, nullable=True)
+
+    # New in 2.0
+    cache_ttl = Column(Integer, nullable=True)
+
+    # New in 2.0
+    cache_query_params = Column(String(400), nullable=True)
+
+    # New in 2.0
+    cache_headers = Column(String(400), nullable=True)
+
+    # New in 2.0
+    rate_limit = Column(Integer, nullable=True)
+
+    # New in 2.0
+    rate_limit_period = Column(Integer, nullable=True)
+
+    # New in 2.0
+    rate_limit_per_client = Column(Boolean, nullable=True, default=False)
+
     service_id = Column(Integer, ForeignKey('service.id', ondelete='CASCADE'), nullable=True)
     service = relationship('Service', backref=backref('http_soap', order_by=name, cascade='all, delete, delete-orphan'))
 
@@ -475,7 +499,9 @@ class HTTPSOAP(Base):
                  url_path=None, method=None, soap_action=None, soap_version=None, data_format=None, ping_method=None,
                  pool_size=None, merge_url_params_req=None, url_params_pri=None, params_pri=None, serialization_type=None, \
                  timeout=None, service_id=None, service=None, security=None, cluster_id=None, cluster=None, service_name=None, \
-                 security_id=None, security_name=None):
+                 security_id=None, security_name=None, needs_streaming=None, max_body_size=None, cache_ttl=None, \
+                 cache_query_params=None, cache_headers=None, rate_limit=None, rate_limit_period=None, \
+                 rate_limit_per_client=None):
         self.id = id
         self.name = name
         self.is_active = is_active
@@ -503,6 +529,14 @@ class HTTPSOAP(Base):
         self.service_name = service_name # Not used by the DB
         self.security_id = security_id
         self.security_name = security_name
+        self.needs_streaming = needs_streaming
+        self.max_body_size = max_body_size
+        self.cache_ttl = cache_ttl
+        self.cache_query_params = cache_query_params
+        self.cache_headers = cache_headers
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.rate_limit_per_client = rate_limit_per_client
 
 # ################################################################################################################################
 
@@ -1135,6 +1169,10 @@ class Delivery(Base):
     """
     __tablename__ = 'delivery'
 
+    # Deliveries of a definition are browsed by state, most recently used first, using (last_used, task_id) as keys
+    # to paginate by
+    __table_args__ = (Index('delivery_def_state_used_idx', 'definition_id', 'state', 'last_used', 'task_id'), {})
+
     id = Column(Integer, Sequence('deliv_seq'), primary_key=True)
     task_id = Column(String(64), unique=True, nullable=False, index=True)
 
@@ -1185,6 +1223,20 @@ class DeliveryHistory(Base):
     delivery_id = Column(Integer, ForeignKey('delivery.id', ondelete='CASCADE'), nullable=False, primary_key=False)
     delivery = relationship(Delivery, backref=backref('history_list', order_by=entry_time, cascade='all, delete, delete-orphan'))
 
+class DeliveryStateCount(Base):
+    """ How many deliveries of a given definition are in a given state. Updated in the same transaction
+    each state transition is carried out in.
+    """
+    __tablename__ = 'delivery_state_count'
+    __table_args__ = (UniqueConstraint('definition_id', 'state'), {})
+
+    id = Column(Integer, Sequence('deliv_state_cnt_seq'), primary_key=True)
+    state = Column(String(200), nullable=False)
+    value = Column(Integer, nullable=False, default=0)
+
+    definition_id = Column(Integer, ForeignKey('delivery_def_base.id', ondelete='CASCADE'), nullable=False, primary_key=False)
+    definition = relationship(DeliveryDefinitionBase, backref=backref('state_count_list', cascade='all, delete, delete-orphan'))
+
 # ################################################################################################################################
 
 class MsgNamespace(Base):
@@ -1251,6 +1303,9 @@ class HTTSOAPAudit(Base):
     """
     __tablename__ = 'http_soap_audit'
 
+    # Audit log is browsed from the newest entries to the oldest ones, using (req_time, id) as keys to paginate by
+    __table_args__ = (Index('http_soap_audit_conn_time_idx', 'conn_id', 'req_time', 'id'), {})
+
     id = Column(Integer, Sequence('http_soap_audit_seq'), primary_key=True)
     name = Column(String(200), nullable=False, index=True)
     cid = Column(String(200), nullable=False, index=True)
@@ -1299,6 +1354,26 @@ class HTTSOAPAudit(Base):
         self.resp_headers = resp_headers
         self.resp_payload = resp_payload
 
+class HTTSOAPAuditToken(Base):
+    """ A search index of HTTP/SOAP audit log - each row is a word found in a request or response of a given CID.
+    """
+    __tablename__ = 'http_soap_au_tok'
+    __table_args__ = (Index('http_soap_au_tok_tok_idx', 'token', 'cluster_id', 'cid'), {})
+
+    id = Column(Integer, Sequence('http_soap_au_tok_seq'), primary_key=True)
+    token = Column(String(200), nullable=False)
+    cid = Column(String(200), nullable=False)
+    event_time = Column(DateTime(), nullable=False, index=True)
+
+    cluster_id = Column(Integer, ForeignKey('cluster.id', ondelete='CASCADE'), nullable=False)
+
+    def __init__(self, id=None, token=None, cid=None, event_time=None, cluster_id=None):
+        self.id = id
+        self.token = token
+        self.cid = cid
+        self.event_time = event_time
+        self.cluster_id = cluster_id
+
 class HTTSOAPAuditReplacePatternsJSONPointer(Base):
     """ JSONPointer replace patterns for HTTP/SOAP connections.
     """
@@ -13,7 +13,7 @@ import logging
 from functools import wraps
 
 # SQLAlchemy
-from sqlalchemy import func, not_
+from sqlalchemy import and_, func, not_, or_, select
 from sqlalchemy.sql.expression import case
 
 # Zato
@@ -21,10 +21,12 @@ from zato.common import DEFAULT_HTTP_PING_METHOD, DEFAULT_HTTP_POOL_SIZE, HTTP_S
      URL_PARAMS_PRIORITY
 from zato.common.odb.model import AWSS3, APIKeySecurity, AWSSecurity, CassandraConn, CassandraQuery, ChannelAMQP, ChannelWMQ, \
      ChannelZMQ, Cluster, ConnDefAMQP, ConnDefWMQ, CronStyleJob, DeliveryDefinitionBase, Delivery, DeliveryHistory, \
-     DeliveryPayload, ElasticSearch, JSONPointer, HTTPBasicAuth, HTTPSOAP, HTTSOAPAudit, IMAP, IntervalBasedJob, Job, \
-     MsgNamespace, NotificationOpenStackSwift as NotifOSS, NTLM, OAuth, OpenStackSecurity, OpenStackSwift, OutgoingAMQP, \
-     OutgoingFTP, OutgoingWMQ, OutgoingZMQ, PubSubConsumer, PubSubProducer, PubSubTopic, SecurityBase, Server, Service, SMTP, \
-     Solr, SQLConnectionPool, TechnicalAccount, TLSKeyCertSecurity, WSSDefinition, XPath, XPathSecurity
+     DeliveryPayload, ElasticSearch, JSONPointer, HTTPBasicAuth, HTTPSOAP, HTTSOAPAudit, HTTSOAPAuditToken, IMAP, \
+     IntervalBasedJob, Job, MsgNamespace, NotificationOpenStackSwift as NotifOSS, NTLM, OAuth, OpenStackSecurity, \
+     OpenStackSwift, OutgoingAMQP, OutgoingFTP, OutgoingWMQ, OutgoingZMQ, PubSubConsumer, PubSubProducer, PubSubTopic, \
+     SecurityBase, Server, Service, SMTP, Solr, SQLConnectionPool, TechnicalAccount, TLSKeyCertSecurity, WSSDefinition, XPath, \
+     XPathSecurity
+from zato.common.odb.util import get_search_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -469,6 +471,15 @@ def _http_soap(session, cluster_id):
         HTTPSOAP.audit_max_payload,
         HTTPSOAP.audit_repl_patt_type,
         HTTPSOAP.timeout,
+        case([(HTTPSOAP.needs_streaming != None, HTTPSOAP.needs_streaming)], else_=False).label('needs_streaming'),
+        HTTPSOAP.max_body_size,
+        HTTPSOAP.cache_ttl,
+        HTTPSOAP.cache_query_params,
+        HTTPSOAP.cache_headers,
+        HTTPSOAP.rate_limit,
+        HTTPSOAP.rate_limit_period,
+        case([(HTTPSOAP.rate_limit_per_client != None, HTTPSOAP.rate_limit_per_client)], else_=False).label(
+            'rate_limit_per_client'),
         SecurityBase.sec_type,
         Service.name.label('service_name'),
         Service.id.label('service_id'),
@@ -614,7 +625,11 @@ def delivery_count_by_state(session, def_id):
         filter(Delivery.definition_id==def_id).\
         group_by(Delivery.state)
 
-def delivery_list(session, cluster_id, def_name, state, start=None, stop=None, needs_payload=False):
+def delivery_list(session, cluster_id, def_name, state, start=None, stop=None, needs_payload=False,
+        last_used=None, last_task_id=None):
+    """ Deliveries of a given definition, most recently used first. If last_used and last_task_id are given,
+    only deliveries following the one they point to are returned.
+    """
     columns = [
         DeliveryDefinitionBase.name.label('def_name'),
         DeliveryDefinitionBase.target_type,
@@ -648,7 +663,12 @@ def delivery_list(session, cluster_id, def_name, state, start=None, stop=None, n
     if stop:
         q = q.filter(Delivery.last_used <= stop)
 
-    q = q.order_by(Delivery.last_used.desc())
+    if last_used:
+        q = q.filter(or_(
+            Delivery.last_used < last_used,
+            and_(Delivery.last_used == last_used, Delivery.task_id < last_task_id)))
+
+    q = q.order_by(Delivery.last_used.desc(), Delivery.task_id.desc())
 
     return q
 
@@ -717,7 +737,8 @@ def json_pointer_list(session, cluster_id, needs_columns=False):
 
 # ################################################################################################################################
 
-def _http_soap_audit(session, cluster_id, conn_id=None, start=None, stop=None, query=None, id=None, needs_req_payload=False):
+def _http_soap_audit(session, cluster_id, conn_id=None, start=None, stop=None, query=None, id=None, needs_req_payload=False,
+        last_req_time=None, last_id=None):
     columns = [
         HTTSOAPAudit.id,
         HTTSOAPAudit.name.label('conn_name'),
@@ -737,15 +758,29 @@ def _http_soap_audit(session, cluster_id, conn_id=None, start=None, stop=None, q
             HTTSOAPAudit.req_headers, HTTSOAPAudit.req_payload, HTTSOAPAudit.resp_headers, HTTSOAPAudit.resp_payload
         ])
 
-    q = session.query(*columns)
+    q = session.query(*columns).\
+        filter(HTTSOAPAudit.cluster_id == cluster_id)
     
     if query:
-        query = '%{}%'.format(query)
-        q = q.filter(
-            HTTSOAPAudit.cid.ilike(query) | \
-            HTTSOAPAudit.req_headers.ilike(query) | HTTSOAPAudit.req_payload.ilike(query) | \
-            HTTSOAPAudit.resp_headers.ilike(query) | HTTSOAPAudit.resp_payload.ilike(query)
-        )
+        tokens = get_search_tokens(query)
+
+        # Each of the words looked for must have been found, as a whole word, in a CID, a request or its response ..
+        if tokens:
+            for token in tokens:
+                q = q.filter(HTTSOAPAudit.cid.in_(
+                    select([HTTSOAPAuditToken.cid]).\
+                    where(HTTSOAPAuditToken.token==token).\
+                    where(HTTSOAPAuditToken.cluster_id==cluster_id)))
+
+        # .. unless there are no words that could have been indexed at all, i.e. the query is too short,
+        # in which case it is looked for as a substring.
+        else:
+            query = '%{}%'.format(query)
+            q = q.filter(
+                HTTSOAPAudit.cid.ilike(query) | \
+                HTTSOAPAudit.req_headers.ilike(query) | HTTSOAPAudit.req_payload.ilike(query) | \
+                HTTSOAPAudit.resp_headers.ilike(query) | HTTSOAPAudit.resp_payload.ilike(query)
+            )
 
     if id:
         q = q.filter(HTTSOAPAudit.id == id)
@@ -757,14 +792,21 @@ def _http_soap_audit(session, cluster_id, conn_id=None, start=None, stop=None, q
         q = q.filter(HTTSOAPAudit.req_time >= start)
 
     if stop:
-        q = q.filter(HTTSOAPAudit.req_time <= start)
+        q = q.filter(HTTSOAPAudit.req_time <= stop)
+
+    # Keyset pagination - only entries older than the last one already returned
+    if last_req_time:
+        q = q.filter(or_(
+            HTTSOAPAudit.req_time < last_req_time,
+            and_(HTTSOAPAudit.req_time == last_req_time, HTTSOAPAudit.id < last_id)))
 
-    q = q.order_by(HTTSOAPAudit.req_time.desc())
+    q = q.order_by(HTTSOAPAudit.req_time.desc(), HTTSOAPAudit.id.desc())
 
     return q
 
-def http_soap_audit_item_list(session, cluster_id, conn_id, start, stop, query, needs_req_payload):
-    return _http_soap_audit(session, cluster_id, conn_id, start, stop, query)
+def http_soap_audit_item_list(session, cluster_id, conn_id, start, stop, query, needs_req_payload, last_req_time=None,
+        last_id=None):
+    return _http_soap_audit(session, cluster_id, conn_id, start, stop, query, last_req_time=last_req_time, last_id=last_id)
 
 def http_soap_audit_item(session, cluster_id, id):
     return _http_soap_audit(session, cluster_id, id=id, needs_req_payload=True)
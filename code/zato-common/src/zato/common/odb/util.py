@@ -7,13 +7,16 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 """
 
 # stdlib
+import re
 from logging import getLogger
 
 # Zato
-from zato.common import engine_def, engine_def_sqlite, ZATO_NOT_GIVEN
+from zato.common import AUDIT_LOG, engine_def, engine_def_sqlite, ZATO_NOT_GIVEN
 
 logger = getLogger(__name__)
 
+search_token_re = re.compile(r'\w+', re.UNICODE)
+
 django_sa_mappings = {
     'NAME': 'sqlite_path',
     'HOST': 'host',
@@ -83,3 +86,27 @@ def get_engine_url(args):
             attrs['db_name'] = sqlite_path
 
     return (engine_def_sqlite if is_sqlite else engine_def).format(**attrs)
+
+def get_search_tokens(*values, **kwargs):
+    """ Returns a set of lower-cased words found in values given on input, such as payloads of requests,
+    to index them with or, on the other side, to look them up in an index with. Tokens that are too short
+    are ignored, too long ones are truncated and no more than max_tokens of them are returned.
+    """
+    max_tokens = kwargs.get('max_tokens', AUDIT_LOG.SEARCH.MAX_TOKENS)
+    out = set()
+
+    for value in values:
+        if not value:
+            continue
+
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+
+        for token in search_token_re.findall(value.lower()):
+            if len(token) >= AUDIT_LOG.SEARCH.MIN_TOKEN_LENGTH:
+                out.add(token[:AUDIT_LOG.SEARCH.MAX_TOKEN_LENGTH])
+
+                if len(out) == max_tokens:
+                    return out
+
+    return out
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from time import time
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent.event import AsyncResult
+
+# nose
+from nose.tools import eq_
+
+# SQLAlchemy
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common import DELIVERY_HISTORY_ENTRY, DELIVERY_STATE
+from zato.common.delivery import _CHECK, _RETRY, add_state_change, DeliveryStore
+from zato.common.odb.model import Base, Delivery, DeliveryDefinitionBase, DeliveryHistory, DeliveryPayload, DeliveryStateCount
+from zato.common.test import rand_int, rand_string
+
+# ################################################################################################################################
+
+class DummyDeliveryStore(DeliveryStore):
+    def __init__(self, *args, **kwargs):
+        super(DummyDeliveryStore, self).__init__(*args, **kwargs)
+        self.needs_batch_error = False
+        self.invalid_task_ids = []
+        self.batches = []
+        self.registered = []
+
+    def _insert_many(self, items):
+        if self.needs_batch_error:
+            raise Exception('Dummy batch error')
+        self.batches.append(items)
+
+    def _register(self, item, is_resubmit, is_auto):
+        if item.task_id in self.invalid_task_ids:
+            raise ValueError(item.task_id)
+        self.registered.append(item)
+        return 0
+
+    def is_deleted(self, name):
+        return True
+
+# ################################################################################################################################
+
+def get_item():
+    return Bunch(task_id=rand_string(), def_name=rand_string(), log_name=rand_string(), retry_seconds=rand_int())
+
+# ################################################################################################################################
+
+class DeliveryStoreTestCase(TestCase):
+
+    def test_due_checks_earliest_first(self):
+        store = DummyDeliveryStore(check_batch_size=2)
+        store.keep_running = True
+
+        item1, item2, item3, item4 = get_item(), get_item(), get_item(), get_item()
+
+        store.spawn_check_target(item3, 3)
+        store.spawn_check_target(item1, 1)
+        store.spawn_check_target(item4, 1000)
+        store.spawn_check_target(item2, 2)
+
+        eq_(store.get_stats().scheduled, 4)
+
+        now = time() + 10
+
+        due = store._get_due(now)
+        eq_([item for _, _, _, item in due], [item1, item2])
+        eq_(set(action for _, _, action, _ in due), set([_CHECK]))
+
+        due = store._get_due(now)
+        eq_([item for _, _, _, item in due], [item3])
+
+        eq_(store._get_due(now), [])
+        eq_(store.get_stats().scheduled, 1)
+
+    def test_insert_batch(self):
+        store = DummyDeliveryStore()
+        batch = [(get_item(), AsyncResult()) for x in range(3)]
+
+        store._insert_batch(batch)
+
+        eq_(store.batches, [[item for item, _ in batch]])
+        eq_([result.get() for _, result in batch], [0, 0, 0])
+
+        stats = store.get_stats()
+        eq_(stats.insert_batches, 1)
+        eq_(stats.stored, 3)
+
+    def test_insert_batch_falls_back_to_one_by_one(self):
+        store = DummyDeliveryStore()
+        store.needs_batch_error = True
+
+        batch = [(get_item(), AsyncResult()) for x in range(3)]
+        invalid_item, invalid_result = batch[1]
+        store.invalid_task_ids.append(invalid_item.task_id)
+
+        store._insert_batch(batch)
+
+        eq_(store.registered, [batch[0][0], batch[2][0]])
+        eq_(batch[0][1].get(), 0)
+        eq_(batch[2][1].get(), 0)
+        self.assertRaises(ValueError, invalid_result.get)
+
+        stats = store.get_stats()
+        eq_(stats.insert_errors, 1)
+        eq_(stats.stored, 2)
+
+    def test_stop_stores_enqueued_deliveries(self):
+        store = DummyDeliveryStore(batch_size=2)
+
+        for x in range(5):
+            store.queue.put((get_item(), AsyncResult()))
+
+        eq_(store.get_stats().queue_depth, 5)
+
+        store.stop()
+
+        eq_([len(items) for items in store.batches], [2, 2, 1])
+        eq_(store.get_stats().queue_depth, 0)
+
+    def test_check_targets_skips_deleted_definitions(self):
+
+        # The ODB is not needed at all if all the definitions have been deleted
+        store = DummyDeliveryStore(odb=None)
+        store.check_targets([get_item(), get_item()])
+
+        eq_(store.get_stats().check_batches, 0)
+
+# ################################################################################################################################
+
+class DummyODB(object):
+    def __init__(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine, tables=[DeliveryDefinitionBase.__table__, Delivery.__table__,
+            DeliveryPayload.__table__, DeliveryHistory.__table__, DeliveryStateCount.__table__])
+        self.session = sessionmaker(bind=engine)
+
+class CheckTargetsDeliveryStore(DeliveryStore):
+    def __init__(self, *args, **kwargs):
+        super(CheckTargetsDeliveryStore, self).__init__(*args, **kwargs)
+        self.confirmed_meanwhile = []
+
+    def is_deleted(self, name):
+        return False
+
+    def _claim(self, session, item, values):
+
+        # Confirmed by its target after check_targets read it but before it was claimed
+        if item.task_id in self.confirmed_meanwhile:
+            table = Delivery.__table__
+            session.execute(update(table).where(table.c.id==item.delivery_id).values(
+                state=DELIVERY_STATE.IN_PROGRESS_TARGET_OK, target_count=table.c.target_count + 1))
+
+        return super(CheckTargetsDeliveryStore, self)._claim(session, item, values)
+
+class CheckTargetsTestCase(TestCase):
+
+    def setUp(self):
+        self.def_id = 1
+        self.retry_repeats = 3
+
+        self.store = CheckTargetsDeliveryStore(odb=DummyODB())
+        self.session = self.store.odb.session()
+
+        self.session.execute(DeliveryDefinitionBase.__table__.insert().values(id=self.def_id, name='my.def', short_def='',
+            target_type='service', expire_after=1, expire_arch_succ_after=24, expire_arch_fail_after=48, check_after=1,
+            retry_repeats=self.retry_repeats, retry_seconds=1, cluster_id=1))
+
+        # Counters already exist so they are only updated
+        for state in DELIVERY_STATE.IN_PROGRESS_STARTED, DELIVERY_STATE.IN_PROGRESS_TARGET_OK, \
+                DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE, DELIVERY_STATE.IN_DOUBT, DELIVERY_STATE.CONFIRMED, \
+                DELIVERY_STATE.FAILED:
+            self.session.add(DeliveryStateCount(state=state, value=1, definition_id=self.def_id))
+
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def add_delivery(self, state, source_count, target_count):
+        now = datetime.utcnow()
+
+        delivery = Delivery(task_id=rand_string(), name='my.def', creation_time=now, state=state,
+            source_count=source_count, target_count=target_count, resubmit_count=0, definition_id=self.def_id)
+        self.session.add(delivery)
+        self.session.flush()
+
+        self.session.add(DeliveryPayload(task_id=delivery.task_id, creation_time=now, payload=b'123',
+            delivery_id=delivery.id))
+        self.session.commit()
+
+        return Bunch(task_id=delivery.task_id, def_id=self.def_id, def_name='my.def', log_name=delivery.task_id,
+            retry_repeats=self.retry_repeats, target='my.service', target_type='service')
+
+    def get_delivery(self, task_id):
+        self.session.expire_all()
+        return self.session.query(Delivery).filter(Delivery.task_id==task_id).one()
+
+    def get_history(self, task_id):
+        return [elem.entry_type for elem in self.session.query(DeliveryHistory).filter(DeliveryHistory.task_id==task_id)]
+
+    def test_check_targets_state_transitions(self):
+        confirmed = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_TARGET_OK, 1, 1)
+        retried = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_STARTED, self.retry_repeats - 1, self.retry_repeats - 1)
+        failed = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE, self.retry_repeats, self.retry_repeats)
+
+        self.store.check_targets([confirmed, retried, failed])
+
+        # Confirmed by its target
+        eq_(self.get_delivery(confirmed.task_id).state, DELIVERY_STATE.CONFIRMED)
+        eq_(self.get_history(confirmed.task_id), [DELIVERY_HISTORY_ENTRY.ENTERED_CONFIRMED])
+
+        # Still has attempts left so it stays in progress and is invoked once more
+        delivery = self.get_delivery(retried.task_id)
+        eq_(delivery.state, DELIVERY_STATE.IN_PROGRESS_STARTED)
+        eq_(delivery.source_count, self.retry_repeats)
+        eq_(self.get_history(retried.task_id), [DELIVERY_HISTORY_ENTRY.ENTERED_RETRY])
+        eq_(retried.source_count, self.retry_repeats)
+        eq_([(action, elem) for _, _, action, elem in self.store.schedule], [(_RETRY, retried)])
+
+        # That was the last attempt
+        eq_(self.get_delivery(failed.task_id).state, DELIVERY_STATE.FAILED)
+        eq_(self.get_history(failed.task_id), [DELIVERY_HISTORY_ENTRY.ENTERED_FAILED])
+
+        eq_(self.store.get_state_counts(self.def_id), {
+            DELIVERY_STATE.IN_PROGRESS_STARTED: 1,
+            DELIVERY_STATE.IN_PROGRESS_TARGET_OK: 0,
+            DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE: 0,
+            DELIVERY_STATE.IN_DOUBT: 1,
+            DELIVERY_STATE.CONFIRMED: 2,
+            DELIVERY_STATE.FAILED: 2,
+        })
+
+        stats = self.store.get_stats()
+        eq_(stats.check_batches, 1)
+        eq_(stats.checked, 3)
+        eq_(stats.skipped, 0)
+
+    def test_check_targets_in_doubt(self):
+        item = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_STARTED, 2, 1)
+
+        self.store.check_targets([item])
+
+        eq_(self.get_delivery(item.task_id).state, DELIVERY_STATE.IN_DOUBT)
+        eq_(self.get_history(item.task_id), [DELIVERY_HISTORY_ENTRY.ENTERED_IN_DOUBT])
+        eq_(self.store.schedule, [])
+
+        counts = self.store.get_state_counts(self.def_id)
+        eq_(counts[DELIVERY_STATE.IN_PROGRESS_STARTED], 0)
+        eq_(counts[DELIVERY_STATE.IN_DOUBT], 2)
+
+    def test_check_targets_skips_finished_deliveries(self):
+
+        # Confirmed by its target in the meantime, e.g. by check_target, so there is nothing left to do
+        item = self.add_delivery(DELIVERY_STATE.CONFIRMED, 1, 1)
+
+        self.store.check_targets([item])
+
+        eq_(self.get_delivery(item.task_id).state, DELIVERY_STATE.CONFIRMED)
+        eq_(self.get_history(item.task_id), [])
+
+        stats = self.store.get_stats()
+        eq_(stats.checked, 0)
+        eq_(stats.skipped, 1)
+
+    def test_check_targets_confirmed_meanwhile(self):
+        item = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_STARTED, 2, 1)
+        other = self.add_delivery(DELIVERY_STATE.IN_PROGRESS_STARTED, 2, 1)
+        self.store.confirmed_meanwhile.append(item.task_id)
+
+        self.store.check_targets([item, other])
+
+        # The target's confirmation is not overwritten and the delivery will be checked again ..
+        delivery = self.get_delivery(item.task_id)
+        eq_(delivery.state, DELIVERY_STATE.IN_PROGRESS_TARGET_OK)
+        eq_(delivery.target_count, 2)
+        eq_(self.get_history(item.task_id), [])
+        eq_([(action, elem) for _, _, action, elem in self.store.schedule], [(_CHECK, item)])
+
+        # .. but other deliveries of the batch are not affected.
+        eq_(self.get_delivery(other.task_id).state, DELIVERY_STATE.IN_DOUBT)
+        eq_(self.get_history(other.task_id), [DELIVERY_HISTORY_ENTRY.ENTERED_IN_DOUBT])
+
+        counts = self.store.get_state_counts(self.def_id)
+        eq_(counts[DELIVERY_STATE.IN_PROGRESS_STARTED], 0)
+        eq_(counts[DELIVERY_STATE.IN_DOUBT], 2)
+
+        stats = self.store.get_stats()
+        eq_(stats.checked, 2)
+        eq_(stats.conflicts, 1)
+
+# ################################################################################################################################
+
+class AddStateChangeTestCase(TestCase):
+
+    def test_add_state_change(self):
+        def_id1 = rand_int()
+        def_id2 = def_id1 + 1
+        changes = {}
+
+        add_state_change(changes, def_id1, None, DELIVERY_STATE.IN_PROGRESS_STARTED)
+        add_state_change(changes, def_id1, None, DELIVERY_STATE.IN_PROGRESS_STARTED)
+        add_state_change(changes, def_id1, DELIVERY_STATE.IN_PROGRESS_STARTED, DELIVERY_STATE.IN_DOUBT)
+        add_state_change(changes, def_id2, DELIVERY_STATE.CONFIRMED, None)
+        add_state_change(changes, def_id2, DELIVERY_STATE.FAILED, DELIVERY_STATE.FAILED)
+
+        eq_(changes, {
+            (def_id1, DELIVERY_STATE.IN_PROGRESS_STARTED): 1,
+            (def_id1, DELIVERY_STATE.IN_DOUBT): 1,
+            (def_id2, DELIVERY_STATE.CONFIRMED): -1,
+        })
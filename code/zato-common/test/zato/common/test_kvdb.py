@@ -18,7 +18,8 @@ from bunch import Bunch
 from nose.tools import eq_
 
 # Zato
-from zato.common.kvdb import KVDB
+from zato.common import KVDB as _KVDB
+from zato.common.kvdb import get_config_version, KVDB, TranslationCache
 from zato.common.test import rand_string, rand_int
 
 # ##############################################################################
@@ -94,4 +95,149 @@ class KVDBTestCase(TestCase):
         kvdb = FakeKVDB(config=config, decrypt_func=decrypt_func)
         kvdb.init()
 
-        self.assertTrue(isinstance(kvdb.conn, FakeStrictRedis))
\ No newline at end of file
+        self.assertTrue(isinstance(kvdb.conn, FakeStrictRedis))
+
+# ##############################################################################
+
+class FakeTranslationConn(object):
+    """ Keeps translations in a dictionary of hashes, the way KVDB does.
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.version = 0
+        self.requests = 0
+        self.pipelines = 0
+
+    def add(self, system1, key1, value1, system2, key2, value2):
+        name = _KVDB.SEPARATOR.join((_KVDB.TRANSLATION, system1, key1, value1, system2, key2))
+        self.hashes[name.encode('utf-8')] = {'value2': value2}
+        self.version += 1
+
+    def get(self, name):
+        self.requests += 1
+        return self.version
+
+    def scan(self, cursor=0, match=None, count=None):
+        """ Returns names in batches of up to count of them, the cursor is an index into a sorted list of all names.
+        """
+        self.requests += 1
+
+        names = sorted(self.hashes)
+        cursor = int(cursor)
+        next_cursor = cursor + count
+
+        return str(next_cursor if next_cursor < len(names) else 0), names[cursor:next_cursor]
+
+    def pipeline(self):
+        self.pipelines += 1
+        return FakeTranslationPipeline(self)
+
+class FakeTranslationPipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.names = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def hget(self, name, key):
+        self.names.append((name, key))
+
+    def execute(self):
+        self.conn.requests += 1
+        return [self.conn.hashes[name][key] for name, key in self.names]
+
+class TranslationCacheTestCase(TestCase):
+
+    def test_translate_from_snapshot(self):
+        conn = FakeTranslationConn()
+        conn.add('crm', 'currency', 'EUR', 'billing', 'currency', '978')
+        conn.add('crm', 'currency', 'USD', 'billing', 'currency', '840')
+
+        cache = TranslationCache(conn)
+        cache.load()
+        requests = conn.requests
+
+        eq_(cache.translate('crm', 'currency', 'EUR', 'billing', 'currency'), '978')
+        eq_(cache.translate('crm', 'currency', 'PLN', 'billing', 'currency', 'default'), 'default')
+        eq_(cache.translate_many([
+            ('crm', 'currency', 'USD', 'billing', 'currency'),
+            ('crm', 'currency', 'GBP', 'billing', 'currency')]), ['840', ''])
+
+        # Nothing has been read from KVDB after the snapshot was loaded
+        eq_(conn.requests, requests)
+
+        stats = cache.get_stats()
+        eq_(stats.hits, 2)
+        eq_(stats.misses, 2)
+        eq_(stats.size, 2)
+        eq_(stats.version, 2)
+
+    def test_on_version(self):
+        conn = FakeTranslationConn()
+        conn.add('crm', 'currency', 'EUR', 'billing', 'currency', '978')
+
+        cache = TranslationCache(conn)
+        cache.load()
+
+        conn.add('crm', 'currency', 'USD', 'billing', 'currency', '840')
+
+        # A message about a version already loaded is ignored
+        cache.on_version(1)
+        eq_(cache.translate('crm', 'currency', 'USD', 'billing', 'currency'), '')
+        eq_(cache.get_stats().loads, 1)
+
+        cache.on_version(2)
+        eq_(cache.translate('crm', 'currency', 'USD', 'billing', 'currency'), '840')
+        eq_(cache.get_stats().loads, 2)
+
+    def test_load_in_batches(self):
+        conn = FakeTranslationConn()
+        for idx in range(5):
+            conn.add('crm', 'currency', str(idx), 'billing', 'currency', str(idx * 10))
+
+        cache = TranslationCache(conn, 2)
+        cache.load()
+
+        # Three batches of names, each one with its values read in a single pipeline
+        eq_(conn.pipelines, 3)
+        eq_(cache.get_stats().size, 5)
+
+        for idx in range(5):
+            eq_(cache.translate('crm', 'currency', str(idx), 'billing', 'currency'), str(idx * 10))
+
+# ##############################################################################
+
+class FakeConfigVersionConn(object):
+    def __init__(self):
+        self.keys = {}
+
+    def setnx(self, name, value):
+        self.keys.setdefault(name, value)
+
+    def mget(self, *names):
+        return [self.keys.get(name) for name in names]
+
+    def incr(self, name):
+        self.keys[name] = self.keys.get(name, 0) + 1
+
+class GetConfigVersionTestCase(TestCase):
+
+    def test_get_config_version(self):
+        conn = FakeConfigVersionConn()
+
+        version1 = get_config_version(conn)
+        eq_(version1, get_config_version(conn))
+
+        conn.incr(_KVDB.CONFIG_VERSION)
+        version2 = get_config_version(conn)
+        self.assertNotEquals(version1, version2)
+
+        # After a flush the counter starts from 0 again but the version is still a new one
+        conn.keys.clear()
+        version3 = get_config_version(conn)
+        self.assertTrue(version3.endswith('.0'))
+        self.assertNotEquals(version1, version3)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from unittest import TestCase
+
+# SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Zato
+from zato.common.odb.model import Base, HTTSOAPAudit, HTTSOAPAuditToken
+from zato.common.odb.query import http_soap_audit_item_list
+from zato.common.odb.util import get_search_tokens
+
+class HTTPSOAPAuditSearchTestCase(TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine, tables=[HTTSOAPAudit.__table__, HTTSOAPAuditToken.__table__])
+        self.session = sessionmaker(bind=engine)()
+
+        self.add('K01234567', b'{"customer": "ABC-123"}')
+        self.add('K76543210', b'{"customer": "DEF-456", "customers": 2}')
+        self.add('K55555555', b'{"customer": "ABC-123"}', 2)
+
+    def tearDown(self):
+        self.session.close()
+
+    def add(self, cid, req_payload, cluster_id=1):
+        now = datetime.utcnow()
+
+        item = HTTSOAPAudit(name='my.channel', cid=cid, transport='plain_http', connection='channel', req_time=now,
+            remote_addr='127.0.0.1', req_payload=req_payload)
+        item.cluster_id = cluster_id
+        item.conn_id = 1
+        self.session.add(item)
+
+        for token in get_search_tokens(cid, req_payload):
+            self.session.add(HTTSOAPAuditToken(None, token, cid, now, cluster_id))
+
+        self.session.commit()
+
+    def search(self, query, cluster_id=1):
+        return sorted(item.cid for item in http_soap_audit_item_list(self.session, cluster_id, None, None, None, query, False))
+
+    def test_whole_words(self):
+        self.assertEquals(self.search('customer'), ['K01234567', 'K76543210'])
+        self.assertEquals(self.search('abc 123'), ['K01234567'])
+        self.assertEquals(self.search('abc 456'), [])
+        self.assertEquals(self.search('k01234567'), ['K01234567'])
+
+        # Only whole words are looked for, i.e. 'customer' is not found in 'customers' and parts of CIDs are not found
+        self.assertEquals(self.search('customers'), ['K76543210'])
+        self.assertEquals(self.search('ustome'), [])
+        self.assertEquals(self.search('0123'), [])
+
+    def test_whole_words_other_cluster(self):
+        self.assertEquals(self.search('abc 123', 2), ['K55555555'])
+        self.assertEquals(self.search('def', 2), [])
+
+    def test_substrings(self):
+
+        # There are no words long enough to have been indexed so the query is looked for as a substring
+        self.assertEquals(self.search('2'), ['K01234567', 'K76543210'])
+        self.assertEquals(self.search('f'), ['K76543210'])
+        self.assertEquals(self.search('f', 2), [])
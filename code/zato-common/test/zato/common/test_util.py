@@ -16,8 +16,9 @@ from uuid import uuid4
 from lxml import etree
 
 # Zato
-from zato.common import ParsingException, soap_body_xpath, zato_path
+from zato.common import AUDIT_LOG, ParsingException, soap_body_xpath, zato_path
 from zato.common import util
+from zato.common.odb.util import get_search_tokens
 
 class ZatoPathTestCase(TestCase):
     def test_zato_path(self):
@@ -61,4 +62,16 @@ class UtilsTestCase(TestCase):
 class XPathTestCase(TestCase):
     def test_validate_xpath(self):
         self.assertRaises(etree.XPathSyntaxError, util.validate_xpath, 'a b c')
-        self.assertTrue(util.validate_xpath('//node'))
\ No newline at end of file
+        self.assertTrue(util.validate_xpath('//node'))
+
+class SearchTokensTestCase(TestCase):
+    def test_tokens(self):
+        tokens = get_search_tokens(b'{"Customer": "ABC-123", "a": 1}', None, '<zażółć>Gęślą</zażółć>')
+        self.assertEquals(tokens, set(['customer', 'abc', '123', 'zażółć', 'gęślą']))
+
+    def test_limits(self):
+        long_token = 'a' * (AUDIT_LOG.SEARCH.MAX_TOKEN_LENGTH + 1)
+        self.assertEquals(get_search_tokens(long_token), set([long_token[:AUDIT_LOG.SEARCH.MAX_TOKEN_LENGTH]]))
+
+        tokens = get_search_tokens(' '.join('token{}'.format(x) for x in range(10)), max_tokens=3)
+        self.assertEquals(len(tokens), 3)
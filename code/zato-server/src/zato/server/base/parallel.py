@@ -19,7 +19,7 @@ from traceback import format_exc
 from uuid import uuid4
 
 # anyjson
-from anyjson import dumps
+from anyjson import dumps, loads
 
 # arrow
 from arrow import utcnow
@@ -51,17 +51,19 @@ from tzlocal import get_localzone
 
 # Zato
 from zato.broker.client import BrokerClient
-from zato.common import ACCESS_LOG_DT_FORMAT, CHANNEL, KVDB, MISC, SERVER_JOIN_STATUS, SERVER_UP_STATUS,\
+from zato.common import ACCESS_LOG_DT_FORMAT, CHANNEL, DELIVERY_BATCH, KVDB, MISC, SERVER_JOIN_STATUS, SERVER_UP_STATUS,\
      ZATO_ODB_POOL_NAME
 from zato.common.broker_message import AMQP_CONNECTOR, code_to_name, HOT_DEPLOY,\
      JMS_WMQ_CONNECTOR, MESSAGE_TYPE, SERVICE, TOPICS, ZMQ_CONNECTOR
+from zato.common.kvdb import get_config_version
 from zato.common.pubsub import PubSubAPI, RedisPubSub
 from zato.common.util import add_startup_jobs, get_kvdb_config_for_log, new_cid, register_diag_handlers
 from zato.server.base import BrokerMessageReceiver
 from zato.server.base.worker import WorkerStore
-from zato.server.config import ConfigDict, ConfigStore
+from zato.server.config import ConfigDict, ConfigSnapshot, ConfigStore
 from zato.server.connection.amqp.channel import start_connector as amqp_channel_start_connector
 from zato.server.connection.amqp.outgoing import start_connector as amqp_out_start_connector
+from zato.server.connection.http_soap.cache import get_headers, get_query_params
 from zato.server.connection.jms_wmq.channel import start_connector as jms_wmq_channel_start_connector
 from zato.server.connection.jms_wmq.outgoing import start_connector as jms_wmq_out_start_connector
 from zato.server.connection.zmq_.channel import start_connector as zmq_channel_start_connector
@@ -214,14 +216,21 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         the services have been already deployed. Later workers will check that
         the flag exists and will skip the deployment altogether.
 
+        Unless misc.deploy_services_in_bulk is False, the first worker stores all
+        the services in the ODB in one transaction and publishes a catalogue of what
+        has been stored so the other workers only need to import the services' modules.
+
         The first worker to be started will also start a singleton thread later on,
         outside this method but basing on whether the method returns True or not.
         """
+        items = self.internal_service_modules + self.service_modules + self.service_sources
+
+        # New in 2.0 hence optional
+        in_bulk = asbool(self.fs_server_config.misc.get('deploy_services_in_bulk', True))
+
         def import_initial_services_jobs():
             # (re-)deploy the services from a clear state
-            self.service_store.import_services_from_anywhere(
-                self.internal_service_modules + self.service_modules +
-                self.service_sources, self.base_dir)
+            self.service_store.import_services_from_anywhere(items, self.base_dir)
 
             # Add the statistics-related scheduler jobs to the ODB
             add_startup_jobs(self.cluster_id, self.odb, self.startup_jobs)
@@ -229,6 +238,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         lock_name = '{}{}:{}'.format(KVDB.LOCK_SERVER_STARTING, self.fs_server_config.main.token, deployment_key)
         already_deployed_flag = '{}{}:{}'.format(KVDB.LOCK_SERVER_ALREADY_DEPLOYED,
             self.fs_server_config.main.token, deployment_key)
+        catalogue_key = '{}{}:{}'.format(KVDB.SERVICE_CATALOGUE, self.fs_server_config.main.token, deployment_key)
 
         logger.debug('Will use the lock_name: [{}]'.format(lock_name))
 
@@ -239,8 +249,19 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
                 msg = 'Not attempting to grab the lock_name:[{}]'.format(lock_name)
                 logger.debug(msg)
 
+                catalogue = redis_conn.get(catalogue_key) if in_bulk else None
+
+                # Services may have been edited since the catalogue was built, e.g. to deactivate them,
+                # in which case it cannot be relied on anymore.
+                if catalogue:
+                    catalogue = loads(catalogue)
+                    if catalogue['config_version'] != get_config_version(redis_conn):
+                        catalogue = None
+
                 # Simply deploy services, the first worker has already cleared out the ODB
-                import_initial_services_jobs()
+                if not catalogue:
+                    import_initial_services_jobs()
+
             else:
                 # We are this server's first worker so we need to re-populate
                 # the database and create the flag indicating we're done.
@@ -248,11 +269,24 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
                     lock_name, self.deployment_lock_expires, self.deployment_lock_timeout)
                 logger.debug(msg)
 
-                # .. Remove all the deployed services from the DB ..
-                self.odb.drop_deployed_services(server.id)
+                if in_bulk:
+
+                    config_version = get_config_version(redis_conn)
+
+                    # Store all the services in the ODB at once, removing what had been deployed previously ..
+                    services = self.service_store.import_services_in_bulk(items, self.base_dir)
+                    add_startup_jobs(self.cluster_id, self.odb, self.startup_jobs)
+
+                    # .. and let the other workers know what has been stored so they don't have to access the ODB.
+                    redis_conn.set(catalogue_key, dumps({'config_version':config_version, 'services':services}))
+                    redis_conn.expire(catalogue_key, self.deployment_lock_expires)
+
+                else:
+                    # .. Remove all the deployed services from the DB ..
+                    self.odb.drop_deployed_services(server.id)
 
-                # .. deploy them back.
-                import_initial_services_jobs()
+                    # .. deploy them back.
+                    import_initial_services_jobs()
 
                 # Add the flag to Redis indicating that this server has already
                 # deployed its services. Note that by default the expiration
@@ -267,6 +301,11 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
 
                 return True
 
+        # Workers other than the first one import services outside of the lock, using what the first one stored
+        # in the ODB, so they can all do it in parallel.
+        if catalogue:
+            self.service_store.import_services_from_catalogue(items, self.base_dir, catalogue['services'])
+
     def get_lua_programs(self):
         for item in 'internal', 'user':
             dir_name = os.path.join(self.repo_location, 'lua', item)
@@ -336,7 +375,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         if is_first:
             broker_callbacks[TOPICS[MESSAGE_TYPE.TO_SINGLETON]] = self.on_broker_msg_singleton
 
-        self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs())
+        # New in 2.0 hence optional
+        dispatch_config = self.fs_server_config.get('broker_dispatch', {})
+
+        self.broker_client = BrokerClient(self.kvdb, 'parallel', broker_callbacks, self.get_lua_programs(), dispatch_config)
 
         if is_first:
 
@@ -361,23 +403,46 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
 
         return is_first
 
-    def _after_init_accepted(self, server, deployment_key):
+    def read_config(self, server):
+        """ Reads configuration of everything the server's workers need - connections, security definitions and
+        the like. Only one worker at a time reads it from the ODB, storing a snapshot of what has been read
+        in a local cache file, and the others load the snapshot instead of running the same queries again.
+        """
+        # New in 2.0 hence optional
+        use_cache = asbool(self.fs_server_config.misc.get('cache_config_snapshot', True))
 
-        # Pub/sub
-        self.pubsub = PubSubAPI(RedisPubSub(self.kvdb.conn))
+        version = get_config_version(self.kvdb.conn)
+        cache_dir = self.hot_deploy_config.work_dir if use_cache else None
 
-        # Repo location so that AMQP subprocesses know where to read
-        # the server's configuration from.
-        self.config.repo_location = self.repo_location
+        snapshot = ConfigSnapshot(self.odb, version, cache_dir)
+        start = time.time()
+
+        if use_cache:
+            lock_name = '{}{}:{}'.format(KVDB.LOCK_CONFIG_SNAPSHOT, self.fs_server_config.main.token, version)
+            with Lock(lock_name, self.deployment_lock_expires, self.deployment_lock_timeout, self.kvdb.conn):
+                from_cache = snapshot.load()
+                self._set_config(server, snapshot)
 
+                if not from_cache:
+                    snapshot.save()
+        else:
+            from_cache = False
+            self._set_config(server, snapshot)
+
+        logger.info('Config version `%s` read from %s in %.3fs, ODB queries:`%s`, ODB time:%.3fs', version,
+            'cache file' if from_cache else 'ODB', time.time() - start, snapshot.query_count, snapshot.query_time)
+
+    def _set_config(self, server, odb):
+        """ Populates self.config using odb, which is a ConfigSnapshot.
+        """
         # 
         # Cassandra - start
         #
 
-        query = self.odb.get_cassandra_conn_list(server.cluster.id, True)
+        query = odb.get_cassandra_conn_list(server.cluster.id, True)
         self.config.cassandra_conn = ConfigDict.from_query('cassandra_conn', query)
 
-        query = self.odb.get_cassandra_query_list(server.cluster.id, True)
+        query = odb.get_cassandra_query_list(server.cluster.id, True)
         self.config.cassandra_query = ConfigDict.from_query('cassandra_query', query)
 
         # 
@@ -388,10 +453,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         # Search - start
         #
 
-        query = self.odb.get_search_es_list(server.cluster.id, True)
+        query = odb.get_search_es_list(server.cluster.id, True)
         self.config.search_es = ConfigDict.from_query('search_es', query)
 
-        query = self.odb.get_search_solr_list(server.cluster.id, True)
+        query = odb.get_search_solr_list(server.cluster.id, True)
         self.config.search_solr = ConfigDict.from_query('search_solr', query)
 
         # 
@@ -404,10 +469,10 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
 
         # OpenStack - Swift
 
-        query = self.odb.get_cloud_openstack_swift_list(server.cluster.id, True)
+        query = odb.get_cloud_openstack_swift_list(server.cluster.id, True)
         self.config.cloud_openstack_swift = ConfigDict.from_query('cloud_openstack_swift', query)
 
-        query = self.odb.get_cloud_aws_s3_list(server.cluster.id, True)
+        query = odb.get_cloud_aws_s3_list(server.cluster.id, True)
         self.config.cloud_aws_s3 = ConfigDict.from_query('cloud_aws_s3', query)
 
         # 
@@ -421,31 +486,31 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         #
 
         # FTP
-        query = self.odb.get_out_ftp_list(server.cluster.id, True)
+        query = odb.get_out_ftp_list(server.cluster.id, True)
         self.config.out_ftp = ConfigDict.from_query('out_ftp', query)
 
         # Plain HTTP
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'plain_http', True)
+        query = odb.get_http_soap_list(server.cluster.id, 'outgoing', 'plain_http', True)
         self.config.out_plain_http = ConfigDict.from_query('out_plain_http', query)
 
         # SOAP
-        query = self.odb.get_http_soap_list(server.cluster.id, 'outgoing', 'soap', True)
+        query = odb.get_http_soap_list(server.cluster.id, 'outgoing', 'soap', True)
         self.config.out_soap = ConfigDict.from_query('out_soap', query)
 
         # SQL
-        query = self.odb.get_out_sql_list(server.cluster.id, True)
+        query = odb.get_out_sql_list(server.cluster.id, True)
         self.config.out_sql = ConfigDict.from_query('out_sql', query)
 
         # AMQP
-        query = self.odb.get_out_amqp_list(server.cluster.id, True)
+        query = odb.get_out_amqp_list(server.cluster.id, True)
         self.config.out_amqp = ConfigDict.from_query('out_amqp', query)
 
         # JMS WMQ
-        query = self.odb.get_out_jms_wmq_list(server.cluster.id, True)
+        query = odb.get_out_jms_wmq_list(server.cluster.id, True)
         self.config.out_jms_wmq = ConfigDict.from_query('out_jms_wmq', query)
 
         # ZMQ
-        query = self.odb.get_out_zmq_list(server.cluster.id, True)
+        query = odb.get_out_zmq_list(server.cluster.id, True)
         self.config.out_zmq = ConfigDict.from_query('out_zmq', query)
 
         #
@@ -459,7 +524,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         #
 
         # OpenStack Swift
-        query = self.odb.get_notif_cloud_openstack_swift(server.cluster.id, True)
+        query = odb.get_notif_cloud_openstack_swift(server.cluster.id, True)
         self.config.notif_cloud_openstack_swift = ConfigDict.from_query('notif_cloud_openstack_swift', query)
 
         #
@@ -473,43 +538,43 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         #
 
         # API keys
-        query = self.odb.get_apikey_security_list(server.cluster.id, True)
+        query = odb.get_apikey_security_list(server.cluster.id, True)
         self.config.apikey = ConfigDict.from_query('apikey', query)
 
         # AWS
-        query = self.odb.get_aws_security_list(server.cluster.id, True)
+        query = odb.get_aws_security_list(server.cluster.id, True)
         self.config.aws = ConfigDict.from_query('aws', query)
 
         # HTTP Basic Auth
-        query = self.odb.get_basic_auth_list(server.cluster.id, True)
+        query = odb.get_basic_auth_list(server.cluster.id, True)
         self.config.basic_auth = ConfigDict.from_query('basic_auth', query)
 
         # NTLM
-        query = self.odb.get_ntlm_list(server.cluster.id, True)
+        query = odb.get_ntlm_list(server.cluster.id, True)
         self.config.ntlm = ConfigDict.from_query('ntlm', query)
 
         # OAuth
-        query = self.odb.get_oauth_list(server.cluster.id, True)
+        query = odb.get_oauth_list(server.cluster.id, True)
         self.config.oauth = ConfigDict.from_query('oauth', query)
 
         # OpenStack
-        query = self.odb.get_openstack_security_list(server.cluster.id, True)
+        query = odb.get_openstack_security_list(server.cluster.id, True)
         self.config.openstack_security = ConfigDict.from_query('openstack_security', query)
 
         # Technical accounts
-        query = self.odb.get_tech_acc_list(server.cluster.id, True)
+        query = odb.get_tech_acc_list(server.cluster.id, True)
         self.config.tech_acc = ConfigDict.from_query('tech_acc', query)
 
         # TLS key/cert pairs
-        query = self.odb.get_tls_key_cert_list(server.cluster.id, True)
+        query = odb.get_tls_key_cert_list(server.cluster.id, True)
         self.config.tls_key_cert = ConfigDict.from_query('tls_key_cert', query)
 
         # WS-Security
-        query = self.odb.get_wss_list(server.cluster.id, True)
+        query = odb.get_wss_list(server.cluster.id, True)
         self.config.wss = ConfigDict.from_query('wss', query)
 
         # XPath
-        query = self.odb.get_xpath_sec_list(server.cluster.id, True)
+        query = odb.get_xpath_sec_list(server.cluster.id, True)
         self.config.xpath_sec = ConfigDict.from_query('xpath_sec', query)
 
         #
@@ -520,7 +585,7 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
 
         # All the HTTP/SOAP channels.
         http_soap = []
-        for item in self.odb.get_http_soap_list(server.cluster.id, 'channel'):
+        for item in odb.get_http_soap_list(server.cluster.id, 'channel'):
 
             hs_item = Bunch()
             for key in item.keys():
@@ -529,6 +594,9 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
             hs_item.replace_patterns_json_pointer = item.replace_patterns_json_pointer
             hs_item.replace_patterns_xpath = item.replace_patterns_xpath
 
+            hs_item.cache_query_params = get_query_params(item.cache_query_params)
+            hs_item.cache_headers = get_headers(item.cache_headers)
+
             hs_item.match_target = '{}{}{}'.format(hs_item.soap_action, MISC.SEPARATOR, hs_item.url_path)
             hs_item.match_target_compiled = parse_compile(hs_item.match_target)
 
@@ -537,15 +605,15 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         self.config.http_soap = http_soap
 
         # Namespaces
-        query = self.odb.get_namespace_list(server.cluster.id, True)
+        query = odb.get_namespace_list(server.cluster.id, True)
         self.config.msg_ns = ConfigDict.from_query('msg_ns', query)
 
         # XPath
-        query = self.odb.get_xpath_list(server.cluster.id, True)
+        query = odb.get_xpath_list(server.cluster.id, True)
         self.config.xpath = ConfigDict.from_query('msg_xpath', query)
 
         # JSON Pointer
-        query = self.odb.get_json_pointer_list(server.cluster.id, True)
+        query = odb.get_json_pointer_list(server.cluster.id, True)
         self.config.json_pointer = ConfigDict.from_query('json_pointer', query)
 
         # SimpleIO
@@ -559,29 +627,44 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         self.config.pubsub.default_consumer = Bunch()
         self.config.pubsub.default_producer = Bunch()
 
-        query = self.odb.get_pubsub_topic_list(server.cluster.id, True)
+        query = odb.get_pubsub_topic_list(server.cluster.id, True)
         self.config.pubsub.topics = ConfigDict.from_query('pubsub_topics', query)
 
-        id, name = self.odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-consumer')
+        id, name = odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-consumer')
         self.config.pubsub.default_consumer.id, self.config.pubsub.default_consumer.name = id, name
 
-        id, name = self.odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-producer')
+        id, name = odb.get_pubsub_default_client(server.cluster.id, 'zato.pubsub.default-producer')
         self.config.pubsub.default_producer.id, self.config.pubsub.default_producer.name = id, name
 
-        query = self.odb.get_pubsub_producer_list(server.cluster.id, True)
+        query = odb.get_pubsub_producer_list(server.cluster.id, True)
         self.config.pubsub.producers = ConfigDict.from_query('pubsub_producers', query, list_config=True)
 
-        query = self.odb.get_pubsub_consumer_list(server.cluster.id, True)
+        query = odb.get_pubsub_consumer_list(server.cluster.id, True)
         self.config.pubsub.consumers = ConfigDict.from_query('pubsub_consumers', query, list_config=True)
 
         # E-mail - SMTP
-        query = self.odb.get_email_smtp_list(server.cluster.id, True)
+        query = odb.get_email_smtp_list(server.cluster.id, True)
         self.config.email_smtp = ConfigDict.from_query('email_smtp', query)
 
         # E-mail - IMAP
-        query = self.odb.get_email_imap_list(server.cluster.id, True)
+        query = odb.get_email_imap_list(server.cluster.id, True)
         self.config.email_imap = ConfigDict.from_query('email_imap', query)
 
+        # URL security
+        self.config.url_sec = odb.get_url_security(server.cluster.id, 'channel')[0]
+
+    def _after_init_accepted(self, server, deployment_key):
+
+        # Pub/sub
+        self.pubsub = PubSubAPI(RedisPubSub(self.kvdb.conn))
+
+        # Repo location so that AMQP subprocesses know where to read
+        # the server's configuration from.
+        self.config.repo_location = self.repo_location
+
+        # Configuration of all the connections, security definitions and the like
+        self.read_config(server)
+
         # Assign config to worker
         self.worker_store.worker_config = self.config
         self.worker_store.broker_client = self.broker_client
@@ -812,6 +895,18 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
         parallel_server.delivery_store.odb = parallel_server.odb
         parallel_server.delivery_store.delivery_lock_timeout = float(parallel_server.fs_server_config.misc.delivery_lock_timeout)
 
+        # Store new deliveries in batches and check their targets from a single greenlet
+        delivery_config = parallel_server.fs_server_config.get('delivery', {})
+        if asbool(delivery_config.get('needs_batching', True)):
+            parallel_server.delivery_store.batch_size = int(delivery_config.get('batch_size', DELIVERY_BATCH.SIZE))
+            parallel_server.delivery_store.flush_interval = float(
+                delivery_config.get('flush_interval', DELIVERY_BATCH.FLUSH_INTERVAL))
+            parallel_server.delivery_store.check_batch_size = int(
+                delivery_config.get('check_batch_size', DELIVERY_BATCH.CHECK_SIZE))
+            parallel_server.delivery_store.check_interval = float(
+                delivery_config.get('check_interval', DELIVERY_BATCH.CHECK_INTERVAL))
+            parallel_server.delivery_store.start()
+
         if is_first:
             parallel_server.invoke_startup_services()
 
@@ -832,6 +927,20 @@ class ParallelServer(DisposableObject, BrokerMessageReceiver):
     def destroy(self):
         """ A Spring Python hook for closing down all the resources held.
         """
+        # Store in the ODB all the audit log entries that haven't been stored yet
+        audit_queue = getattr(self.worker_store, 'audit_queue', None)
+        if audit_queue:
+            audit_queue.stop()
+
+        # Same goes for guaranteed deliveries
+        if self.delivery_store:
+            self.delivery_store.stop()
+
+        # The hub monitor's watchdog thread must not outlive the worker
+        hub_monitor = getattr(self.worker_store, 'hub_monitor', None)
+        if hub_monitor:
+            hub_monitor.stop()
+
         if self.singleton_server:
 
             # Close all the connector subprocesses this server has possibly started
@@ -14,7 +14,6 @@ from copy import deepcopy
 from errno import ENOENT
 from json import loads
 from threading import RLock
-from time import sleep
 from traceback import format_exc
 from urlparse import urlparse
 from uuid import uuid4
@@ -24,35 +23,46 @@ from bunch import Bunch
 
 # dateutil
 from dateutil.parser import parse
-from dateutil.relativedelta import relativedelta
-from dateutil.rrule import DAILY, MINUTELY, rrule
 
 # gunicorn
 from gunicorn.workers.ggevent import GeventWorker as GunicornGeventWorker
 from gunicorn.workers.sync import SyncWorker as GunicornSyncWorker
 
+# Paste
+from paste.util.converters import asbool
+
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, MSG_PATTERN_TYPE, PUB_SUB, SEC_DEF_TYPE, SIMPLE_IO, \
-     TRACE1, ZATO_ODB_POOL_NAME
+from zato.common import AUDIT_LOG, CHANNEL, CREDENTIALS_CACHE, DATA_FORMAT, HTTP_CACHE, HTTP_SOAP_SERIALIZATION_TYPE, HTTP_STREAMING, \
+     MSG_PATTERN_TYPE, PUB_SUB, RATE_LIMIT, SEC_DEF_TYPE, SIMPLE_IO, TRACE1, WSDL_CACHE, ZATO_ODB_POOL_NAME
 from zato.common import broker_message
 from zato.common.broker_message import code_to_name
 from zato.common.dispatch import dispatcher
+from zato.common.kvdb import TranslationCache
 from zato.common.pubsub import Client, Consumer, Topic
-from zato.common.util import new_cid, pairwise, parse_extra_into_dict, get_validate_tls_key_cert
+from zato.common.util import new_cid, parse_extra_into_dict, get_validate_tls_key_cert
 from zato.server.base import BrokerMessageReceiver
 from zato.server.connection.cassandra import CassandraAPI, CassandraConnStore
 from zato.server.connection.cloud.aws.s3 import S3Wrapper
+from zato.server.connection.circuit_breaker import CircuitBreakerStore
 from zato.server.connection.cloud.openstack.swift import SwiftWrapper
 from zato.server.connection.email import IMAPAPI, IMAPConnStore, SMTPAPI, SMTPConnStore
 from zato.server.connection.ftp import FTPStore
+from zato.server.connection.http_soap.audit import AuditQueue
+from zato.server.connection.http_soap.cache import ResponseCache
 from zato.server.connection.http_soap.channel import RequestDispatcher, RequestHandler
 from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper, SudsSOAPWrapper
-from zato.server.connection.http_soap.url_data import URLData
+from zato.server.connection.http_soap.rate_limit import RateLimiter
+from zato.server.connection.http_soap.url_data import CredentialsCache, URLData
+from zato.server.connection.http_soap.wsdl import WSDLCache
+from zato.server.connection.metrics import ConnMetricsStore
 from zato.server.connection.search.es import ElasticSearchAPI, ElasticSearchConnStore
 from zato.server.connection.search.solr import SolrAPI, SolrConnStore
 from zato.server.connection.sql import PoolStore, SessionWrapper
+from zato.server.hub_monitor import HubMonitor
 from zato.server.message import JSONPointerStore, NamespaceStore, XPathStore
+from zato.server.profiler import SamplingProfiler
 from zato.server.query import CassandraQueryAPI, CassandraQueryStore
+from zato.server.service import WorkerFacades
 from zato.server.stats import MaintenanceTool
 
 logger = logging.getLogger(__name__)
@@ -93,21 +103,39 @@ class WorkerStore(BrokerMessageReceiver):
 
     def init(self):
 
+        # Latencies and pool utilisation of connections, created along with the connections.
+        # New in 2.0 hence optional.
+        self.conn_metrics_store = ConnMetricsStore(self.server.fs_server_config.get('conn_metrics', {}))
+
         # Statistics maintenance
-        self.stats_maint = MaintenanceTool(self.kvdb.conn)
+        self.stats_maint = MaintenanceTool(self.kvdb.conn, self.server.fs_server_config.get('stats', {}))
+
+        # Profiles services on demand, each worker samples its own greenlets
+        self.profiler = SamplingProfiler(self.kvdb, '{}:{}'.format(self.server.name, os.getpid()),
+            self.server.fs_server_config.get('sampling_profiler', {}))
+
+        # Measures how late the hub is and records calls blocking it, each worker watches its own.
+        # New in 2.0 hence optional.
+        self.hub_monitor = HubMonitor('{}:{}'.format(self.server.name, os.getpid()),
+            self.server.fs_server_config.get('hub_monitor', {}))
+
+        if self.hub_monitor.is_enabled:
+            self.hub_monitor.start()
 
         self.msg_ns_store = NamespaceStore()
         self.json_pointer_store = JSONPointerStore()
         self.xpath_store = XPathStore()
 
         # Cassandra
-        self.cassandra_api = CassandraAPI(CassandraConnStore())
+        self.cassandra_api = CassandraAPI(CassandraConnStore(
+            self.conn_metrics_store, self.server.fs_server_config.get('cassandra', {})))
         self.cassandra_query_store = CassandraQueryStore()
         self.cassandra_query_api = CassandraQueryAPI(self.cassandra_query_store)
 
         # Search
-        self.search_es_api = ElasticSearchAPI(ElasticSearchConnStore())
-        self.search_solr_api = SolrAPI(SolrConnStore())
+        search_config = self.server.fs_server_config.get('search', {})
+        self.search_es_api = ElasticSearchAPI(ElasticSearchConnStore(self.conn_metrics_store), search_config)
+        self.search_solr_api = SolrAPI(SolrConnStore(self.conn_metrics_store), search_config)
 
         # E-mail
         self.email_smtp_api = SMTPAPI(SMTPConnStore())
@@ -128,16 +156,69 @@ class WorkerStore(BrokerMessageReceiver):
         self.init_email_smtp()
         self.init_email_imap()
 
+        # Connection facades shared by all the services in this worker
+        self.worker_facades = WorkerFacades(self)
+
+        # HTTP/SOAP audit log is stored in the ODB in background, in batches.
+        # New in 2.0 hence optional.
+        audit_queue_config = self.server.fs_server_config.get('audit_queue', {})
+        self.audit_queue = AuditQueue(self.server.odb,
+            int(audit_queue_config.get('max_size', AUDIT_LOG.QUEUE.MAX_SIZE)),
+            int(audit_queue_config.get('batch_size', AUDIT_LOG.QUEUE.BATCH_SIZE)),
+            float(audit_queue_config.get('flush_interval', AUDIT_LOG.QUEUE.FLUSH_INTERVAL)),
+            audit_queue_config.get('overflow_policy', AUDIT_LOG.QUEUE.OVERFLOW_POLICY.DROP),
+            float(audit_queue_config.get('block_timeout', AUDIT_LOG.QUEUE.BLOCK_TIMEOUT)),
+            asbool(audit_queue_config.get('needs_tokens', True)))
+        self.audit_queue.start()
+
+        # Parsed WSDLs shared by all the suds outgoing connections, optionally persisted on disk.
+        # New in 2.0 hence optional.
+        wsdl_cache_config = self.server.fs_server_config.get('wsdl_cache', {})
+        wsdl_cache_dir = os.path.join(self.server.hot_deploy_config.work_dir, WSDL_CACHE.DIR_NAME) \
+            if asbool(wsdl_cache_config.get('needs_disk_cache', True)) else None
+        self.wsdl_cache = WSDLCache(wsdl_cache_dir, int(wsdl_cache_config.get('days', WSDL_CACHE.DAYS)))
+
+        # Data dictionary translations, read from KVDB once and refreshed each time they change
+        self.translation_cache = TranslationCache(self.kvdb.conn)
+        self.translation_cache.load()
+
+        # Credentials of HTTP channels verified successfully, so they needn't be checked on each request.
+        # New in 2.0 hence optional.
+        credentials_cache_config = self.server.fs_server_config.get('credentials_cache', {})
+        credentials_cache = CredentialsCache(
+            int(credentials_cache_config.get('max_size', CREDENTIALS_CACHE.MAX_SIZE)),
+            int(credentials_cache_config.get('ttl', CREDENTIALS_CACHE.TTL)))
+
+        # Circuit breakers and bulkheads of outgoing connections, created along with the connections.
+        # New in 2.0 hence optional.
+        self.circuit_breaker_store = CircuitBreakerStore(self.server.fs_server_config.get('circuit_breaker', {}))
+
         # Request dispatcher - matches URLs, checks security and dispatches HTTP
         # requests to services.
-        self.request_dispatcher = RequestDispatcher(simple_io_config=self.worker_config.simple_io)
+        http_streaming_config = self.server.fs_server_config.get('http_streaming', {})
+        self.request_dispatcher = RequestDispatcher(simple_io_config=self.worker_config.simple_io,
+            spill_threshold=int(http_streaming_config.get('spill_threshold', HTTP_STREAMING.SPILL_THRESHOLD)),
+            chunk_size=int(http_streaming_config.get('chunk_size', HTTP_STREAMING.CHUNK_SIZE)))
+
+        http_cache_config = self.server.fs_server_config.get('http_cache', {})
+        self.request_dispatcher.response_cache = ResponseCache(
+            int(http_cache_config.get('max_size', HTTP_CACHE.MAX_SIZE)),
+            int(http_cache_config.get('max_item_size', HTTP_CACHE.MAX_ITEM_SIZE)))
+
+        rate_limit_config = self.server.fs_server_config.get('rate_limit', {})
+        self.request_dispatcher.rate_limiter = RateLimiter(self.kvdb.conn,
+            float(rate_limit_config.get('sync_interval', RATE_LIMIT.SYNC_INTERVAL)),
+            max_buckets=int(rate_limit_config.get('max_buckets', RATE_LIMIT.MAX_BUCKETS)),
+            trusted_proxies=int(rate_limit_config.get('trusted_proxies', RATE_LIMIT.TRUSTED_PROXIES)))
+        self.request_dispatcher.rate_limiter.start()
+
         self.request_dispatcher.url_data = URLData(
             deepcopy(self.worker_config.http_soap),
-            self.server.odb.get_url_security(self.server.cluster_id, 'channel')[0],
+            self.worker_config.url_sec,
             self.worker_config.basic_auth, self.worker_config.ntlm, self.worker_config.oauth, self.worker_config.tech_acc,
             self.worker_config.wss, self.worker_config.apikey, self.worker_config.aws, self.worker_config.openstack_security,
             self.worker_config.xpath_sec, self.worker_config.tls_key_cert, self.kvdb, self.broker_client, self.server.odb,
-            self.json_pointer_store, self.xpath_store)
+            self.json_pointer_store, self.xpath_store, self.audit_queue, credentials_cache)
 
         self.request_dispatcher.request_handler = RequestHandler(self.server)
 
@@ -217,13 +298,16 @@ class WorkerStore(BrokerMessageReceiver):
             'timeout':config.timeout}
         wrapper_config.update(sec_config)
 
+        circuit_breaker = self.circuit_breaker_store.get(config.transport, config.name)
+        metrics = self.conn_metrics_store.get(config.transport, config.name)
+
         if wrapper_config['serialization_type'] == HTTP_SOAP_SERIALIZATION_TYPE.SUDS.id:
             wrapper_config['queue_build_cap'] = float(self.server.fs_server_config.misc.queue_build_cap)
-            wrapper = SudsSOAPWrapper(wrapper_config)
+            wrapper = SudsSOAPWrapper(wrapper_config, self.wsdl_cache, circuit_breaker, metrics)
             wrapper.build_client_queue()
             return wrapper
 
-        return HTTPSOAPWrapper(wrapper_config)
+        return HTTPSOAPWrapper(wrapper_config, circuit_breaker=circuit_breaker, metrics=metrics)
 
 # ################################################################################################################################
 
@@ -231,7 +315,7 @@ class WorkerStore(BrokerMessageReceiver):
         """ Initializes SQL connections, first to ODB and then any user-defined ones.
         """
         # We need a store first
-        self.sql_pool_store = PoolStore()
+        self.sql_pool_store = PoolStore(circuit_breaker_store=self.circuit_breaker_store, metrics_store=self.conn_metrics_store)
 
         # Connect to ODB
         self.sql_pool_store[ZATO_ODB_POOL_NAME] = self.worker_config.odb_data
@@ -807,10 +891,22 @@ class WorkerStore(BrokerMessageReceiver):
         """
         self.request_dispatcher.url_data.on_broker_msg_CHANNEL_HTTP_SOAP_CREATE_EDIT(msg, *args)
 
+        # Whatever has been cached may have been produced by a different service or for a different URL path
+        if msg.get('old_name'):
+            self.request_dispatcher.response_cache.invalidate(msg.old_name)
+            self.request_dispatcher.rate_limiter.invalidate(msg.old_name)
+
     def on_broker_msg_CHANNEL_HTTP_SOAP_DELETE(self, msg, *args):
         """ Deletes an HTTP/SOAP channel.
         """
         self.request_dispatcher.url_data.on_broker_msg_CHANNEL_HTTP_SOAP_DELETE(msg, *args)
+        self.request_dispatcher.response_cache.invalidate(msg.name)
+        self.request_dispatcher.rate_limiter.invalidate(msg.name)
+
+    def on_broker_msg_CHANNEL_HTTP_SOAP_CACHE_INVALIDATE(self, msg, *args):
+        """ Invalidates cached responses of an HTTP/SOAP channel or of all of them.
+        """
+        self.request_dispatcher.response_cache.invalidate(msg.get('name'))
 
 # ################################################################################################################################
 
@@ -839,6 +935,10 @@ class WorkerStore(BrokerMessageReceiver):
         # Are we dealing with plain HTTP or SOAP?
         config_dict = getattr(self.worker_config, 'out_' + transport)
 
+        # A new connection, even if only edited, starts with a new circuit breaker and new metrics
+        self.circuit_breaker_store.delete(transport, name)
+        self.conn_metrics_store.delete(transport, name)
+
         return self._delete_config_close_wrapper(name, config_dict, 'an outgoing HTTP/SOAP connection', log_func)
 
     def on_broker_msg_OUTGOING_HTTP_SOAP_CREATE_EDIT(self, msg, *args):
@@ -865,6 +965,13 @@ class WorkerStore(BrokerMessageReceiver):
         """
         self._delete_config_close_wrapper_http_soap(msg['name'], msg['transport'], logger.error)
 
+# ################################################################################################################################
+
+    def on_broker_msg_OUTGOING_CIRCUIT_BREAKER_RESET(self, msg, *args):
+        """ Resets circuit breakers of outgoing connections of a given type and name, or of all of them.
+        """
+        self.circuit_breaker_store.reset(msg.get('conn_type'), msg.get('name'))
+
 # ################################################################################################################################
 
     def on_broker_msg_SERVICE_DELETE(self, msg, *args):
@@ -902,6 +1009,12 @@ class WorkerStore(BrokerMessageReceiver):
         for name in('is_active', 'slow_threshold'):
             self.server.service_store.services[msg.impl_name][name] = msg[name]
 
+    def on_broker_msg_SERVICE_PROFILER_START(self, msg, *args):
+        self.profiler.start(msg.session_id, msg.service_name, msg.duration, msg.sample_rate, msg.interval)
+
+    def on_broker_msg_SERVICE_PROFILER_STOP(self, msg, *args):
+        self.profiler.stop(msg.session_id)
+
 # ################################################################################################################################
 
     def on_broker_msg_OUTGOING_FTP_CREATE_EDIT(self, msg, *args):
@@ -925,52 +1038,27 @@ class WorkerStore(BrokerMessageReceiver):
 # ################################################################################################################################
 
     def on_broker_msg_STATS_DELETE(self, msg, *args):
-        start = parse(msg.start)
-        stop = parse(msg.stop)
-
-        # Looks weird but this is so we don't have to create a list instead of a generator
-        # (and Python 3 won't leak the last element anymore)
-        last_elem = None
-
-        # Are the dates are at least a day apart? If so, we'll split the interval
-        # into smaller one day-long batches.
-        if(stop-start).days:
-            for elem1, elem2 in pairwise(elem for elem in rrule(DAILY, dtstart=start, until=stop)):
-                self.broker_client.invoke_async(
-                    {'action':broker_message.STATS.DELETE_DAY.value, 'start':elem1.isoformat(), 'stop':elem2.isoformat()})
-
-                # So as not to drown the broker with a sudden surge of messages
-                sleep(0.02)
-
-                last_elem = elem2
-
-            # It's possible we still have something left over. Let's say
-            #
-            # start = '2012-07-24T02:02:53'
-            # stop = '2012-07-25T02:04:53'
-            #
-            # The call to rrule(DAILY, ...) will nicely slice the time between
-            # start and stop into one day intervals yet the last element of the slice
-            # will have the time portion equal to that of start - so in this
-            # particular case it would be that last_elem was 2012-07-25T02:02:53
-            # which would be still be 2 minutes short of stop. Hence the need for
-            # a relativedelta, to tease out the remaining time information.
-            delta = relativedelta(stop, last_elem)
-            if delta.minutes:
-                self.stats_maint.delete(last_elem, stop, MINUTELY)
-
-        # Not a full day apart so we can delete everything ourselves
-        else:
-            self.stats_maint.delete(start, stop, MINUTELY)
+
+        # All the keys are scanned through only once so there is no need to split the interval into smaller ones anymore
+        self.stats_maint.delete(parse(msg.start), parse(msg.stop))
 
     def on_broker_msg_STATS_DELETE_DAY(self, msg, *args):
-        self.stats_maint.delete(parse(msg.start), parse(msg.stop), MINUTELY)
+        # Sent by servers which still split intervals into days
+        self.stats_maint.delete(parse(msg.start), parse(msg.stop))
+
+    def on_broker_msg_STATS_APPLY_RETENTION(self, msg, *args):
+        self.stats_maint.apply_retention()
 
 # ################################################################################################################################
 
     def on_broker_msg_SERVICE_PUBLISH(self, msg, args=None):
         return self._on_message_invoke_service(msg, CHANNEL.INVOKE_ASYNC, 'SERVICE_PUBLISH', args)
 
+# ################################################################################################################################
+
+    def on_broker_msg_DATA_DICT_TRANSLATION_CHANGED(self, msg, *args):
+        self.translation_cache.on_version(msg.version)
+
 # ################################################################################################################################
 
     def on_broker_msg_MSG_NS_CREATE(self, msg, *args):
@@ -9,9 +9,15 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+import os
+from cPickle import dump, HIGHEST_PROTOCOL, load
 from copy import deepcopy
+from glob import glob
 from logging import getLogger
+from tempfile import mkstemp
 from threading import RLock
+from time import time
+from traceback import format_exc
 
 # Paste
 from paste.util.multidict import MultiDict
@@ -24,95 +30,113 @@ from zato.common import ZATO_NONE
 
 logger = getLogger(__name__)
 
+# Tells keys which are missing apart from ones whose value is None
+_missing = object()
+
 class ConfigDict(object):
     """ Stores configuration of a particular item of interest, such as an
     outgoing HTTP connection. Could've been a dict and we wouldn't have been using
     .get and .set but things like connection names aren't necessarily proper
-    Python attribute names. Also, despite certain dict operations being atomic
-    in CPython, the class employs a threading.Lock in critical places so the code
-    doesn't assume anything about CPython's byte code-specific implementation
-    details.
+    Python attribute names.
+
+    The underlying Bunch is a copy-on-write snapshot - it is never modified once
+    published. Writers serialize on a lock, build a new snapshot with their changes
+    applied and swap it in with a single assignment, so readers never need a lock,
+    always see a complete version of the configuration and can keep iterating over
+    an older one while a new one is being swapped in.
     """
     def __init__(self, name, _bunch=None):
         self.name = name
         self._impl = _bunch
-        self.lock = RLock()
+        self.lock = RLock() # Used by writers only
+
+    def _get_writable(self):
+        """ Returns a shallow copy of the current snapshot for a writer to modify and swap in afterwards.
+        """
+        return self._impl.__class__(self._impl)
+
+    def get_snapshot(self):
+        """ Returns the current snapshot. It must not be modified by callers but it will not change
+        underneath them either, which lets them read multiple items from a consistent version.
+        """
+        return self._impl
 
     def get(self, key, default=None):
-        with self.lock:
-            return self._impl.get(key, default)
+        return self._impl.get(key, default)
 
     def set(self, key, value):
         with self.lock:
-            self._impl[key] = value
+            impl = self._get_writable()
+            impl[key] = value
+            self._impl = impl
 
     __setitem__ = set
 
     def __getitem__(self, key):
-        with self.lock:
-            return self._impl.__getitem__(key)
+        return self._impl.__getitem__(key)
 
     def __delitem__(self, key):
         with self.lock:
-            del self._impl[key]
+            impl = self._get_writable()
+            del impl[key]
+            self._impl = impl
 
     def pop(self, key, default):
         with self.lock:
-            return self._impl.pop(key, default)
+
+            # Not 'key in self._impl' because Bunch would then also look up attributes, e.g. 'values'
+            impl = self._get_writable()
+            value = impl.pop(key, _missing)
+
+            if value is _missing:
+                return default
+
+            self._impl = impl
+
+            return value
 
     def __iter__(self):
-        with self.lock:
-            return iter(self._impl)
+        return iter(self._impl)
 
     def __repr__(self):
-        with self.lock:
-            return '<{} at {} keys:[{}]>'.format(self.__class__.__name__,
-                hex(id(self)), sorted(self._impl.keys()))
+        return '<{} at {} keys:[{}]>'.format(self.__class__.__name__,
+            hex(id(self)), sorted(self._impl.keys()))
 
     __str__ = __repr__
 
     def __nonzero__(self):
-        with self.lock:
-            return bool(self._impl)
+        return bool(self._impl)
 
     def keys(self):
-        with self.lock:
-            return self._impl.keys()
+        return self._impl.keys()
 
     def values(self):
-        with self.lock:
-            return self._impl.values()
+        return self._impl.values()
 
     def items(self):
-        with self.lock:
-            return self._impl.items()
+        return self._impl.items()
 
     def copy(self):
-        """ Returns a new instance of ConfigDict with items copied over from self.
+        """ Returns a new instance of ConfigDict sharing the current snapshot with self. Since snapshots are never
+        modified, each of the two will get its own one on its first write. Note that values are shared too - anything
+        that should not be seen through the other instance needs to be set anew rather than modified in place.
         """
-        with self.lock:
-            config_dict = ConfigDict(self.name)
-            config_dict._impl = Bunch()
-            config_dict._impl.update(deepcopy(self._impl))
-
-            return config_dict
+        return ConfigDict(self.name, self._impl)
 
     def get_config_list(self):
         """ Returns a list of deepcopied config Bunch objects.
         """
-        with self.lock:
-            out = []
-            for value in self._impl.values():
-                config = value['config']
-                out.append(deepcopy(config))
+        out = []
+        for value in self._impl.values():
+            config = value['config']
+            out.append(deepcopy(config))
 
         return out
 
     def copy_keys(self):
-        """ Returns a deepcopy of the underlying Bunch's keys
+        """ Returns a list of the current snapshot's keys.
         """
-        with self.lock:
-            return deepcopy(self._impl.keys())
+        return list(self._impl.keys())
 
     @staticmethod
     def from_query(name, query_data, impl_class=Bunch, item_class=Bunch, list_config=False):
@@ -248,3 +272,105 @@ class ConfigStore(object):
         config_store.odb_data = deepcopy(self.odb_data)
 
         return config_store
+
+# ################################################################################################################################
+
+class ConfigSnapshot(object):
+    """ A serialisable snapshot of configuration a server reads from the ODB when it starts. Any get_* method
+    of the underlying ODBManager can be invoked on a snapshot - each result is converted to plain Bunch objects
+    and kept in self.data so that sibling worker processes can load it from a local cache file instead of
+    running the same queries again. Cache files are named after a cluster-wide config version which is bumped
+    each time the configuration is edited so a stale snapshot is never loaded.
+    """
+    def __init__(self, odb, version, cache_dir=None):
+        self.odb = odb
+        self.version = version
+        self.cache_dir = cache_dir
+        self.data = {}
+        self.query_count = 0
+        self.query_time = 0.0
+
+    def __getattr__(self, name):
+        if not name.startswith('get_'):
+            raise AttributeError(name)
+
+        def _get(*args):
+            return self.get(name, *args)
+
+        return _get
+
+    def _to_snapshot(self, result):
+        """ Converts results of ODB queries to objects that can be pickled.
+        """
+        # A list of rows along with their columns, as returned by queries with needs_columns=True ..
+        if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], list):
+            rows, columns = result
+            names = columns.keys()
+            return [Bunch((name, getattr(row, name)) for name in names) for row in rows], Bunch.fromkeys(names)
+
+        # .. a list of rows only ..
+        if isinstance(result, list):
+            return [row if isinstance(row, Bunch) else Bunch(zip(row.keys(), row)) for row in result]
+
+        # .. anything else must already be made of plain Python objects.
+        return result
+
+    def get(self, func_name, *args):
+        """ Returns a result of invoking an ODBManager's method, either taken from the snapshot or,
+        if there is nothing in the snapshot for this method and arguments, from the ODB.
+        """
+        key = (func_name,) + args
+
+        if key not in self.data:
+            start = time()
+            self.data[key] = self._to_snapshot(getattr(self.odb, func_name)(*args))
+            self.query_time += time() - start
+            self.query_count += 1
+
+        return self.data[key]
+
+    @property
+    def path(self):
+        return os.path.join(self.cache_dir, 'config-snapshot-{}.pickle'.format(self.version))
+
+    def load(self):
+        """ Loads the snapshot from a cache file, if there is one for the current config version.
+        Returns True if the snapshot could be loaded, False otherwise.
+        """
+        if not self.cache_dir or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, 'rb') as f:
+                self.data = load(f)
+        except Exception, e:
+            logger.warn('Could not load config snapshot from `%s`, e:`%s`', self.path, format_exc(e))
+            self.data = {}
+            return False
+        else:
+            return True
+
+    def save(self):
+        """ Stores the snapshot in a cache file, deleting files of any previous config versions. The file
+        is written under a temporary name first so other processes never read a partially written one.
+        """
+        if not self.cache_dir:
+            return
+
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            for name in glob(os.path.join(self.cache_dir, 'config-snapshot-*.pickle')):
+                if name != self.path:
+                    os.remove(name)
+
+            # The file will have credentials in it so mkstemp is used because it creates it as readable to its owner only
+            fd, tmp_path = mkstemp(dir=self.cache_dir, prefix='config-snapshot-', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                dump(self.data, f, HIGHEST_PROTOCOL)
+
+            os.rename(tmp_path, self.path)
+
+        except Exception, e:
+            logger.warn('Could not save config snapshot to `%s`, e:`%s`', self.path, format_exc(e))
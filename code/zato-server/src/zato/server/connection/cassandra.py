@@ -9,8 +9,10 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from collections import OrderedDict
 from copy import deepcopy
 from logging import getLogger
+from time import time
 from traceback import format_exc
 
 # bunch
@@ -19,12 +21,15 @@ from bunch import Bunch
 # Cassandra
 from cassandra.auth import PlainTextAuthProvider
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
 
 # gevent
 from gevent.lock import RLock
 
 # Zato
-from zato.common import Inactive, PASSWORD_SHADOW
+from zato.common import CASSANDRA, CONN_METRICS, Inactive, PASSWORD_SHADOW
+from zato.server.connection.metrics import instrument, LatencyHistogram
 
 logger = getLogger(__name__)
 
@@ -34,6 +39,199 @@ msg_to_stdlib = {
     'tls_client_priv_key': 'keyfile',
     }
 
+# ################################################################################################################################
+
+class StatementStats(object):
+    """ How often a statement was found among prepared ones and how long executing it took.
+    """
+    def __init__(self, cql):
+        self.cql = cql
+        self.hits = 0
+        self.misses = 0
+        self.calls = 0
+        self.statements = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def on_call_end(self, start, statements, is_error):
+        self.calls += 1
+        self.statements += statements
+        self.latency.record(time() - start)
+
+        if is_error:
+            self.errors += 1
+
+    def get_stats(self):
+        stats = Bunch()
+        stats.cql = self.cql
+        stats.hits = self.hits
+        stats.misses = self.misses
+        stats.calls = self.calls
+        stats.statements = self.statements
+        stats.errors = self.errors
+        stats.latency_mean = self.latency.get_mean()
+        stats.latency_p50 = self.latency.get_percentile(50)
+        stats.latency_p99 = self.latency.get_percentile(99)
+        stats.latency_max = self.latency.max
+
+        return stats
+
+# ################################################################################################################################
+
+class CassandraClient(object):
+    """ Executes CQL through a session of a connection definition. Each statement is prepared once, the first time it's
+    needed, and kept in a cache keyed by its CQL text, least recently used statements being evicted once the cache is full.
+
+    Statements may be executed one by one, many at a time with a limit on how many are in progress concurrently,
+    in unlogged batches of statements to the same partition or, for large results, page by page.
+
+    Each call is timed under the statement's CQL. With execute_many and execute_batch it's how long all the statements
+    took together, with iter_rows it's how long the first page took. Statistics of up to stats_size statements are kept,
+    those of the least recently used ones being evicted first, same as prepared statements.
+
+    Nothing here blocks or yields except for calls to Cassandra themselves, so in a gevent-based worker no locks are needed.
+    A statement prepared concurrently by two greenlets is simply prepared twice.
+    """
+    def __init__(self, name, session, config=None):
+        config = config or {}
+
+        self.name = name
+        self.session = session
+        self.cache_size = int(config.get('statement_cache_size', CASSANDRA.CLIENT.STATEMENT_CACHE_SIZE))
+        self.concurrency = int(config.get('concurrency', CASSANDRA.CLIENT.CONCURRENCY))
+        self.batch_size = int(config.get('batch_size', CASSANDRA.CLIENT.BATCH_SIZE))
+        self.fetch_size = int(config.get('fetch_size', CASSANDRA.CLIENT.FETCH_SIZE))
+        self.stats_size = int(config.get('stats_size', CASSANDRA.CLIENT.STATS_SIZE))
+
+        self.prepared = OrderedDict() # CQL -> PreparedStatement, least recently used ones first
+        self.stats = OrderedDict() # CQL -> StatementStats, least recently used ones first
+        self.evictions = 0
+        self.stats_evictions = 0
+
+    def _get_stats(self, cql):
+        stats = self.stats.pop(cql, None)
+
+        if not stats:
+            stats = StatementStats(cql)
+
+            if len(self.stats) >= self.stats_size > 0:
+                self.stats.popitem(last=False)
+                self.stats_evictions += 1
+
+        # Re-added each time so the most recently used statements are always the last ones
+        if self.stats_size:
+            self.stats[cql] = stats
+
+        return stats
+
+    def prepare(self, cql):
+        """ Returns a prepared statement for the CQL given, preparing it only if it isn't in the cache already.
+        """
+        stats = self._get_stats(cql)
+        statement = self.prepared.pop(cql, None)
+
+        if statement:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+            statement = self.session.prepare(cql)
+
+            if len(self.prepared) >= self.cache_size > 0:
+                self.prepared.popitem(last=False)
+                self.evictions += 1
+
+        # Re-added each time so the most recently used statements are always the last ones
+        if self.cache_size:
+            self.prepared[cql] = statement
+
+        return statement
+
+    def _call(self, cql, statements, func, *args, **kwargs):
+        stats = self._get_stats(cql)
+        start = time()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            stats.on_call_end(start, statements, True)
+            raise
+        else:
+            stats.on_call_end(start, statements, False)
+            return result
+
+    def execute(self, cql, params=None):
+        """ Executes a statement with parameters given and returns its result.
+        """
+        return self._call(cql, 1, self.session.execute, self.prepare(cql).bind(params or ()))
+
+    def _execute_concurrent(self, cql, count, statements, concurrency, raise_on_first_error):
+        stats = self._get_stats(cql)
+        start = time()
+
+        try:
+            results = execute_concurrent(self.session, statements, concurrency or self.concurrency, raise_on_first_error)
+        except Exception:
+            stats.on_call_end(start, count, True)
+            raise
+        else:
+            stats.on_call_end(start, count, not all(success for success, _ in results))
+            return results
+
+    def execute_many(self, cql, params_list, concurrency=None, raise_on_first_error=True):
+        """ Executes a statement once for each of the parameters given, no more than concurrency statements at a time.
+        Returns a (success, result or exception) pair for each parameters, in the order they were given in.
+        """
+        prepared = self.prepare(cql)
+        statements = [(prepared.bind(params), None) for params in params_list]
+
+        return self._execute_concurrent(cql, len(statements), statements, concurrency, raise_on_first_error)
+
+    def execute_batch(self, cql, params_list, batch_size=None, concurrency=None, raise_on_first_error=True):
+        """ Executes a statement once for each of the parameters given, in unlogged batches. Each batch has statements
+        of a single partition only and no more than batch_size of them. Batches are executed concurrently, no more than
+        concurrency at a time, and statements whose partition cannot be told, because the statement doesn't bind
+        its whole partition key, are executed on their own. Returns a (success, result or exception) pair for each batch
+        and for each statement executed on its own.
+        """
+        prepared = self.prepare(cql)
+        batch_size = batch_size or self.batch_size
+
+        partitions = OrderedDict() # Routing key -> bound statements
+        statements = []
+
+        for params in params_list:
+            bound = prepared.bind(params)
+            routing_key = bound.routing_key
+
+            if routing_key is None:
+                statements.append((bound, None))
+            else:
+                partitions.setdefault(routing_key, []).append(bound)
+
+        for partition in partitions.values():
+            for idx in range(0, len(partition), batch_size):
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for bound in partition[idx:idx+batch_size]:
+                    batch.add(bound)
+                statements.append((batch, None))
+
+        return self._execute_concurrent(cql, len(params_list), statements, concurrency, raise_on_first_error)
+
+    def iter_rows(self, cql, params=None, fetch_size=None):
+        """ Yields rows of a statement's result, fetched in pages of fetch_size rows each, so that large results
+        never need to be kept in memory all at once.
+        """
+        bound = self.prepare(cql).bind(params or ())
+        bound.fetch_size = fetch_size or self.fetch_size
+
+        for row in self._call(cql, 1, self.session.execute, bound):
+            yield row
+
+    def get_stats(self):
+        return [stats.get_stats() for _, stats in sorted(self.stats.items())]
+
+# ################################################################################################################################
+
 class CassandraAPI(object):
     def __init__(self, conn_store):
         self._conn_store = conn_store
@@ -64,12 +262,19 @@ class CassandraAPI(object):
     def change_password_def(self, config):
         return self._conn_store.change_password(config)
 
+    def get_statement_stats(self, name=None):
+        return self._conn_store.get_statement_stats(name)
+
+# ################################################################################################################################
+
 class CassandraConnStore(object):
     """ Stores connections to Cassandra.
     """
-    def __init__(self):
+    def __init__(self, metrics_store=None, config=None):
         self.sessions = {}
         self.lock = RLock()
+        self.metrics_store = metrics_store
+        self.config = config or {}
 
     def __getitem__(self, name):
         return self.sessions[name]
@@ -83,7 +288,7 @@ class CassandraConnStore(object):
         config_no_sensitive = deepcopy(config)
         config_no_sensitive['password'] = PASSWORD_SHADOW
 
-        item = Bunch(config=config, config_no_sensitive=config_no_sensitive, is_connected=False, conn=None)
+        item = Bunch(config=config, config_no_sensitive=config_no_sensitive, is_connected=False, conn=None, client=None)
 
         try:
             auth_provider = PlainTextAuthProvider(config.username, config.password) if config.username else None
@@ -103,11 +308,17 @@ class CassandraConnStore(object):
             session = cluster.connect()
             session.set_keyspace(config.default_keyspace)
 
+            # Both connections and queries based on them execute statements through the same session
+            metrics = self.metrics_store.get(CONN_METRICS.CONN_TYPE.CASSANDRA, name) if self.metrics_store else None
+            if metrics:
+                session.execute = instrument(metrics, session.execute)
+
             logger.debug('Connected to `%s`', config_no_sensitive)
         except Exception, e:
             logger.warn('Could not connect to Cassandra `%s`, config:`%s`, e:`%s`', name, config_no_sensitive, format_exc(e))
         else:
             item.conn = session
+            item.client = CassandraClient(name, session, self.config)
             item.is_connected = True
 
         self.sessions[name] = item
@@ -134,6 +345,9 @@ class CassandraConnStore(object):
         finally:
             del self.sessions[name]
 
+            if self.metrics_store:
+                self.metrics_store.delete(CONN_METRICS.CONN_TYPE.CASSANDRA, name)
+
     def delete(self, name):
         """ Deletes an existing connection.
         """
@@ -150,3 +364,18 @@ class CassandraConnStore(object):
             new_config = deepcopy(self.sessions[password_data.name].config_no_sensitive)
             new_config.password = password_data.password
             return self.edit(password_data.name, new_config)
+
+    def get_statement_stats(self, name=None):
+        """ Returns statistics of statements executed through connections of a given name, or through all of them.
+        """
+        out = []
+
+        with self.lock:
+            for item_name, item in sorted(self.sessions.items()):
+                if item.client and (name is None or name == item_name):
+                    for stats in item.client.get_stats():
+                        stats.name = item_name
+                        out.append(stats)
+
+        return out
+
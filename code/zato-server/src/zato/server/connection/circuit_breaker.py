@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from collections import deque
+from math import ceil
+from threading import RLock
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# Paste
+from paste.util.converters import asbool
+
+# Zato
+from zato.common import CIRCUIT_BREAKER, ZatoException
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class CircuitBreakerOpen(ZatoException):
+    """ Raised when a call to a connection is rejected because its circuit breaker is open.
+    """
+    def __init__(self, name, retry_after):
+        super(CircuitBreakerOpen, self).__init__(None, 'Circuit breaker of `{}` is open, retry after {:.2f}s'.format(
+            name, retry_after))
+        self.retry_after = retry_after
+
+class BulkheadFull(ZatoException):
+    """ Raised when a call to a connection is rejected because too many other calls to it are already in progress.
+    """
+    def __init__(self, name, max_concurrency):
+        super(BulkheadFull, self).__init__(None, '`{}` already has {} call(s) in progress'.format(name, max_concurrency))
+
+# ################################################################################################################################
+
+def get_percentile(values, percentile):
+    """ Returns a given percentile of a non-empty list of values, using the nearest-rank method.
+    """
+    values = sorted(values)
+    idx = int(ceil(percentile / 100 * len(values))) - 1
+
+    return values[max(0, min(idx, len(values) - 1))]
+
+# ################################################################################################################################
+
+class CircuitBreaker(object):
+    """ A circuit breaker and a bulkhead of a single outgoing connection.
+
+    While closed, the breaker lets all calls through and keeps track of how many of the most recent window_size ones
+    failed or took longer than slow_call_time. Once there have been at least min_calls of them and the error rate
+    or the slow call rate reaches its threshold, the breaker opens and rejects all calls for open_time seconds.
+    After that, it becomes half-open and lets through up to probes calls - if all of them succeed, it closes again,
+    otherwise it opens for another open_time seconds.
+
+    Regardless of the state, no more than max_concurrency calls may be in progress at a time, if it's set, so that
+    a slow connection can't tie up all the greenlets of a worker. Calls beyond that are rejected immediately.
+
+    If needs_adaptive_timeout is set, get_timeout returns the timeout_percentile of latencies observed multiplied
+    by timeout_multiplier, so that calls to a connection that has slowed down fail fast instead of each of them
+    waiting for the connection's full timeout.
+    """
+    def __init__(self, name, window_size=CIRCUIT_BREAKER.WINDOW_SIZE, min_calls=CIRCUIT_BREAKER.MIN_CALLS,
+            error_rate=CIRCUIT_BREAKER.ERROR_RATE, slow_call_time=CIRCUIT_BREAKER.SLOW_CALL_TIME,
+            slow_call_rate=CIRCUIT_BREAKER.SLOW_CALL_RATE, open_time=CIRCUIT_BREAKER.OPEN_TIME,
+            probes=CIRCUIT_BREAKER.PROBES, max_concurrency=CIRCUIT_BREAKER.MAX_CONCURRENCY, needs_adaptive_timeout=False,
+            timeout_percentile=CIRCUIT_BREAKER.TIMEOUT_PERCENTILE, timeout_multiplier=CIRCUIT_BREAKER.TIMEOUT_MULTIPLIER,
+            min_timeout=CIRCUIT_BREAKER.MIN_TIMEOUT):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_time = slow_call_time
+        self.slow_call_rate = slow_call_rate
+        self.open_time = open_time
+        self.probes = probes
+        self.max_concurrency = max_concurrency
+        self.needs_adaptive_timeout = needs_adaptive_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+
+        self.state = CIRCUIT_BREAKER.STATE.CLOSED
+        self.opened_at = None
+        self.outcomes = deque() # (is_failure, is_slow) of the most recent calls made while closed
+        self.failures = 0 # How many of self.outcomes are failures ..
+        self.slow = 0 # .. and how many are slow calls
+        self.latencies = deque(maxlen=window_size)
+        self.in_progress = 0
+        self.probes_in_progress = 0
+        self.probes_ok = 0
+        self.lock = RLock()
+
+        self.stats = Bunch()
+        self.stats.calls = 0
+        self.stats.failures = 0
+        self.stats.slow_calls = 0
+        self.stats.rejected_open = 0
+        self.stats.rejected_concurrency = 0
+        self.stats.opened = 0
+
+# ################################################################################################################################
+
+    def _open(self, now):
+        self.state = CIRCUIT_BREAKER.STATE.OPEN
+        self.opened_at = now
+        self.probes_in_progress = 0
+        self.probes_ok = 0
+        self.stats.opened += 1
+
+        logger.warn('Circuit breaker of `%s` opened for %ss', self.name, self.open_time)
+
+    def _close(self):
+        self.state = CIRCUIT_BREAKER.STATE.CLOSED
+        self.opened_at = None
+        self.outcomes.clear()
+        self.failures = 0
+        self.slow = 0
+        self.probes_in_progress = 0
+        self.probes_ok = 0
+
+    def reset(self):
+        """ Closes the breaker and forgets about all the calls made so far.
+        """
+        with self.lock:
+            if self.state != CIRCUIT_BREAKER.STATE.CLOSED:
+                logger.info('Circuit breaker of `%s` reset', self.name)
+            self._close()
+
+# ################################################################################################################################
+
+    def before(self):
+        """ Needs to be called before each call to the connection. Raises an exception if the call must not be made,
+        otherwise returns a token to be given to self.after once the call completes.
+        """
+        with self.lock:
+            now = time()
+            is_probe = False
+
+            if self.state == CIRCUIT_BREAKER.STATE.OPEN:
+                if now < self.opened_at + self.open_time:
+                    self.stats.rejected_open += 1
+                    raise CircuitBreakerOpen(self.name, self.opened_at + self.open_time - now)
+
+                self.state = CIRCUIT_BREAKER.STATE.HALF_OPEN
+                logger.info('Circuit breaker of `%s` half-open', self.name)
+
+            if self.state == CIRCUIT_BREAKER.STATE.HALF_OPEN:
+
+                # All the probes needed are already in progress
+                if self.probes_in_progress + self.probes_ok >= self.probes:
+                    self.stats.rejected_open += 1
+                    raise CircuitBreakerOpen(self.name, 0)
+
+                is_probe = True
+
+            if self.max_concurrency and self.in_progress >= self.max_concurrency:
+                self.stats.rejected_concurrency += 1
+                raise BulkheadFull(self.name, self.max_concurrency)
+
+            if is_probe:
+                self.probes_in_progress += 1
+
+            self.in_progress += 1
+
+            return now, is_probe
+
+    def after(self, token, is_failure):
+        """ Needs to be called after each call that self.before let through, with the token it returned.
+        """
+        start, is_probe = token
+        is_failure = bool(is_failure)
+        latency = time() - start
+        is_slow = latency > self.slow_call_time
+
+        with self.lock:
+            self.in_progress -= 1
+            self.latencies.append(latency)
+
+            self.stats.calls += 1
+            if is_failure:
+                self.stats.failures += 1
+            if is_slow:
+                self.stats.slow_calls += 1
+
+            if is_probe:
+                self.probes_in_progress -= 1
+
+                # The breaker may have been reset in the meantime
+                if self.state != CIRCUIT_BREAKER.STATE.HALF_OPEN:
+                    return
+
+                if is_failure or is_slow:
+                    self._open(time())
+                else:
+                    self.probes_ok += 1
+                    if self.probes_ok >= self.probes:
+                        self._close()
+                        logger.info('Circuit breaker of `%s` closed', self.name)
+                return
+
+            # Calls that started before the breaker opened don't count anymore
+            if self.state != CIRCUIT_BREAKER.STATE.CLOSED:
+                return
+
+            self.outcomes.append((is_failure, is_slow))
+            self.failures += is_failure
+            self.slow += is_slow
+
+            if len(self.outcomes) > self.window_size:
+                old_failure, old_slow = self.outcomes.popleft()
+                self.failures -= old_failure
+                self.slow -= old_slow
+
+            total = len(self.outcomes)
+            if total >= self.min_calls:
+                if self.failures >= self.error_rate * total or self.slow >= self.slow_call_rate * total:
+                    self._open(time())
+
+    def cancel(self, token):
+        """ Needs to be called instead of self.after if a call let through by self.before wasn't made after all.
+        """
+        with self.lock:
+            self.in_progress -= 1
+            if token[1]:
+                self.probes_in_progress -= 1
+
+    def call(self, func, *args, **kwargs):
+        """ Invokes a callable through the breaker, any exception it raises counting as a failure.
+        """
+        token = self.before()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.after(token, True)
+            raise
+        else:
+            self.after(token, False)
+            return result
+
+# ################################################################################################################################
+
+    def get_timeout(self, default):
+        """ Returns the timeout calls to the connection should use, given the connection's own one.
+        """
+        if not self.needs_adaptive_timeout:
+            return default
+
+        with self.lock:
+            if len(self.latencies) < self.min_calls:
+                return default
+            latencies = list(self.latencies)
+
+        timeout = get_percentile(latencies, self.timeout_percentile) * self.timeout_multiplier
+
+        return min(max(timeout, self.min_timeout), default)
+
+    def get_stats(self):
+        with self.lock:
+            stats = Bunch(self.stats)
+            stats.name = self.name
+            stats.state = self.state
+            stats.in_progress = self.in_progress
+
+            total = len(self.outcomes)
+            stats.error_rate = self.failures / total if total else 0.0
+            stats.slow_call_rate = self.slow / total if total else 0.0
+            stats.latency = get_percentile(self.latencies, self.timeout_percentile) if self.latencies else 0.0
+
+            return stats
+
+# ################################################################################################################################
+
+class CircuitBreakerStore(object):
+    """ Circuit breakers of all the outgoing connections of a worker, keyed by their types and names,
+    all of them using the same configuration, i.e. the server's [circuit_breaker] section. Breakers are opt-in,
+    there are none unless is_enabled is set in that section.
+    """
+    def __init__(self, config=None):
+        config = config or {}
+
+        self.is_enabled = asbool(config.get('is_enabled', False))
+        self.options = {
+            'window_size': int(config.get('window_size', CIRCUIT_BREAKER.WINDOW_SIZE)),
+            'min_calls': int(config.get('min_calls', CIRCUIT_BREAKER.MIN_CALLS)),
+            'error_rate': float(config.get('error_rate', CIRCUIT_BREAKER.ERROR_RATE)),
+            'slow_call_time': float(config.get('slow_call_time', CIRCUIT_BREAKER.SLOW_CALL_TIME)),
+            'slow_call_rate': float(config.get('slow_call_rate', CIRCUIT_BREAKER.SLOW_CALL_RATE)),
+            'open_time': float(config.get('open_time', CIRCUIT_BREAKER.OPEN_TIME)),
+            'probes': int(config.get('probes', CIRCUIT_BREAKER.PROBES)),
+            'max_concurrency': int(config.get('max_concurrency', CIRCUIT_BREAKER.MAX_CONCURRENCY)),
+            'needs_adaptive_timeout': asbool(config.get('needs_adaptive_timeout', False)),
+            'timeout_percentile': float(config.get('timeout_percentile', CIRCUIT_BREAKER.TIMEOUT_PERCENTILE)),
+            'timeout_multiplier': float(config.get('timeout_multiplier', CIRCUIT_BREAKER.TIMEOUT_MULTIPLIER)),
+            'min_timeout': float(config.get('min_timeout', CIRCUIT_BREAKER.MIN_TIMEOUT)),
+        }
+        self.breakers = {} # (conn_type, name) -> CircuitBreaker
+        self.lock = RLock()
+
+    def get(self, conn_type, name):
+        """ Returns a breaker of a given connection, creating it if needed, or None if breakers are disabled.
+        """
+        if not self.is_enabled:
+            return None
+
+        with self.lock:
+            breaker = self.breakers.get((conn_type, name))
+            if not breaker:
+                breaker = self.breakers[(conn_type, name)] = CircuitBreaker(name, **self.options)
+
+            return breaker
+
+    def delete(self, conn_type, name):
+        """ Deletes a breaker of a given connection, e.g. because the connection has just been edited or deleted.
+        """
+        with self.lock:
+            self.breakers.pop((conn_type, name), None)
+
+    def reset(self, conn_type=None, name=None):
+        """ Resets breakers of a given connection type and name, or of all the connections if neither is given.
+        """
+        with self.lock:
+            for (_conn_type, _name), breaker in self.breakers.items():
+                if (conn_type is None or conn_type == _conn_type) and (name is None or name == _name):
+                    breaker.reset()
+
+    def get_stats(self):
+        """ Returns statistics of all the breakers, sorted by connection types and names.
+        """
+        with self.lock:
+            out = []
+            for (conn_type, _), breaker in sorted(self.breakers.items()):
+                stats = breaker.get_stats()
+                stats.conn_type = conn_type
+                out.append(stats)
+
+            return out
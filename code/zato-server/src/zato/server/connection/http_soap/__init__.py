@@ -9,11 +9,14 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-from httplib import BAD_REQUEST, FORBIDDEN, NOT_FOUND, UNAUTHORIZED
+from httplib import BAD_REQUEST, FORBIDDEN, NOT_FOUND, REQUEST_ENTITY_TOO_LARGE, UNAUTHORIZED
 
 # Zato
 from zato.common import HTTPException
 
+# Not in httplib under Python 2.7
+TOO_MANY_REQUESTS = 429
+
 class ClientHTTPError(HTTPException):
     def __init__(self, cid, msg, status):
         super(ClientHTTPError, self).__init__(cid, msg, status)
@@ -30,6 +33,15 @@ class NotFound(ClientHTTPError):
     def __init__(self, cid, msg):
         super(NotFound, self).__init__(cid, msg, NOT_FOUND)
         
+class RequestEntityTooLarge(ClientHTTPError):
+    def __init__(self, cid, msg):
+        super(RequestEntityTooLarge, self).__init__(cid, msg, REQUEST_ENTITY_TOO_LARGE)
+        
+class TooManyRequests(ClientHTTPError):
+    def __init__(self, cid, msg, retry_after):
+        super(TooManyRequests, self).__init__(cid, msg, TOO_MANY_REQUESTS)
+        self.retry_after = retry_after
+        
 class Unauthorized(ClientHTTPError):
     def __init__(self, cid, msg, challenge):
         super(Unauthorized, self).__init__(cid, msg, UNAUTHORIZED)
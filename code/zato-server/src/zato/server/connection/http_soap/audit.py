@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from time import time
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent.queue import Empty, Full, Queue
+
+# Zato
+from zato.common import AUDIT_LOG
+
+logger = logging.getLogger(__name__)
+
+# What kind of a row has been enqueued
+_REQUEST = 'request'
+_RESPONSE = 'response'
+
+# ################################################################################################################################
+
+class AuditQueue(object):
+    """ A write-behind queue for HTTP/SOAP audit log. Requests and responses are enqueued by the request path
+    and a background greenlet stores them in the ODB in batches, whenever there are batch_size of them
+    or flush_interval seconds have passed, whichever comes first.
+
+    Request rows are always inserted before response rows of the same batch are applied so that the latter
+    can always find the former. If the queue is full, overflow_policy decides whether new rows are dropped
+    or whether the caller waits for up to block_timeout seconds until there's room for them.
+
+    Unless needs_tokens is False, words found in requests and responses are also added to the audit log's search index.
+    """
+    def __init__(self, odb, max_size=AUDIT_LOG.QUEUE.MAX_SIZE, batch_size=AUDIT_LOG.QUEUE.BATCH_SIZE,
+            flush_interval=AUDIT_LOG.QUEUE.FLUSH_INTERVAL, overflow_policy=AUDIT_LOG.QUEUE.OVERFLOW_POLICY.DROP,
+            block_timeout=AUDIT_LOG.QUEUE.BLOCK_TIMEOUT, needs_tokens=True):
+        self.odb = odb
+        self.needs_tokens = needs_tokens
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        self.queue = Queue(max_size)
+        self.keep_running = False
+        self.greenlet = None
+
+        self.stats = Bunch()
+        self.stats.enqueued = 0
+        self.stats.dropped = 0
+        self.stats.stored = 0
+        self.stats.errors = 0
+        self.stats.batches = 0
+
+        if self.overflow_policy not in AUDIT_LOG.QUEUE.OVERFLOW_POLICY:
+            raise ValueError('Unrecognized overflow_policy `{}`, expected one of `{}`'.format(
+                self.overflow_policy, list(AUDIT_LOG.QUEUE.OVERFLOW_POLICY)))
+
+    def start(self):
+        self.keep_running = True
+        self.greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        """ Stops the background greenlet and stores in the ODB everything that is still enqueued.
+        """
+        self.keep_running = False
+
+        if self.greenlet:
+            self.greenlet.join(self.flush_interval * 2)
+
+        while True:
+            batch = self._collect(False)
+            if not batch:
+                break
+            self.flush(batch)
+
+# ################################################################################################################################
+
+    def _put(self, item):
+        try:
+            if self.overflow_policy == AUDIT_LOG.QUEUE.OVERFLOW_POLICY.BLOCK:
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except Full:
+            self.stats.dropped += 1
+            logger.warn('Audit queue full (%s), dropping %s of cid:`%s`', self.max_size, item[0], item[1]['cid'])
+        else:
+            self.stats.enqueued += 1
+
+    def put_request(self, row):
+        """ Enqueues a new audit row with all the request-related columns already set.
+        """
+        self._put((_REQUEST, row))
+
+    def put_response(self, row):
+        """ Enqueues response-related data to update an already existing row of the same cid with.
+        """
+        self._put((_RESPONSE, row))
+
+# ################################################################################################################################
+
+    def _collect(self, needs_wait=True):
+        """ Returns up to batch_size items, waiting for no longer than flush_interval seconds for them to arrive,
+        unless needs_wait is False in which case only items already in the queue are returned.
+        """
+        batch = []
+        deadline = time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            try:
+                if needs_wait:
+                    timeout = deadline - time()
+                    if timeout <= 0:
+                        break
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while self.keep_running:
+            batch = self._collect()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        """ Stores a batch of items in the ODB, requests first, responses next.
+        """
+        requests = [row for kind, row in batch if kind == _REQUEST]
+        responses = [row for kind, row in batch if kind == _RESPONSE]
+
+        try:
+            self.odb.audit_set_http_soap_many(requests, responses, self.needs_tokens)
+        except Exception, e:
+            self.stats.errors += 1
+            logger.warn('Could not store %s audit request(s) and %s response(s), e:`%s`',
+                len(requests), len(responses), format_exc(e))
+        else:
+            self.stats.batches += 1
+            self.stats.stored += len(batch)
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.depth = self.queue.qsize()
+
+        return stats
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from collections import OrderedDict
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from hashlib import sha1, sha256
+from threading import RLock
+from time import time
+from urlparse import parse_qsl
+
+# Bunch
+from bunch import Bunch
+
+# Zato
+from zato.common import HTTP_CACHE, SEC_DEF_TYPE, ZATO_NONE
+
+logger = logging.getLogger(__name__)
+
+# Security definitions whose credentials are always in HTTP headers, anything else is never cached
+_header_sec_types = (SEC_DEF_TYPE.APIKEY, SEC_DEF_TYPE.BASIC_AUTH, SEC_DEF_TYPE.TECH_ACCOUNT)
+
+# Responses with any of these headers are specific to the client they are sent to so they are never cached ..
+_per_client_headers = ('set-cookie', 'set-cookie2')
+
+# .. and neither are responses with any of these Cache-Control directives.
+_not_cacheable_directives = ('no-store', 'private')
+
+# ################################################################################################################################
+
+def get_query_params(value):
+    """ Turns a comma-separated list of query string parameters a channel's responses depend on into a list.
+    """
+    return [elem.strip() for elem in (value or '').split(',') if elem.strip()]
+
+def get_headers(value):
+    """ Turns a comma-separated list of HTTP headers a channel's responses depend on, such as Accept-Language,
+    into a list of WSGI environ keys, such as HTTP_ACCEPT_LANGUAGE.
+    """
+    return ['HTTP_{}'.format(elem.upper().replace('-', '_')) for elem in get_query_params(value)]
+
+# ################################################################################################################################
+
+class CacheEntry(object):
+    """ A response to a GET or HEAD request, cached along with its validators.
+    """
+    __slots__ = ('payload', 'content_type', 'headers', 'etag', 'last_modified', 'last_modified_http', 'expires')
+
+    def __init__(self, payload, content_type, headers, ttl):
+        self.payload = payload
+        self.content_type = content_type
+        self.headers = headers
+        self.etag = '"{}"'.format(sha1(payload).hexdigest())
+        self.last_modified = int(time())
+        self.last_modified_http = formatdate(self.last_modified, usegmt=True)
+        self.expires = self.last_modified + ttl
+
+    def is_not_modified(self, wsgi_environ):
+        """ Returns True if a conditional request's If-None-Match or If-Modified-Since matches this entry.
+        """
+        if_none_match = wsgi_environ.get('HTTP_IF_NONE_MATCH')
+
+        # If-None-Match takes precedence over If-Modified-Since if both are given
+        if if_none_match:
+            return if_none_match.strip() == '*' or self.etag in (elem.strip() for elem in if_none_match.split(','))
+
+        if_modified_since = wsgi_environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            if_modified_since = parsedate_tz(if_modified_since)
+            return bool(if_modified_since) and self.last_modified <= mktime_tz(if_modified_since)
+
+        return False
+
+# ################################################################################################################################
+
+class ResponseCache(object):
+    """ Responses of HTTP channels that have cache_ttl set, shared by all the channels of a worker. The cache keeps
+    up to max_size entries, evicting the least recently used ones, and each entry is valid for its channel's cache_ttl
+    seconds. Only successful responses to GET and HEAD requests no bigger than max_item_size bytes are cached,
+    as long as they don't set cookies and their Cache-Control allows for it.
+
+    Keys are made of a request's method, path, query string parameters, selected headers and the credentials presented,
+    so responses are never shared between clients authenticating differently. Channels may declare which of the query
+    string parameters are relevant, all of them are used by default.
+    """
+    def __init__(self, max_size=HTTP_CACHE.MAX_SIZE, max_item_size=HTTP_CACHE.MAX_ITEM_SIZE):
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.entries = OrderedDict() # (channel name, key) -> CacheEntry, least recently used ones first
+        self.stats = {} # channel name -> Bunch
+        self.lock = RLock()
+
+    def _get_stats(self, channel_name):
+        stats = self.stats.get(channel_name)
+        if not stats:
+            stats = self.stats[channel_name] = Bunch()
+            stats.hits = 0
+            stats.misses = 0
+            stats.not_modified = 0
+            stats.bytes_saved = 0
+
+        return stats
+
+# ################################################################################################################################
+
+    def get_key(self, channel_item, sec, wsgi_environ):
+        """ Returns a key a response to a request would be cached under or None if it's not cacheable at all.
+        """
+        if not self.max_size or not channel_item.get('cache_ttl'):
+            return None
+
+        method = wsgi_environ.get('REQUEST_METHOD')
+        if method not in HTTP_CACHE.METHODS:
+            return None
+
+        identity = None
+        sec_def = sec.sec_def
+
+        if sec_def != ZATO_NONE:
+            if sec_def.sec_type not in _header_sec_types:
+                return None
+
+            if sec_def.sec_type == SEC_DEF_TYPE.APIKEY:
+                identity = wsgi_environ.get(sec_def.username)
+            elif sec_def.sec_type == SEC_DEF_TYPE.BASIC_AUTH:
+                identity = wsgi_environ.get('HTTP_AUTHORIZATION')
+            else:
+                identity = (wsgi_environ.get('HTTP_X_ZATO_USER'), wsgi_environ.get('HTTP_X_ZATO_PASSWORD'))
+
+            identity = (sec_def.sec_type, sec_def.name, identity)
+
+        query = parse_qsl(wsgi_environ.get('QUERY_STRING', ''), True)
+        query_params = channel_item.get('cache_query_params')
+        if query_params:
+            query = [(name, value) for name, value in query if name in query_params]
+
+        headers = [wsgi_environ.get(name) for name in channel_item.get('cache_headers') or []]
+
+        return sha256(repr((method, wsgi_environ['PATH_INFO'], sorted(query), headers, identity))).hexdigest()
+
+    def get(self, channel_name, key):
+        """ Returns an unexpired entry of a given channel and key or None if there isn't any.
+        """
+        with self.lock:
+            entry = self.entries.pop((channel_name, key), None)
+            stats = self._get_stats(channel_name)
+
+            if not entry or entry.expires < time():
+                stats.misses += 1
+                return None
+
+            # Re-inserting moves the key to the end, i.e. makes it the most recently used one
+            self.entries[(channel_name, key)] = entry
+
+            stats.hits += 1
+            stats.bytes_saved += len(entry.payload)
+
+            return entry
+
+    def set(self, channel_name, key, ttl, response):
+        """ Caches a service's response under a given key and returns the new entry, or None if it can't be cached.
+        """
+        payload = response.payload
+
+        if response.status_code != 200 or not isinstance(payload, basestring):
+            return None
+
+        # Header names are case-insensitive
+        headers = dict((name.lower(), value) for name, value in response.headers.items())
+
+        if any(name in headers for name in _per_client_headers):
+            return None
+
+        cache_control = headers.get('cache-control', '').lower()
+        if any(directive in cache_control for directive in _not_cacheable_directives):
+            return None
+
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        if len(payload) > self.max_item_size:
+            return None
+
+        entry = CacheEntry(payload, response.content_type, dict(response.headers), ttl)
+
+        with self.lock:
+            self.entries.pop((channel_name, key), None)
+            self.entries[(channel_name, key)] = entry
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(False)
+
+        return entry
+
+    def not_modified(self, channel_name):
+        """ Records that a cached response didn't have to be sent at all because the client already had it.
+        """
+        with self.lock:
+            self._get_stats(channel_name).not_modified += 1
+
+    def invalidate(self, channel_name=None):
+        """ Deletes all the entries of a given channel or of all the channels if no name is given.
+        """
+        with self.lock:
+            if channel_name is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == channel_name]:
+                    del self.entries[key]
+
+    def get_stats(self):
+        """ Returns statistics of each channel, including its hit ratio and how many responses are currently cached.
+        """
+        with self.lock:
+            out = {}
+            for channel_name, stats in self.stats.items():
+                stats = out[channel_name] = Bunch(stats)
+                stats.size = 0
+                total = stats.hits + stats.misses
+                stats.hit_ratio = stats.hits / total if total else 0.0
+
+            for channel_name, _ in self.entries:
+                out.setdefault(channel_name, Bunch(
+                    hits=0, misses=0, not_modified=0, bytes_saved=0, hit_ratio=0.0, size=0)).size += 1
+
+            return out
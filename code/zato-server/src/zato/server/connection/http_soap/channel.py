@@ -10,7 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
-from httplib import INTERNAL_SERVER_ERROR, NOT_FOUND, responses, UNAUTHORIZED
+from httplib import INTERNAL_SERVER_ERROR, NOT_FOUND, NOT_MODIFIED, OK, REQUEST_ENTITY_TOO_LARGE, responses, UNAUTHORIZED
+from math import ceil
 from traceback import format_exc
 
 # anyjson
@@ -20,16 +21,22 @@ from anyjson import dumps
 from django.http import QueryDict
 
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, SEC_DEF_TYPE, SIMPLE_IO, TRACE1, URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, \
-     ZATO_ERROR, ZATO_NONE, ZATO_OK
+from zato.common import CHANNEL, DATA_FORMAT, HTTP_STREAMING, SEC_DEF_TYPE, SIMPLE_IO, TRACE1, URL_PARAMS_PRIORITY, URL_TYPE, \
+     zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.util import payload_from_request
-from zato.server.connection.http_soap import ClientHTTPError, NotFound, Unauthorized
+from zato.server.connection.http_soap import ClientHTTPError, NotFound, RequestEntityTooLarge, TOO_MANY_REQUESTS, \
+     TooManyRequests, Unauthorized
+from zato.server.connection.http_soap.stream import read_body, RequestBody
 from zato.server.service.internal import AdminService
 
 logger = logging.getLogger(__name__)
 
 _status_internal_server_error = b'{} {}'.format(INTERNAL_SERVER_ERROR, responses[INTERNAL_SERVER_ERROR])
 _status_not_found = b'{} {}'.format(NOT_FOUND, responses[NOT_FOUND])
+_status_not_modified = b'{} {}'.format(NOT_MODIFIED, responses[NOT_MODIFIED])
+_status_ok = b'{} {}'.format(OK, responses[OK])
+_status_request_entity_too_large = b'{} {}'.format(REQUEST_ENTITY_TOO_LARGE, responses[REQUEST_ENTITY_TOO_LARGE])
+_status_too_many_requests = b'{} Too Many Requests'.format(TOO_MANY_REQUESTS)
 _status_unauthorized = b'{} {}'.format(UNAUTHORIZED, responses[UNAUTHORIZED])
 
 soap_doc = b"""<?xml version='1.0' encoding='UTF-8'?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns="https://zato.io/ns/20130518"><soap:Body>{body}</soap:Body></soap:Envelope>""" # noqa
@@ -82,11 +89,17 @@ def get_client_error_wrapper(transport, data_format):
 class RequestDispatcher(object):
     """ Dispatches all the incoming HTTP/SOAP requests to appropriate handlers.
     """
-    def __init__(self, url_data=None, security=None, request_handler=None, simple_io_config=None):
+    def __init__(self, url_data=None, security=None, request_handler=None, simple_io_config=None,
+            spill_threshold=HTTP_STREAMING.SPILL_THRESHOLD, chunk_size=HTTP_STREAMING.CHUNK_SIZE, response_cache=None,
+            rate_limiter=None):
         self.url_data = url_data
         self.security = security
         self.request_handler = request_handler
         self.simple_io_config = simple_io_config
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.spill_threshold = spill_threshold
+        self.chunk_size = chunk_size
 
     def wrap_error_message(self, cid, url_type, msg):
         """ Wraps an error message in a transport-specific envelope.
@@ -109,6 +122,17 @@ class RequestDispatcher(object):
 
         return soap_action
 
+    def _read_request(self, cid, channel_item, wsgi_environ):
+        """ Returns a request's body - a string for regular channels and a file-like RequestBody for streaming ones,
+        in either case no bigger than the channel's max_body_size, if there is one.
+        """
+        max_body_size = channel_item.get('max_body_size')
+
+        if channel_item.get('needs_streaming'):
+            return RequestBody.from_wsgi(cid, wsgi_environ, max_body_size, self.spill_threshold, self.chunk_size)
+
+        return read_body(cid, wsgi_environ, max_body_size)
+
     def dispatch(self, cid, req_timestamp, wsgi_environ, worker_store):
         """ Base method for dispatching incoming HTTP/SOAP messages. If the security
         configuration is one of the technical account or HTTP basic auth,
@@ -137,29 +161,46 @@ class RequestDispatcher(object):
         # This is needed in parallel.py's on_wsgi_request
         wsgi_environ['zato.http.channel_item'] = channel_item
 
-        payload = wsgi_environ['wsgi.input'].read()
-        
         # OK, we can possibly handle it
         if url_match:
 
-            # This is a synchronous call so that whatever happens next we are always
-            # able to have at least initial audit log of requests.
-            if channel_item['audit_enabled']:
-                self.url_data.audit_set_request(cid, channel_item, payload, wsgi_environ)
-
             # Raise 404 if the channel is inactive
             if not channel_item['is_active']:
                 logger.warn('url_data:[%s] is not active, raising NotFound', sorted(url_match.items()))
                 raise NotFound(cid, 'Channel inactive')
 
+            payload = None
+
             try:
 
+                # Requests over a channel's rate limit are rejected before anything else is done with them
+                if self.rate_limiter:
+                    retry_after = self.rate_limiter.check(channel_item, wsgi_environ)
+                    if retry_after:
+                        raise TooManyRequests(cid, 'Rate limit of channel `{}` exceeded'.format(channel_item['name']),
+                            int(ceil(retry_after)))
+
+                # Bodies of requests to channels which don't need them in memory are spooled instead of being read at once
+                payload = self._read_request(cid, channel_item, wsgi_environ)
+                is_streaming = isinstance(payload, RequestBody)
+
+                # Payload is masked right away but it's the audit queue that will store it in the ODB
+                # so whatever happens next we are always able to have at least initial audit log of requests.
+                # Streamed bodies are not audited as they may be arbitrarily large.
+                if channel_item['audit_enabled']:
+                    self.url_data.audit_set_request(cid, channel_item, '' if is_streaming else payload, wsgi_environ)
+
                 # Need to read security info here so we know if POST needs to be
                 # parsed. If so, we do it here and reuse it in other places
                 # so it doesn't have to be parsed two or more times.
                 sec = self.url_data.url_sec[channel_item['match_target']]
+
+                # Security definitions that sign or carry credentials in the body need all of it
+                sec_payload = payload.getvalue() if is_streaming and sec.sec_def != ZATO_NONE and sec.sec_def.sec_type in(
+                    SEC_DEF_TYPE.OAUTH, SEC_DEF_TYPE.WSS, SEC_DEF_TYPE.XPATH_SEC) else payload
+
                 if sec.sec_def != ZATO_NONE and sec.sec_def.sec_type == SEC_DEF_TYPE.OAUTH:
-                    post_data = QueryDict(payload, encoding='utf-8')
+                    post_data = QueryDict(sec_payload, encoding='utf-8')
                 else:
                     post_data = {}
 
@@ -170,11 +211,22 @@ class RequestDispatcher(object):
                 # in later steps, it won't be parsed twice or more.
                 if sec.sec_def != ZATO_NONE and sec.sec_def.sec_type == SEC_DEF_TYPE.XPATH_SEC:
                     wsgi_environ['zato.request.payload'] = payload_from_request(
-                        cid, payload, channel_item.data_format, channel_item.transport)
+                        cid, sec_payload, channel_item.data_format, channel_item.transport)
 
                 # Will raise an exception on any security violation
                 self.url_data.check_security(
-                    sec, cid, channel_item, path_info, payload, wsgi_environ, post_data)
+                    sec, cid, channel_item, path_info, sec_payload, wsgi_environ, post_data)
+
+                # Services of streaming channels receive the body as is, without having it parsed in advance
+                if is_streaming:
+                    wsgi_environ.setdefault('zato.request.payload', payload)
+
+                # Responses of channels with a cache configured may be returned without invoking their services at all
+                cache_key = self.response_cache.get_key(channel_item, sec, wsgi_environ) if self.response_cache else None
+                if cache_key:
+                    entry = self.response_cache.get(channel_item['name'], cache_key)
+                    if entry:
+                        return self.set_cached_response(channel_item, wsgi_environ, entry)
 
                 # OK, no security exception at that point means we can finally
                 # invoke the service.
@@ -184,6 +236,11 @@ class RequestDispatcher(object):
                 # Got response from the service so we can construct response headers now
                 self.add_response_headers(wsgi_environ, response)
 
+                if cache_key:
+                    entry = self.response_cache.set(channel_item['name'], cache_key, channel_item['cache_ttl'], response)
+                    if entry:
+                        return self.set_cached_response(channel_item, wsgi_environ, entry)
+
                 # Return the payload to the client
                 return response.payload
 
@@ -201,6 +258,11 @@ class RequestDispatcher(object):
                         wsgi_environ['zato.http.response.headers']['WWW-Authenticate'] = e.challenge
                     elif isinstance(e, NotFound):
                         status = _status_not_found
+                    elif isinstance(e, RequestEntityTooLarge):
+                        status = _status_request_entity_too_large
+                    elif isinstance(e, TooManyRequests):
+                        status = _status_too_many_requests
+                        wsgi_environ['zato.http.response.headers']['Retry-After'] = str(e.retry_after)
                 else:
                     status_code = INTERNAL_SERVER_ERROR
                     response = _format_exc
@@ -225,6 +287,10 @@ class RequestDispatcher(object):
                 
                 return response
 
+            finally:
+                if isinstance(payload, RequestBody):
+                    payload.close()
+
         # This is 404, no such URL path and SOAP action is known.
         else:
             response = b"[{}] Unknown URL:[{}] or SOAP action:[{}]".format(cid, path_info, soap_action)
@@ -233,6 +299,24 @@ class RequestDispatcher(object):
             logger.error(response)
             return response
 
+    def set_cached_response(self, channel_item, wsgi_environ, entry):
+        """ Sets headers of a cached response and returns its payload, or nothing at all, along with 304 Not Modified,
+        if the client sent a conditional request matching what it already has.
+        """
+        headers = wsgi_environ['zato.http.response.headers']
+        headers.update(entry.headers)
+        headers['Content-Type'] = entry.content_type
+        headers['ETag'] = entry.etag
+        headers['Last-Modified'] = entry.last_modified_http
+
+        if entry.is_not_modified(wsgi_environ):
+            self.response_cache.not_modified(channel_item['name'])
+            wsgi_environ['zato.http.response.status'] = _status_not_modified
+            return b''
+
+        wsgi_environ['zato.http.response.status'] = _status_ok
+        return entry.payload
+
     def add_response_headers(self, wsgi_environ, response):
         """ Adds HTTP response headers on a 200 OK.
         """
@@ -272,7 +356,7 @@ class RequestHandler(object):
         if post_data:
             post = post_data
         else:
-            if channel_item.data_format == DATA_FORMAT.POST:
+            if channel_item.data_format == DATA_FORMAT.POST and isinstance(raw_request, basestring):
                 post = QueryDict(raw_request, encoding='utf-8')
             else:
                 post = QueryDict(None, encoding='utf-8')
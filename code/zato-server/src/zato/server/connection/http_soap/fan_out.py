@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent import Timeout
+from gevent.lock import BoundedSemaphore
+from gevent.queue import Empty, Queue
+
+# Zato
+from zato.common import FAN_OUT
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+def _get_needed(mode, needed, total):
+    """ Returns how many calls need to succeed for a fan-out of a given mode to be complete.
+    """
+    if mode == FAN_OUT.MODE.ALL:
+        return total
+
+    if mode == FAN_OUT.MODE.QUORUM:
+        return total // 2 + 1
+
+    if mode == FAN_OUT.MODE.FIRST:
+        return min(needed or 1, total)
+
+    raise ValueError('Unrecognized mode `{}`, expected one of `{}`'.format(
+        mode, (FAN_OUT.MODE.ALL, FAN_OUT.MODE.FIRST, FAN_OUT.MODE.QUORUM)))
+
+def fan_out(calls, concurrency=FAN_OUT.CONCURRENCY, timeout=None, call_timeout=None, mode=FAN_OUT.MODE.ALL, needed=None):
+    """ Invokes callables concurrently, no more than concurrency of them at a time, and returns a Bunch with a result
+    of each of them, in the same order the callables were given in.
+
+    mode decides when the fan-out is complete - when all the calls succeed, when the first needed ones do,
+    or when a majority of them does. Calls still running or waiting for their turn at that point, or once timeout
+    seconds have passed, or once it's clear that a first-N or quorum fan-out can't be complete anymore, are cancelled.
+    Each call may additionally take no longer than call_timeout seconds.
+
+    Each result has the call's index, whether it was ok, what the call returned or the exception it raised,
+    whether it timed out or was cancelled and how long it took.
+    """
+    start = time()
+    deadline = start + timeout if timeout else None
+    needed = _get_needed(mode, needed, len(calls))
+
+    semaphore = BoundedSemaphore(concurrency)
+    done = Queue()
+    results = []
+
+    def _run(result, call):
+        with semaphore:
+            call_start = time()
+            try:
+                with Timeout(call_timeout):
+                    result.response = call()
+                    result.ok = True
+            except Timeout, e:
+                result.exception = e
+                result.is_timeout = True
+            except Exception, e:
+                result.exception = e
+            finally:
+                result.time = time() - call_start
+        done.put(result)
+
+    greenlets = []
+    for idx, call in enumerate(calls):
+        result = Bunch(index=idx, ok=False, response=None, exception=None, is_timeout=False, is_cancelled=False, time=None)
+        results.append(result)
+        greenlets.append(gevent.spawn(_run, result, call))
+
+    ok_count = 0
+    failed_count = 0
+
+    while ok_count + failed_count < len(calls):
+
+        # Complete already ..
+        if ok_count >= needed:
+            break
+
+        # .. or it cannot be complete anymore, though with FAN_OUT.MODE.ALL all the results are always waited for
+        if mode != FAN_OUT.MODE.ALL and len(calls) - failed_count < needed:
+            break
+
+        if deadline:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+        else:
+            remaining = None
+
+        try:
+            result = done.get(timeout=remaining)
+        except Empty:
+            break
+
+        if result.ok:
+            ok_count += 1
+        else:
+            failed_count += 1
+
+    # Stragglers are not needed anymore
+    running = [greenlet for greenlet in greenlets if not greenlet.ready()]
+    if running:
+        gevent.killall(running)
+
+    for result in results:
+        if not result.ok and result.exception is None:
+            result.is_cancelled = True
+
+    out = Bunch()
+    out.results = results
+    out.ok_count = len([result for result in results if result.ok]) # Some may have completed after the loop ended
+    out.is_complete = out.ok_count >= needed
+    out.time = time() - start
+
+    return out
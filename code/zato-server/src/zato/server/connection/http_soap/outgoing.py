@@ -26,19 +26,37 @@ from parse import PARSE_RE
 import requests
 
 # Zato
-from zato.common import DATA_FORMAT, HTTP_SOAP_SERIALIZATION_TYPE, Inactive, SEC_DEF_TYPE, URL_TYPE
+from zato.common import DATA_FORMAT, FAN_OUT, HTTP_SOAP_SERIALIZATION_TYPE, Inactive, SEC_DEF_TYPE, URL_TYPE
 from zato.common.util import get_component_name
+from zato.server.connection.http_soap.fan_out import fan_out
+from zato.server.connection.http_soap.wsdl import WSDLCache
 from zato.server.connection.queue import ConnectionQueue
 
 logger = logging.getLogger(__name__)
 
 # ################################################################################################################################
 
+def is_server_error(response, transport):
+    """ Returns True if a response means the remote end failed to handle a request. SOAP faults are returned
+    with HTTP 500 yet they are errors of the application rather than of the server, so they are not counted.
+    """
+    if response.status_code < 500:
+        return False
+
+    if transport == URL_TYPE.SOAP and response.status_code == 500:
+        return 'Fault' not in (response.text or '')
+
+    return True
+
+# ################################################################################################################################
+
 class BaseHTTPSOAPWrapper(object):
     """ Base class for HTTP/SOAP connections wrappers.
     """
-    def __init__(self, config, requests_module=None):
+    def __init__(self, config, requests_module=None, circuit_breaker=None, metrics=None):
         self.config = config
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
         self.config['timeout'] = float(self.config['timeout'])
         self.config_no_sensitive = deepcopy(self.config)
         self.config_no_sensitive['password'] = '***'
@@ -136,8 +154,8 @@ class BaseHTTPSOAPWrapper(object):
 class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
     """ A thin wrapper around the API exposed by the 'requests' package.
     """
-    def __init__(self, config, requests_module=None):
-        super(HTTPSOAPWrapper, self).__init__(config, requests_module)
+    def __init__(self, config, requests_module=None, circuit_breaker=None, metrics=None):
+        super(HTTPSOAPWrapper, self).__init__(config, requests_module, circuit_breaker, metrics)
 
         self.soap = {}
         self.soap['1.1'] = {}
@@ -228,6 +246,14 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 
     auth = property(fget=_get_auth, doc=_get_auth)
 
+    def get_timeout(self):
+        """ Returns the timeout to use, which may be lower than the configured one if adaptive timeouts are enabled.
+        """
+        if self.circuit_breaker:
+            return self.circuit_breaker.get_timeout(self.config['timeout'])
+
+        return self.config['timeout']
+
     def _enforce_is_active(self):
         if not self.config['is_active']:
             raise Inactive(self.config['name'])
@@ -275,9 +301,28 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 
         logger.info('CID:[%s], address:[%s], qs_params:[%s], auth:[%s], kwargs:[%s]', cid, address, qs_params, self.requests_auth, kwargs) 
 
-        response = self.session.request(method, address, data=data,
-            auth=self.requests_auth, params=qs_params, headers=headers, timeout=self.config['timeout'],
-            cert=self.tls_key_cert, verify=False, *args, **kwargs)
+        timeout = kwargs.pop('timeout', None) or self.get_timeout()
+
+        # Raises an exception if the connection's circuit breaker is open or too many calls are already in progress
+        token = self.circuit_breaker.before() if self.circuit_breaker else None
+        start = self.metrics.on_call_start() if self.metrics else None
+
+        try:
+            response = self.session.request(method, address, data=data,
+                auth=self.requests_auth, params=qs_params, headers=headers, timeout=timeout,
+                cert=self.tls_key_cert, verify=False, *args, **kwargs)
+        except Exception:
+            if token:
+                self.circuit_breaker.after(token, True)
+            if start:
+                self.metrics.on_call_end(start, True)
+            raise
+        else:
+            is_error = is_server_error(response, self.config.get('transport'))
+            if token:
+                self.circuit_breaker.after(token, is_error)
+            if start:
+                self.metrics.on_call_end(start, is_error)
 
         logger.debug('CID:[%s], response:[%s]', cid, response.text)
 
@@ -314,10 +359,11 @@ class HTTPSOAPWrapper(BaseHTTPSOAPWrapper):
 # ################################################################################################################################
 
 class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
-    """ A thin wrapper around the suds SOAP library
+    """ A thin wrapper around the suds SOAP library. Clients are clones of a prototype from wsdl_cache so the WSDL
+    is parsed at most once per connection queue, or not at all if it hasn't changed since it was last parsed.
     """
-    def __init__(self, config):
-        super(SudsSOAPWrapper, self).__init__(config)
+    def __init__(self, config, wsdl_cache=None, circuit_breaker=None, metrics=None, requests_module=None):
+        super(SudsSOAPWrapper, self).__init__(config, requests_module, circuit_breaker)
         self.update_lock = RLock()
         self.config = config
         self.config['timeout'] = float(self.config['timeout'])
@@ -325,16 +371,47 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
         self.config_no_sensitive['password'] = '***'
         self.address = '{}{}'.format(self.config['address_host'], self.config['address_url_path'])
         self.conn_type = 'Suds SOAP'
+        self.wsdl_cache = wsdl_cache or WSDLCache()
+        self.local_wsdl_cache = WSDLCache()
+
+        # Lazily-imported here to make sure gevent monkey patches everything well in advance
+        from suds import WebFault
+
+        # SOAP faults are responses of a working remote end so they don't count as failures of the connection
         self.client = ConnectionQueue(
             self.config['pool_size'], self.config['queue_build_cap'], self.config['name'], self.conn_type, self.address,
-            self.add_client)
+            self.add_client, circuit_breaker, metrics, (WebFault,))
 
-    def add_client(self):
+    def get_wsdl(self):
+        """ Returns contents of the WSDL or None if they cannot be fetched without suds, which is the case with NTLM.
+        """
+        sec_type = self.config['sec_type']
 
-        logger.info('About to add a client to `%s` (%s)', self.address, self.conn_type)
+        if sec_type == SEC_DEF_TYPE.NTLM:
+            return None
+
+        auth = (self.suds_auth['username'], self.suds_auth['password']) if sec_type == SEC_DEF_TYPE.BASIC_AUTH else None
 
+        response = self.session.get(self.address, auth=auth, timeout=self.config['timeout'], verify=False)
+        response.raise_for_status()
+
+        return response.content
+
+    def create_client(self, cache):
+        """ Creates a new client, which means fetching and parsing the WSDL, along with its imported documents,
+        possibly reading them from cache.
+        """
         # Lazily-imported here to make sure gevent monkey patches everything well in advance
         from suds.client import Client
+
+        return Client(self.address, autoblend=True, cache=cache, timeout=self.config['timeout'], **self.get_client_options())
+
+    def get_client_options(self):
+        """ Returns security-related options each client needs to have its own copies of. Both transport and wsse
+        are always returned because clones start off with deep copies of their prototype's options and the prototype
+        may have been created by another connection, with credentials of its own.
+        """
+        # Lazily-imported here to make sure gevent monkey patches everything well in advance
         from suds.transport.https import HttpAuthenticated
         from suds.transport.https import WindowsHttpAuthenticated
         from suds.wsse import Security, UsernameToken
@@ -342,24 +419,39 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
         sec_type = self.config['sec_type']
 
         if sec_type == SEC_DEF_TYPE.BASIC_AUTH:
-            transport = HttpAuthenticated(**self.suds_auth)
+            return {'transport': HttpAuthenticated(**self.suds_auth), 'wsse': None}
 
         elif sec_type == SEC_DEF_TYPE.NTLM:
-            transport = WindowsHttpAuthenticated(**self.suds_auth)
+            return {'transport': WindowsHttpAuthenticated(**self.suds_auth), 'wsse': None}
 
         elif sec_type == SEC_DEF_TYPE.WSS:
             security = Security()
             token = UsernameToken(self.suds_auth['username'], self.suds_auth['password'])
             security.tokens.append(token)
 
-            client = Client(self.address, autoblend=True, wsse=security)
+            return {'transport': HttpAuthenticated(), 'wsse': security}
+
+        # No security at all
+        return {'transport': HttpAuthenticated(), 'wsse': None}
 
-        if sec_type in(SEC_DEF_TYPE.BASIC_AUTH, SEC_DEF_TYPE.NTLM):
-            client = Client(self.address, autoblend=True, transport=transport)
+    def add_client(self):
 
-        # Still could be either none at all or WSS
-        if not sec_type:
-            client = Client(self.address, autoblend=True, timeout=self.config['timeout'])
+        logger.info('About to add a client to `%s` (%s)', self.address, self.conn_type)
+
+        try:
+            wsdl = self.get_wsdl()
+        except Exception, e:
+            logger.warn('Could not fetch WSDL from `%s`, e:`%s`', self.address, format_exc(e))
+            wsdl = None
+
+        # If contents of the WSDL are not known, its prototype can be shared by clients of this queue only
+        if wsdl is None:
+            wsdl_cache, wsdl = self.local_wsdl_cache, b''
+        else:
+            wsdl_cache = self.wsdl_cache
+
+        client = wsdl_cache.get_client(self.address, wsdl, self.create_client)
+        client.set_options(timeout=self.config['timeout'], **self.get_client_options())
 
         self.client.put_client(client)
 
@@ -369,3 +461,55 @@ class SudsSOAPWrapper(BaseHTTPSOAPWrapper):
             self.client.build_queue()
 
 # ################################################################################################################################
+
+class HTTPSOAPFacade(object):
+    """ What services see as self.outgoing.plain_http and self.outgoing.soap - the connections' ConfigDict,
+    with everything delegated to it, plus a way to invoke multiple connections concurrently.
+    """
+    def __init__(self, config_dict):
+        self.config_dict = config_dict
+
+    def __getattr__(self, name):
+        return getattr(self.config_dict, name)
+
+    def __getitem__(self, key):
+        return self.config_dict[key]
+
+    def __iter__(self):
+        return iter(self.config_dict)
+
+    def __nonzero__(self):
+        return bool(self.config_dict)
+
+    def __repr__(self):
+        return repr(self.config_dict)
+
+    def _get_callable(self, cid, call):
+        if callable(call):
+            return call
+
+        conn = self.config_dict[call['name']].conn
+        kwargs = {'headers': call.get('headers') or {}}
+
+        if call.get('timeout'):
+            kwargs['timeout'] = call['timeout']
+
+        return lambda: conn.http_request(call.get('method', 'GET'), cid, call.get('data', ''), call.get('params'), **kwargs)
+
+    def fan_out(self, cid, calls, concurrency=FAN_OUT.CONCURRENCY, timeout=None, call_timeout=None, mode=FAN_OUT.MODE.ALL,
+            needed=None):
+        """ Invokes multiple connections concurrently, e.g. to aggregate responses of many backends. Each call is either
+        a dict with a connection's name and, optionally, its method, data, params, headers and timeout, or a callable
+        taking no arguments, which is what suds SOAP connections, being invoked through their clients, need to use.
+
+        Returns the outcome of zato.server.connection.http_soap.fan_out.fan_out, each of the results
+        having also the name of the connection it's about, if it was given.
+        """
+        out = fan_out([self._get_callable(cid, call) for call in calls], concurrency, timeout, call_timeout, mode, needed)
+
+        for call, result in zip(calls, out.results):
+            result.name = None if callable(call) else call['name']
+
+        return out
+
+# ################################################################################################################################
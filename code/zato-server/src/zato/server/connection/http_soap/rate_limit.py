@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from collections import OrderedDict
+from math import ceil
+from threading import RLock
+from time import time
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# Zato
+from zato.common import KVDB, RATE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+def get_client(wsgi_environ, trusted_proxies=0):
+    """ Returns what identifies a client of a channel that has per-client rate limits, i.e. the client's address.
+    Each channel has at most one security definition, shared by all of its clients, so it can't tell them apart.
+
+    Clients can send any X-Forwarded-For they like so it's used only if trusted_proxies is given, in which case
+    the address is the one appended by the outermost of that many proxies, i.e. the last but trusted_proxies - 1 one.
+    """
+    if trusted_proxies:
+        forwarded_for = [elem.strip() for elem in wsgi_environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if elem.strip()]
+        if forwarded_for:
+            return forwarded_for[max(len(forwarded_for) - trusted_proxies, 0)]
+
+    return wsgi_environ.get('REMOTE_ADDR', '')
+
+# ################################################################################################################################
+
+class TokenBucket(object):
+    """ Holds up to limit tokens, refilled at a rate of limit tokens per period seconds, each request taking one of them.
+    """
+    __slots__ = ('limit', 'period', 'rate', 'tokens', 'last_refill', 'last_used', 'pending', 'blocked_until')
+
+    def __init__(self, limit, period, now):
+        self.limit = limit
+        self.period = period
+        self.rate = limit / period
+        self.tokens = float(limit)
+        self.last_refill = now
+        self.last_used = now
+        self.pending = 0 # How many tokens have been taken since the last sync with Redis
+        self.blocked_until = 0 # Set if the cluster-wide limit has been reached in the current period
+
+    def take(self, now):
+        """ Takes a token and returns 0 if there was any left or returns in how many seconds there will be one otherwise.
+        """
+        self.last_used = now
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(self.limit, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+        self.tokens -= 1
+        self.pending += 1
+
+        return 0
+
+# ################################################################################################################################
+
+class RateLimiter(object):
+    """ Rate limits of HTTP channels. Each channel's rate_limit requests per rate_limit_period seconds apply either
+    to the channel as a whole or, if rate_limit_per_client is set, to each of its clients' addresses separately.
+
+    Requests are checked against token buckets local to a worker so there's no Redis round-trip on the request path.
+    Instead, every sync_interval seconds a background greenlet adds how many requests each bucket let through
+    to cluster-wide counters of the current period, all of them in a single Redis pipeline. If a counter shows
+    that the cluster as a whole has reached a limit, the bucket rejects requests until the period is over.
+
+    Enforcement is therefore approximate - in the worst case, each of N workers may let through up to a limit's worth
+    of requests in the sync_interval before the counters reveal the limit has been reached.
+
+    There are at most max_buckets of them - if there are more clients than that, buckets of the least recently seen ones
+    are deleted, along with their usage that has not been synced yet.
+    """
+    def __init__(self, kvdb_conn=None, sync_interval=RATE_LIMIT.SYNC_INTERVAL, idle_time=RATE_LIMIT.IDLE_TIME,
+            max_buckets=RATE_LIMIT.MAX_BUCKETS, trusted_proxies=RATE_LIMIT.TRUSTED_PROXIES):
+        self.kvdb_conn = kvdb_conn
+        self.sync_interval = sync_interval
+        self.idle_time = idle_time
+        self.max_buckets = max_buckets
+        self.trusted_proxies = trusted_proxies
+        self.buckets = OrderedDict() # (channel name, client) -> TokenBucket, least recently used ones first
+        self.lock = RLock()
+        self.keep_running = False
+        self.greenlet = None
+
+        self.stats = Bunch()
+        self.stats.allowed = 0
+        self.stats.rejected = 0
+        self.stats.evicted = 0
+        self.stats.syncs = 0
+        self.stats.sync_errors = 0
+
+    def start(self):
+        self.keep_running = True
+        self.greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        self.keep_running = False
+        if self.greenlet:
+            self.greenlet.kill(block=False)
+
+# ################################################################################################################################
+
+    def check(self, channel_item, wsgi_environ):
+        """ Returns 0 if a request to a channel is allowed or the number of seconds the client should retry after otherwise.
+        """
+        limit = channel_item.get('rate_limit')
+        if not limit:
+            return 0
+
+        period = channel_item.get('rate_limit_period') or RATE_LIMIT.PERIOD
+        client = get_client(wsgi_environ, self.trusted_proxies) if channel_item.get('rate_limit_per_client') else None
+        key = (channel_item['name'], client)
+        now = time()
+
+        with self.lock:
+
+            # Re-inserting moves the key to the end, i.e. makes it the most recently used one
+            bucket = self.buckets.pop(key, None)
+
+            # New buckets are also needed if a channel's limits have just been changed
+            if not bucket or bucket.limit != limit or bucket.period != period:
+                bucket = TokenBucket(limit, period, now)
+
+            self.buckets[key] = bucket
+
+            while len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(False)
+                self.stats.evicted += 1
+
+            retry_after = bucket.take(now)
+
+            if retry_after:
+                self.stats.rejected += 1
+            else:
+                self.stats.allowed += 1
+
+            return retry_after
+
+    def invalidate(self, channel_name):
+        """ Deletes all the buckets of a given channel, e.g. because it's just been deleted.
+        """
+        with self.lock:
+            for key in [key for key in self.buckets if key[0] == channel_name]:
+                del self.buckets[key]
+
+# ################################################################################################################################
+
+    def _get_key(self, channel_name, client, bucket, now):
+        window = int(now // bucket.period)
+        return '{}{}:{}:{}'.format(KVDB.RATE_LIMIT_PREFIX, channel_name, client or '', window), window
+
+    def sync(self):
+        """ Adds local usage of all the buckets to their cluster-wide counters and blocks the ones whose limits
+        have been reached by the cluster as a whole. Also deletes buckets that haven't been used for idle_time seconds.
+        """
+        now = time()
+        to_sync = []
+
+        with self.lock:
+            for key, bucket in self.buckets.items():
+                if bucket.last_used < now - self.idle_time:
+                    del self.buckets[key]
+                elif bucket.pending:
+                    to_sync.append((key, bucket, bucket.pending))
+                    bucket.pending = 0
+
+        if not to_sync or not self.kvdb_conn:
+            return
+
+        pipeline = self.kvdb_conn.pipeline()
+        windows = []
+
+        for (channel_name, client), bucket, pending in to_sync:
+            redis_key, window = self._get_key(channel_name, client, bucket, now)
+            windows.append(window)
+            pipeline.incrby(redis_key, pending)
+            pipeline.expire(redis_key, int(ceil(bucket.period)) * 2)
+
+        try:
+            results = pipeline.execute()
+        except Exception, e:
+            self.stats.sync_errors += 1
+            logger.warn('Could not sync %s rate limit bucket(s), e:`%s`', len(to_sync), format_exc(e))
+
+            # Usage will be added next time
+            with self.lock:
+                for _, bucket, pending in to_sync:
+                    bucket.pending += pending
+            return
+
+        self.stats.syncs += 1
+
+        with self.lock:
+            for (_, bucket, _), window, total in zip(to_sync, windows, results[::2]):
+                if total >= bucket.limit:
+                    bucket.blocked_until = (window + 1) * bucket.period
+                    bucket.tokens = 0.0
+
+    def _run(self):
+        while self.keep_running:
+            gevent.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception, e:
+                logger.warn('Rate limit sync error, e:`%s`', format_exc(e))
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.buckets = len(self.buckets)
+
+        return stats
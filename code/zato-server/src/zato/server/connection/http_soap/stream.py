@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+from tempfile import SpooledTemporaryFile
+
+# anyjson
+from anyjson import loads
+
+# lxml
+from lxml.etree import iterparse
+
+# Zato
+from zato.common import HTTP_STREAMING
+from zato.server.connection.http_soap import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+def check_content_length(cid, wsgi_environ, max_body_size):
+    """ Rejects a request whose declared Content-Length exceeds max_body_size before any of its body is read.
+    """
+    content_length = wsgi_environ.get('CONTENT_LENGTH')
+    if max_body_size and content_length and int(content_length) > max_body_size:
+        raise RequestEntityTooLarge(cid, 'Content-Length `{}` exceeds the limit of `{}` bytes'.format(
+            content_length, max_body_size))
+
+def read_body(cid, wsgi_environ, max_body_size=None):
+    """ Reads an entire request body into a string, making sure it's not bigger than max_body_size, if one is given.
+    """
+    check_content_length(cid, wsgi_environ, max_body_size)
+
+    if not max_body_size:
+        return wsgi_environ['wsgi.input'].read()
+
+    # Chunked requests have no Content-Length so we need to check what has been actually read
+    body = wsgi_environ['wsgi.input'].read(max_body_size + 1)
+    if len(body) > max_body_size:
+        raise RequestEntityTooLarge(cid, 'Request body exceeds the limit of `{}` bytes'.format(max_body_size))
+
+    return body
+
+# ################################################################################################################################
+
+class RequestBody(object):
+    """ A file-like request body of an HTTP channel in streaming mode. The body is read from wsgi.input in chunks,
+    is kept in memory if it's no bigger than spill_threshold and is spilled to a temporary file otherwise,
+    so the memory used by a request doesn't depend on how big its body is. Services can read the body as any file
+    or process it incrementally with iterparse or iter_json_lines.
+    """
+    def __init__(self, cid, wsgi_input, max_body_size=None, spill_threshold=HTTP_STREAMING.SPILL_THRESHOLD,
+            chunk_size=HTTP_STREAMING.CHUNK_SIZE):
+        self.cid = cid
+        self.size = 0
+        self.file = SpooledTemporaryFile(spill_threshold)
+
+        try:
+            while True:
+                chunk = wsgi_input.read(chunk_size)
+                if not chunk:
+                    break
+
+                self.size += len(chunk)
+
+                if max_body_size and self.size > max_body_size:
+                    raise RequestEntityTooLarge(cid, 'Request body exceeds the limit of `{}` bytes'.format(max_body_size))
+
+                self.file.write(chunk)
+
+        except Exception:
+            self.file.close()
+            raise
+
+        self.file.seek(0)
+
+    @staticmethod
+    def from_wsgi(cid, wsgi_environ, max_body_size=None, spill_threshold=HTTP_STREAMING.SPILL_THRESHOLD,
+            chunk_size=HTTP_STREAMING.CHUNK_SIZE):
+        check_content_length(cid, wsgi_environ, max_body_size)
+        return RequestBody(cid, wsgi_environ['wsgi.input'], max_body_size, spill_threshold, chunk_size)
+
+    @property
+    def is_spilled(self):
+        """ Whether the body has been written out to a temporary file.
+        """
+        return self.file._rolled
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def readline(self, *args):
+        return self.file.readline(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def getvalue(self):
+        """ Returns the whole body as a string - note that it defeats the purpose of streaming for large bodies.
+        """
+        self.file.seek(0)
+        value = self.file.read()
+        self.file.seek(0)
+
+        return value
+
+    def iterparse(self, events=('end',), tag=None, **kwargs):
+        """ Incrementally parses the body as XML, yielding (event, element) tuples. Elements that are not needed
+        anymore should be cleared by the caller to keep memory usage constant.
+        """
+        self.file.seek(0)
+        return iterparse(self.file, events=events, tag=tag, **kwargs)
+
+    def iter_json_lines(self):
+        """ Yields each non-empty line of the body parsed as a JSON document.
+        """
+        self.file.seek(0)
+        for line in self.file:
+            line = line.strip()
+            if line:
+                yield loads(line)
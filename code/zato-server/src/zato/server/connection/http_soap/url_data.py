@@ -10,10 +10,12 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from hashlib import sha256
 from json import dumps, loads
 from threading import RLock
+from time import time
 from traceback import format_exc
 
 # Bunch
@@ -31,10 +33,11 @@ from secwall.server import on_basic_auth, on_wsse_pwd
 from secwall.wsse import WSSE
 
 # Zato
-from zato.common import AUDIT_LOG, DATA_FORMAT, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, TRACE1, ZATO_NONE
-from zato.common.broker_message import code_to_name, CHANNEL, SECURITY
+from zato.common import AUDIT_LOG, CREDENTIALS_CACHE, MISC, MSG_PATTERN_TYPE, SEC_DEF_TYPE, TRACE1, ZATO_NONE
+from zato.common.broker_message import code_to_name, SECURITY
 from zato.common.dispatch import dispatcher
 from zato.server.connection.http_soap import Unauthorized
+from zato.server.connection.http_soap.cache import get_headers, get_query_params
 
 logger = logging.getLogger(__name__)
 
@@ -42,13 +45,96 @@ class OAuthStore(object):
     def __init__(self, oauth_config):
         self.oauth_config = oauth_config
 
+# ################################################################################################################################
+
+class CredentialsCache(object):
+    """ A bounded LRU cache of credentials that have been successfully verified, each of them valid for up to ttl seconds.
+    Keys start with a security definition's type and name so that all the entries of a definition can be invalidated
+    when it is edited, deleted or has its password changed. The rest of a key is a hash of the definition's expected
+    password and the credentials presented, which means a stale entry will never match a changed password anyway
+    and no passwords are kept in the cache in plain text.
+    """
+    def __init__(self, max_size=CREDENTIALS_CACHE.MAX_SIZE, ttl=CREDENTIALS_CACHE.TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> expiration time, least recently used ones first
+        self.lock = RLock()
+
+        self.stats = Bunch()
+        self.stats.hits = 0
+        self.stats.misses = 0
+        self.stats.evicted = 0
+
+    def has(self, key):
+        """ Returns True if credentials of a given key have been verified and the entry hasn't expired yet.
+        """
+        if not self.max_size:
+            return False
+
+        with self.lock:
+            expires = self.entries.pop(key, None)
+
+            if expires is None or expires < time():
+                self.stats.misses += 1
+                return False
+
+            # Re-inserting moves the key to the end, i.e. makes it the most recently used one
+            self.entries[key] = expires
+            self.stats.hits += 1
+
+            return True
+
+    def add(self, key):
+        """ Stores a key of verified credentials, evicting the least recently used entries if the cache is full.
+        """
+        if not self.max_size:
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = time() + self.ttl
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(False)
+                self.stats.evicted += 1
+
+    def invalidate(self, sec_def_type, name):
+        """ Deletes all the entries of a security definition of a given type and name.
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == sec_def_type and key[1] == name]:
+                del self.entries[key]
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.size = len(self.entries)
+
+        return stats
+
+# ################################################################################################################################
+
+def get_credentials_key(sec_def_type, name, *credentials):
+    """ Returns a CredentialsCache key of a security definition and credentials, the latter hashed along with
+    the length of each so that no two different sequences of them can produce the same input to the hash.
+    """
+    digest = sha256()
+
+    for item in credentials:
+        item = item if isinstance(item, bytes) else '{}'.format(item).encode('utf-8')
+        digest.update(b'{}:'.format(len(item)))
+        digest.update(item)
+
+    return sec_def_type, name, digest.hexdigest()
+
+# ################################################################################################################################
+
 class URLData(OAuthDataStore):
     """ Performs URL matching and all the HTTP/SOAP-related security checks.
     """
     def __init__(self, channel_data=None, url_sec=None, basic_auth_config=None, ntlm_config=None, oauth_config=None,
                  tech_acc_config=None, wss_config=None, apikey_config=None, aws_config=None, openstack_config=None,
                  xpath_sec_config=None, tls_key_cert_config=None, kvdb=None, broker_client=None, odb=None,
-                 json_pointer_store=None, xpath_store=None):
+                 json_pointer_store=None, xpath_store=None, audit_queue=None, credentials_cache=None):
         self.channel_data = channel_data
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -67,6 +153,17 @@ class URLData(OAuthDataStore):
 
         self.json_pointer_store = json_pointer_store
         self.xpath_store = xpath_store
+        self.audit_queue = audit_queue
+        self.credentials_cache = credentials_cache or CredentialsCache()
+
+        # Security handlers by security definition type, filled in lazily
+        self.sec_handlers = {}
+
+        # OAuth definitions by their usernames
+        self.oauth_by_username = {}
+        if oauth_config:
+            for sec_config in oauth_config.values():
+                self.oauth_by_username[sec_config.config.username] = sec_config
 
         self.url_sec_lock = RLock()
         self.update_lock = RLock()
@@ -89,10 +186,9 @@ class URLData(OAuthDataStore):
     # OAuth data store API
 
     def _lookup_oauth(self, username, class_):
-        # usernames are unique so we know the first match is ours
-        for sec_config in self.oauth_config.values():
-            if sec_config.config.username == username:
-                return class_(sec_config.config.username, sec_config.config.password)
+        sec_config = self.oauth_by_username.get(username)
+        if sec_config:
+            return class_(sec_config.config.username, sec_config.config.password)
 
     def lookup_consumer(self, key):
         return self._lookup_oauth(key, OAuthConsumer)
@@ -101,17 +197,17 @@ class URLData(OAuthDataStore):
         return self._lookup_oauth(token_field, OAuthToken)
 
     def lookup_nonce(self, oauth_consumer, oauth_token, nonce):
-        for sec_config in self.oauth_config.values():
-            if sec_config.config.username == oauth_consumer.key:
+        sec_config = self.oauth_by_username.get(oauth_consumer.key)
+        if sec_config:
 
-                # The nonce was reused
-                existing_nonce = self.kvdb.has_oauth_nonce(oauth_consumer.key, nonce)
-                if existing_nonce:
-                    return nonce
-                else:
-                    # No such nonce so we add it to the store
-                    self.kvdb.add_oauth_nonce(
-                        oauth_consumer.key, nonce, sec_config.config.max_nonce_log)
+            # The nonce was reused
+            existing_nonce = self.kvdb.has_oauth_nonce(oauth_consumer.key, nonce)
+            if existing_nonce:
+                return nonce
+            else:
+                # No such nonce so we add it to the store
+                self.kvdb.add_oauth_nonce(
+                    oauth_consumer.key, nonce, sec_config.config.max_nonce_log)
 
     def fetch_request_token(self, oauth_consumer, oauth_callback):
         """-> OAuthToken."""
@@ -147,6 +243,12 @@ class URLData(OAuthDataStore):
         """ Performs the authentication using HTTP Basic Auth.
         """
         env = {'HTTP_AUTHORIZATION':wsgi_environ.get('HTTP_AUTHORIZATION')}
+
+        cache_key = get_credentials_key(
+            SEC_DEF_TYPE.BASIC_AUTH, sec_def.name, sec_def.username, sec_def.password, env['HTTP_AUTHORIZATION'])
+        if self.credentials_cache.has(cache_key):
+            return
+
         url_config = {'basic-auth-username':sec_def.username, 'basic-auth-password':sec_def.password}
 
         result = on_basic_auth(env, url_config, False)
@@ -157,6 +259,8 @@ class URLData(OAuthDataStore):
             logger.error(msg)
             raise Unauthorized(cid, msg, 'Basic realm="{}"'.format(sec_def.realm))
 
+        self.credentials_cache.add(cache_key)
+
     def _handle_security_wss(self, cid, sec_def, path_info, body, wsgi_environ, ignored_post_data=None):
         """ Performs the authentication using WS-Security.
         """
@@ -231,6 +335,12 @@ class URLData(OAuthDataStore):
                 logger.error(error_msg)
                 raise Unauthorized(cid, error_msg, 'zato-tech-acc')
 
+        cache_key = get_credentials_key(SEC_DEF_TYPE.TECH_ACCOUNT, sec_def.name, sec_def.password,
+            wsgi_environ['HTTP_X_ZATO_USER'], wsgi_environ['HTTP_X_ZATO_PASSWORD'])
+
+        if self.credentials_cache.has(cache_key):
+            return wsgi_environ['HTTP_X_ZATO_USER']
+
         # Note that logs get a specific information what went wrong whereas the
         # user gets a generic 'username or password' message
         msg_template = '[{}] The {} is incorrect, URI:[{}], X_ZATO_USER:[{}]'
@@ -249,6 +359,8 @@ class URLData(OAuthDataStore):
             logger.error(error_msg)
             raise Unauthorized(cid, user_msg, 'zato-tech-acc')
 
+        self.credentials_cache.add(cache_key)
+
         return wsgi_environ['HTTP_X_ZATO_USER']
 
     def _handle_security_xpath_sec(self, cid, sec_def, ignored_path_info, ignored_body, wsgi_environ, ignored_post_data=None):
@@ -304,20 +416,27 @@ class URLData(OAuthDataStore):
         """
         if sec.sec_def != ZATO_NONE:
             sec_def, sec_def_type = sec.sec_def, sec.sec_def.sec_type
-            handler_name = '_handle_security_{0}'.format(sec_def_type.replace('-', '_'))
-            getattr(self, handler_name)(
-                cid, sec_def, path_info, payload, wsgi_environ, post_data)
+
+            handler = self.sec_handlers.get(sec_def_type)
+            if not handler:
+                handler = getattr(self, '_handle_security_{0}'.format(sec_def_type.replace('-', '_')))
+                self.sec_handlers[sec_def_type] = handler
+
+            handler(cid, sec_def, path_info, payload, wsgi_environ, post_data)
 
     def _update_url_sec(self, msg, sec_def_type, delete=False):
         """ Updates URL security definitions that use the security configuration
         of the name and type given in 'msg' so that existing definitions use
         the new configuration or, optionally, deletes the URL security definition
-        altogether if 'delete' is True.
+        altogether if 'delete' is True. Credentials of that definition verified
+        previously will need to be verified again.
         """
+        name = msg.get('old_name') if msg.get('old_name') else msg.get('name')
+        self.credentials_cache.invalidate(sec_def_type, name)
+
         for target_match, url_info in self.url_sec.items():
             sec_def = url_info.sec_def
             if sec_def != ZATO_NONE and sec_def.sec_type == sec_def_type:
-                name = msg.get('old_name') if msg.get('old_name') else msg.get('name')
                 if sec_def.name == name:
                     if delete:
                         del self.url_sec[target_match]
@@ -543,6 +662,11 @@ class URLData(OAuthDataStore):
     def _update_oauth(self, name, config):
         self.oauth_config[name] = Bunch()
         self.oauth_config[name].config = config
+        self.oauth_by_username[config.username] = self.oauth_config[name]
+
+    def _delete_oauth(self, name):
+        self.oauth_by_username.pop(self.oauth_config[name].config.username, None)
+        del self.oauth_config[name]
 
     def oauth_get(self, name):
         """ Returns the configuration of the OAuth account of the given name.
@@ -560,7 +684,7 @@ class URLData(OAuthDataStore):
         """ Updates an existing OAuth account.
         """
         with self.url_sec_lock:
-            del self.oauth_config[msg.old_name]
+            self._delete_oauth(msg.old_name)
             self._update_oauth(msg.name, msg)
             self._update_url_sec(msg, SEC_DEF_TYPE.OAUTH)
 
@@ -569,7 +693,7 @@ class URLData(OAuthDataStore):
         """
         with self.url_sec_lock:
             self._delete_channel_data('oauth', msg.name)
-            del self.oauth_config[msg.name]
+            self._delete_oauth(msg.name)
             self._update_url_sec(msg, SEC_DEF_TYPE.OAUTH, True)
 
     def on_broker_msg_SECURITY_OAUTH_CHANGE_PASSWORD(self, msg, *args):
@@ -760,6 +884,20 @@ class URLData(OAuthDataStore):
             channel_item['security_id'] = msg['security_id']
             channel_item['security_name'] = msg['security_name']
 
+        # New in 2.0
+        channel_item.needs_streaming = msg.get('needs_streaming') or False
+        channel_item.max_body_size = msg.get('max_body_size') or None
+
+        # New in 2.0
+        channel_item.cache_ttl = msg.get('cache_ttl') or None
+        channel_item.cache_query_params = get_query_params(msg.get('cache_query_params'))
+        channel_item.cache_headers = get_headers(msg.get('cache_headers'))
+
+        # New in 2.0
+        channel_item.rate_limit = msg.get('rate_limit') or None
+        channel_item.rate_limit_period = msg.get('rate_limit_period') or None
+        channel_item.rate_limit_per_client = msg.get('rate_limit_per_client') or False
+
         channel_item.audit_enabled = old_data.get('audit_enabled', False)
         channel_item.audit_max_payload = old_data.get('audit_max_payload', 0)
         channel_item.audit_repl_patt_type = old_data.get('audit_repl_patt_type', None)
@@ -867,7 +1005,8 @@ class URLData(OAuthDataStore):
         return dumps({key: repr(value) for key, value in env})
 
     def audit_set_request(self, cid, channel_item, payload, wsgi_environ):
-        """ Stores initial audit information, right after receiving a request.
+        """ Enqueues initial audit information, right after receiving a request. Payload is masked here
+        but it's the audit queue that will store the data in the ODB.
         """
         if channel_item['audit_repl_patt_type'] == MSG_PATTERN_TYPE.JSON_POINTER.id:
             payload = loads(payload) if payload else ''
@@ -891,30 +1030,37 @@ class URLData(OAuthDataStore):
         if not remote_addr:
             remote_addr = wsgi_environ.get('REMOTE_ADDR', '(None)')
 
-        self.odb.audit_set_request_http_soap(channel_item['id'], channel_item['name'], cid, 
-            channel_item['transport'], channel_item['connection'], datetime.utcnow(),
-            channel_item.get('username'), remote_addr, self._dump_wsgi_environ(wsgi_environ), payload)
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+
+        self.audit_queue.put_request({
+            'conn_id': channel_item['id'],
+            'name': channel_item['name'],
+            'cid': cid,
+            'transport': channel_item['transport'],
+            'connection': channel_item['connection'],
+            'req_time': datetime.utcnow(),
+            'user_token': channel_item.get('username'),
+            'remote_addr': remote_addr,
+            'req_headers': self._dump_wsgi_environ(wsgi_environ).encode('utf-8'),
+            'req_payload': payload,
+        })
 
     def audit_set_response(self, cid, response, wsgi_environ):
-        """ Stores audit info regarding a response to a previous request.
+        """ Enqueues audit info regarding a response to a previous request.
         """
-        payload = dumps({
+        if isinstance(response, unicode):
+            response = response.encode('utf-8')
+
+        self.audit_queue.put_response({
             'cid': cid,
             'invoke_ok': wsgi_environ['zato.http.response.status'][0] not in ('4', '5'),
             'auth_ok':  wsgi_environ['zato.http.response.status'][0] != '4',
-            'resp_time': datetime.utcnow().isoformat(),
-            'resp_headers': self._dump_wsgi_environ(wsgi_environ),
+            'resp_time': datetime.utcnow(),
+            'resp_headers': self._dump_wsgi_environ(wsgi_environ).encode('utf-8'),
             'resp_payload': response,
         })
 
-        self.broker_client.publish({
-            'cid': cid,
-            'data_format':DATA_FORMAT.JSON, 
-            'action': CHANNEL.HTTP_SOAP_AUDIT_RESPONSE.value,
-            'payload': payload,
-            'service': 'zato.http-soap.set-audit-response-data'
-        })
-
     def on_broker_msg_CHANNEL_HTTP_SOAP_AUDIT_CONFIG(self, msg):
         for item in self.channel_data:
             if item.id == msg.id:
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging, os
+from hashlib import sha1, sha256
+from shutil import rmtree
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent.lock import RLock
+
+# Zato
+from zato.common import WSDL_CACHE
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class WSDLCache(object):
+    """ Parsed WSDL definitions for suds clients. Instead of fetching and parsing a WSDL along with all of its imported
+    schemas for each client in a connection queue, a prototype client is created once per WSDL and all the clients
+    are its clones, sharing the prototype's object graph.
+
+    Prototypes are kept in memory by the WSDL's address and a hash of its contents, so a WSDL that changes is parsed anew.
+    If cache_dir is given, suds persists parsed documents in a subdirectory specific to the address and hash,
+    so they needn't be parsed again after a restart either. Subdirectories of previous versions of a WSDL are deleted.
+    """
+    def __init__(self, cache_dir=None, days=WSDL_CACHE.DAYS):
+        self.cache_dir = cache_dir
+        self.days = days
+
+        self.prototypes = {} # address -> (digest, client)
+        self.locks = {} # address -> RLock
+
+        self.stats = Bunch()
+        self.stats.hits = 0
+        self.stats.misses = 0
+        self.stats.build_time = 0.0
+
+# ################################################################################################################################
+
+    def _get_suds_cache(self, address, digest):
+        """ Returns a suds cache to keep parsed documents of a given version of a WSDL in. Deletes directories of any
+        previous versions first.
+        """
+        # Lazily-imported here to make sure gevent monkey patches everything well in advance
+        from suds.cache import NoCache, ObjectCache
+
+        if not self.cache_dir:
+            return NoCache()
+
+        address_dir = os.path.join(self.cache_dir, sha1(address.encode('utf-8')).hexdigest())
+
+        if os.path.exists(address_dir):
+            for name in os.listdir(address_dir):
+                if name != digest:
+                    rmtree(os.path.join(address_dir, name), True)
+
+        return ObjectCache(os.path.join(address_dir, digest), days=self.days)
+
+    def get_client(self, address, wsdl, create_func):
+        """ Returns a new client for a WSDL of a given address and contents, cloned from a prototype which is first
+        created by create_func, given a suds cache on input, unless there already is one for that very version of the WSDL.
+        """
+        digest = sha256(wsdl).hexdigest()
+        lock = self.locks.setdefault(address, RLock())
+
+        with lock:
+            digest_prototype = self.prototypes.get(address)
+
+            if digest_prototype and digest_prototype[0] == digest:
+                self.stats.hits += 1
+                return digest_prototype[1].clone()
+
+            self.stats.misses += 1
+            start = time()
+
+            prototype = create_func(self._get_suds_cache(address, digest))
+            self.prototypes[address] = (digest, prototype)
+
+            build_time = time() - start
+            self.stats.build_time += build_time
+
+            logger.info('Parsed WSDL `%s` (%s) in %.3fs', address, digest, build_time)
+
+            return prototype.clone()
+
+    def get_stats(self):
+        stats = Bunch(self.stats)
+        stats.size = len(self.prototypes)
+
+        return stats
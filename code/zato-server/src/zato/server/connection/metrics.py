@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from bisect import bisect_left
+from math import ceil
+from threading import RLock
+from time import time
+
+# Bunch
+from bunch import Bunch
+
+# Paste
+from paste.util.converters import asbool
+
+# Zato
+from zato.common import CONN_METRICS
+
+# ################################################################################################################################
+
+class LatencyHistogram(object):
+    """ Counts of latencies falling into buckets of fixed, roughly logarithmic, upper bounds in milliseconds. Recording
+    a latency is a bisect and a few increments regardless of how many have been recorded already. Percentiles are
+    estimated as upper bounds of the buckets they fall into, or the maximum latency if that one is lower.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds=CONN_METRICS.BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # The last bucket is for anything above the highest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """ Records a latency, given in seconds.
+        """
+        value *= 1000
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+    def get_mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def get_percentile(self, percentile):
+        if not self.count:
+            return 0.0
+
+        rank = ceil(percentile / 100 * self.count)
+        running = 0
+
+        for idx, count in enumerate(self.counts):
+            running += count
+            if running >= rank:
+                return min(self.bounds[idx], self.max) if idx < len(self.bounds) else self.max
+
+    def get_buckets(self):
+        """ Returns non-empty buckets as (upper bound, count) pairs, the bound being None for the overflow bucket.
+        """
+        bounds = list(self.bounds) + [None]
+        return [(bound, count) for bound, count in zip(bounds, self.counts) if count]
+
+# ################################################################################################################################
+
+class ConnMetrics(object):
+    """ Latencies of calls to a single connection definition along with utilisation of its pool, if it has any.
+
+    Pool wait time is how long it took to obtain a connection from the pool, as opposed to call latency which is how long
+    the remote end took to respond. Pools that keep idle connections let the metrics know how to count them via get_idle.
+
+    Nothing here blocks or yields, so in a gevent-based worker no locks are needed for counters to stay consistent.
+    """
+    def __init__(self, conn_type, name):
+        self.conn_type = conn_type
+        self.name = name
+        self.get_idle = None
+        self.reset()
+
+    def reset(self):
+        self.latency = LatencyHistogram()
+        self.wait = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+        self.in_progress = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.exhausted = 0
+        self.connects = 0
+        self.disconnects = 0
+
+    def on_call_start(self):
+        """ Needs to be called before each call, returns the value on_call_end needs to be given.
+        """
+        self.in_progress += 1
+        return time()
+
+    def on_call_end(self, start, is_error):
+        self.in_progress -= 1
+        self.calls += 1
+        self.latency.record(time() - start)
+
+        if is_error:
+            self.errors += 1
+
+    def on_checkout(self, wait=None):
+        self.checked_out += 1
+        self.checkouts += 1
+
+        if wait is not None:
+            self.wait.record(wait)
+
+    def on_checkin(self):
+        self.checked_out -= 1
+
+    def on_exhausted(self):
+        """ Records that a connection was needed but the pool had none left.
+        """
+        self.exhausted += 1
+
+    def on_connect(self):
+        self.connects += 1
+
+    def on_disconnect(self):
+        self.disconnects += 1
+
+    def get_stats(self):
+        stats = Bunch()
+        stats.conn_type = self.conn_type
+        stats.name = self.name
+        stats.calls = self.calls
+        stats.errors = self.errors
+        stats.in_progress = self.in_progress
+        stats.latency_mean = self.latency.get_mean()
+        stats.latency_p50 = self.latency.get_percentile(50)
+        stats.latency_p90 = self.latency.get_percentile(90)
+        stats.latency_p99 = self.latency.get_percentile(99)
+        stats.latency_max = self.latency.max
+        stats.latency_buckets = ', '.join('{}:{}'.format(
+            'inf' if bound is None else bound, count) for bound, count in self.latency.get_buckets())
+        stats.wait_mean = self.wait.get_mean()
+        stats.wait_p99 = self.wait.get_percentile(99)
+        stats.wait_max = self.wait.max
+        stats.checked_out = self.checked_out
+        stats.idle = self.get_idle() if self.get_idle else None
+        stats.checkouts = self.checkouts
+        stats.exhausted = self.exhausted
+        stats.connects = self.connects
+        stats.disconnects = self.disconnects
+
+        return stats
+
+# ################################################################################################################################
+
+def instrument(metrics, func):
+    """ Returns a callable wrapping func so that each call to it is recorded in metrics, any exception raised
+    counting as an error.
+    """
+    def _instrumented(*args, **kwargs):
+        start = metrics.on_call_start()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            metrics.on_call_end(start, True)
+            raise
+        else:
+            metrics.on_call_end(start, False)
+            return result
+
+    return _instrumented
+
+# ################################################################################################################################
+
+class ConnMetricsStore(object):
+    """ Metrics of all the connection definitions of a worker, keyed by their types and names.
+    """
+    def __init__(self, config=None):
+        self.is_enabled = asbool((config or {}).get('is_enabled', True))
+        self.metrics = {} # (conn_type, name) -> ConnMetrics
+        self.lock = RLock()
+
+    def get(self, conn_type, name):
+        """ Returns metrics of a given connection, creating them if needed, or None if metrics are disabled.
+        """
+        if not self.is_enabled:
+            return None
+
+        with self.lock:
+            metrics = self.metrics.get((conn_type, name))
+            if not metrics:
+                metrics = self.metrics[(conn_type, name)] = ConnMetrics(conn_type, name)
+
+            return metrics
+
+    def delete(self, conn_type, name):
+        with self.lock:
+            self.metrics.pop((conn_type, name), None)
+
+    def reset(self, conn_type=None, name=None):
+        """ Zeroes metrics of connections of a given type and name, or of all the connections if neither is given.
+        Gauges, such as how many connections are currently checked out, are kept.
+        """
+        with self.lock:
+            for (_conn_type, _name), metrics in self.metrics.items():
+                if (conn_type is None or conn_type == _conn_type) and (name is None or name == _name):
+                    in_progress, checked_out = metrics.in_progress, metrics.checked_out
+                    metrics.reset()
+                    metrics.in_progress, metrics.checked_out = in_progress, checked_out
+
+    def get_stats(self):
+        with self.lock:
+            return [metrics.get_stats() for _, metrics in sorted(self.metrics.items())]
@@ -28,34 +28,73 @@ class _Connection(object):
     """ Meant to be used as a part of a 'with' block - returns a connection from its queue each time 'with' is entered
     assuming the queue isn't empty.
     """
-    def __init__(self, client_queue, conn_name):
+    def __init__(self, client_queue, conn_name, circuit_breaker=None, metrics=None, ignored_errors=()):
         self.queue = client_queue
         self.conn_name = conn_name
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.ignored_errors = ignored_errors
         self.client = None
+        self.token = None
+        self.start = None
 
     def __enter__(self):
+
+        # Raises an exception if the connection's circuit breaker is open or too many calls are already in progress
+        if self.circuit_breaker:
+            self.token = self.circuit_breaker.before()
+
         try:
             self.client = self.queue.get(block=False)
         except Empty:
             self.client = None
+            if self.token:
+                self.circuit_breaker.cancel(self.token)
+                self.token = None
+            if self.metrics:
+                self.metrics.on_exhausted()
             msg = 'No free connections to `{}`'.format(self.conn_name)
             logger.error(msg)
             raise Exception(msg)
         else:
+            # Clients are never waited for so there is no wait time to record
+            if self.metrics:
+                self.metrics.on_checkout()
+                self.start = self.metrics.on_call_start()
             return self.client
 
     def __exit__(self, type, value, traceback):
+
+        # Any exception raised within the 'with' block counts as a failure, unless it's one of ignored_errors,
+        # i.e. the remote end responded with an error of its own, such as a SOAP fault.
+        is_error = type is not None and not issubclass(type, self.ignored_errors)
+
         if self.client:
             self.queue.put(self.client)
 
+            if self.metrics:
+                self.metrics.on_call_end(self.start, is_error)
+                self.metrics.on_checkin()
+
+        if self.token:
+            self.circuit_breaker.after(self.token, is_error)
+
 # ################################################################################################################################
 
 class ConnectionQueue(object):
     """ Holds connections to resources. Each time it's called a connection is fetched from its underlying queue
     assuming any connection is still available.
     """
-    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func):
+    def __init__(self, pool_size, queue_build_cap, conn_name, conn_type, address, add_client_func, circuit_breaker=None,
+            metrics=None, ignored_errors=()):
         self.queue = Queue(pool_size)
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.ignored_errors = ignored_errors
+
+        # Clients in the queue are the idle ones
+        if self.metrics:
+            self.metrics.get_idle = self.queue.qsize
         self.queue_build_cap = queue_build_cap
         self.conn_name = conn_name
         self.conn_type = conn_type
@@ -65,10 +104,13 @@ class ConnectionQueue(object):
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def __call__(self):
-        return _Connection(self.queue, self.conn_name)
+        return _Connection(self.queue, self.conn_name, self.circuit_breaker, self.metrics, self.ignored_errors)
 
     def put_client(self, client):
         self.queue.put(client)
+
+        if self.metrics:
+            self.metrics.on_connect()
         self.logger.info('Added `%s` client to %s (%s)', self.conn_name, self.address, self.conn_type)
 
     def build_queue(self):
@@ -102,13 +144,13 @@ class ConnectionQueue(object):
 class Wrapper(object):
     """ Base class for connections wrappers.
     """
-    def __init__(self, config, conn_type):
+    def __init__(self, config, conn_type, metrics=None):
         self.conn_type = conn_type
         self.config = config
 
         self.client = ConnectionQueue(
             self.config.pool_size, self.config.queue_build_cap, self.config.name, self.conn_type, self.config.auth_url,
-            self.add_client)
+            self.add_client, metrics=metrics)
 
         self.update_lock = RLock()
         self.logger = logging.getLogger(self.__class__.__name__)
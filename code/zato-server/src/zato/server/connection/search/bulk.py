@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from logging import getLogger
+from time import time
+from traceback import format_exc
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# Zato
+from zato.common import SEARCH
+from zato.server.store import BaseAPI
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+class BulkIndexer(object):
+    """ Buffers documents and sends them to a search engine in batches, once there are batch_size of them or once
+    the oldest of them has been buffered for flush_interval seconds, whichever comes first.
+
+    send_func is given a list of documents and returns (document, error, is_retryable) triples for each document
+    that could not be indexed. Retryable documents are sent again, up to retries times with an exponentially growing
+    delay in between, and any exception send_func raises means all the documents it was given can be retried.
+    Documents that still could not be indexed are kept in self.failed as (document, error) pairs.
+
+    Meant to be used in a 'with' block, buffered documents are sent when the block is exited.
+    """
+    def __init__(self, name, send_func, batch_size=SEARCH.BULK.BATCH_SIZE, flush_interval=SEARCH.BULK.FLUSH_INTERVAL,
+            retries=SEARCH.BULK.RETRIES, retry_delay=SEARCH.BULK.RETRY_DELAY, close_func=None):
+        self.name = name
+        self.send_func = send_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.close_func = close_func
+
+        self.buffer = []
+        self.buffer_start = None # When the oldest document buffered was added
+        self.failed = []
+        self.indexed = 0
+        self.retried = 0
+        self.flushes = 0
+        self.send_time = 0.0
+        self.is_closed = False
+        self._is_closing = False
+        self._is_sleeping = False
+
+        # Documents added slowly are still sent in time even if add is not called for a while
+        self._flusher = gevent.spawn(self._flush_periodically) if self.flush_interval else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add(self, doc):
+        if self.is_closed:
+            raise ValueError('Bulk indexer `{}` is already closed'.format(self.name))
+
+        if not self.buffer:
+            self.buffer_start = time()
+
+        self.buffer.append(doc)
+
+        if len(self.buffer) >= self.batch_size or (self.flush_interval and time() - self.buffer_start >= self.flush_interval):
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self._is_closing:
+            self._is_sleeping = True
+            gevent.sleep(self.flush_interval)
+            self._is_sleeping = False
+
+            if self.buffer and time() - self.buffer_start >= self.flush_interval:
+                self.flush()
+
+    def _send(self, docs):
+        start = time()
+        try:
+            return self.send_func(docs)
+        except Exception, e:
+            logger.warn('Could not send %d documents through `%s`, e:`%s`', len(docs), self.name, format_exc(e))
+            return [(doc, e, True) for doc in docs]
+        finally:
+            self.send_time += time() - start
+
+    def flush(self):
+        """ Sends all the documents buffered, retrying those that could not be indexed.
+        """
+        if not self.buffer:
+            return
+
+        docs, self.buffer = self.buffer, []
+        self.flushes += 1
+
+        for attempt in range(self.retries + 1):
+            failures = self._send(docs)
+            self.indexed += len(docs) - len(failures)
+
+            retryable = []
+            for doc, error, is_retryable in failures:
+                if is_retryable and attempt < self.retries:
+                    retryable.append(doc)
+                else:
+                    self.failed.append((doc, error))
+
+            if not retryable:
+                break
+
+            self.retried += len(retryable)
+            gevent.sleep(self.retry_delay * 2 ** attempt)
+            docs = retryable
+
+    def close(self):
+        """ Sends any documents still buffered and returns statistics of the indexer.
+        """
+        if not self.is_closed:
+            self._is_closing = True
+
+            # Documents the flusher may be sending right now must not be lost so it's killed only while it sleeps
+            if self._flusher:
+                if self._is_sleeping:
+                    self._flusher.kill()
+                else:
+                    self._flusher.join()
+
+            self.flush()
+            self.is_closed = True
+
+            if self.close_func:
+                self.close_func()
+
+        return self.get_stats()
+
+    def get_stats(self):
+        stats = Bunch()
+        stats.name = self.name
+        stats.indexed = self.indexed
+        stats.failed = len(self.failed)
+        stats.retried = self.retried
+        stats.flushes = self.flushes
+        stats.buffered = len(self.buffer)
+        stats.docs_per_sec = self.indexed / self.send_time if self.send_time else 0.0
+
+        return stats
+
+# ################################################################################################################################
+
+class BulkAPI(BaseAPI):
+    """ A base class for APIs of search connections which documents can be indexed in bulk through.
+    """
+    def __init__(self, conn_store, config=None):
+        super(BulkAPI, self).__init__(conn_store)
+        config = config or {}
+
+        self.bulk_batch_size = int(config.get('bulk_batch_size', SEARCH.BULK.BATCH_SIZE))
+        self.bulk_flush_interval = float(config.get('bulk_flush_interval', SEARCH.BULK.FLUSH_INTERVAL))
+        self.bulk_retries = int(config.get('bulk_retries', SEARCH.BULK.RETRIES))
+        self.bulk_retry_delay = float(config.get('bulk_retry_delay', SEARCH.BULK.RETRY_DELAY))
+        self.scroll_size = int(config.get('scroll_size', SEARCH.SCROLL.SIZE))
+
+    def _get_bulk_indexer(self, name, send_func, batch_size=None, flush_interval=None, retries=None, retry_delay=None,
+            close_func=None):
+        return BulkIndexer(name, send_func,
+            batch_size or self.bulk_batch_size,
+            self.bulk_flush_interval if flush_interval is None else flush_interval,
+            self.bulk_retries if retries is None else retries,
+            self.bulk_retry_delay if retry_delay is None else retry_delay,
+            close_func)
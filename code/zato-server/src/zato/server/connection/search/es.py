@@ -8,18 +8,105 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+# stdlib
+from logging import getLogger
+from traceback import format_exc
+
 # elasticutils
 from elasticutils import get_es
 
 # Zato
-from zato.server.store import BaseAPI, BaseStore
+from zato.common import CONN_METRICS, SEARCH
+from zato.server.connection.metrics import instrument
+from zato.server.connection.search.bulk import BulkAPI
+from zato.server.store import BaseStore
+
+logger = getLogger(__name__)
+
+# Documents may use these keys to be indexed elsewhere than in the default index or type, or under a given ID
+_meta_keys = ('_index', '_type', '_id')
+
+# Documents rejected with these statuses were not indexed because the cluster was too busy and can be sent again
+_retryable_statuses = (429, 503)
+
+def _get_bulk_send(es, index, doc_type):
+    """ Returns a function sending documents to ElasticSearch in a single bulk request.
+    """
+    def _send(docs):
+        body = []
+        for doc in docs:
+            body.append({'index': dict((key, doc[key]) for key in _meta_keys if key in doc)})
+            body.append(dict((key, value) for key, value in doc.items() if key not in _meta_keys))
+
+        response = es.bulk(body, index=index, doc_type=doc_type)
+        failures = []
+
+        for doc, item in zip(docs, response['items']):
+            result = item.values()[0]
+            status = result.get('status', 200)
+            error = result.get('error')
+
+            if error or status >= 300:
+                failures.append((doc, error or status, status in _retryable_statuses))
+
+        return failures
+
+    return _send
 
-class ElasticSearchAPI(BaseAPI):
+class ElasticSearchAPI(BulkAPI):
     """ API to obtain ElasticSearch connections through.
     """
+    def __init__(self, conn_store, config=None):
+        super(ElasticSearchAPI, self).__init__(conn_store, config)
+        self.scroll_keep_alive = (config or {}).get('es_scroll_keep_alive', SEARCH.SCROLL.ES_KEEP_ALIVE)
+
+    def bulk_indexer(self, name, index=None, doc_type=None, **options):
+        """ Returns a bulk indexer sending documents to a given connection, by default to the index and type given.
+        Documents may use _index, _type and _id keys to override them or to set their IDs.
+        """
+        return self._get_bulk_indexer(name, _get_bulk_send(self[name].conn, index, doc_type), **options)
+
+    def scroll(self, name, query, index=None, doc_type=None, size=None, keep_alive=None):
+        """ Yields hits matching a query, fetched in pages through a scan search. Each page has no more than size hits
+        from each shard, in no particular order.
+        """
+        es = self[name].conn
+        keep_alive = keep_alive or self.scroll_keep_alive
+
+        response = es.search(index=index, doc_type=doc_type, body=query, search_type='scan', scroll=keep_alive,
+            size=size or self.scroll_size)
+        scroll_id = response['_scroll_id']
+
+        try:
+            while True:
+                response = es.scroll(scroll_id, scroll=keep_alive)
+                scroll_id = response['_scroll_id']
+                hits = response['hits']['hits']
+
+                if not hits:
+                    break
+
+                for hit in hits:
+                    yield hit
+
+        finally:
+            # Not waiting until the scroll expires on its own
+            try:
+                es.transport.perform_request('DELETE', '/_search/scroll', body=scroll_id)
+            except Exception, e:
+                logger.warn('Could not clear scroll `%s` of `%s`, e:`%s`', scroll_id, name, format_exc(e))
 
 class ElasticSearchConnStore(BaseStore):
     """ Stores connections to ElasticSearch.
     """
+    metrics_conn_type = CONN_METRICS.CONN_TYPE.SEARCH_ES
+
     def create_impl(self, config, config_no_sensitive):
-        return get_es(config.hosts.splitlines(), float(config.timeout), send_get_body_as=config.body_as)
+        impl = get_es(config.hosts.splitlines(), float(config.timeout), send_get_body_as=config.body_as)
+
+        # All the requests, whichever method of the client they are made through, go through its transport
+        metrics = self.get_metrics(config.name)
+        if metrics:
+            impl.transport.perform_request = instrument(metrics, impl.transport.perform_request)
+
+        return impl
@@ -11,20 +11,25 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from logging import getLogger
 
+# anyjson
+from anyjson import loads
+
 # pysolr
 from pysolr import Solr
 
 # Zato
+from zato.common import CONN_METRICS
 from zato.common.util import ping_solr
 from zato.server.connection.queue import Wrapper
-from zato.server.store import BaseAPI, BaseStore
+from zato.server.connection.search.bulk import BulkAPI
+from zato.server.store import BaseStore
 
 logger = getLogger(__name__)
 
 class SolrWrapper(Wrapper):
-    def __init__(self, config):
+    def __init__(self, config, metrics=None):
         config.auth_url = config.address
-        super(SolrWrapper, self).__init__(config, 'Solr')
+        super(SolrWrapper, self).__init__(config, 'Solr', metrics)
 
     def add_client(self):
 
@@ -34,14 +39,63 @@ class SolrWrapper(Wrapper):
         # Create a client now
         self.client.put_client(Solr(self.config.address, timeout=self.config.timeout))
 
-class SolrAPI(BaseAPI):
-    """ API to obtain ElasticSearch connections through.
+    def add(self, docs, commit_within=None):
+        with self.client() as client:
+            client.add(docs, commit=False, commitWithin=commit_within)
+
+    def commit(self):
+        with self.client() as client:
+            client.commit()
+
+    def select(self, params):
+        """ Returns a decoded response to a query with the params given.
+        """
+        with self.client() as client:
+
+            # pysolr's own search doesn't return nextCursorMark so the underlying method is used
+            return loads(client._select(params))
+
+class SolrAPI(BulkAPI):
+    """ API to obtain Solr connections through.
     """
+    def bulk_indexer(self, name, commit=True, commit_within=None, **options):
+        """ Returns a bulk indexer sending documents to a given connection, committing them once the indexer is closed
+        unless told not to. Solr rejects or accepts a batch of documents as a whole so retries are per batch.
+        """
+        wrapper = self[name].conn
+
+        def _send(docs):
+            wrapper.add(docs, commit_within)
+            return []
+
+        return self._get_bulk_indexer(name, _send, close_func=wrapper.commit if commit else None, **options)
+
+    def iter_docs(self, name, q, sort='id asc', rows=None, **params):
+        """ Yields documents matching a query, fetched in pages of rows documents each by following a cursorMark.
+        sort must include the uniqueKey field. A client is taken from the pool only for as long as each page is fetched.
+        """
+        wrapper = self[name].conn
+        cursor_mark = '*'
+
+        while True:
+            response = wrapper.select(dict(params, q=q, sort=sort, rows=rows or self.scroll_size, cursorMark=cursor_mark))
+
+            for doc in response['response']['docs']:
+                yield doc
+
+            # Solr returns the same mark once there are no more documents
+            next_cursor_mark = response.get('nextCursorMark')
+            if not next_cursor_mark or next_cursor_mark == cursor_mark:
+                break
+
+            cursor_mark = next_cursor_mark
 
 class SolrConnStore(BaseStore):
-    """ Stores connections to ElasticSearch.
+    """ Stores connections to Solr.
     """
+    metrics_conn_type = CONN_METRICS.CONN_TYPE.SEARCH_SOLR
+
     def create_impl(self, _, config_no_sensitive):
-        w = SolrWrapper(config_no_sensitive)
+        w = SolrWrapper(config_no_sensitive, self.get_metrics(config_no_sensitive.name))
         w.build_queue()
         return w
@@ -27,7 +27,7 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 from springpython.context import DisposableObject
 
 # Zato
-from zato.common import Inactive, PASSWORD_SHADOW
+from zato.common import CIRCUIT_BREAKER, CONN_METRICS, Inactive, PASSWORD_SHADOW, ZATO_ODB_POOL_NAME
 from zato.common.odb import ping_queries
 from zato.common.odb.util import get_engine_url
 from zato.common.util import get_component_name, parse_extra_into_dict
@@ -68,8 +68,10 @@ class SessionWrapper(object):
 class SQLConnectionPool(object):
     """ A pool of SQL connections wrapping an SQLAlchemy engine.
     """
-    def __init__(self, name, config, config_no_sensitive):
+    def __init__(self, name, config, config_no_sensitive, circuit_breaker=None, metrics=None):
         self.logger = getLogger(self.__class__.__name__)
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
 
         self.name = name
         self.config = config
@@ -102,24 +104,59 @@ class SQLConnectionPool(object):
         event.listen(self.engine, 'checkout', self.on_checkout)
         event.listen(self.engine, 'connect', self.on_connect)
         event.listen(self.engine, 'first_connect', self.on_first_connect)
+
+        # Each statement executed goes through the pool's circuit breaker and is timed, if either is needed
+        if self.circuit_breaker or self.metrics:
+            event.listen(self.engine, 'before_cursor_execute', self.on_before_cursor_execute)
+            event.listen(self.engine, 'after_cursor_execute', self.on_after_cursor_execute)
+            event.listen(self.engine, 'dbapi_error', self.on_dbapi_error)
+
+        if self.metrics:
+            event.listen(self.engine, 'invalidate', self.on_invalidate)
+
+            # There is no event emitted before a connection is checked out so the pool's own method is what is timed
+            self.engine.pool.connect = self._get_timed_pool_connect(self.engine.pool.connect)
+
+            # SQLite has no pools
+            if hasattr(self.engine.pool, 'checkedin'):
+                self.metrics.get_idle = self.engine.pool.checkedin
         
     def __str__(self):
         return '<{} at {}, config:[{}]>'.format(self.__class__.__name__, hex(id(self)), self.config_no_sensitive)
     
     __repr__ = __str__
         
+    def _get_timed_pool_connect(self, connect):
+        def _timed_connect():
+            start = time()
+            conn = connect()
+            self.metrics.wait.record(time() - start)
+
+            return conn
+
+        return _timed_connect
+
     def on_checkin(self, dbapi_conn, conn_record):
+        if self.metrics:
+            self.metrics.on_checkin()
+
         if self.logger.isEnabledFor(DEBUG):
             msg = 'Checked in dbapi_conn:{}, conn_record:{}'.format(dbapi_conn, conn_record)
             self.logger.debug(msg)
             
     def on_checkout(self, dbapi_conn, conn_record, conn_proxy):
+        if self.metrics:
+            self.metrics.on_checkout()
+
         if self.logger.isEnabledFor(DEBUG):
             msg = 'Checked out dbapi_conn:{}, conn_record:{}, conn_proxy:{}'.format(
                 dbapi_conn, conn_record, conn_proxy)
             self.logger.debug(msg)
             
     def on_connect(self, dbapi_conn, conn_record):
+        if self.metrics:
+            self.metrics.on_connect()
+
         if self.logger.isEnabledFor(DEBUG):
             msg = 'Connect dbapi_conn:{}, conn_record:{}'.format(dbapi_conn, conn_record)
             self.logger.debug(msg)
@@ -129,6 +166,38 @@ class SQLConnectionPool(object):
             msg = 'First connect dbapi_conn:{}, conn_record:{}'.format(dbapi_conn, conn_record)
             self.logger.debug(msg)
         
+    def on_invalidate(self, dbapi_conn, conn_record, exception):
+        self.metrics.on_disconnect()
+
+    def on_before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Raises an exception if the circuit breaker is open or too many statements are already in progress
+        if self.circuit_breaker:
+            context._zato_circuit_breaker_token = self.circuit_breaker.before()
+
+        if self.metrics:
+            context._zato_metrics_start = self.metrics.on_call_start()
+
+    def _on_cursor_execute_done(self, context, is_failure):
+        token = getattr(context, '_zato_circuit_breaker_token', None)
+        if token:
+            context._zato_circuit_breaker_token = None
+            self.circuit_breaker.after(token, is_failure)
+
+        start = getattr(context, '_zato_metrics_start', None)
+        if start:
+            context._zato_metrics_start = None
+            self.metrics.on_call_end(start, is_failure)
+
+    def on_after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._on_cursor_execute_done(context, False)
+
+    def on_dbapi_error(self, conn, cursor, statement, parameters, context, exception):
+
+        # Only errors of the database itself or of connections to it count as failures, unlike ones caused
+        # by statements, e.g. IntegrityError or ProgrammingError, which say nothing about the database's health.
+        dbapi = self.engine.dialect.dbapi
+        self._on_cursor_execute_done(context, isinstance(exception, (dbapi.OperationalError, dbapi.InterfaceError)))
+
     def ping(self):
         """ Pings the SQL database and returns the response time, in milliseconds.
         """
@@ -162,9 +231,11 @@ class PoolStore(DisposableObject):
     """ A main class for accessing all of the SQL connection pools. Each server
     thread has its own store.
     """
-    def __init__(self, sql_conn_class=SQLConnectionPool):
+    def __init__(self, sql_conn_class=SQLConnectionPool, circuit_breaker_store=None, metrics_store=None):
         super(PoolStore, self).__init__()
         self.sql_conn_class = sql_conn_class
+        self.circuit_breaker_store = circuit_breaker_store
+        self.metrics_store = metrics_store
         self._lock = RLock()
         self.wrappers = {}
         self.logger = getLogger(self.__class__.__name__)
@@ -194,7 +265,16 @@ class PoolStore(DisposableObject):
                 
             config_no_sensitive = deepcopy(config)
             config_no_sensitive['password'] = PASSWORD_SHADOW
-            pool = self.sql_conn_class(name, config, config_no_sensitive)
+
+            # ODB is not an outgoing connection, there is nothing else the server could do without it
+            if self.circuit_breaker_store and name != ZATO_ODB_POOL_NAME:
+                circuit_breaker = self.circuit_breaker_store.get(CIRCUIT_BREAKER.CONN_TYPE.SQL, name)
+            else:
+                circuit_breaker = None
+
+            metrics = self.metrics_store.get(CONN_METRICS.CONN_TYPE.SQL, name) if self.metrics_store else None
+
+            pool = self.sql_conn_class(name, config, config_no_sensitive, circuit_breaker, metrics)
 
             wrapper = SessionWrapper()
             wrapper.init_session(name, config, pool)
@@ -207,6 +287,12 @@ class PoolStore(DisposableObject):
         with self._lock:
             self.wrappers[name].pool.engine.dispose()
             del self.wrappers[name]
+
+            if self.circuit_breaker_store:
+                self.circuit_breaker_store.delete(CIRCUIT_BREAKER.CONN_TYPE.SQL, name)
+
+            if self.metrics_store:
+                self.metrics_store.delete(CONN_METRICS.CONN_TYPE.SQL, name)
             
     def __str__(self):
         out = StringIO()
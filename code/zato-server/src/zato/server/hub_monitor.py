@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import gc
+import logging
+import sys
+from collections import deque
+from datetime import datetime
+from time import time
+from traceback import format_exc, format_stack
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent import getcurrent
+from gevent.monkey import get_original
+
+# greenlet
+import greenlet
+
+# Paste
+from paste.util.converters import asbool
+
+# Zato
+from zato.common import HUB_MONITOR
+from zato.server.connection.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Real OS threads and locks, and a sleep blocking only them, even if gevent has monkey-patched the thread and time modules
+start_new_thread = get_original('thread', 'start_new_thread')
+allocate_lock = get_original('thread', 'allocate_lock')
+get_ident = get_original('thread', 'get_ident')
+sleep = get_original('time', 'sleep')
+
+# ################################################################################################################################
+
+def get_func_name(func):
+    """ Returns a 'module:name' label of a callable, e.g. one a greenlet was spawned with.
+    """
+    func = getattr(func, 'func', func) # functools.partial
+    name = getattr(func, '__name__', None) or func.__class__.__name__
+
+    return '{}:{}'.format(getattr(func, '__module__', None) or '?', name)
+
+def get_greenlet_func_name(item):
+    """ Returns a label of the function a greenlet runs - the one it was spawned with or its class if it has none.
+    """
+    func = getattr(item, '_run', None) or getattr(item, 'run', None)
+    if func:
+        return get_func_name(func)
+
+    return '{}:{}'.format(item.__class__.__module__, item.__class__.__name__)
+
+def get_waiting_in(frame):
+    """ Returns a 'module:name' label of the innermost function of a suspended greenlet outside of gevent,
+    i.e. the one that made it wait, or None if all of its frames belong to gevent.
+    """
+    while frame:
+        module = frame.f_globals.get('__name__') or ''
+        if module != 'gevent' and not module.startswith('gevent.'):
+            return '{}:{}'.format(module, frame.f_code.co_name)
+        frame = frame.f_back
+
+# ################################################################################################################################
+
+class HubMonitor(object):
+    """ Watches the gevent hub of a worker for anything keeping it from switching between greenlets, such as CPU-heavy
+    services or blocking calls which gevent did not patch.
+
+    - A greenlet wakes up each interval and records how late it was in a histogram of the loop's lag.
+
+    - A watchdog running in an OS thread of its own notices when the greenlet is late by more than threshold and, while
+      the hub is still blocked, records the call blocking it, along with the service this happened in. Calls blocking
+      without releasing the GIL, e.g. ones in C extensions, are not seen by the watchdog until they return, but the lag
+      they cause is still recorded.
+
+    - If hub_time is enabled and greenlet supports tracing, each switch between greenlets adds the time since
+      the previous one to the service the greenlet switched away from was running, i.e. counts how long services held
+      the hub for. This is off by default because it installs a trace function global to the whole process.
+    """
+    def __init__(self, worker_name, config=None):
+        config = config or {}
+
+        self.worker_name = worker_name
+        self.is_enabled = asbool(config.get('is_enabled', True))
+        self.interval = float(config.get('interval', HUB_MONITOR.INTERVAL))
+        self.threshold = float(config.get('threshold', HUB_MONITOR.THRESHOLD))
+        self.max_depth = int(config.get('max_depth', HUB_MONITOR.MAX_DEPTH))
+        self.needs_hub_time = asbool(config.get('hub_time', False)) and hasattr(greenlet, 'settrace')
+        self.blocks = deque(maxlen=int(config.get('max_blocks', HUB_MONITOR.MAX_BLOCKS)))
+
+        self.is_running = False
+        self.services = {} # Greenlets running services -> names of the services, the innermost one last
+
+        # Stacks of blocking calls are searched for frames of this method to find out which service blocked the hub
+        self._run_code = self.run.__func__.__code__
+
+        self._thread_id = None
+        self._generation = 0
+        self._checker = None
+        self._watch_done = None # Held by the watchdog thread until it returns
+        self._prev_trace = None
+        self._watch_error = None
+        self._switched_at = time()
+
+        self.reset()
+
+    def reset(self):
+        """ Zeroes the lag and hub time counters and forgets blocking calls recorded so far.
+        """
+        self.lag = LatencyHistogram()
+        self.blocked = 0
+        self.blocks.clear()
+        self.hub_time = {} # Service name -> how many times it was invoked and for how long it held the hub
+        self.reset_at = time()
+        self.heartbeat = time()
+        self._blocked_heartbeat = None
+        self._pending_block = None
+
+# ################################################################################################################################
+
+    def start(self):
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self._generation += 1
+        self._thread_id = get_ident()
+        self._switched_at = self.heartbeat = time()
+
+        if self.needs_hub_time:
+            self._prev_trace = greenlet.settrace(self._on_switch)
+
+        self._checker = gevent.spawn(self._check_lag)
+
+        self._watch_done = allocate_lock()
+        self._watch_done.acquire()
+        start_new_thread(self._watch, (self._generation, self._watch_done))
+
+        logger.info('Hub monitor started, interval:`%s`, threshold:`%s`, hub_time:`%s`',
+            self.interval, self.threshold, self.needs_hub_time)
+
+    def stop(self):
+        if not self.is_running:
+            return
+
+        # The watchdog thread notices it on its next check and returns
+        self.is_running = False
+
+        if self.needs_hub_time:
+            greenlet.settrace(self._prev_trace)
+            self._prev_trace = None
+
+        if self._checker and self._checker is not getcurrent():
+            self._checker.kill()
+        self._checker = None
+
+        # Blocks the hub for at most threshold / 2 seconds, but no watchdog is ever left running, e.g. while the interpreter
+        # is shutting down.
+        self._watch_done.acquire()
+        self._watch_done.release()
+        self._watch_done = None
+
+        logger.info('Hub monitor stopped')
+
+# ################################################################################################################################
+
+    def run(self, service_name, func):
+        """ Invokes func, a service's handle method, counting how long the service holds the hub for.
+        """
+        if not self.needs_hub_time:
+            return func()
+
+        current = getcurrent()
+        names = self.services.setdefault(current, [])
+
+        # Time since the last switch belongs to whichever service invoked this one, if any
+        self._add_hub_time(names)
+        names.append(service_name)
+
+        try:
+            return func()
+        finally:
+            self._add_hub_time(names)
+            names.pop()
+
+            if not names:
+                self.services.pop(current, None)
+
+            self._get_hub_time(service_name).calls += 1
+
+    def _get_hub_time(self, service_name):
+        hub_time = self.hub_time.get(service_name)
+        if not hub_time:
+            hub_time = self.hub_time[service_name] = Bunch(calls=0, time=0.0, max_slice=0.0)
+
+        return hub_time
+
+    def _add_hub_time(self, names):
+        """ Adds the time since the last switch to the innermost of the services a greenlet runs, if it runs any.
+        """
+        now = time()
+
+        if names:
+            elapsed = now - self._switched_at
+            hub_time = self._get_hub_time(names[-1])
+            hub_time.time += elapsed
+
+            if elapsed > hub_time.max_slice:
+                hub_time.max_slice = elapsed
+
+        self._switched_at = now
+
+    def _on_switch(self, event, args):
+        """ Called by greenlet on each switch, args being the greenlets switched from and to.
+        """
+        if event in ('switch', 'throw'):
+            self._add_hub_time(self.services.get(args[0]))
+
+        if self._prev_trace:
+            self._prev_trace(event, args)
+
+# ################################################################################################################################
+
+    def _check_lag(self):
+        while self.is_running:
+            heartbeat = self.heartbeat = time()
+            gevent.sleep(self.interval)
+
+            lag = max(time() - heartbeat - self.interval, 0)
+            self.lag.record(lag)
+
+            if lag > self.threshold:
+                self.blocked += 1
+
+                # The watchdog recorded the call as soon as it noticed it, now it is known for how long the hub was blocked
+                block = self._pending_block
+                if block and self._blocked_heartbeat == heartbeat:
+                    block.duration = round(lag * 1000, 3)
+                    logger.warn('Hub blocked for %.1f ms, service:`%s`, stack:`%s`',
+                        block.duration, block.service_name, block.stack)
+                self._pending_block = None
+
+            # Logging is not done in the watchdog thread because locks of logging handlers are gevent ones
+            if self._watch_error:
+                logger.warn('Could not record a call blocking the hub, e:`%s`', self._watch_error)
+                self._watch_error = None
+
+    def _watch(self, generation, done):
+        """ Runs in an OS thread of its own so it can look into the hub's thread while the hub is still blocked.
+        Releases done once it returns.
+        """
+        try:
+            while self.is_running and generation == self._generation:
+                sleep(self.threshold / 2)
+
+                heartbeat = self.heartbeat
+                blocked_for = time() - heartbeat - self.interval
+
+                if blocked_for > self.threshold and heartbeat != self._blocked_heartbeat:
+                    try:
+                        self._record_block(heartbeat, blocked_for)
+                    except Exception, e:
+                        self._watch_error = format_exc(e)
+        finally:
+            done.release()
+
+    def _record_block(self, heartbeat, blocked_for):
+        frame = sys._current_frames().get(self._thread_id)
+        if not frame:
+            return
+
+        block = Bunch()
+        block.timestamp = datetime.utcnow().isoformat()
+        block.service_name = self._get_service_name(frame)
+        block.duration = round(blocked_for * 1000, 3) # Updated once the hub is no longer blocked
+        block.stack = ''.join(format_stack(frame, self.max_depth))
+
+        self._blocked_heartbeat = heartbeat
+        self._pending_block = block
+        self.blocks.append(block)
+
+    def _get_service_name(self, frame):
+        """ Returns the name of the innermost service a frame, and the ones that called it, belong to, if any.
+        """
+        while frame:
+            if frame.f_code is self._run_code:
+                return frame.f_locals.get('service_name')
+            frame = frame.f_back
+
+# ################################################################################################################################
+
+    def get_census(self):
+        """ Returns counts of live greenlets grouped by the functions they were spawned with and the innermost functions
+        outside of gevent they are waiting in. Goes through all the objects the garbage collector tracks.
+        """
+        current = getcurrent()
+        counts = {}
+
+        for item in gc.get_objects():
+            if not isinstance(item, greenlet.greenlet) or item.dead:
+                continue
+
+            waiting_in = HUB_MONITOR.RUNNING_FRAME if item is current else get_waiting_in(item.gr_frame)
+
+            key = (get_greenlet_func_name(item), waiting_in or '')
+            counts[key] = counts.get(key, 0) + 1
+
+        out = []
+
+        for (func, waiting_in), count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+            out.append(Bunch(func=func, waiting_in=waiting_in, count=count))
+
+        return out
+
+    def get_lag_stats(self):
+        """ Returns statistics of the loop's lag, in milliseconds.
+        """
+        stats = Bunch()
+        stats.worker_name = self.worker_name
+        stats.is_running = self.is_running
+        stats.interval = self.interval
+        stats.threshold = self.threshold
+        stats.since = datetime.utcfromtimestamp(self.reset_at).isoformat()
+        stats.checks = self.lag.count
+        stats.blocked = self.blocked
+        stats.lag_mean = self.lag.get_mean()
+        stats.lag_p50 = self.lag.get_percentile(50)
+        stats.lag_p90 = self.lag.get_percentile(90)
+        stats.lag_p99 = self.lag.get_percentile(99)
+        stats.lag_max = self.lag.max
+        stats.lag_buckets = ', '.join('{}:{}'.format(
+            'inf' if bound is None else bound, count) for bound, count in self.lag.get_buckets())
+
+        return stats
+
+    def get_blocks(self):
+        """ Returns the most recent blocking calls, newest first.
+        """
+        return list(reversed(self.blocks))
+
+    def get_hub_time(self):
+        """ Returns, for each service, for how long in total, on average and at most at once, in milliseconds,
+        it held the hub, i.e. ran without letting other greenlets run, most time-consuming services first.
+        """
+        out = []
+
+        for name, hub_time in sorted(self.hub_time.items(), key=lambda item: (-item[1].time, item[0])):
+            item = Bunch()
+            item.service_name = name
+            item.calls = hub_time.calls
+            item.hub_time = round(hub_time.time * 1000, 3)
+            item.hub_time_mean = round(hub_time.time * 1000 / hub_time.calls, 3) if hub_time.calls else 0.0
+            item.max_slice = round(hub_time.max_slice * 1000, 3)
+            out.append(item)
+
+        return out
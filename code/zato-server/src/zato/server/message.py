@@ -369,6 +369,48 @@ class Mapper(object):
         for to, from_ in items:
             self.map(to, from_, *args, **kwargs)
 
+    def compile(self, items, separator='/', skip_missing=True, default=ZATO_NOT_GIVEN):
+        """ Turns (to, from_) pairs, as accepted by map_many, into a MappingProgram which produces the same results
+        but can be run over any number of source documents without parsing the pairs each time. Functions,
+        time formats and substitutions are the ones set at the time compile is called.
+        """
+        rules = []
+
+        for to, from_ in items:
+            orig_from = from_
+            force_func = None
+            force_func_name = None
+            from_format, to_format = None, None
+
+            # Perform any string substitutions first.
+            if self.subs:
+                from_.format(**self.subs)
+                to.format(**self.subs)
+
+            # Pick at most one processing functions.
+            for key in self.func_keys:
+                if from_.startswith(key):
+                    from_ = from_.replace('{}:'.format(key), '', 1)
+                    force_func = self.funcs[key]
+                    force_func_name = key
+                    break
+
+            # Perhaps it's a date value that needs to be converted.
+            needs_time_reformat = from_.startswith('time:')
+            if needs_time_reformat:
+                from_format, from_ = self._get_time_format(from_)
+                to_format, _ = self._get_time_format(to)
+
+            rules.append((to, _get_target_keys(to), from_.split(separator)[1:], orig_from, force_func, force_func_name,
+                needs_time_reformat, from_format, to_format))
+
+        return MappingProgram(rules, self.map_type, self.time_util, skip_missing, default)
+
+    def run(self, program):
+        """ Runs a compiled MappingProgram over this mapper's source, storing results in its target.
+        """
+        program.run(self.source, self.target)
+
     def get(self, path, default=None, separator='/'):
         for found_path, value in dpath_util.search(self.source.obj, path, yielded=True, separator=separator):
             if path == '{}{}'.format(separator, found_path):
@@ -384,4 +426,89 @@ class Mapper(object):
     def _get_time_format(self, path):
         path = path.split('time:')[1]
         sep_idx = path.find(':')
-        return self.times[path[:sep_idx]], path[sep_idx+1:]
\ No newline at end of file
+        return self.times[path[:sep_idx]], path[sep_idx+1:]
+# ################################################################################################################################
+
+def _get_target_keys(to):
+    """ Returns keys dpath.util.new would traverse for a given target path or None if they are not all plain,
+    non-empty, strings, in which case values should be set by dpath itself.
+    """
+    keys = to.lstrip('/').split('/')
+    return keys if all(keys) else None
+
+def _set_value(target, to, keys, value):
+    """ Same as dpath.util.new(target, to, value) as long as all the containers on the way are dicts, which is the case
+    for targets built by mappers unless lists are set explicitly. Defers to dpath as soon as anything else is found.
+    """
+    if keys is None:
+        return dpath_util.new(target, to, value)
+
+    obj = target
+
+    for key in keys[:-1]:
+        if not isinstance(obj, dict):
+            return dpath_util.new(target, to, value)
+
+        if key not in obj:
+            obj[key] = {}
+
+        obj = obj[key]
+
+    if not isinstance(obj, dict):
+        return dpath_util.new(target, to, value)
+
+    obj[keys[-1]] = value
+
+class MappingProgram(object):
+    """ Mapping rules compiled by Mapper.compile - paths are already split, functions and time formats are already
+    looked up. Produces the same results as Mapper.map_many given the same rules.
+    """
+    def __init__(self, rules, map_type=MSG_MAPPER.DICT_TO_DICT, time_util=None, skip_missing=True, default=ZATO_NOT_GIVEN):
+        self.rules = rules
+        self.map_type = map_type
+        self.time_util = time_util
+        self.skip_missing = skip_missing
+        self.default = default
+
+    def run(self, source, target=None):
+        """ Maps a single source document into target, a new dict unless given on input, and returns the target.
+        """
+        target = target if target is not None else {}
+
+        if not isinstance(source, DictNav) and self.map_type.startswith('dict-to-'):
+            source = DictNav(source)
+
+        for to, keys, from_keys, orig_from, force_func, force_func_name, needs_time_reformat, from_format, to_format \
+                in self.rules:
+
+            # Obtain the value.
+            value = source.get(from_keys)
+
+            if needs_time_reformat:
+                value = self.time_util.reformat(value, from_format, to_format)
+
+            # Don't return anything if we are to skip missing values
+            # or, we aren't, return a default value.
+            if not value:
+                if self.skip_missing:
+                    continue
+                else:
+                    value = self.default if self.default != ZATO_NOT_GIVEN else value
+
+            # We have some value, let's process it using the function found above.
+            if force_func:
+                try:
+                    value = force_func(value)
+                except Exception, e:
+                    logger.warn('Error in force_func:`%s` `%s` over `%s` in `%s` -> `%s` e:`%s`',
+                        force_func_name, force_func, value, orig_from, to, format_exc(e))
+                    raise
+
+            _set_value(target, to, keys, value)
+
+        return target
+
+    def run_many(self, sources):
+        """ Maps each of source documents into a new dict, returning a list of them in the same order.
+        """
+        return [self.run(source) for source in sources]
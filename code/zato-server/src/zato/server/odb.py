@@ -15,6 +15,7 @@ from datetime import datetime, timedelta
 from traceback import format_exc
 
 # SQLAlchemy
+from sqlalchemy import bindparam
 from sqlalchemy.exc import IntegrityError, ProgrammingError
 
 # Bunch
@@ -23,8 +24,10 @@ from bunch import Bunch
 # Zato
 from zato.common import DEPLOYMENT_STATUS, MISC, SEC_DEF_TYPE, TRACE1, ZATO_NONE, ZATO_ODB_POOL_NAME
 from zato.common.odb.model import APIKeySecurity, Cluster, DeployedService, DeploymentPackage, DeploymentStatus, HTTPBasicAuth, \
-     HTTPSOAP, HTTSOAPAudit, OAuth, Server, Service, TechnicalAccount, XPathSecurity, WSSDefinition
+     HTTSOAPAudit, HTTSOAPAuditReplacePatternsJSONPointer, HTTSOAPAuditReplacePatternsXPath, HTTSOAPAuditToken, JSONPointer, \
+     OAuth, Server, Service, TechnicalAccount, XPath, XPathSecurity, WSSDefinition
 from zato.common.odb import query
+from zato.common.odb.util import get_search_tokens
 from zato.common.util import current_host
 from zato.server.connection.sql import SessionWrapper
 
@@ -125,7 +128,19 @@ class ODBManager(SessionWrapper):
             for c in q.statement.columns:
                 columns[c.name] = None
 
-            for item in q.all():
+            items = q.all()
+
+            # Fetch all security definitions of each type needed in one query per type rather than one per URL
+            sec_defs = {}
+            for sec_type in set(item.sec_type for item in items if item.security_id):
+
+                # Will raise KeyError if the DB gets somehow misconfigured.
+                db_class = sec_type_db_class[sec_type]
+
+                for sec_def in session.query(db_class).filter(db_class.cluster_id==cluster_id):
+                    sec_defs[sec_def.id] = sec_def
+
+            for item in items:
                 target = '{}{}{}'.format(item.soap_action, MISC.SEPARATOR, item.url_path)
 
                 result[target] = Bunch()
@@ -135,13 +150,7 @@ class ODBManager(SessionWrapper):
 
                 if item.security_id:
                     result[target].sec_def = Bunch()
-
-                    # Will raise KeyError if the DB gets somehow misconfigured.
-                    db_class = sec_type_db_class[item.sec_type]
-
-                    sec_def = session.query(db_class).\
-                            filter(db_class.id==item.security_id).\
-                            one()
+                    sec_def = sec_defs[item.security_id]
 
                     # Common things first
                     result[target].sec_def.name = sec_def.name
@@ -249,6 +258,92 @@ class ODBManager(SessionWrapper):
             logger.error(msg)
             self._session.rollback()
 
+    def _get_services_by_name(self, session):
+        """ Returns a dictionary of all the services in the server's cluster, keyed by their names.
+        """
+        out = {}
+
+        q = session.query(Service.id, Service.name, Service.is_active, Service.slow_threshold).\
+            filter(Service.cluster_id==self.cluster.id)
+
+        for item in q.all():
+            out[item.name] = [item.id, item.is_active, item.slow_threshold]
+
+        return out
+
+    def add_services(self, items, max_attempts=2):
+        """ Adds information about all of the server's services into the ODB in a single transaction, replacing
+        everything that had been deployed on this server previously. Each item must have the same attributes
+        add_service expects.
+
+        Returns a dictionary of service names to lists of [id, is_active, slow_threshold]. If another server
+        of the same cluster adds the same services at the same time, the whole transaction is retried.
+        """
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            with closing(self.session()) as session:
+                try:
+                    existing = self._get_services_by_name(session)
+
+                    # Services that have never been deployed anywhere in the cluster ..
+                    new_services = []
+                    new_names = set()
+
+                    for item in items:
+                        if item.name not in existing and item.name not in new_names:
+                            new_names.add(item.name)
+                            new_services.append({
+                                'name': item.name,
+                                'is_active': True,
+                                'impl_name': item.impl_name,
+                                'is_internal': item.is_internal,
+                                'cluster_id': self.cluster.id,
+                            })
+
+                    # .. are inserted in one statement ..
+                    if new_services:
+                        session.execute(Service.__table__.insert(), new_services)
+                        existing = self._get_services_by_name(session)
+
+                    # .. and so is everything that is deployed on this server.
+                    session.query(DeployedService).\
+                        filter(DeployedService.server_id==self.server.id).\
+                        delete()
+
+                    deployed = {}
+
+                    for item in items:
+                        deployed[item.name] = {
+                            'deployment_time': item.deployment_time,
+                            'details': item.details,
+                            'server_id': self.server.id,
+                            'service_id': existing[item.name][0],
+                            'source': item.source_info.source,
+                            'source_path': item.source_info.path,
+                            'source_hash': item.source_info.hash,
+                            'source_hash_method': item.source_info.hash_method,
+                        }
+
+                    if deployed:
+                        session.execute(DeployedService.__table__.insert(), deployed.values())
+
+                    session.commit()
+
+                except(IntegrityError, ProgrammingError), e:
+                    session.rollback()
+
+                    if attempt >= max_attempts:
+                        raise
+
+                    logger.log(TRACE1, 'IntegrityError (add_services), attempt:[%s], e:[%s]',
+                        attempt, format_exc(e).decode('utf-8'))
+
+                else:
+                    return dict((item.name, existing[item.name]) for item in items)
+
     def is_service_active(self, service_id):
         """ Returns whether the given service is active or not.
         """
@@ -387,15 +482,35 @@ class ODBManager(SessionWrapper):
             item_list = query.http_soap_list(session, cluster_id, connection, transport, True, needs_columns)
 
             if connection == 'channel':
+                json_pointer = self._get_replace_patterns(session, cluster_id, HTTSOAPAuditReplacePatternsJSONPointer, JSONPointer)
+                xpath = self._get_replace_patterns(session, cluster_id, HTTSOAPAuditReplacePatternsXPath, XPath)
+
+                out = []
                 for item in item_list:
-                    item.replace_patterns_json_pointer = [elem.pattern.name for elem in session.query(HTTPSOAP).\
-                        filter(HTTPSOAP.id == item.id).one().replace_patterns_json_pointer]
+                    item = Bunch(zip(item.keys(), item))
+                    item.replace_patterns_json_pointer = json_pointer.get(item.id, [])
+                    item.replace_patterns_xpath = xpath.get(item.id, [])
+                    out.append(item)
 
-                    item.replace_patterns_xpath = [elem.pattern.name for elem in session.query(HTTPSOAP).\
-                        filter(HTTPSOAP.id == item.id).one().replace_patterns_xpath]
+                return out
 
             return item_list
 
+    def _get_replace_patterns(self, session, cluster_id, assoc_class, pattern_class):
+        """ Returns a dictionary of HTTP/SOAP connection IDs to names of replace patterns of a given type they use.
+        """
+        out = {}
+
+        q = session.query(assoc_class.conn_id, pattern_class.name).\
+            filter(assoc_class.pattern_id==pattern_class.id).\
+            filter(assoc_class.cluster_id==cluster_id).\
+            order_by(assoc_class.id)
+
+        for conn_id, name in q.all():
+            out.setdefault(conn_id, []).append(name)
+
+        return out
+
 # ################################################################################################################################
 
     def get_job_list(self, cluster_id, needs_columns=False):
@@ -640,6 +755,50 @@ class ODBManager(SessionWrapper):
             session.add(audit)
             session.commit()
 
+    def audit_set_http_soap_many(self, requests, responses, needs_tokens=True):
+        """ Inserts new audit rows and updates existing ones with data regarding responses, all in one transaction.
+        Each of the lists is stored using a single executemany call. If needs_tokens is True, words found in requests
+        and responses are added to the audit log's search index, also in the same transaction.
+        """
+        table = HTTSOAPAudit.__table__
+        tokens = []
+
+        if needs_tokens:
+            for row in requests:
+                tokens.extend(self._get_audit_tokens(row['cid'], row['req_time'], row['cid'],
+                    row['req_payload'], row['req_headers']))
+
+            for row in responses:
+                tokens.extend(self._get_audit_tokens(row['cid'], row['resp_time'], row['resp_payload'], row['resp_headers']))
+
+        with closing(self.session()) as session:
+
+            if requests:
+                for row in requests:
+                    row['cluster_id'] = self.cluster.id
+
+                session.execute(table.insert(), requests)
+
+            if tokens:
+                session.execute(HTTSOAPAuditToken.__table__.insert(), tokens)
+
+            if responses:
+                update = table.update().\
+                    where(table.c.cid==bindparam('b_cid')).\
+                    values(invoke_ok=bindparam('b_invoke_ok'), auth_ok=bindparam('b_auth_ok'),
+                        resp_time=bindparam('b_resp_time'), resp_headers=bindparam('b_resp_headers'),
+                        resp_payload=bindparam('b_resp_payload'))
+
+                session.execute(update, [dict(('b_{}'.format(key), value) for key, value in row.items()) for row in responses])
+
+            session.commit()
+
+    def _get_audit_tokens(self, cid, event_time, *values):
+        """ Returns rows of the audit log's search index for values of a given CID.
+        """
+        return [{'token':token, 'cid':cid, 'event_time':event_time, 'cluster_id':self.cluster.id}
+            for token in get_search_tokens(*values)]
+
 # ################################################################################################################################
 
     def get_cloud_openstack_swift_list(self, cluster_id, needs_columns=False):
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import logging
+import signal
+from random import random
+from time import time
+from traceback import format_exc
+
+# anyjson
+from anyjson import dumps
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent import getcurrent
+
+# Zato
+from zato.common import KVDB, PROFILER
+
+logger = logging.getLogger(__name__)
+
+# ################################################################################################################################
+
+class SamplingProfiler(object):
+    """ Profiles a single service in a worker by periodically sampling stacks of greenlets invoking it, for a bounded
+    period of time. A wall-clock timer is used so greenlets suspended while waiting for I/O, a lock or other greenlets
+    are sampled too - their stacks end with PROFILER.WAIT_FRAME. Stacks are kept in the collapsed format, i.e.
+    'service;outermost.module:func;...;innermost.module:func', and periodically added to the ones other workers sampled
+    in the same session so the KVDB always has stacks of the whole cluster.
+
+    Invocations of other services, and all invocations when no session is active, only check a flag.
+    """
+    def __init__(self, kvdb, worker_name, config=None):
+        config = config or {}
+
+        self.kvdb = kvdb
+        self.worker_name = worker_name
+        self.max_depth = int(config.get('max_depth', PROFILER.MAX_DEPTH))
+        self.flush_interval = float(config.get('flush_interval', PROFILER.FLUSH_INTERVAL))
+        self.result_ttl = int(config.get('result_ttl', PROFILER.RESULT_TTL))
+
+        self.is_active = False
+        self.session_id = None
+        self.service_name = None
+        self.sample_rate = PROFILER.SAMPLE_RATE
+        self.interval = PROFILER.INTERVAL
+        self.until = 0
+
+        # Stack walking stops at this method so frames of whoever invoked the service are not included
+        self._run_code = self.run.__func__.__code__
+
+        self._flusher = None
+        self._prev_handler = None
+        self._reset()
+
+    def _reset(self):
+        self.greenlets = {} # Greenlets running sampled invocations -> name of the service
+        self.stacks = {} # Collapsed stack -> how many times it was sampled since the last flush
+        self.samples = 0
+        self.sampler_time = 0.0
+        self.started = None
+        self.stopped = None
+        self.profiled_calls = 0
+        self.profiled_time = 0.0
+        self.unprofiled_calls = 0
+        self.unprofiled_time = 0.0
+
+# ################################################################################################################################
+
+    def start(self, session_id, service_name, duration=PROFILER.DURATION, sample_rate=PROFILER.SAMPLE_RATE,
+            interval=PROFILER.INTERVAL):
+        """ Starts sampling invocations of a given service, stopping a session already in progress, if there is one.
+        """
+        if self.is_active:
+            self.stop()
+
+        self._reset()
+
+        self.session_id = session_id
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.started = time()
+        self.until = self.started + min(duration, PROFILER.MAX_DURATION)
+
+        self._prev_handler = signal.signal(signal.SIGALRM, self._sample)
+
+        # Blocking system calls, e.g. ones made by C libraries, are restarted rather than interrupted by the timer
+        signal.siginterrupt(signal.SIGALRM, False)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+        self.is_active = True
+        self._flusher = gevent.spawn(self._flush_periodically)
+
+        logger.info('Profiling `%s` in session `%s` for %ss, sample_rate:`%s`, interval:`%s`',
+            service_name, session_id, duration, sample_rate, interval)
+
+    def stop(self, session_id=None):
+        """ Stops the current session, or only a given one if session_id is provided, and flushes stacks sampled so far.
+        """
+        if not self.is_active or (session_id and session_id != self.session_id):
+            return
+
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._prev_handler or signal.SIG_DFL)
+
+        self.is_active = False
+        self.stopped = time()
+        self.greenlets.clear()
+
+        if self._flusher and self._flusher is not getcurrent():
+            self._flusher.kill()
+        self._flusher = None
+
+        self.flush()
+
+        logger.info('Stopped profiling `%s` in session `%s`, samples:`%s`', self.service_name, self.session_id, self.samples)
+
+# ################################################################################################################################
+
+    def run(self, service_name, func):
+        """ Invokes func, a service's handle method, sampling its stacks if the service is the one being profiled.
+        Durations of both sampled and other invocations are kept so the overhead of sampling can be compared.
+        """
+        if service_name != self.service_name or time() > self.until:
+            return func()
+
+        is_sampled = random() < self.sample_rate
+        current = getcurrent()
+
+        if is_sampled:
+            self.greenlets[current] = service_name
+
+        start = time()
+
+        try:
+            return func()
+        finally:
+            elapsed = time() - start
+
+            if is_sampled:
+                self.greenlets.pop(current, None)
+                self.profiled_calls += 1
+                self.profiled_time += elapsed
+            else:
+                self.unprofiled_calls += 1
+                self.unprofiled_time += elapsed
+
+    def _get_stack(self, frame):
+        """ Returns names of functions from the outermost to the innermost one, starting from a service's handle method.
+        """
+        stack = []
+
+        while frame and frame.f_code is not self._run_code and len(stack) < self.max_depth:
+            stack.append('{}:{}'.format(frame.f_globals.get('__name__', frame.f_code.co_filename), frame.f_code.co_name))
+            frame = frame.f_back
+
+        stack.reverse()
+
+        return stack
+
+    def _sample(self, signum, frame):
+        """ Called by the timer, frame belongs to whichever greenlet happened to be running.
+        """
+        start = time()
+        current = getcurrent()
+
+        for greenlet, service_name in self.greenlets.items():
+            if greenlet is current:
+                stack = self._get_stack(frame)
+
+            # Each greenlet not running now waits for I/O, a lock or for other greenlets to yield control
+            else:
+                stack = self._get_stack(greenlet.gr_frame)
+                stack.append(PROFILER.WAIT_FRAME)
+
+            key = ';'.join([service_name] + stack)
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+        self.sampler_time += time() - start
+
+# ################################################################################################################################
+
+    def _flush_periodically(self):
+        while self.is_active:
+            gevent.sleep(min(self.flush_interval, max(self.until - time(), 0)))
+
+            if time() >= self.until:
+                self.stop()
+            else:
+                self.flush()
+
+    def flush(self):
+        """ Adds stacks sampled since the last flush to the ones of all the workers and stores statistics of this worker.
+        """
+        if not self.session_id:
+            return
+
+        stacks, self.stacks = self.stacks, {}
+        stacks_key = '{}{}'.format(KVDB.PROFILER_STACKS, self.session_id)
+        workers_key = '{}{}'.format(KVDB.PROFILER_WORKERS, self.session_id)
+
+        try:
+            with self.kvdb.conn.pipeline() as p:
+                for stack, count in stacks.items():
+                    p.hincrby(stacks_key, stack, count)
+
+                p.hset(workers_key, self.worker_name, dumps(self.get_stats()))
+                p.expire(stacks_key, self.result_ttl)
+                p.expire(workers_key, self.result_ttl)
+                p.execute()
+
+        except Exception, e:
+            logger.warn('Could not flush %d stacks of session `%s`, e:`%s`', len(stacks), self.session_id, format_exc(e))
+
+    def get_stats(self):
+        """ Returns statistics of the current or last session in this worker. Overhead is the share of the session's time
+        the worker spent on sampling stacks. Outside of sessions the timer is not running so there is no overhead.
+        """
+        if self.started:
+            elapsed = (self.stopped if self.stopped and not self.is_active else time()) - self.started
+        else:
+            elapsed = 0.0
+
+        stats = Bunch()
+        stats.worker_name = self.worker_name
+        stats.session_id = self.session_id
+        stats.service_name = self.service_name
+        stats.is_active = self.is_active
+        stats.samples = self.samples
+        stats.elapsed = round(elapsed, 3)
+        stats.sampler_time = round(self.sampler_time, 6)
+        stats.overhead = round(100.0 * self.sampler_time / elapsed, 3) if elapsed else 0.0
+        stats.profiled_calls = self.profiled_calls
+        stats.profiled_mean = round(1000.0 * self.profiled_time / self.profiled_calls, 3) if self.profiled_calls else 0.0
+        stats.unprofiled_calls = self.unprofiled_calls
+        stats.unprofiled_mean = round(1000.0 * self.unprofiled_time / self.unprofiled_calls, 3) if self.unprofiled_calls else 0.0
+
+        return stats
+
+# ################################################################################################################################
+
+def get_top_functions(stacks, n=PROFILER.TOP_N):
+    """ Given collapsed stacks mapped to how many times each was sampled, returns n functions with the most samples.
+    Self samples are those in which a function was the innermost one, total ones also include samples of all the
+    functions it called. Service names, i.e. roots of the stacks, are not functions and are skipped.
+    """
+    self_samples = {}
+    total_samples = {}
+    all_samples = sum(stacks.values())
+
+    for stack, count in stacks.items():
+        names = stack.split(';')[1:]
+        if not names:
+            continue
+
+        self_samples[names[-1]] = self_samples.get(names[-1], 0) + count
+
+        # Recursive functions are counted once per stack
+        for name in set(names):
+            total_samples[name] = total_samples.get(name, 0) + count
+
+    out = []
+
+    for name in sorted(total_samples, key=lambda name: (-self_samples.get(name, 0), -total_samples[name], name))[:n]:
+        item = Bunch()
+        item.name = name
+        item.self_samples = self_samples.get(name, 0)
+        item.total_samples = total_samples[name]
+        item.self_perc = round(100.0 * item.self_samples / all_samples, 2)
+        item.total_perc = round(100.0 * item.total_samples / all_samples, 2)
+        out.append(item)
+
+    return out
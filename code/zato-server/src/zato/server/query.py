@@ -24,11 +24,12 @@ class CassandraQueryStore(BaseStore):
     """ Stores Cassandra prepared statements.
     """
     def create_impl(self, config, config_no_sensitive, **extra):
-        conn = extra['def_'].conn
-        if not conn:
+        client = extra['def_'].client
+        if not client:
             logger.warn('Could not create a Cassandra query `%s`, conn is None`', config_no_sensitive)
         else:
-            return conn.prepare(config.value)
+            # Shares the statement with the connection's cache in case services execute the same CQL directly
+            return client.prepare(config.value)
 
     def update_by_def(self, del_name, new_def):
         """ Invoked when the underlying definition got updated.
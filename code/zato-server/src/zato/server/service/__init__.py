@@ -11,6 +11,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import logging
 from datetime import datetime
+from functools import partial
 from sys import maxint
 from traceback import format_exc
 
@@ -32,12 +33,13 @@ from retools.lock import Lock
 
 # Zato
 from zato.common import BROKER, CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, ZatoException
-from zato.common.broker_message import SERVICE
+from zato.common.broker_message import CHANNEL as CHANNEL_MSG, SERVICE
 from zato.common.nav import DictNav, ListNav
 from zato.common.util import uncamelify, new_cid, payload_from_request, service_name_from_impl
 from zato.server.connection import request_response, slow_response
 from zato.server.connection.amqp.outgoing import PublisherFacade
 from zato.server.connection.email import EMailAPI
+from zato.server.connection.http_soap.outgoing import HTTPSOAPFacade
 from zato.server.connection.jms_wmq.outgoing import WMQFacade
 from zato.server.connection.search import SearchAPI
 from zato.server.connection.zmq_.outgoing import ZMQFacade
@@ -136,12 +138,77 @@ class TimeUtil(object):
 
 # ##############################################################################
 
+class WorkerFacades(object):
+    """ Connection facades services access through self.outgoing, self.cloud, self.email and self.search.
+    None of them depends on a particular invocation so they are shared by all services of a worker
+    and each is built only when first accessed by any service.
+    """
+    def __init__(self, worker_store):
+        self.worker_store = worker_store
+        self._outgoing = None
+        self._cloud = None
+        self._email = None
+        self._search = None
+
+    @property
+    def outgoing(self):
+        if self._outgoing is None:
+            broker_client = self.worker_store.broker_client
+            delivery_store = self.worker_store.server.delivery_store
+
+            # Queues
+            out_amqp = PublisherFacade(broker_client, delivery_store)
+            out_jms_wmq = WMQFacade(broker_client, delivery_store)
+            out_zmq = ZMQFacade(broker_client, delivery_store)
+
+            # SQL
+            out_sql = self.worker_store.sql_pool_store
+
+            # Regular outconns
+            out_ftp, out_plain_http, out_soap = self.worker_store.worker_config.outgoing_connections()
+            out_plain_http, out_soap = HTTPSOAPFacade(out_plain_http), HTTPSOAPFacade(out_soap)
+            self._outgoing = Outgoing(out_ftp, out_amqp, out_zmq, out_jms_wmq, out_sql, out_plain_http, out_soap)
+
+        return self._outgoing
+
+    @property
+    def cloud(self):
+        if self._cloud is None:
+            self._cloud = Cloud()
+            self._cloud.openstack.swift = self.worker_store.worker_config.cloud_openstack_swift
+            self._cloud.aws.s3 = self.worker_store.worker_config.cloud_aws_s3
+
+        return self._cloud
+
+    @property
+    def email(self):
+        if self._email is None:
+            self._email = EMailAPI(self.worker_store.email_smtp_api, self.worker_store.email_imap_api)
+
+        return self._email
+
+    @property
+    def search(self):
+        if self._search is None:
+            self._search = SearchAPI(self.worker_store.search_es_api, self.worker_store.search_solr_api)
+
+        return self._search
+
+# ##############################################################################
+
 class Service(object):
     """ A base class for all services deployed on Zato servers, no matter
     the transport and protocol, be it plain HTTP, SOAP, WebSphere MQ or any other,
     regardless whether they're built-in or user-defined ones.
+
+    Services that set instance_pool_size to a positive number will have up to that many
+    of their instances kept by the service store and reused across invocations instead
+    of being created anew each time. Each such instance has its reset method called before
+    it's returned to the pool - subclasses which keep their own per-invocation state
+    in instance attributes must override it and call super(MyService, self).reset() too.
     """
     passthrough_to = ''
+    instance_pool_size = 0
 
     def __init__(self, *ignored_args, **ignored_kwargs):
         self.logger = logging.getLogger(self.get_name())
@@ -150,8 +217,11 @@ class Service(object):
         self.pubsub = None
         self.channel = None
         self.cid = None
-        self.outgoing = None
-        self.cloud = None
+        self._outgoing = None
+        self._cloud = None
+        self._email = None
+        self._search = None
+        self._msg = None
         self.worker_store = None
         self.odb = None
         self.data_format = None
@@ -179,6 +249,90 @@ class Service(object):
         self.has_validate_input = False
         self.has_validate_output = False
 
+    def reset(self):
+        """ Clears out all the per-invocation state so a pooled instance can be reused. Request and response
+        objects are always created anew because whoever invoked the service may still hold references to them.
+        """
+        self.channel = None
+        self.cid = None
+        self._outgoing = None
+        self._cloud = None
+        self._email = None
+        self._search = None
+        self._msg = None
+        self.data_format = None
+        self.transport = None
+        self.wsgi_environ = None
+        self.job_type = None
+        self.environ = {}
+        self.request = Request(self.logger)
+        self.response = Response(self.logger)
+        self.invocation_time = None
+        self.handle_return_time = None
+        self.processing_time_raw = None
+        self.processing_time = None
+        self.from_passthrough = False
+        self.passthrough_request = None
+
+        # Set on instance level by pass-through services
+        self.__dict__.pop('SimpleIO', None)
+
+# ##############################################################################
+
+    def _get_outgoing(self):
+        if self._outgoing is None:
+            self._outgoing = self.worker_store.worker_facades.outgoing
+        return self._outgoing
+
+    def _set_outgoing(self, value):
+        self._outgoing = value
+
+    outgoing = property(_get_outgoing, _set_outgoing)
+
+    def _get_cloud(self):
+        if self._cloud is None:
+            self._cloud = self.worker_store.worker_facades.cloud
+        return self._cloud
+
+    def _set_cloud(self, value):
+        self._cloud = value
+
+    cloud = property(_get_cloud, _set_cloud)
+
+    def _get_email(self):
+        if self._email is None:
+            self._email = self.worker_store.worker_facades.email
+        return self._email
+
+    def _set_email(self, value):
+        self._email = value
+
+    email = property(_get_email, _set_email)
+
+    def _get_search(self):
+        if self._search is None:
+            self._search = self.worker_store.worker_facades.search
+        return self._search
+
+    def _set_search(self, value):
+        self._search = value
+
+    search = property(_get_search, _set_search)
+
+    def _get_msg(self):
+        if self._msg is None:
+            self._msg = MessageFacade(self.worker_store.msg_ns_store,
+                self.worker_store.json_pointer_store, self.worker_store.xpath_store, self.worker_store.msg_ns_store,
+                self.request.payload, self.time)
+        return self._msg
+
+    def _set_msg(self, value):
+        self._msg = value
+
+    msg = property(_get_msg, _set_msg)
+
+# ##############################################################################
+
     @staticmethod
     def get_name_static(class_):
         return Service.get_name(class_)
@@ -227,32 +381,12 @@ class Service(object):
 
         self.slow_threshold = self.server.service_store.services[self.impl_name]['slow_threshold']
 
-        # Queues
-        out_amqp = PublisherFacade(self.broker_client, self.server.delivery_store)
-        out_jms_wmq = WMQFacade(self.broker_client, self.server.delivery_store)
-        out_zmq = ZMQFacade(self.broker_client, self.server.delivery_store)
-
-        # SQL
-        out_sql = self.worker_store.sql_pool_store
-
-        # Regular outconns
-        out_ftp, out_plain_http, out_soap = self.worker_store.worker_config.outgoing_connections()
-        self.outgoing = Outgoing(out_ftp, out_amqp, out_zmq, out_jms_wmq, out_sql, out_plain_http, out_soap)
-
-        # Cloud
-        self.cloud = Cloud()
-        self.cloud.openstack.swift = self.worker_store.worker_config.cloud_openstack_swift
-        self.cloud.aws.s3 = self.worker_store.worker_config.cloud_aws_s3
-
         # Cassandra
         self.cassandra_conn = self.worker_store.cassandra_api
         self.cassandra_query = self.worker_store.cassandra_query_api
 
-        # E-mail
-        self.email = EMailAPI(self.worker_store.email_smtp_api, self.worker_store.email_imap_api)
-
-        # Search
-        self.search = SearchAPI(self.worker_store.search_es_api, self.worker_store.search_solr_api)
+        # Note that self.outgoing, self.cloud, self.email, self.search and self.msg
+        # are not created here - they are built lazily on first access.
 
         is_sio = hasattr(self, 'SimpleIO')
         self.request.http.init(self.wsgi_environ)
@@ -261,10 +395,6 @@ class Service(object):
             self.request.init(is_sio, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ)
             self.response.init(self.cid, self.SimpleIO, self.data_format)
 
-        self.msg = MessageFacade(self.worker_store.msg_ns_store,
-            self.worker_store.json_pointer_store, self.worker_store.xpath_store, self.worker_store.msg_ns_store,
-            self.request.payload, self.time)
-
     def set_response_data(self, service, **kwargs):
         response = service.response.payload
         if not isinstance(response, (basestring, dict, list, tuple, EtreeElement, ObjectifiedElement)):
@@ -318,14 +448,34 @@ class Service(object):
                 channel_item=channel_item)
         else:
             service.validate_input()
-            service.handle()
+
+            # Invocations pay for profiling only if the service is being profiled, otherwise it's just this check
+            profiler = getattr(worker_store, 'profiler', None)
+            if profiler and profiler.is_active:
+                handle = partial(profiler.run, service.name, service.handle)
+            else:
+                handle = service.handle
+
+            # The hub monitor needs to know which service holds the hub, or blocks it, at any time
+            hub_monitor = getattr(worker_store, 'hub_monitor', None)
+            if hub_monitor and hub_monitor.is_running:
+                hub_monitor.run(service.name, handle)
+            else:
+                handle()
+
             service.validate_output()
 
         service.call_hooks('after')
         service.post_handle()
         service.call_hooks('finalize')
 
-        return set_response_func(service, data_format=data_format, transport=transport, **kwargs)
+        response = set_response_func(service, data_format=data_format, transport=transport, **kwargs)
+
+        # The instance is not needed anymore so it can be possibly reused
+        if service.instance_pool_size:
+            server.service_store.release_instance(service)
+
+        return response
 
     def invoke_by_impl_name(self, impl_name, payload='', channel=CHANNEL.INVOKE, data_format=DATA_FORMAT.DICT,
             transport=None, serialize=False, as_bunch=False, **kwargs):
@@ -478,6 +628,15 @@ class Service(object):
     def translate(self, *args, **kwargs):
         raise NotImplementedError('An initializer should override this method')
 
+    def translate_many(self, *args, **kwargs):
+        raise NotImplementedError('An initializer should override this method')
+
+    def invalidate_http_cache(self, channel_name=None):
+        """ Invalidates responses of an HTTP channel of a given name, or of all the channels if it's None, cached by
+        all the workers of all the servers in the cluster.
+        """
+        self.broker_client.publish({'action': CHANNEL_MSG.HTTP_SOAP_CACHE_INVALIDATE.value, 'name': channel_name})
+
     def handle(self):
         """ The only method Zato services need to implement in order to process
         incoming requests.
@@ -660,7 +819,8 @@ class Service(object):
         service.data_format = data_format
         service.wsgi_environ = wsgi_environ
         service.job_type = job_type
-        service.translate = server.kvdb.translate
+        service.translate = worker_store.translation_cache.translate
+        service.translate_many = worker_store.translation_cache.translate_many
         service.delivery_store = server.delivery_store
         service.user_config = server.user_config
 
@@ -12,7 +12,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from zato.common.broker_message import DEFINITION
 from zato.common.odb.model import CassandraConn
 from zato.common.odb.query import cassandra_conn_list
-from zato.server.service.internal import AdminService, ChangePasswordBase
+from zato.server.service import Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO, ChangePasswordBase
 from zato.server.service.meta import CreateEditMeta, DeleteMeta, GetListMeta
 
 elem = 'definition_cassandra'
@@ -47,4 +48,19 @@ class ChangePassword(ChangePasswordBase):
         def _auth(instance, password):
             instance.password = password
             
-        return self._handle(CassandraConn, _auth, DEFINITION.CASSANDRA_CHANGE_PASSWORD.value)
\ No newline at end of file
+        return self._handle(CassandraConn, _auth, DEFINITION.CASSANDRA_CHANGE_PASSWORD.value)
+
+class GetStatementList(AdminService):
+    """ Returns prepared statement cache hits and misses along with latencies, in milliseconds, of statements executed
+    through a given Cassandra connection, or through all of them, as seen by the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_definition_cassandra_get_statement_list_request'
+        response_elem = 'zato_definition_cassandra_get_statement_list_response'
+        input_optional = ('name',)
+        output_required = ('name', 'cql', Integer('hits'), Integer('misses'), Integer('calls'), Integer('statements'),
+            Integer('errors'), Float('latency_mean'), Float('latency_p50'), Float('latency_p99'), Float('latency_max'))
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.cassandra_api.get_statement_stats(self.request.input.get('name') or None)
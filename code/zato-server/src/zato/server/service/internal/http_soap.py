@@ -10,23 +10,30 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from contextlib import closing
+from datetime import datetime, timedelta
 from json import dumps
 from traceback import format_exc
 
+# dateutil
+from dateutil.parser import parse
+
 # Paste
 from paste.util.converters import asbool
 
+# SQLAlchemy
+from sqlalchemy import exists, func
+
 # WebHelpers
 from webhelpers.paginate import Page
 
 # Zato
-from zato.common import BATCH_DEFAULTS, DEFAULT_HTTP_PING_METHOD, DEFAULT_HTTP_POOL_SIZE, HTTP_SOAP_SERIALIZATION_TYPE, \
+from zato.common import AUDIT_LOG, BATCH_DEFAULTS, DEFAULT_HTTP_PING_METHOD, DEFAULT_HTTP_POOL_SIZE, HTTP_SOAP_SERIALIZATION_TYPE, \
      MISC, MSG_PATTERN_TYPE, PARAMS_PRIORITY, SEC_DEF_TYPE, URL_PARAMS_PRIORITY, URL_TYPE, ZatoException, ZATO_NONE
 from zato.common.broker_message import CHANNEL, OUTGOING
 from zato.common.odb.model import Cluster, JSONPointer, HTTPSOAP, HTTSOAPAudit, HTTSOAPAuditReplacePatternsJSONPointer, \
-     HTTSOAPAuditReplacePatternsXPath, SecurityBase, Service, to_json, XPath
+     HTTSOAPAuditReplacePatternsXPath, HTTSOAPAuditToken, SecurityBase, Service, to_json, XPath
 from zato.common.odb.query import http_soap_audit_item, http_soap_audit_item_list, http_soap_list
-from zato.server.service import Boolean, Integer, List
+from zato.server.service import Boolean, Float, Integer, List
 from zato.server.service.internal import AdminService, AdminSIO
 
 class _HTTPSOAPService(object):
@@ -80,7 +87,8 @@ class GetList(AdminService):
         output_optional = ('service_id', 'service_name', 'security_id', 'security_name', 'sec_type', 
                            'method', 'soap_action', 'soap_version', 'data_format', 'host', 'ping_method',
                            'pool_size', 'merge_url_params_req', 'url_params_pri', 'params_pri', 'serialization_type',
-                           'timeout')
+                           'timeout', 'needs_streaming', 'max_body_size', 'cache_ttl', 'cache_query_params', 'cache_headers',
+                           'rate_limit', 'rate_limit_period', 'rate_limit_per_client')
         output_repeated = True
         
     def get_data(self, session):
@@ -101,7 +109,9 @@ class Create(AdminService, _HTTPSOAPService):
         input_required = ('cluster_id', 'name', 'is_active', 'connection', 'transport', 'is_internal', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format',
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout')
+            'serialization_type', 'timeout', Boolean('needs_streaming'), Integer('max_body_size'), Integer('cache_ttl'),
+            'cache_query_params', 'cache_headers', Integer('rate_limit'), Integer('rate_limit_period'),
+            Boolean('rate_limit_per_client'))
         output_required = ('id', 'name')
     
     def handle(self):
@@ -164,6 +174,14 @@ class Create(AdminService, _HTTPSOAPService):
                 item.params_pri = input.get('params_pri') or PARAMS_PRIORITY.DEFAULT
                 item.serialization_type = input.get('serialization_type') or HTTP_SOAP_SERIALIZATION_TYPE.DEFAULT.id
                 item.timeout = input.get('timeout') or MISC.DEFAULT_HTTP_TIMEOUT
+                item.needs_streaming = input.get('needs_streaming') or False
+                item.max_body_size = input.get('max_body_size') or None
+                item.cache_ttl = input.get('cache_ttl') or None
+                item.cache_query_params = input.get('cache_query_params') or None
+                item.cache_headers = input.get('cache_headers') or None
+                item.rate_limit = input.get('rate_limit') or None
+                item.rate_limit_period = input.get('rate_limit_period') or None
+                item.rate_limit_per_client = input.get('rate_limit_per_client') or False
 
                 session.add(item)
                 session.commit()
@@ -172,6 +190,14 @@ class Create(AdminService, _HTTPSOAPService):
                     input.impl_name = service.impl_name
                     input.service_id = service.id
                     input.service_name = service.name
+                    input.needs_streaming = item.needs_streaming
+                    input.max_body_size = item.max_body_size
+                    input.cache_ttl = item.cache_ttl
+                    input.cache_query_params = item.cache_query_params
+                    input.cache_headers = item.cache_headers
+                    input.rate_limit = item.rate_limit
+                    input.rate_limit_period = item.rate_limit_period
+                    input.rate_limit_per_client = item.rate_limit_per_client
 
                 input.id = item.id
                 input.update(sec_info)
@@ -201,7 +227,9 @@ class Edit(AdminService, _HTTPSOAPService):
         input_required = ('id', 'cluster_id', 'name', 'is_active', 'connection', 'transport', 'url_path')
         input_optional = ('service', 'security_id', 'method', 'soap_action', 'soap_version', 'data_format', 
             'host', 'ping_method', 'pool_size', Boolean('merge_url_params_req'), 'url_params_pri', 'params_pri',
-            'serialization_type', 'timeout')
+            'serialization_type', 'timeout', Boolean('needs_streaming'), Integer('max_body_size'), Integer('cache_ttl'),
+            'cache_query_params', 'cache_headers', Integer('rate_limit'), Integer('rate_limit_period'),
+            Boolean('rate_limit_per_client'))
         output_required = ('id', 'name')
     
     def handle(self):
@@ -266,6 +294,14 @@ class Edit(AdminService, _HTTPSOAPService):
                 item.params_pri = input.get('params_pri') or PARAMS_PRIORITY.DEFAULT
                 item.serialization_type = input.get('serialization_type') or HTTP_SOAP_SERIALIZATION_TYPE.DEFAULT.id
                 item.timeout = input.get('timeout') or MISC.DEFAULT_HTTP_TIMEOUT
+                item.needs_streaming = input.get('needs_streaming') or False
+                item.max_body_size = input.get('max_body_size') or None
+                item.cache_ttl = input.get('cache_ttl') or None
+                item.cache_query_params = input.get('cache_query_params') or None
+                item.cache_headers = input.get('cache_headers') or None
+                item.rate_limit = input.get('rate_limit') or None
+                item.rate_limit_period = input.get('rate_limit_period') or None
+                item.rate_limit_per_client = input.get('rate_limit_per_client') or False
 
                 session.add(item)
                 session.commit()
@@ -277,6 +313,14 @@ class Edit(AdminService, _HTTPSOAPService):
                     input.merge_url_params_req = item.merge_url_params_req
                     input.url_params_pri = item.url_params_pri
                     input.params_pri = item.params_pri
+                    input.needs_streaming = item.needs_streaming
+                    input.max_body_size = item.max_body_size
+                    input.cache_ttl = item.cache_ttl
+                    input.cache_query_params = item.cache_query_params
+                    input.cache_headers = item.cache_headers
+                    input.rate_limit = item.rate_limit
+                    input.rate_limit_period = item.rate_limit_period
+                    input.rate_limit_per_client = item.rate_limit_per_client
                 else:
                     input.ping_method = item.ping_method
                     input.pool_size = item.pool_size
@@ -376,6 +420,34 @@ class ReloadWSDL(AdminService, _HTTPSOAPService):
         action = OUTGOING.HTTP_SOAP_CREATE_EDIT.value
         self.notify_worker_threads(fields, action)
 
+class InvalidateCache(AdminService):
+    """ Invalidates cached responses of a given HTTP channel or of all the channels if no name is given, in all the workers.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_http_soap_invalidate_cache_request'
+        response_elem = 'zato_http_soap_invalidate_cache_response'
+        input_optional = ('name',)
+
+    def handle(self):
+        self.invalidate_http_cache(self.request.input.get('name') or None)
+
+class GetCacheStats(AdminService):
+    """ Returns statistics of cached responses of HTTP channels, as seen by the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_http_soap_get_cache_stats_request'
+        response_elem = 'zato_http_soap_get_cache_stats_response'
+        output_required = ('name', Integer('hits'), Integer('misses'), Float('hit_ratio'), Integer('not_modified'),
+            Integer('bytes_saved'), Integer('size'))
+        output_repeated = True
+
+    def handle(self):
+        stats = self.worker_store.request_dispatcher.response_cache.get_stats()
+
+        for name, item in sorted(stats.items()):
+            item.name = name
+            self.response.payload.append(item)
+
 class GetURLSecurity(AdminService):
     """ Returns a JSON document describing the security configuration of all
     Zato channels.
@@ -580,20 +652,38 @@ class _BaseAuditService(AdminService):
         
         return Page(q, page=current_batch, items_per_page=batch_size)
 
+    def get_keyset_page(self, session):
+        """ Returns up to batch_size items older than the one pointed to by last_req_time_utc and last_id or the newest
+        ones if these are not given. Unlike with get_page, the number of all matching items needn't be counted.
+        """
+        batch_size = min(self.request.input.get('batch_size') or BATCH_DEFAULTS.SIZE, BATCH_DEFAULTS.MAX_SIZE)
+        last_req_time = self.request.input.get('last_req_time_utc')
+
+        q = http_soap_audit_item_list(session, self.server.cluster_id, self.request.input.conn_id,
+            self.request.input.get('start'), self.request.input.get('stop'), self.request.input.get('query'), False,
+            parse(last_req_time) if last_req_time else None, self.request.input.get('last_id'))
+
+        return q.limit(batch_size).all()
+
 class GetAuditItemList(_BaseAuditService):
-    """ Returns a list of audit items for a particular HTTP/SOAP object.
+    """ Returns a list of audit items for a particular HTTP/SOAP object. If keyset_pagination is True, items are returned
+    in batches following the one whose last item's req_time_utc and id are given on input instead of by batch numbers.
     """
     class SimpleIO(AdminSIO):
         request_elem = 'zato_http_soap_get_audit_item_list_request'
         response_elem = 'zato_http_soap_get_audit_item_list_response'
         input_required = ('conn_id', )
-        input_optional = ('start', 'stop', Integer('current_batch'), Integer('batch_size'), 'query')
+        input_optional = ('start', 'stop', Integer('current_batch'), Integer('batch_size'), 'query',
+            Boolean('keyset_pagination'), 'last_req_time_utc', Integer('last_id'))
         output_required = ('id', 'cid', 'req_time_utc', 'remote_addr',)
         output_optional = ('resp_time_utc', 'user_token', 'invoke_ok', 'auth_ok', )
 
     def handle(self):
         with closing(self.odb.session()) as session:
-            self.response.payload[:] = self.get_page(session)
+            if self.request.input.get('keyset_pagination'):
+                self.response.payload[:] = self.get_keyset_page(session)
+            else:
+                self.response.payload[:] = self.get_page(session)
             
         for item in self.response.payload.zato_output:
             item.req_time_utc = item.req_time_utc.isoformat()
@@ -643,3 +733,102 @@ class GetAuditItem(_BaseAuditService):
             self.response.payload = item
 
 # ################################################################################################################################
+
+# ################################################################################################################################
+
+class PruneAuditLog(AdminService):
+    """ Deletes audit log entries older than retention_days, or than audit_back_log hours of the channel or outgoing
+    connection they belong to if that is shorter, along with words indexed for them. Entries are deleted one time window
+    of partition_hours at a time, each window in its own transaction, so the ODB never has to run a single DELETE
+    over millions of rows. If retention_days is 0, which is the default if it's not configured, nothing is deleted,
+    regardless of audit_back_log.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_http_soap_prune_audit_log_request'
+        response_elem = 'zato_http_soap_prune_audit_log_response'
+        input_optional = (Integer('retention_days'), Integer('partition_hours'))
+        output_required = (Integer('deleted'), Integer('deleted_tokens'))
+
+    def _get_oldest(self, session, conn_id=None):
+        q = session.query(func.min(HTTSOAPAudit.req_time)).\
+            filter(HTTSOAPAudit.cluster_id==self.server.cluster_id)
+
+        if conn_id:
+            q = q.filter(HTTSOAPAudit.conn_id==conn_id)
+
+        return q.scalar()
+
+    def _prune(self, session, cutoff, partition, conn_id=None):
+        """ Deletes entries older than cutoff, of a given connection only if conn_id is given, and returns how many
+        of them, and of the words indexed for them, have been deleted.
+        """
+        deleted = deleted_tokens = 0
+        oldest = self._get_oldest(session, conn_id)
+
+        while oldest and oldest < cutoff:
+            window_end = min(oldest + partition, cutoff)
+
+            q = session.query(HTTSOAPAudit).\
+                filter(HTTSOAPAudit.cluster_id==self.server.cluster_id).\
+                filter(HTTSOAPAudit.req_time < window_end)
+
+            if conn_id:
+                q = q.filter(HTTSOAPAudit.conn_id==conn_id)
+
+            deleted += q.delete(synchronize_session=False)
+
+            # Words of entries that are still kept, e.g. because they belong to other connections, are not deleted
+            deleted_tokens += session.query(HTTSOAPAuditToken).\
+                filter(HTTSOAPAuditToken.cluster_id==self.server.cluster_id).\
+                filter(HTTSOAPAuditToken.event_time < window_end).\
+                filter(~exists().where(HTTSOAPAudit.cid==HTTSOAPAuditToken.cid)).\
+                delete(synchronize_session=False)
+
+            session.commit()
+
+            # Looked up again rather than simply moved forward so that windows without any entries are skipped
+            oldest = self._get_oldest(session, conn_id)
+
+        return deleted, deleted_tokens
+
+    def handle(self):
+
+        # New in 2.0 hence optional
+        config = self.server.fs_server_config.get('audit_log', {})
+
+        retention_days = self.request.input.get('retention_days')
+        if retention_days in (None, ''):
+            retention_days = int(config.get('retention_days', AUDIT_LOG.RETENTION.DAYS))
+
+        partition_hours = self.request.input.get('partition_hours') or \
+            int(config.get('partition_hours', AUDIT_LOG.RETENTION.PARTITION_HOURS))
+
+        deleted = deleted_tokens = 0
+
+        if retention_days:
+            now = datetime.utcnow()
+            cutoff = now - timedelta(days=retention_days)
+            partition = timedelta(hours=partition_hours)
+
+            with closing(self.odb.session()) as session:
+                deleted, deleted_tokens = self._prune(session, cutoff, partition)
+
+                # Connections whose own audit_back_log, in hours, is shorter than the retention period
+                conns = session.query(HTTPSOAP.id, HTTPSOAP.audit_back_log).\
+                    filter(HTTPSOAP.cluster_id==self.server.cluster_id).\
+                    filter(HTTPSOAP.audit_back_log > 0).\
+                    filter(HTTPSOAP.audit_back_log < retention_days * 24).\
+                    all()
+
+                for conn_id, audit_back_log in conns:
+                    conn_deleted, conn_deleted_tokens = self._prune(
+                        session, now - timedelta(hours=audit_back_log), partition, conn_id)
+                    deleted += conn_deleted
+                    deleted_tokens += conn_deleted_tokens
+
+            if deleted:
+                self.logger.info('Deleted %s audit log entries and %s search tokens older than %s or audit_back_log',
+                    deleted, deleted_tokens, cutoff.isoformat())
+
+        self.response.payload.deleted = deleted
+        self.response.payload.deleted_tokens = deleted_tokens
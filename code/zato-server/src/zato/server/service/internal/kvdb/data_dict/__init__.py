@@ -8,6 +8,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # Zato
 from zato.common import KVDB, ZatoException
+from zato.common.broker_message import DATA_DICT
 from zato.common.util import multikeysort, translation_name
 from zato.server.service.internal import AdminService
 
@@ -16,6 +17,12 @@ class DataDictService(AdminService):
         super(DataDictService, self).__init__(*args, **kwargs)
         self._dict_items = []
         
+    def _on_translations_changed(self):
+        """ Bumps the version of translations and lets all the workers know they need to refresh their caches.
+        """
+        version = self.server.kvdb.conn.incr(KVDB.TRANSLATION_VERSION)
+        self.broker_client.publish({'action': DATA_DICT.TRANSLATION_CHANGED.value, 'version': version})
+
     def _name(self, system1, key1, value1, system2, key2):
         return translation_name(system1, key1, value1, system2, key2)
 
@@ -99,6 +99,8 @@ class Edit(_CreateEdit):
         response_elem = 'zato_kvdb_data_dict_dictionary_edit_response'
     
     def _handle(self, id):
+        needs_notify = False
+
         for item in self._get_translations():
             if item['id1'] == id or item['id2'] == id:
                 existing_name = self._name(item['system1'], item['key1'], item['value1'], item['system2'], item['key2'])
@@ -116,6 +118,11 @@ class Edit(_CreateEdit):
                 if item['id2'] == id:
                     self.server.kvdb.conn.hset(hash_name, 'value2', self.request.input.value)
 
+                needs_notify = True
+
+        if needs_notify:
+            self._on_translations_changed()
+
 class Delete(DataDictService):
     """ Deletes a dictionary entry by its ID.
     """
@@ -128,9 +135,15 @@ class Delete(DataDictService):
     def handle(self):
         id = str(self.request.input.id)
         self.server.kvdb.conn.hdel(KVDB.DICTIONARY_ITEM, id)
+        needs_notify = False
+
         for item in self._get_translations():
             if item['id1'] == id or item['id2'] == id:
                 self.server.kvdb.conn.delete(self._name(item['system1'], item['key1'], item['value1'], item['system2'], item['key2']))
+                needs_notify = True
+
+        if needs_notify:
+            self._on_translations_changed()
                 
         self.response.payload.id = self.request.input.id
         
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Zato
+from zato.common.broker_message import OUTGOING
+from zato.server.service import Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO
+
+class GetList(AdminService):
+    """ Returns state and counters of circuit breakers of outgoing connections, as seen by the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_outgoing_circuit_breaker_get_list_request'
+        response_elem = 'zato_outgoing_circuit_breaker_get_list_response'
+        output_required = ('conn_type', 'name', 'state', Integer('calls'), Integer('failures'), Integer('slow_calls'),
+            Integer('rejected_open'), Integer('rejected_concurrency'), Integer('opened'), Integer('in_progress'),
+            Float('error_rate'), Float('slow_call_rate'), Float('latency'))
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.circuit_breaker_store.get_stats()
+
+class Reset(AdminService):
+    """ Resets circuit breakers of outgoing connections of a given type and name, or of all the connections if neither
+    is given, in all the workers.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_outgoing_circuit_breaker_reset_request'
+        response_elem = 'zato_outgoing_circuit_breaker_reset_response'
+        input_optional = ('conn_type', 'name')
+
+    def handle(self):
+        self.broker_client.publish({'action': OUTGOING.CIRCUIT_BREAKER_RESET.value,
+            'conn_type': self.request.input.get('conn_type') or None, 'name': self.request.input.get('name') or None})
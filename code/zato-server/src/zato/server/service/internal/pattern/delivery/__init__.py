@@ -13,12 +13,12 @@ from hashlib import sha1, sha256
 from json import dumps, loads
 
 # Zato
-from zato.common import DATA_FORMAT, DELIVERY_STATE, INVOCATION_TARGET, KVDB
+from zato.common import DATA_FORMAT, DELIVERY_COUNTERS, DELIVERY_STATE, INVOCATION_TARGET, KVDB
+from zato.common.delivery import add_state_change, IN_PROGRESS_STATES
 from zato.common.odb.model import DeliveryDefinitionBase, DeliveryDefinitionOutconnWMQ
-from zato.common.odb.query import delivery_count_by_state, delivery_definition_list, \
-     delivery_history_list
+from zato.common.odb.query import delivery_definition_list, delivery_history_list
 from zato.common.util import dotted_getattr, validate_input_dict
-from zato.server.service import AsIs, Integer
+from zato.server.service import AsIs, Boolean, Integer
 from zato.server.service.internal import AdminService, AdminSIO
 
 dispatch_dict = {
@@ -69,13 +69,10 @@ class UpdateDeliveryCounters(AdminService):
         input_required = ('def_id', 'def_name')
         
     def handle(self):
-        counters = {}
-        with closing(self.odb.session()) as session:
-            for state, count in delivery_count_by_state(session, self.request.input.def_id):
-                counters[state] = count
+        counters = self.delivery_store.get_state_counts(self.request.input.def_id)
                 
         in_progress = 0 
-        for name in (DELIVERY_STATE.IN_PROGRESS_STARTED, DELIVERY_STATE.IN_PROGRESS_TARGET_FAILURE, DELIVERY_STATE.IN_PROGRESS_TARGET_OK):
+        for name in IN_PROGRESS_STATES:
             in_progress += counters.get(name, 0)
             
         self.delivery_store.update_counters(
@@ -107,14 +104,38 @@ class GetCounters(AdminService):
 
     def handle(self):
         counters = self.delivery_store.get_counters(self.request.input.def_name)
-        
-        counters['in_progress'] = counters['in-progress']
-        counters['in_doubt'] = counters['in-doubt']
-        
-        del counters['in-doubt']
-        del counters['in-progress']
-        
-        self.response.payload = counters
+
+        self.response.payload = {
+            'total': counters[DELIVERY_COUNTERS.TOTAL],
+            'in_progress': counters[DELIVERY_COUNTERS.IN_PROGRESS],
+            'in_doubt': counters[DELIVERY_COUNTERS.IN_DOUBT],
+            'confirmed': counters[DELIVERY_COUNTERS.CONFIRMED],
+            'failed': counters[DELIVERY_COUNTERS.FAILED],
+        }
+
+class ReconcileDeliveryCounters(AdminService):
+    """ Recomputes per-state counters of a delivery definition given on input from the deliveries themselves.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_pattern_delivery_reconcile_delivery_counters_request'
+        response_elem = 'zato_pattern_delivery_reconcile_delivery_counters_response'
+        input_required = ('def_id', 'def_name')
+
+    def handle(self):
+        fixed = self.delivery_store.reconcile_state_counts(self.request.input.def_id)
+        if fixed:
+            self.logger.warn('Reconciled counters of delivery definition `%s`, fixed:`%s`', self.request.input.def_name, fixed)
+
+class ReconcileCounters(AdminService):
+    """ Asynchronously invokes a service to reconcile counters for each delivery definition in the ODB.
+    """
+    def handle(self):
+        with closing(self.odb.session()) as session:
+            for d_def in delivery_definition_list(session, self.server.cluster_id):
+                self.invoke_async(
+                    ReconcileDeliveryCounters.get_name(),
+                    dumps({'def_id':d_def.id, 'def_name':d_def.name}),
+                    data_format=DATA_FORMAT.JSON)
 
 # ##############################################################################
 
@@ -231,13 +252,15 @@ class GetDetails(AdminService):
 # ##############################################################################
 
 class GetList(_Base):
-    """ Returns a batch of instances that are in the in-doubt state.
+    """ Returns a batch of instances that are in the in-doubt state. If keyset_pagination is True, instances are returned
+    in batches following the one whose last item's last_used_utc and task_id are given on input instead of by batch numbers.
     """
     class SimpleIO(AdminSIO):
         request_elem = 'zato_pattern_delivery_in_doubt_get_list_request'
         response_elem = 'zato_pattern_delivery_in_doubt_get_list_response'
         input_required = ('def_name', 'state')
-        input_optional = ('batch_size', 'current_batch', 'start', 'stop',)
+        input_optional = ('batch_size', 'current_batch', 'start', 'stop', Boolean('keyset_pagination'), 'last_used_utc',
+            AsIs('last_task_id'))
         output_required = ('def_name', 'target_type', AsIs('task_id'), 'creation_time_utc', 'last_used_utc', 
             'source_count', 'target_count', 'resubmit_count', 'retry_repeats', 'check_after', 'retry_seconds')
         output_repeated = True
@@ -264,6 +287,11 @@ class Delete(AdminService):
         with closing(self.odb.session()) as session:
             delivery = session.merge(self.delivery_store.get_delivery(self.request.input.task_id))
             session.delete(delivery)
+
+            changes = {}
+            add_state_change(changes, delivery.definition_id, delivery.state, None)
+            self.delivery_store.update_state_counts(session, changes)
+
             session.commit()
             
 # ##############################################################################
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime, timedelta
+from time import time
+
+# anyjson
+from anyjson import loads
+
+# dateutil
+from dateutil.parser import parse
+
+# Zato
+from zato.common import KVDB, PROFILER, ZatoException
+from zato.common.broker_message import SERVICE
+from zato.common.util import new_cid
+from zato.server.profiler import get_top_functions
+from zato.server.service import Boolean, Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO
+
+# ################################################################################################################################
+
+class BaseProfilerService(AdminService):
+    """ A base class for services managing profiling sessions.
+    """
+    def get_result_ttl(self):
+        return int(self.server.fs_server_config.get('sampling_profiler', {}).get('result_ttl', PROFILER.RESULT_TTL))
+
+    def get_session(self, session_id):
+        session = self.server.kvdb.conn.hgetall('{}{}'.format(KVDB.PROFILER_SESSION, session_id))
+        if not session:
+            raise ZatoException(self.cid, 'No such profiling session `{}`'.format(session_id))
+
+        return session
+
+# ################################################################################################################################
+
+class Start(BaseProfilerService):
+    """ Makes all the workers of all the servers in the cluster profile a given service for a given number of seconds.
+    Only sample_rate of its invocations, chosen at random, are profiled.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_start_request'
+        response_elem = 'zato_profiler_start_response'
+        input_required = ('service_name',)
+        input_optional = (Integer('duration'), Float('sample_rate'), Float('interval'))
+        output_required = ('session_id',)
+
+    def handle(self):
+        input = self.request.input
+
+        duration = input.duration or PROFILER.DURATION
+        sample_rate = PROFILER.SAMPLE_RATE if input.sample_rate in (None, '') else input.sample_rate
+        interval = PROFILER.INTERVAL if input.interval in (None, '') else input.interval
+
+        if input.service_name not in self.server.service_store.name_to_impl_name:
+            raise ZatoException(self.cid, 'No such service `{}`'.format(input.service_name))
+
+        if not 0 < duration <= PROFILER.MAX_DURATION:
+            raise ZatoException(self.cid, 'duration must be between 1 and {} seconds'.format(PROFILER.MAX_DURATION))
+
+        if not 0 < sample_rate <= 1:
+            raise ZatoException(self.cid, 'sample_rate must be greater than 0 and not greater than 1')
+
+        # Each sample is a signal delivered to the worker so too short intervals would keep it busy handling them only
+        if not PROFILER.MIN_INTERVAL <= interval <= PROFILER.MAX_INTERVAL:
+            raise ZatoException(self.cid, 'interval must be between {} and {} seconds'.format(
+                PROFILER.MIN_INTERVAL, PROFILER.MAX_INTERVAL))
+
+        session_id = new_cid()
+        session_key = '{}{}'.format(KVDB.PROFILER_SESSION, session_id)
+        result_ttl = self.get_result_ttl()
+        now = time()
+
+        with self.server.kvdb.conn.pipeline() as p:
+            p.hmset(session_key, {
+                'service_name': input.service_name,
+                'start': datetime.utcnow().isoformat(),
+                'duration': duration,
+                'sample_rate': sample_rate,
+                'interval': interval,
+            })
+            p.expire(session_key, result_ttl)
+
+            # Results of sessions older than that have already expired
+            p.zadd(KVDB.PROFILER_SESSIONS, now, session_id)
+            p.zremrangebyscore(KVDB.PROFILER_SESSIONS, '-inf', now - result_ttl)
+            p.execute()
+
+        self.broker_client.publish({'action':SERVICE.PROFILER_START.value, 'session_id':session_id,
+            'service_name':input.service_name, 'duration':duration, 'sample_rate':sample_rate, 'interval':interval})
+
+        self.response.payload.session_id = session_id
+
+class Stop(BaseProfilerService):
+    """ Stops a profiling session in all the workers before its time is up.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_stop_request'
+        response_elem = 'zato_profiler_stop_response'
+        input_required = ('session_id',)
+
+    def handle(self):
+        session_id = self.request.input.session_id
+        self.get_session(session_id)
+
+        self.server.kvdb.conn.hset('{}{}'.format(KVDB.PROFILER_SESSION, session_id), 'stop', datetime.utcnow().isoformat())
+        self.broker_client.publish({'action':SERVICE.PROFILER_STOP.value, 'session_id':session_id})
+
+# ################################################################################################################################
+
+class GetList(BaseProfilerService):
+    """ Returns the most recent profiling sessions, newest first.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_get_list_request'
+        response_elem = 'zato_profiler_get_list_response'
+        output_required = ('session_id', 'service_name', 'start', Integer('duration'), Float('sample_rate'),
+            Float('interval'), Boolean('is_active'))
+        output_optional = ('stop',)
+        output_repeated = True
+
+    def handle(self):
+        session_ids = self.server.kvdb.conn.zrevrange(KVDB.PROFILER_SESSIONS, 0, PROFILER.MAX_SESSIONS - 1)
+        now = datetime.utcnow()
+
+        with self.server.kvdb.conn.pipeline() as p:
+            for session_id in session_ids:
+                p.hgetall('{}{}'.format(KVDB.PROFILER_SESSION, session_id))
+            sessions = p.execute()
+
+        out = []
+
+        # Sessions whose results have already expired are skipped
+        for session_id, session in zip(session_ids, sessions):
+            if session:
+                session['session_id'] = session_id
+                session['is_active'] = not session.get('stop') and now < parse(session['start']) + timedelta(
+                    seconds=int(session['duration']))
+                out.append(session)
+
+        self.response.payload[:] = out
+
+# ################################################################################################################################
+
+class GetTopFunctions(BaseProfilerService):
+    """ Returns functions with the most samples in a given session, across all the workers. Self samples are the ones
+    a function itself was running in, or, for PROFILER.WAIT_FRAME, in which greenlets were waiting for I/O or other
+    greenlets. Total samples also include those of the functions it called.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_get_top_functions_request'
+        response_elem = 'zato_profiler_get_top_functions_response'
+        input_required = ('session_id',)
+        input_optional = (Integer('n'),)
+        output_required = ('name', Integer('self_samples'), Integer('total_samples'), Float('self_perc'),
+            Float('total_perc'))
+        output_repeated = True
+
+    def handle(self):
+        session_id = self.request.input.session_id
+        self.get_session(session_id)
+
+        stacks = self.server.kvdb.conn.hgetall('{}{}'.format(KVDB.PROFILER_STACKS, session_id))
+        stacks = dict((stack, int(count)) for stack, count in stacks.items())
+
+        self.response.payload[:] = get_top_functions(stacks, self.request.input.n or PROFILER.TOP_N)
+
+class GetStacks(BaseProfilerService):
+    """ Returns all the stacks sampled in a given session, across all the workers, one per line in the collapsed format
+    flame graph tools accept, i.e. 'service;outer.module:func;inner.module:func samples'.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_get_stacks_request'
+        response_elem = 'zato_profiler_get_stacks_response'
+        input_required = ('session_id',)
+        output_required = ('stacks', Integer('samples'))
+
+    def handle(self):
+        session_id = self.request.input.session_id
+        self.get_session(session_id)
+
+        stacks = self.server.kvdb.conn.hgetall('{}{}'.format(KVDB.PROFILER_STACKS, session_id))
+
+        self.response.payload.stacks = '\n'.join('{} {}'.format(stack, stacks[stack]) for stack in sorted(stacks))
+        self.response.payload.samples = sum(int(count) for count in stacks.values())
+
+class GetOverhead(BaseProfilerService):
+    """ Returns, for each worker, how many samples it took and what share of its time it spent on taking them. Mean times
+    of sampled and other invocations of the service in the same session are returned too, they can be compared
+    if sample_rate was lower than 1.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_profiler_get_overhead_request'
+        response_elem = 'zato_profiler_get_overhead_response'
+        input_required = ('session_id',)
+        output_required = ('worker_name', Boolean('is_active'), Integer('samples'), Float('elapsed'), Float('sampler_time'),
+            Float('overhead'), Integer('profiled_calls'), Float('profiled_mean'), Integer('unprofiled_calls'),
+            Float('unprofiled_mean'))
+        output_repeated = True
+
+    def handle(self):
+        session_id = self.request.input.session_id
+        self.get_session(session_id)
+
+        workers = self.server.kvdb.conn.hgetall('{}{}'.format(KVDB.PROFILER_WORKERS, session_id))
+        self.response.payload[:] = [loads(workers[name]) for name in sorted(workers)]
@@ -19,6 +19,7 @@ from bunch import Bunch
 # Zato
 from zato.common import ZatoException
 from zato.common.odb.model import Cluster, Server
+from zato.server.service import Float, Integer
 from zato.server.service.internal import AdminService, AdminSIO
 
 class ClusterWideSingletonKeepAlive(AdminService):
@@ -165,3 +166,17 @@ class Delete(AdminService):
                 self.logger.error(msg)
                 
                 raise
+
+class GetBrokerDispatchStats(AdminService):
+    """ Returns metrics of the pool broker messages are dispatched to in the worker this service is invoked in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_server_get_broker_dispatch_stats_request'
+        response_elem = 'zato_server_get_broker_dispatch_stats_response'
+        output_required = (Integer('size'), Integer('max_queue_size'), 'overload_policy', Integer('depth'),
+            Integer('depth_high'), Integer('depth_normal'), Integer('max_depth'), Integer('accepted'), Integer('dispatched'),
+            Integer('errors'), Integer('shed'), Integer('spilled'), Float('wait_time_avg'), Float('wait_time_max'),
+            Float('wait_time_last'))
+
+    def handle(self):
+        self.response.payload = self.broker_client.get_dispatch_stats()
@@ -29,11 +29,12 @@ from dateutil.rrule import MINUTELY, rrule, rruleset
 from scipy import stats as sp_stats
 
 # Zato
-from zato.common import KVDB, SECONDS_IN_DAY, StatsElem, ZatoException
+from zato.common import KVDB, SECONDS_IN_DAY, STATS_HISTOGRAM, StatsElem, ZatoException
 from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import get_tier, get_tiers, Histogram
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
@@ -58,16 +59,27 @@ class Delete(AdminService):
         self.broker_client.invoke_async(
             {'action':STATS.DELETE.value, 'start':self.request.input.start, 'stop':self.request.input.stop})
         
+class ApplyRetention(AdminService):
+    """ Sets TTLs on aggregated statistics stored before retention was enforced through TTLs, deleting those
+    which are already past their retention.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_apply_retention_request'
+        response_elem = 'zato_stats_apply_retention_response'
+
+    def handle(self):
+        self.broker_client.invoke_async({'action':STATS.APPLY_RETENTION.value})
+
 # ##############################################################################
 
 class BaseAggregatingService(AdminService):
     """ A base class for all services that process statistics into aggregated values.
     """
-    def aggregate_raw_times(self, key, service_name, max_batch_size=None):
+    def aggregate_raw_times(self, key, service_name, max_batch_size=None, histogram=None):
         """ Aggregates values from a list living under a given key. Returns its
         min, max, mean and an overall usage count. 'max_batch_size' controls how
         many items will be fetched from the list so it's possible to fetch less
-        items than its LLEN returns.
+        items than its LLEN returns. All the values are also recorded in 'histogram', if one is given.
         """
         key_len = self.server.kvdb.conn.llen(key)
         if max_batch_size:
@@ -82,6 +94,10 @@ class BaseAggregatingService(AdminService):
             
         times = [int(elem) for elem in self.server.kvdb.conn.lrange(key, 0, batch_size)]
 
+        if histogram is not None:
+            for elem in times:
+                histogram.record(elem)
+
         if times:
             mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
             max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
@@ -130,6 +146,11 @@ class BaseAggregatingService(AdminService):
                     stats[name].append(value)
                 elif name == 'min':
                     stats[name] = min(stats[name], value)
+
+            # Keys aggregated before histograms were introduced don't have any
+            if STATS_HISTOGRAM.FIELD in values:
+                stats.setdefault(STATS_HISTOGRAM.FIELD, Histogram()).merge(
+                    Histogram.from_string(values[STATS_HISTOGRAM.FIELD]))
                     
         for service_name, values in service_stats.items():
             values['mean'] = sp_stats.tmean(values['mean'])
@@ -167,9 +188,23 @@ class BaseAggregatingService(AdminService):
             aggr_key = '{}{}:{}'.format(key_prefix, service_name, key_suffix)
             for name in STATS_KEYS:
                 self.hset_aggr_key(aggr_key, name, values[name])
+
+            if values.get(STATS_HISTOGRAM.FIELD):
+                self.hset_aggr_key(aggr_key, STATS_HISTOGRAM.FIELD, values[STATS_HISTOGRAM.FIELD].to_string())
+
+            self.expire_aggr_key(aggr_key, key_prefix, key_suffix)
         
     def hset_aggr_key(self, aggr_key, hash_key, hash_value):
         self.server.kvdb.conn.hset(aggr_key, hash_key, hash_value)
+
+    def expire_aggr_key(self, aggr_key, key_prefix, key_suffix):
+        """ Makes an aggregated key expire once its tier's retention is over. Summaries belong to no tier and never expire.
+        """
+        tier = get_tiers(self.server.fs_server_config.get('stats', {})).get(key_prefix)
+        if tier:
+            ttl = tier.get_ttl(tier.parse_key(aggr_key))
+            if ttl is not None:
+                self.server.kvdb.conn.expire(aggr_key, max(ttl, 1))
         
 # ##############################################################################
         
@@ -230,13 +265,16 @@ class AggregateByMinute(BaseAggregatingService):
             service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
             
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            histogram = Histogram()
+            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name, histogram=histogram)
             
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
             self.hset_aggr_key(aggr_key, 'mean', batch_mean)
             self.hset_aggr_key(aggr_key, 'usage', batch_total)
             self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
+            self.hset_aggr_key(aggr_key, STATS_HISTOGRAM.FIELD, histogram.to_string())
+            self.expire_aggr_key(aggr_key, KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, key_suffix)
             
             # Raw per-minute statistics keys will expire by themselves, we don't need
             # to delete them manually.
@@ -286,7 +324,8 @@ class StatsReturningService(AdminService):
         input_optional = ('service_name', Integer('n'), 'n_type')
         output_optional = ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
             'min_resp_time', 'max_resp_time', 'all_services_usage', 'all_services_time',
-            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services')
+            'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services',
+            'p50_resp_time', 'p90_resp_time', 'p99_resp_time', 'p99_9_resp_time')
     
     stats_key_prefix = KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE
     
@@ -297,6 +336,14 @@ class StatsReturningService(AdminService):
             if all_services_stats[name]:
                 value = float('{:.2f}'.format(100.0 * getattr(stats_elem, name) / all_services_stats[name]))
                 setattr(stats_elem, '{}_perc_all_services'.format(name), value)
+
+    def set_percentiles(self, stats_elem):
+        """ Sets response time percentiles out of a histogram of all the periods a given stats_elem covers.
+        A bucket's highest value may be greater than any value actually recorded so percentiles never exceed the maximum.
+        """
+        if stats_elem.temp_histogram:
+            for percentile, name in STATS_HISTOGRAM.PERCENTILES:
+                setattr(stats_elem, name, min(stats_elem.temp_histogram.get_percentile(percentile), stats_elem.max_resp_time))
                 
     def yield_top_n(self, n, n_type, stats_elems):
         """ Yields top N services.
@@ -350,7 +397,15 @@ class StatsReturningService(AdminService):
             delta_seconds = delta.seconds
         
         if not suffixes:
-            suffixes = self.get_suffixes(start, stop)
+
+            # Statistics aggregated by minute can be read from the coarsest tier the interval allows for instead,
+            # e.g. a year from January to January means 12 per-month keys for each service rather than 525,600 per-minute ones.
+            if stats_key_prefix == KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE:
+                tier = get_tier(get_tiers(self.server.fs_server_config.get('stats', {})), start, stop)
+                stats_key_prefix = tier.prefix
+                suffixes = tier.get_suffixes(start, stop)
+            else:
+                suffixes = self.get_suffixes(start, stop)
         
         # We make several passes. First two passes are made over Redis keys, one gathers the services, if any at all,
         # and another one actually collects statistics for each service found. Next pass, a partly optional one,
@@ -366,6 +421,7 @@ class StatsReturningService(AdminService):
                 service_name = key.replace(stats_key_prefix, '').replace(':{}'.format(suffix), '')
             
                 stats_elem = StatsElem(service_name)
+                stats_elem.temp_histogram = Histogram()
                 stats_elems[service_name] = stats_elem
                 
                 # When building statistics, we can't expect there will be data for all the time
@@ -383,8 +439,13 @@ class StatsReturningService(AdminService):
                 
                 # We can convert all the values to floats here to ease with computing
                 # all the stuff and convert them still to integers later on, when necessary.
-                key_values = Bunch(
-                    ((name, float(value)) for (name, value) in self.server.kvdb.conn.hgetall(key).items()))
+                # The histogram is the only value that is not a number.
+                key_values = self.server.kvdb.conn.hgetall(key)
+                histogram = key_values.pop(STATS_HISTOGRAM.FIELD, None)
+                key_values = Bunch(((name, float(value)) for (name, value) in key_values.items()))
+
+                if histogram:
+                    stats_elem.temp_histogram.merge(Histogram.from_string(histogram))
                     
                 if key_values:
     
@@ -420,6 +481,7 @@ class StatsReturningService(AdminService):
             stats_elem.rate = float('{:.2f}'.format(sum(stats_elem.usage_trend_int) / delta_seconds))
             
             self.set_percent_of_all_services(all_services_stats, stats_elem)
+            self.set_percentiles(stats_elem)
 
             if needs_trends:
                 stats_elem.mean_trend = ','.join(str(elem) for elem in stats_elem.mean_trend_int)
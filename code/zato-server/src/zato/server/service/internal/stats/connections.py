@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Zato
+from zato.server.service import Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO
+
+class GetList(AdminService):
+    """ Returns latencies, in milliseconds, and pool utilisation of connections, as seen by the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_connections_get_list_request'
+        response_elem = 'zato_stats_connections_get_list_response'
+        input_optional = ('conn_type',)
+        output_required = ('conn_type', 'name', Integer('calls'), Integer('errors'), Integer('in_progress'),
+            Float('latency_mean'), Float('latency_p50'), Float('latency_p90'), Float('latency_p99'), Float('latency_max'),
+            'latency_buckets', Float('wait_mean'), Float('wait_p99'), Float('wait_max'), Integer('checked_out'),
+            Integer('checkouts'), Integer('exhausted'), Integer('connects'), Integer('disconnects'))
+        output_optional = (Integer('idle'),)
+        output_repeated = True
+
+    def handle(self):
+        conn_type = self.request.input.get('conn_type')
+
+        self.response.payload[:] = [item for item in self.worker_store.conn_metrics_store.get_stats()
+            if not conn_type or item.conn_type == conn_type]
+
+class Reset(AdminService):
+    """ Zeroes metrics of connections of a given type and name, or of all the connections if neither is given,
+    in the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_connections_reset_request'
+        response_elem = 'zato_stats_connections_reset_response'
+        input_optional = ('conn_type', 'name')
+
+    def handle(self):
+        self.worker_store.conn_metrics_store.reset(
+            self.request.input.get('conn_type') or None, self.request.input.get('name') or None)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Zato
+from zato.server.service import Boolean, Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO
+
+class GetLag(AdminService):
+    """ Returns statistics, in milliseconds, of how late the event loop of the worker this service runs in was.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_hub_monitor_get_lag_request'
+        response_elem = 'zato_stats_hub_monitor_get_lag_response'
+        output_required = ('worker_name', Boolean('is_running'), Float('interval'), Float('threshold'), 'since',
+            Integer('checks'), Integer('blocked'), Float('lag_mean'), Float('lag_p50'), Float('lag_p90'), Float('lag_p99'),
+            Float('lag_max'), 'lag_buckets')
+
+    def handle(self):
+        self.response.payload = self.worker_store.hub_monitor.get_lag_stats()
+
+class GetBlocks(AdminService):
+    """ Returns the most recent calls which blocked the event loop of the worker this service runs in, newest first.
+    Durations are in milliseconds.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_hub_monitor_get_blocks_request'
+        response_elem = 'zato_stats_hub_monitor_get_blocks_response'
+        output_required = ('timestamp', Float('duration'), 'stack')
+        output_optional = ('service_name',)
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.hub_monitor.get_blocks()
+
+class GetGreenlets(AdminService):
+    """ Returns counts of greenlets of the worker this service runs in, grouped by the functions they were spawned with
+    and the ones they are waiting in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_hub_monitor_get_greenlets_request'
+        response_elem = 'zato_stats_hub_monitor_get_greenlets_response'
+        output_required = ('func', 'waiting_in', Integer('count'))
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.hub_monitor.get_census()
+
+class GetHubTime(AdminService):
+    """ Returns for how long, in milliseconds, services held the event loop of the worker this service runs in,
+    i.e. ran without letting other greenlets run.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_hub_monitor_get_hub_time_request'
+        response_elem = 'zato_stats_hub_monitor_get_hub_time_response'
+        output_required = ('service_name', Integer('calls'), Float('hub_time'), Float('hub_time_mean'), Float('max_slice'))
+        output_repeated = True
+
+    def handle(self):
+        self.response.payload[:] = self.worker_store.hub_monitor.get_hub_time()
+
+class Reset(AdminService):
+    """ Zeroes lag and hub time statistics and forgets blocking calls of the worker this service runs in.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_hub_monitor_reset_request'
+        response_elem = 'zato_stats_hub_monitor_reset_response'
+
+    def handle(self):
+        self.worker_store.hub_monitor.reset()
@@ -30,10 +30,11 @@ from paodate import Date
 from scipy import stats as sp_stats
 
 # Zato
-from zato.common import KVDB, StatsElem, ZatoException
+from zato.common import KVDB, STATS_HISTOGRAM, StatsElem, ZatoException
 from zato.server.service import Integer, UTC
 from zato.server.service.internal.stats import BaseAggregatingService, STATS_KEYS, StatsReturningService, \
     stop_excluding_rrset
+from zato.server.stats import Histogram
 
 # ##############################################################################
 
@@ -191,6 +192,9 @@ class BaseSummarizingService(BaseAggregatingService):
                         stats[name].append(value)
                     elif name == 'min':
                         stats[name] = min(stats[name], value)
+
+                if STATS_HISTOGRAM.FIELD in values:
+                    stats.setdefault(STATS_HISTOGRAM.FIELD, Histogram()).merge(values[STATS_HISTOGRAM.FIELD])
                         
         for service_name, values in services.items():
             values['mean'] = round(sp_stats.tmean(values['mean']), 2)
@@ -568,6 +572,12 @@ class GetSummaryByRange(StatsReturningService, BaseSummarizingService):
                     # Fetch an existing elem or assign a new one
                     merged_stats_elem = merged_stats_elems.setdefault(stats_elem.service_name, StatsElem(stats_elem.service_name))
 
+                    # Histograms of all the slices are merged into one so percentiles are exact across the whole range
+                    if stats_elem.temp_histogram:
+                        if not merged_stats_elem.temp_histogram:
+                            merged_stats_elem.temp_histogram = Histogram()
+                        merged_stats_elem.temp_histogram.merge(stats_elem.temp_histogram)
+
                     # Total time spent by this service and its total usage
                     merged_stats_elem.time += stats_elem.time
                     merged_stats_elem.usage += stats_elem.usage
@@ -605,6 +615,8 @@ class GetSummaryByRange(StatsReturningService, BaseSummarizingService):
                     value.mean = round(value.temp_mean / value.temp_mean_count)
                     
                 self.set_percent_of_all_services(all_services_stats, value)
+
+            self.set_percentiles(value)
         
         if n:
             for stats_elem in self.yield_top_n(int(n), n_type, merged_stats_elems):
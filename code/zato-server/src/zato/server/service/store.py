@@ -16,6 +16,9 @@ from importlib import import_module
 from traceback import format_exc
 from uuid import uuid4
 
+# Bunch
+from bunch import Bunch
+
 # gevent
 from gevent.lock import RLock
 
@@ -62,6 +65,8 @@ class ServiceStore(InitializingObject):
         self.id_to_impl_name = {}
         self.name_to_impl_name = {}
         self.update_lock = RLock()
+        self.instance_pools = {} # impl_name -> idle instances of services that have instance_pool_size set
+        self.pending = None # If a list, services found are collected in it instead of being added to the ODB one by one
 
     def _invoke_hook(self, object_, hook_name):
         """ A utility method for invoking various service's hooks.
@@ -75,10 +80,34 @@ class ServiceStore(InitializingObject):
             logger.error(msg)
 
     def new_instance(self, class_name):
-        """ Returns a new instance of a service of the given impl name.
+        """ Returns an instance of a service of the given impl name - either a new one or, if the service
+        has opted in to instance pooling, a previously released one if there is any available.
         """
+        pool = self.instance_pools.get(class_name)
+        if pool:
+            return pool.pop()
+
         return self.services[class_name]['service_class']()
 
+    def release_instance(self, service):
+        """ Resets a service instance and returns it to its pool, unless the pool is already full or the service
+        has been redeployed in the meantime, in which case the instance is simply discarded.
+        """
+        impl_name = service.impl_name
+        service_info = self.services.get(impl_name)
+
+        if not service_info or service_info['service_class'] is not service.__class__:
+            return
+
+        pool = self.instance_pools.setdefault(impl_name, [])
+        if len(pool) < service.instance_pool_size:
+            try:
+                service.reset()
+            except Exception:
+                logger.warn('Could not reset service instance [%s], e:[%s]', impl_name, format_exc())
+            else:
+                pool.append(service)
+
     def new_instance_by_id(self, service_id):
         impl_name = self.id_to_impl_name[service_id]
         return self.new_instance(impl_name)
@@ -140,6 +169,66 @@ class ServiceStore(InitializingObject):
             else:
                 self.import_services_from_module(item_name, is_internal)
 
+    def _import_pending(self, items, base_dir):
+        """ Imports services from all the items given on input without adding them to the ODB.
+        Returns information about each of the services imported.
+        """
+        self.pending = []
+        try:
+            self.import_services_from_anywhere(items, base_dir)
+            return self.pending
+        finally:
+            self.pending = None
+
+    def _set_odb_info(self, impl_name, service_id, is_active, slow_threshold):
+        """ Stores ODB-related information about an already imported service.
+        """
+        self.services[impl_name]['is_active'] = is_active
+        self.services[impl_name]['slow_threshold'] = slow_threshold
+
+        self.id_to_impl_name[service_id] = impl_name
+        self.name_to_impl_name[self.services[impl_name]['name']] = impl_name
+
+    def import_services_in_bulk(self, items, base_dir):
+        """ Imports services from all the items given on input and adds them to the ODB in a single transaction.
+        Returns a catalogue of services - a dictionary of their names to lists of [id, is_active, slow_threshold] -
+        that other processes of the same server can use in import_services_from_catalogue.
+        """
+        pending = self._import_pending(items, base_dir)
+
+        # Many services may be defined in the same module
+        source_info = {}
+
+        for info in pending:
+            si = source_info.get(info.mod)
+            if not si:
+                si = source_info[info.mod] = self._get_source_code_info(info.mod)
+            info.source_info = si
+
+        catalogue = self.odb.add_services(pending)
+
+        with self.update_lock:
+            for info in pending:
+                self._set_odb_info(info.impl_name, *catalogue[info.name])
+
+        logger.info('Deployed %s services in bulk', len(catalogue))
+
+        return catalogue
+
+    def import_services_from_catalogue(self, items, base_dir, catalogue):
+        """ Imports services from all the items given on input and takes their ODB-related information
+        from a catalogue another process built in import_services_in_bulk. Only services that cannot be found
+        in the catalogue are added to the ODB, one by one.
+        """
+        for info in self._import_pending(items, base_dir):
+            with self.update_lock:
+                if info.name in catalogue:
+                    self._set_odb_info(info.impl_name, *catalogue[info.name])
+                else:
+                    service_id, is_active, slow_threshold = self.odb.add_service(info.name, info.impl_name,
+                        info.is_internal, info.deployment_time, info.details, self._get_source_code_info(info.mod))
+                    self._set_odb_info(info.impl_name, service_id, is_active, slow_threshold)
+
     def import_services_from_file(self, file_name, is_internal, base_dir):
         """ Imports all the services from the path to a file.
         """
@@ -246,16 +335,25 @@ class ServiceStore(InitializingObject):
                             self.services[impl_name]['deployment_info'] = depl_info
                             self.services[impl_name]['service_class'] = item
 
-                            si = self._get_source_code_info(mod)
-
-                            service_id, is_active, slow_threshold = self.odb.add_service(
-                                name, impl_name, is_internal, timestamp, dumps(str(depl_info)), si)
-
-                            self.services[impl_name]['is_active'] = is_active
-                            self.services[impl_name]['slow_threshold'] = slow_threshold
-
-                            self.id_to_impl_name[service_id] = impl_name
-                            self.name_to_impl_name[name] = impl_name
+                            # Any instances of a previous version of this service are useless now
+                            self.instance_pools.pop(impl_name, None)
+
+                            info = Bunch()
+                            info.name = name
+                            info.impl_name = impl_name
+                            info.is_internal = is_internal
+                            info.deployment_time = timestamp
+                            info.details = dumps(str(depl_info))
+                            info.mod = mod
+
+                            if self.pending is not None:
+                                self.pending.append(info)
+                            else:
+                                si = self._get_source_code_info(mod)
+                                service_id, is_active, slow_threshold = self.odb.add_service(
+                                    name, impl_name, is_internal, timestamp, info.details, si)
+
+                                self._set_odb_info(impl_name, service_id, is_active, slow_threshold)
 
                             logger.debug('Imported service:[{}]'.format(name))
 
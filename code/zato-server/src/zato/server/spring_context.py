@@ -74,6 +74,7 @@ class ZatoContext(PythonConfig):
             'zato.server.service.internal.notif',
             'zato.server.service.internal.notif.cloud.openstack.swift',
             'zato.server.service.internal.outgoing.amqp',
+            'zato.server.service.internal.outgoing.circuit_breaker',
             'zato.server.service.internal.outgoing.ftp',
             'zato.server.service.internal.outgoing.jms_wmq',
             'zato.server.service.internal.outgoing.sql',
@@ -100,9 +101,12 @@ class ZatoContext(PythonConfig):
             'zato.server.service.internal.security.tls.key_cert',
             'zato.server.service.internal.security.wss',
             'zato.server.service.internal.security.xpath',
+            'zato.server.service.internal.profiler',
             'zato.server.service.internal.server',
             'zato.server.service.internal.service',
             'zato.server.service.internal.stats',
+            'zato.server.service.internal.stats.connections',
+            'zato.server.service.internal.stats.hub_monitor',
             'zato.server.service.internal.stats.summary',
             'zato.server.service.internal.stats.trends',
         ]
@@ -236,4 +240,10 @@ class ZatoContext(PythonConfig):
 
             {'name': 'zato.pattern.delivery.dispatch-auto-resubmit', 'seconds':300,
              'service':'zato.pattern.delivery.dispatch-auto-resubmit'},
+
+            {'name': 'zato.pattern.delivery.reconcile-counters', 'minutes':1440,
+             'service':'zato.pattern.delivery.reconcile-counters'},
+
+            {'name': 'zato.http-soap.prune-audit-log', 'minutes':60,
+             'service':'zato.http-soap.prune-audit-log'},
         ]
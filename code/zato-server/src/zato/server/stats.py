@@ -10,26 +10,269 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from collections import OrderedDict
+from math import ceil
+from datetime import datetime, timedelta
+
+# Bunch
+from bunch import Bunch
 
 # dateutil
-from dateutil.rrule import MINUTELY, rrule
+from dateutil.relativedelta import relativedelta
+from dateutil.rrule import DAILY, HOURLY, MINUTELY, MONTHLY, rrule
 
 # Zato
-from zato.common import KVDB
+from zato.common import KVDB, STATS_HISTOGRAM, STATS_RETENTION
 
 logger = logging.getLogger(__name__)
-                
+
+# ################################################################################################################################
+
+class Histogram(object):
+    """ A log-linear histogram of response times, in ms. Times below 2 ** (sub_bucket_bits + 1) have a bucket each and
+    each power of two above that is split into 2 ** sub_bucket_bits equal buckets. All histograms share the same
+    buckets so merging them, e.g. per-minute ones into a per-hour one, is exact. Only non-empty buckets are kept.
+    """
+    def __init__(self, counts=None, sub_bucket_bits=STATS_HISTOGRAM.SUB_BUCKET_BITS):
+        self.counts = counts or {}
+        self.sub_bucket_bits = sub_bucket_bits
+
+    def __repr__(self):
+        return '<{} at {} count:[{}], buckets:[{}]>'.format(self.__class__.__name__, hex(id(self)), self.count, len(self.counts))
+
+    def __nonzero__(self):
+        return bool(self.counts)
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def get_index(self, value):
+        shift = max(int(value).bit_length() - self.sub_bucket_bits - 1, 0)
+        return (shift << self.sub_bucket_bits) + (int(value) >> shift)
+
+    def get_lower_bound(self, index):
+        """ Returns the lowest value a bucket of a given index holds.
+        """
+        shift = max((index >> self.sub_bucket_bits) - 1, 0)
+        return (index - (shift << self.sub_bucket_bits)) << shift
+
+    def get_upper_bound(self, index):
+        """ Returns the highest value a bucket of a given index holds.
+        """
+        return self.get_lower_bound(index + 1) - 1
+
+    def record(self, value, count=1):
+        index = self.get_index(max(value, 0))
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        return self
+
+    def get_percentile(self, percentile):
+        """ Returns the highest value of a bucket a given percentile of all values falls into, or 0 if there are none.
+        """
+        count = self.count
+        if not count:
+            return 0
+
+        rank = max(int(ceil(percentile / 100.0 * count)), 1)
+        seen = 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.get_upper_bound(index)
+
+    def to_string(self):
+        """ Serializes the histogram to a string of comma-separated index:count pairs of non-empty buckets.
+        """
+        return ','.join('{}:{}'.format(index, self.counts[index]) for index in sorted(self.counts))
+
+    @staticmethod
+    def from_string(value, sub_bucket_bits=STATS_HISTOGRAM.SUB_BUCKET_BITS):
+        counts = {}
+        for item in (value or '').split(','):
+            if item:
+                index, count = item.split(':')
+                counts[int(index)] = int(count)
+
+        return Histogram(counts, sub_bucket_bits)
+
+# ################################################################################################################################
+
+class Tier(object):
+    """ A level of aggregated statistics, each key of which holds statistics of a single service over a single period,
+    such as a minute or a month, the period's start being the key's suffix.
+    """
+    def __init__(self, name, prefix, suffix_format, freq, unit, floor_attrs, retention):
+        self.name = name
+        self.prefix = prefix
+        self.suffix_format = suffix_format
+        self.suffix_parts = suffix_format.count(':') + 1
+        self.freq = freq
+        self.unit = unit
+        self.floor_attrs = floor_attrs
+        self.retention = retention # In days, 0 means keys never expire
+
+    def __repr__(self):
+        return '<{} at {} name:[{}], retention:[{}]>'.format(self.__class__.__name__, hex(id(self)), self.name, self.retention)
+
+    def floor(self, dt):
+        """ Returns the start of a period a given datetime falls into.
+        """
+        return dt.replace(**self.floor_attrs)
+
+    def is_aligned(self, dt):
+        return dt == self.floor(dt)
+
+    def get_suffixes(self, start, stop):
+        """ Returns suffixes of keys of all the periods from start, inclusive, to stop, exclusive.
+        """
+        return [elem.strftime(self.suffix_format) for elem in rrule(self.freq, dtstart=start, until=stop) if elem != stop]
+
+    def parse_key(self, key):
+        """ Returns the start of a period a given key holds statistics of.
+        """
+        return datetime.strptime(':'.join(key.rsplit(':', self.suffix_parts)[1:]), self.suffix_format)
+
+    def get_ttl(self, period_start, now=None):
+        """ Returns in how many seconds statistics of a period starting at a given time should expire,
+        or None if they never should. Retention is counted from the period's end.
+        """
+        if not self.retention:
+            return None
+
+        expires_at = period_start + self.unit + timedelta(days=self.retention)
+        return int(((expires_at - (now or datetime.utcnow())).total_seconds()))
+
+# ################################################################################################################################
+
+def get_tiers(config=None):
+    """ Returns all the tiers of aggregated statistics, from the finest to the coarsest one, keyed by their key prefixes.
+    """
+    config = config or {}
+    tiers = OrderedDict()
+
+    for name, prefix, suffix_format, freq, unit, floor_attrs, default_retention in (
+        ('by_minute', KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, '%Y:%m:%d:%H:%M', MINUTELY, relativedelta(minutes=1),
+            {'second':0, 'microsecond':0}, STATS_RETENTION.BY_MINUTE),
+        ('by_hour', KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR, '%Y:%m:%d:%H', HOURLY, relativedelta(hours=1),
+            {'minute':0, 'second':0, 'microsecond':0}, STATS_RETENTION.BY_HOUR),
+        ('by_day', KVDB.SERVICE_TIME_AGGREGATED_BY_DAY, '%Y:%m:%d', DAILY, relativedelta(days=1),
+            {'hour':0, 'minute':0, 'second':0, 'microsecond':0}, STATS_RETENTION.BY_DAY),
+        ('by_month', KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH, '%Y:%m', MONTHLY, relativedelta(months=1),
+            {'day':1, 'hour':0, 'minute':0, 'second':0, 'microsecond':0}, STATS_RETENTION.BY_MONTH),
+        ):
+        retention = int(config.get('retention_{}'.format(name), default_retention))
+        tiers[prefix] = Tier(name, prefix, suffix_format, freq, unit, floor_attrs, retention)
+
+    return tiers
+
+def get_tier(tiers, start, stop, now=None):
+    """ Returns the coarsest tier statistics from start to stop can be read from without losing any precision, i.e. one
+    whose periods both start and stop are boundaries of and whose last period in the interval has surely been aggregated
+    already. The finest tier is returned if no coarser one fits.
+    """
+    tiers = tiers.values()
+    now = now or datetime.utcnow()
+    start, stop = start.replace(tzinfo=None), stop.replace(tzinfo=None)
+
+    for tier in reversed(tiers[1:]):
+
+        # Periods are aggregated only once they are over and the job doing it may not have run yet for the latest one
+        if tier.is_aligned(start) and tier.is_aligned(stop) and stop <= tier.floor(now) - tier.unit:
+            return tier
+
+    return tiers[0]
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
-    def __init__(self, conn):
+    def __init__(self, conn, config=None):
         self.conn = conn
-        
-    def delete(self, start, stop, interval):
-        with self.conn.pipeline() as p:
-            suffixes = (elem.strftime(':%Y:%m:%d:%H:%M') for elem in rrule(MINUTELY, dtstart=start, until=stop))
-            for suffix in suffixes:
-                for key in self.conn.keys('{}*{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, suffix)):
-                    p.delete(key)
-                    
-            p.execute()
+        self.tiers = get_tiers(config)
+        self.batch_size = STATS_RETENTION.SCAN_BATCH_SIZE
+
+    def _iter_keys(self, tier):
+        """ Yields lists of keys of a given tier along with starts of their periods. Keys are iterated over with SCAN
+        so Redis is never blocked for long no matter how many keys there are.
+        """
+        batch = []
+        cursor = 0
+
+        while True:
+
+            # The cursor is returned as a string, it's 0 once the whole keyspace has been iterated over
+            cursor, keys = self.conn.scan(cursor, match='{}*'.format(tier.prefix), count=self.batch_size)
+
+            for key in keys:
+                try:
+                    batch.append((key, tier.parse_key(key)))
+                except ValueError:
+                    logger.warn('Ignoring key `%s` whose suffix is not a `%s` period', key, tier.name)
+                    continue
+
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+
+            if not int(cursor):
+                break
+
+        if batch:
+            yield batch
+
+    def delete(self, start, stop):
+        """ Deletes statistics of all the periods which lie wholly between start and stop, in all the tiers,
+        with a single SCAN through each tier.
+        """
+        start = self.tiers.values()[0].floor(start.replace(tzinfo=None))
+        stop = stop.replace(tzinfo=None)
+        deleted = 0
+
+        for tier in self.tiers.values():
+            for batch in self._iter_keys(tier):
+                keys = [key for key, period_start in batch if start <= period_start and period_start + tier.unit <= stop +
+                    relativedelta(minutes=1)]
+
+                if keys:
+                    self.conn.delete(*keys)
+                    deleted += len(keys)
+
+        logger.info('Deleted %d statistics keys from `%s` to `%s`', deleted, start.isoformat(), stop.isoformat())
+
+        return deleted
+
+    def apply_retention(self, now=None):
+        """ Sets TTLs on keys of tiers whose statistics are to expire, deleting those which are already past
+        their retention. Needed for keys stored before TTLs were set on them at write time.
+        """
+        now = now or datetime.utcnow()
+        out = Bunch(expired=0, deleted=0)
+
+        for tier in self.tiers.values():
+            if not tier.retention:
+                continue
+
+            for batch in self._iter_keys(tier):
+                with self.conn.pipeline() as p:
+                    for key, period_start in batch:
+                        ttl = tier.get_ttl(period_start, now)
+                        if ttl > 0:
+                            p.expire(key, ttl)
+                            out.expired += 1
+                        else:
+                            p.delete(key)
+                            out.deleted += 1
+
+                    p.execute()
+
+        logger.info('Applied retention to statistics, expired:`%d`, deleted:`%d`', out.expired, out.deleted)
+
+        return out
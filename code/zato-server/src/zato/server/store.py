@@ -62,8 +62,11 @@ class BaseAPI(object):
 class BaseStore(object):
     """ A base class for connection/query stores.
     """
-    def __init__(self):
+    metrics_conn_type = None # Set by stores of connections whose usage is to be measured
+
+    def __init__(self, metrics_store=None):
         self.items = {}
+        self.metrics_store = metrics_store
 
         # gevent
         from gevent.lock import RLock
@@ -76,6 +79,12 @@ class BaseStore(object):
     def get(self, name):
         return self.items.get(name)
 
+    def get_metrics(self, name):
+        """ Returns metrics of a connection of a given name or None if they are not needed.
+        """
+        if self.metrics_store and self.metrics_conn_type:
+            return self.metrics_store.get(self.metrics_conn_type, name)
+
     def _create(self, name, config, **extra):
         """ Actually adds a new definition, must be called with self.lock held.
         """
@@ -134,6 +143,9 @@ class BaseStore(object):
         finally:
             del self.items[name]
 
+            if self.metrics_store and self.metrics_conn_type:
+                self.metrics_store.delete(self.metrics_conn_type, name)
+
     def delete(self, name):
         """ Deletes an existing connection.
         """
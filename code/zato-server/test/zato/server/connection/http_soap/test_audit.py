@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import AUDIT_LOG
+from zato.common.test import rand_string
+from zato.server.connection.http_soap.audit import AuditQueue
+
+# ################################################################################################################################
+
+class DummyODB(object):
+    def __init__(self, needs_error=False):
+        self.needs_error = needs_error
+        self.calls = []
+
+    def audit_set_http_soap_many(self, requests, responses, needs_tokens):
+        if self.needs_error:
+            raise Exception('Dummy error')
+        self.calls.append((requests, responses))
+
+# ################################################################################################################################
+
+class AuditQueueTestCase(TestCase):
+
+    def test_invalid_overflow_policy(self):
+        self.assertRaises(ValueError, AuditQueue, DummyODB(), overflow_policy=rand_string())
+
+    def test_requests_stored_before_responses(self):
+        odb = DummyODB()
+        queue = AuditQueue(odb)
+
+        cid1, cid2 = rand_string(), rand_string()
+
+        queue.put_request({'cid': cid1})
+        queue.put_response({'cid': cid1})
+        queue.put_request({'cid': cid2})
+        queue.put_response({'cid': cid2})
+
+        queue.stop()
+
+        eq_(len(odb.calls), 1)
+
+        requests, responses = odb.calls[0]
+        eq_(requests, [{'cid': cid1}, {'cid': cid2}])
+        eq_(responses, [{'cid': cid1}, {'cid': cid2}])
+
+        stats = queue.get_stats()
+        eq_(stats.enqueued, 4)
+        eq_(stats.stored, 4)
+        eq_(stats.batches, 1)
+        eq_(stats.depth, 0)
+
+    def test_stop_drains_in_batches(self):
+        odb = DummyODB()
+        queue = AuditQueue(odb, batch_size=2)
+
+        for x in range(5):
+            queue.put_request({'cid': rand_string()})
+
+        queue.stop()
+
+        eq_([len(requests) for requests, _ in odb.calls], [2, 2, 1])
+
+    def test_drop_when_full(self):
+        odb = DummyODB()
+        queue = AuditQueue(odb, max_size=2, overflow_policy=AUDIT_LOG.QUEUE.OVERFLOW_POLICY.DROP)
+
+        for x in range(3):
+            queue.put_request({'cid': rand_string()})
+
+        stats = queue.get_stats()
+        eq_(stats.enqueued, 2)
+        eq_(stats.dropped, 1)
+        eq_(stats.depth, 2)
+
+    def test_block_when_full_times_out(self):
+        odb = DummyODB()
+        queue = AuditQueue(odb, max_size=1, overflow_policy=AUDIT_LOG.QUEUE.OVERFLOW_POLICY.BLOCK, block_timeout=0.01)
+
+        queue.put_request({'cid': rand_string()})
+        queue.put_request({'cid': rand_string()})
+
+        stats = queue.get_stats()
+        eq_(stats.enqueued, 1)
+        eq_(stats.dropped, 1)
+
+    def test_errors_are_counted(self):
+        queue = AuditQueue(DummyODB(True))
+        queue.put_request({'cid': rand_string()})
+        queue.stop()
+
+        stats = queue.get_stats()
+        eq_(stats.errors, 1)
+        eq_(stats.stored, 0)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from email.utils import formatdate
+from time import time
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import SEC_DEF_TYPE, ZATO_NONE
+from zato.common.test import rand_string
+from zato.server.connection.http_soap.cache import get_headers, get_query_params, ResponseCache
+
+# ################################################################################################################################
+
+def get_channel_item(cache_ttl=10, cache_query_params='', cache_headers=''):
+    return Bunch(name=rand_string(), cache_ttl=cache_ttl, cache_query_params=get_query_params(cache_query_params),
+        cache_headers=get_headers(cache_headers))
+
+def get_wsgi_environ(method='GET', path_info='/foo', query_string='', **kwargs):
+    wsgi_environ = {'REQUEST_METHOD':method, 'PATH_INFO':path_info, 'QUERY_STRING':query_string}
+    wsgi_environ.update(kwargs)
+
+    return wsgi_environ
+
+def get_response(payload=None, status_code=200, headers=None):
+    return Bunch(payload=payload or rand_string(), status_code=status_code, content_type='text/plain',
+        headers=headers or {})
+
+no_sec = Bunch(sec_def=ZATO_NONE)
+
+# ################################################################################################################################
+
+class ResponseCacheTestCase(TestCase):
+
+    def test_get_headers(self):
+        eq_(get_headers(' Accept-Language, X-Foo '), ['HTTP_ACCEPT_LANGUAGE', 'HTTP_X_FOO'])
+        eq_(get_headers(None), [])
+
+    def test_not_cacheable(self):
+        cache = ResponseCache()
+
+        eq_(cache.get_key(get_channel_item(None), no_sec, get_wsgi_environ()), None)
+        eq_(cache.get_key(get_channel_item(), no_sec, get_wsgi_environ('POST')), None)
+        eq_(cache.get_key(get_channel_item(), Bunch(sec_def=Bunch(sec_type=SEC_DEF_TYPE.OAUTH)), get_wsgi_environ()), None)
+        eq_(ResponseCache(0).get_key(get_channel_item(), no_sec, get_wsgi_environ()), None)
+
+    def test_key_query_params_and_headers(self):
+        cache = ResponseCache()
+
+        channel_item = get_channel_item()
+        self.assertNotEqual(
+            cache.get_key(channel_item, no_sec, get_wsgi_environ(query_string='a=1&b=2')),
+            cache.get_key(channel_item, no_sec, get_wsgi_environ(query_string='a=1&b=3')))
+
+        channel_item = get_channel_item(cache_query_params='a', cache_headers='Accept-Language')
+        eq_(cache.get_key(channel_item, no_sec, get_wsgi_environ(query_string='a=1&b=2')),
+            cache.get_key(channel_item, no_sec, get_wsgi_environ(query_string='b=3&a=1')))
+
+        self.assertNotEqual(
+            cache.get_key(channel_item, no_sec, get_wsgi_environ(HTTP_ACCEPT_LANGUAGE='en')),
+            cache.get_key(channel_item, no_sec, get_wsgi_environ(HTTP_ACCEPT_LANGUAGE='de')))
+
+    def test_key_identity(self):
+        cache = ResponseCache()
+        channel_item = get_channel_item()
+        sec = Bunch(sec_def=Bunch(sec_type=SEC_DEF_TYPE.BASIC_AUTH, name=rand_string()))
+
+        self.assertNotEqual(
+            cache.get_key(channel_item, sec, get_wsgi_environ(HTTP_AUTHORIZATION=rand_string())),
+            cache.get_key(channel_item, sec, get_wsgi_environ(HTTP_AUTHORIZATION=rand_string())))
+
+    def test_set_get(self):
+        cache = ResponseCache()
+        name, key = rand_string(), rand_string()
+        response = get_response()
+
+        eq_(cache.get(name, key), None)
+
+        entry = cache.set(name, key, 10, response)
+        self.assertIs(cache.get(name, key), entry)
+        eq_(entry.payload, response.payload)
+
+        stats = cache.get_stats()[name]
+        eq_(stats.hits, 1)
+        eq_(stats.misses, 1)
+        eq_(stats.hit_ratio, 0.5)
+        eq_(stats.bytes_saved, len(response.payload))
+        eq_(stats.size, 1)
+
+    def test_expired(self):
+        cache = ResponseCache()
+        name, key = rand_string(), rand_string()
+
+        entry = cache.set(name, key, 10, get_response())
+        entry.expires = time() - 1
+
+        eq_(cache.get(name, key), None)
+
+    def test_not_stored(self):
+        cache = ResponseCache(max_item_size=5)
+        name = rand_string()
+
+        eq_(cache.set(name, rand_string(), 10, get_response(status_code=500)), None)
+        eq_(cache.set(name, rand_string(), 10, get_response('abc', headers={'Cache-Control':'no-store'})), None)
+        eq_(cache.set(name, rand_string(), 10, get_response('abcdef')), None)
+        eq_(cache.get_stats(), {})
+
+    def test_per_client_responses_not_stored(self):
+        cache = ResponseCache()
+        name = rand_string()
+
+        eq_(cache.set(name, rand_string(), 10, get_response(headers={'Set-Cookie':'session=123'})), None)
+        eq_(cache.set(name, rand_string(), 10, get_response(headers={'set-cookie':'session=123'})), None)
+        eq_(cache.set(name, rand_string(), 10, get_response(headers={'Cache-Control':'private, max-age=60'})), None)
+        eq_(cache.set(name, rand_string(), 10, get_response(headers={'cache-control':'No-Store'})), None)
+        eq_(len(cache.entries), 0)
+
+        entry = cache.set(name, rand_string(), 10, get_response(headers={'Cache-Control':'public', 'X-Foo':'bar'}))
+        eq_(entry.headers, {'Cache-Control':'public', 'X-Foo':'bar'})
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache(2)
+        name = rand_string()
+
+        cache.set(name, 'key1', 10, get_response())
+        cache.set(name, 'key2', 10, get_response())
+        cache.get(name, 'key1')
+        cache.set(name, 'key3', 10, get_response())
+
+        eq_(sorted(key for _, key in cache.entries), ['key1', 'key3'])
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        name1, name2 = rand_string(), rand_string()
+
+        cache.set(name1, rand_string(), 10, get_response())
+        cache.set(name2, rand_string(), 10, get_response())
+
+        cache.invalidate(name1)
+        eq_([name for name, _ in cache.entries], [name2])
+
+        cache.invalidate()
+        eq_(len(cache.entries), 0)
+
+    def test_not_modified(self):
+        entry = ResponseCache().set(rand_string(), rand_string(), 10, get_response())
+
+        self.assertTrue(entry.is_not_modified({'HTTP_IF_NONE_MATCH': '"abc", {}'.format(entry.etag)}))
+        self.assertFalse(entry.is_not_modified({'HTTP_IF_NONE_MATCH': '"abc"'}))
+
+        self.assertTrue(entry.is_not_modified({'HTTP_IF_MODIFIED_SINCE': formatdate(time() + 60, usegmt=True)}))
+        self.assertFalse(entry.is_not_modified({'HTTP_IF_MODIFIED_SINCE': formatdate(time() - 60, usegmt=True)}))
+
+        self.assertFalse(entry.is_not_modified({}))
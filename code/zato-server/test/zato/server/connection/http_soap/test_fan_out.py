@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import FAN_OUT
+from zato.common.test import rand_string
+from zato.server.connection.http_soap.fan_out import fan_out
+from zato.server.connection.http_soap.outgoing import HTTPSOAPFacade
+
+# ################################################################################################################################
+
+def get_call(response, sleep=0, needs_error=False):
+    def _call():
+        gevent.sleep(sleep)
+        if needs_error:
+            raise ValueError(response)
+        return response
+    return _call
+
+class DummyConn(object):
+    def __init__(self):
+        self.calls = []
+
+    def http_request(self, method, cid, data='', params=None, *args, **kwargs):
+        self.calls.append((method, cid, data, params, kwargs))
+        return method
+
+# ################################################################################################################################
+
+class FanOutTestCase(TestCase):
+
+    def test_all(self):
+        out = fan_out([get_call(1, 0.02), get_call(2), get_call(3, 0.01)])
+
+        eq_([result.response for result in out.results], [1, 2, 3])
+        eq_(out.ok_count, 3)
+        self.assertTrue(out.is_complete)
+
+    def test_all_with_errors(self):
+        out = fan_out([get_call(1, 0.01), get_call('abc', needs_error=True), get_call(3, 0.02)])
+
+        eq_([result.ok for result in out.results], [True, False, True])
+        eq_(out.results[1].exception.args, ('abc',))
+        eq_(out.results[2].response, 3)
+        self.assertFalse(out.is_complete)
+
+    def test_first(self):
+        out = fan_out([get_call(1, 1), get_call(2), get_call(3, 1)], mode=FAN_OUT.MODE.FIRST)
+
+        eq_(out.results[1].response, 2)
+        eq_([result.is_cancelled for result in out.results], [True, False, True])
+        self.assertTrue(out.is_complete)
+        self.assertTrue(out.time < 0.5)
+
+    def test_quorum(self):
+        out = fan_out([get_call(1), get_call(2, 1), get_call(3)], mode=FAN_OUT.MODE.QUORUM)
+
+        eq_(out.ok_count, 2)
+        self.assertTrue(out.results[1].is_cancelled)
+        self.assertTrue(out.is_complete)
+
+    def test_quorum_impossible(self):
+        out = fan_out([get_call(1, 1), get_call(2, needs_error=True), get_call(3, needs_error=True)],
+            mode=FAN_OUT.MODE.QUORUM)
+
+        self.assertTrue(out.results[0].is_cancelled)
+        self.assertFalse(out.is_complete)
+        self.assertTrue(out.time < 0.5)
+
+    def test_timeout(self):
+        out = fan_out([get_call(1), get_call(2, 1)], timeout=0.05)
+
+        eq_(out.results[0].response, 1)
+        self.assertTrue(out.results[1].is_cancelled)
+        self.assertFalse(out.is_complete)
+        self.assertTrue(out.time < 0.5)
+
+    def test_call_timeout(self):
+        out = fan_out([get_call(1), get_call(2, 1)], call_timeout=0.05)
+
+        self.assertTrue(out.results[1].is_timeout)
+        self.assertFalse(out.results[1].is_cancelled)
+        eq_(out.ok_count, 1)
+
+    def test_concurrency(self):
+        running = Bunch(current=0, max=0)
+
+        def _call():
+            running.current += 1
+            running.max = max(running.max, running.current)
+            gevent.sleep(0.01)
+            running.current -= 1
+
+        out = fan_out([_call] * 10, concurrency=3)
+
+        eq_(out.ok_count, 10)
+        eq_(running.max, 3)
+
+    def test_facade(self):
+        cid, name = rand_string(), rand_string()
+        conn = DummyConn()
+
+        facade = HTTPSOAPFacade({name: Bunch(conn=conn)})
+        out = facade.fan_out(cid, [{'name':name, 'method':'POST', 'data':'abc', 'timeout':5}, get_call(2)])
+
+        eq_([result.response for result in out.results], ['POST', 2])
+        eq_([result.name for result in out.results], [name, None])
+        eq_(conn.calls, [('POST', cid, 'abc', None, {'headers':{}, 'timeout':5})])
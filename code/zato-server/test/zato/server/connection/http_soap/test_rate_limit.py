@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB
+from zato.common.test import rand_string
+from zato.server.connection.http_soap.rate_limit import get_client, RateLimiter
+
+# ################################################################################################################################
+
+class DummyPipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def incrby(self, key, value):
+        self.commands.append(('incrby', key, value))
+
+    def expire(self, key, seconds):
+        self.commands.append(('expire', key, seconds))
+
+    def execute(self):
+        if self.conn.needs_error:
+            raise Exception('Dummy error')
+
+        self.conn.executed.append(self.commands)
+
+        results = []
+        for command, key, value in self.commands:
+            if command == 'incrby':
+                self.conn.counters[key] = self.conn.counters.get(key, 0) + value
+                results.append(self.conn.counters[key])
+            else:
+                results.append(True)
+
+        return results
+
+class DummyConn(object):
+    def __init__(self):
+        self.needs_error = False
+        self.counters = {}
+        self.executed = []
+
+    def pipeline(self):
+        return DummyPipeline(self)
+
+# ################################################################################################################################
+
+def get_channel_item(rate_limit=2, rate_limit_period=1, rate_limit_per_client=False):
+    return Bunch(name=rand_string(), rate_limit=rate_limit, rate_limit_period=rate_limit_period,
+        rate_limit_per_client=rate_limit_per_client)
+
+# ################################################################################################################################
+
+class RateLimiterTestCase(TestCase):
+
+    def test_no_limit(self):
+        limiter = RateLimiter()
+        channel_item = get_channel_item(None)
+
+        for x in range(10):
+            eq_(limiter.check(channel_item, {}), 0)
+
+        eq_(limiter.get_stats().buckets, 0)
+
+    def test_limit_exceeded(self):
+        limiter = RateLimiter()
+        channel_item = get_channel_item(2, 10)
+
+        eq_(limiter.check(channel_item, {}), 0)
+        eq_(limiter.check(channel_item, {}), 0)
+
+        retry_after = limiter.check(channel_item, {})
+        self.assertTrue(0 < retry_after <= 5)
+
+        stats = limiter.get_stats()
+        eq_(stats.allowed, 2)
+        eq_(stats.rejected, 1)
+
+    def test_tokens_refilled(self):
+        limiter = RateLimiter()
+        channel_item = get_channel_item(1, 10)
+
+        eq_(limiter.check(channel_item, {}), 0)
+        self.assertTrue(limiter.check(channel_item, {}))
+
+        bucket = limiter.buckets[(channel_item.name, None)]
+        bucket.last_refill -= 10
+
+        eq_(limiter.check(channel_item, {}), 0)
+
+    def test_per_client(self):
+        limiter = RateLimiter()
+        channel_item = get_channel_item(1, 10, True)
+
+        eq_(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1'}), 0)
+        eq_(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.2'}), 0)
+        self.assertTrue(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1'}))
+
+        # X-Forwarded-For is not trusted by default
+        self.assertTrue(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1', 'HTTP_X_FORWARDED_FOR':'10.0.0.3'}))
+
+    def test_trusted_proxies(self):
+        limiter = RateLimiter(trusted_proxies=1)
+        channel_item = get_channel_item(1, 10, True)
+
+        # The client's own address is the one appended by the proxy, anything before it may have been made up
+        eq_(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1', 'HTTP_X_FORWARDED_FOR':'10.0.0.2'}), 0)
+        self.assertTrue(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1', 'HTTP_X_FORWARDED_FOR':'10.0.0.3, 10.0.0.2'}))
+        eq_(limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1', 'HTTP_X_FORWARDED_FOR':'10.0.0.2, 10.0.0.3'}), 0)
+
+    def test_get_client(self):
+        environ = {'REMOTE_ADDR':'10.0.0.1', 'HTTP_X_FORWARDED_FOR':'10.0.0.4, 10.0.0.3 , 10.0.0.2'}
+
+        eq_(get_client(environ), '10.0.0.1')
+        eq_(get_client(environ, 1), '10.0.0.2')
+        eq_(get_client(environ, 2), '10.0.0.3')
+        eq_(get_client(environ, 5), '10.0.0.4')
+        eq_(get_client({'REMOTE_ADDR':'10.0.0.1'}, 1), '10.0.0.1')
+
+    def test_max_buckets(self):
+        limiter = RateLimiter(max_buckets=2)
+        channel_item = get_channel_item(1, 10, True)
+
+        limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1'})
+        limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.2'})
+
+        # 10.0.0.1 is now the most recently used one so it's the bucket of 10.0.0.2 that is deleted
+        limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.1'})
+        limiter.check(channel_item, {'REMOTE_ADDR':'10.0.0.3'})
+
+        eq_(sorted(client for _, client in limiter.buckets), ['10.0.0.1', '10.0.0.3'])
+
+        stats = limiter.get_stats()
+        eq_(stats.buckets, 2)
+        eq_(stats.evicted, 1)
+
+    def test_changed_limit(self):
+        limiter = RateLimiter()
+        channel_item = get_channel_item(1, 10)
+
+        eq_(limiter.check(channel_item, {}), 0)
+        self.assertTrue(limiter.check(channel_item, {}))
+
+        channel_item.rate_limit = 2
+        eq_(limiter.check(channel_item, {}), 0)
+
+    def test_sync_blocks_when_cluster_limit_reached(self):
+        conn = DummyConn()
+        limiter = RateLimiter(conn)
+        channel_item = get_channel_item(3, 60)
+
+        eq_(limiter.check(channel_item, {}), 0)
+
+        # Another worker has already used up the rest of the limit
+        limiter.sync()
+        key = conn.executed[0][0][1]
+        self.assertTrue(key.startswith(KVDB.RATE_LIMIT_PREFIX + channel_item.name))
+        conn.counters[key] += 2
+
+        eq_(limiter.check(channel_item, {}), 0)
+        limiter.sync()
+
+        self.assertTrue(limiter.check(channel_item, {}))
+        eq_(limiter.get_stats().syncs, 2)
+
+    def test_sync_error_keeps_usage(self):
+        conn = DummyConn()
+        conn.needs_error = True
+
+        limiter = RateLimiter(conn)
+        channel_item = get_channel_item(10, 60)
+
+        limiter.check(channel_item, {})
+        limiter.check(channel_item, {})
+        limiter.sync()
+
+        eq_(limiter.get_stats().sync_errors, 1)
+
+        conn.needs_error = False
+        limiter.sync()
+
+        eq_(conn.executed[0][0][2], 2)
+
+    def test_idle_buckets_deleted(self):
+        limiter = RateLimiter(idle_time=10)
+        channel_item = get_channel_item()
+
+        limiter.check(channel_item, {})
+        limiter.buckets[(channel_item.name, None)].last_used -= 20
+
+        limiter.sync()
+        eq_(limiter.get_stats().buckets, 0)
+
+    def test_invalidate(self):
+        limiter = RateLimiter()
+        channel_item1, channel_item2 = get_channel_item(), get_channel_item()
+
+        limiter.check(channel_item1, {})
+        limiter.check(channel_item2, {})
+        limiter.invalidate(channel_item1.name)
+
+        eq_(limiter.buckets.keys(), [(channel_item2.name, None)])
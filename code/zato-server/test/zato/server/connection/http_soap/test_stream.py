@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from cStringIO import StringIO
+from unittest import TestCase
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.test import rand_string
+from zato.server.connection.http_soap import RequestEntityTooLarge
+from zato.server.connection.http_soap.stream import read_body, RequestBody
+
+# ################################################################################################################################
+
+def get_wsgi_environ(body, content_length=None):
+    wsgi_environ = {'wsgi.input': StringIO(body)}
+    if content_length is not None:
+        wsgi_environ['CONTENT_LENGTH'] = str(content_length)
+
+    return wsgi_environ
+
+# ################################################################################################################################
+
+class ReadBodyTestCase(TestCase):
+
+    def test_no_limit(self):
+        body = rand_string() * 100
+        eq_(read_body(rand_string(), get_wsgi_environ(body)), body)
+
+    def test_content_length_exceeded(self):
+        self.assertRaises(RequestEntityTooLarge, read_body, rand_string(), get_wsgi_environ('a', 1000), 10)
+
+    def test_chunked_body_exceeded(self):
+        self.assertRaises(RequestEntityTooLarge, read_body, rand_string(), get_wsgi_environ('a' * 11), 10)
+        eq_(read_body(rand_string(), get_wsgi_environ('a' * 10), 10), 'a' * 10)
+
+# ################################################################################################################################
+
+class RequestBodyTestCase(TestCase):
+
+    def test_small_body_kept_in_memory(self):
+        body = RequestBody.from_wsgi(rand_string(), get_wsgi_environ('abc'), spill_threshold=10, chunk_size=2)
+        self.assertFalse(body.is_spilled)
+        eq_(body.size, 3)
+        eq_(body.read(), 'abc')
+        eq_(body.getvalue(), 'abc')
+
+    def test_large_body_spilled(self):
+        data = 'a' * 100
+        body = RequestBody.from_wsgi(rand_string(), get_wsgi_environ(data), spill_threshold=10, chunk_size=7)
+        self.assertTrue(body.is_spilled)
+        eq_(body.size, 100)
+        eq_(body.read(), data)
+        body.close()
+
+    def test_max_body_size(self):
+        self.assertRaises(RequestEntityTooLarge, RequestBody.from_wsgi, rand_string(), get_wsgi_environ('a' * 11), 10,
+            chunk_size=3)
+
+    def test_iter_json_lines(self):
+        body = RequestBody(rand_string(), StringIO('{"a":1}\n\n{"b":2}\n'))
+        eq_(list(body.iter_json_lines()), [{'a':1}, {'b':2}])
+
+    def test_iterparse(self):
+        body = RequestBody(rand_string(), StringIO(b'<root><item>1</item><item>2</item></root>'))
+        eq_([elem.text for _, elem in body.iterparse(tag='item')], ['1', '2'])
@@ -9,6 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from hashlib import sha256
 from unittest import TestCase
 from uuid import uuid4
 
@@ -22,7 +23,7 @@ from nose.tools import eq_
 from parse import compile as parse_compile, Parser, Result
 
 # Zato
-from zato.common import DATA_FORMAT, MISC, URL_TYPE, ZATO_NONE
+from zato.common import DATA_FORMAT, MISC, SEC_DEF_TYPE, URL_TYPE, ZATO_NONE
 from zato.common.test import rand_string
 from zato.common.util import new_cid, payload_from_request
 from zato.server.connection.http_soap import Unauthorized, url_data
@@ -1321,12 +1322,21 @@ class URLDataTestCase(TestCase):
                 'merge_url_params_req', 'url_params_pri', 'params_pri'):
                 eq_(msg[name], channel_item[name])
 
+            eq_(channel_item.needs_streaming, False)
+            eq_(channel_item.max_body_size, None)
+            eq_(channel_item.cache_ttl, None)
+            eq_(channel_item.cache_query_params, [])
+            eq_(channel_item.cache_headers, [])
+            eq_(channel_item.rate_limit, None)
+            eq_(channel_item.rate_limit_period, None)
+            eq_(channel_item.rate_limit_per_client, False)
+
             if needs_security_id:
-                eq_(len(channel_item.keys()), 31)
+                eq_(len(channel_item.keys()), 39)
                 for name in('sec_type', 'security_id', 'security_name'):
                     eq_(msg[name], channel_item[name])
             else:
-                eq_(len(channel_item.keys()), 28)
+                eq_(len(channel_item.keys()), 36)
 
         for needs_security_id in(True, False):
             msg = get_msg(needs_security_id)
@@ -1496,3 +1506,120 @@ class URLDataTestCase(TestCase):
         eq_(dummy_lock.enter_called, True)
 
 # ################################################################################################################################
+
+    def test_handle_security_tech_acc_cached(self):
+
+        salt, password = uuid4().hex, uuid4().hex
+
+        sec_def = Bunch()
+        sec_def.name = uuid4().hex
+        sec_def.salt = salt
+        sec_def.password = sha256(password + ':' + salt).hexdigest()
+
+        wsgi_environ = {'HTTP_X_ZATO_USER': sec_def.name, 'HTTP_X_ZATO_PASSWORD': password}
+
+        ud = url_data.URLData(url_sec={})
+
+        for x in range(3):
+            eq_(ud._handle_security_tech_acc(new_cid(), sec_def, None, None, wsgi_environ), sec_def.name)
+
+        stats = ud.credentials_cache.get_stats()
+        eq_(stats.misses, 1)
+        eq_(stats.hits, 2)
+        eq_(stats.size, 1)
+
+        # Neither the password presented nor the expected one is kept in plain text
+        key = list(ud.credentials_cache.entries)[0]
+        eq_(key[:2], (SEC_DEF_TYPE.TECH_ACCOUNT, sec_def.name))
+        self.assertNotIn(password, key)
+        self.assertNotIn(sec_def.password, key)
+
+        # A different password must be checked in full
+        wsgi_environ['HTTP_X_ZATO_PASSWORD'] = uuid4().hex
+        self.assertRaises(Unauthorized, ud._handle_security_tech_acc, new_cid(), sec_def, None, None, wsgi_environ)
+
+        # Editing the definition invalidates its entries
+        msg = Bunch()
+        msg.name = sec_def.name
+        ud._update_url_sec(msg, SEC_DEF_TYPE.TECH_ACCOUNT)
+        eq_(ud.credentials_cache.get_stats().size, 0)
+
+    def test_oauth_lookup_by_username(self):
+
+        name, username, password = uuid4().hex, uuid4().hex, uuid4().hex
+
+        ud = url_data.URLData(url_sec={}, oauth_config={})
+        ud._update_oauth(name, Bunch(username=username, password=password))
+
+        consumer = ud.lookup_consumer(username)
+        eq_(consumer.key, username)
+        eq_(consumer.secret, password)
+
+        msg = Bunch(name=name)
+        ud._delete_channel_data = Dummy_delete_channel_data()
+        ud.on_broker_msg_SECURITY_OAUTH_DELETE(msg)
+
+        self.assertIsNone(ud.lookup_consumer(username))
+
+# ################################################################################################################################
+
+class CredentialsCacheTestCase(TestCase):
+
+    def test_lru_eviction(self):
+        cache = url_data.CredentialsCache(max_size=2)
+        key1, key2, key3 = (rand_string(),), (rand_string(),), (rand_string(),)
+
+        cache.add(key1)
+        cache.add(key2)
+
+        # key1 is now the most recently used one so it's key2 that is evicted
+        self.assertTrue(cache.has(key1))
+        cache.add(key3)
+
+        self.assertTrue(cache.has(key1))
+        self.assertFalse(cache.has(key2))
+        self.assertTrue(cache.has(key3))
+        eq_(cache.get_stats().evicted, 1)
+
+    def test_ttl(self):
+        cache = url_data.CredentialsCache(ttl=-1)
+        key = (rand_string(),)
+
+        cache.add(key)
+        self.assertFalse(cache.has(key))
+
+    def test_disabled(self):
+        cache = url_data.CredentialsCache(max_size=0)
+        key = (rand_string(),)
+
+        cache.add(key)
+        self.assertFalse(cache.has(key))
+        eq_(cache.get_stats().size, 0)
+
+    def test_invalidate(self):
+        cache = url_data.CredentialsCache()
+        name1, name2 = rand_string(), rand_string()
+
+        cache.add((SEC_DEF_TYPE.BASIC_AUTH, name1, rand_string()))
+        cache.add((SEC_DEF_TYPE.BASIC_AUTH, name1, rand_string()))
+        cache.add((SEC_DEF_TYPE.BASIC_AUTH, name2, rand_string()))
+        cache.add((SEC_DEF_TYPE.TECH_ACCOUNT, name1, rand_string()))
+
+        cache.invalidate(SEC_DEF_TYPE.BASIC_AUTH, name1)
+
+        eq_(sorted(key[:2] for key in cache.entries), sorted([
+            (SEC_DEF_TYPE.BASIC_AUTH, name2), (SEC_DEF_TYPE.TECH_ACCOUNT, name1)]))
+
+    def test_get_credentials_key(self):
+        name, username, password = rand_string(), rand_string(), rand_string()
+
+        key = url_data.get_credentials_key(SEC_DEF_TYPE.BASIC_AUTH, name, username, password, None)
+
+        eq_(key[:2], (SEC_DEF_TYPE.BASIC_AUTH, name))
+        eq_(key, url_data.get_credentials_key(SEC_DEF_TYPE.BASIC_AUTH, name, username, password, None))
+        self.assertNotIn(password, key[2])
+
+        # Credentials are told apart even if they join to the same string
+        self.assertNotEqual(
+            url_data.get_credentials_key(SEC_DEF_TYPE.BASIC_AUTH, name, 'ab', 'c'),
+            url_data.get_credentials_key(SEC_DEF_TYPE.BASIC_AUTH, name, 'a', 'bc'))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import HTTP_SOAP_SERIALIZATION_TYPE, SEC_DEF_TYPE
+from zato.common.test import rand_int, rand_string
+from zato.server.connection.http_soap.outgoing import SudsSOAPWrapper
+from zato.server.connection.http_soap.wsdl import WSDLCache
+
+# ################################################################################################################################
+
+WSDL = b"""<?xml version="1.0" encoding="UTF-8"?>
+<definitions name="Dummy" targetNamespace="urn:dummy" xmlns:tns="urn:dummy"
+    xmlns="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <message name="PingRequest"><part name="data" type="xsd:string"/></message>
+  <message name="PingResponse"><part name="data" type="xsd:string"/></message>
+  <portType name="DummyPortType">
+    <operation name="ping"><input message="tns:PingRequest"/><output message="tns:PingResponse"/></operation>
+  </portType>
+  <binding name="DummyBinding" type="tns:DummyPortType">
+    <soap:binding style="rpc" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="ping">
+      <soap:operation soapAction="ping"/>
+      <input><soap:body use="literal" namespace="urn:dummy"/></input>
+      <output><soap:body use="literal" namespace="urn:dummy"/></output>
+    </operation>
+  </binding>
+  <service name="DummyService">
+    <port name="DummyPort" binding="tns:DummyBinding"><soap:address location="http://localhost/dummy"/></port>
+  </service>
+</definitions>
+"""
+
+# ################################################################################################################################
+
+class DummyClient(object):
+    def __init__(self, cache, prototype=None):
+        self.cache = cache
+        self.prototype = prototype
+
+    def clone(self):
+        return DummyClient(self.cache, self)
+
+class DummyCreateFunc(object):
+    def __init__(self):
+        self.prototypes = []
+
+    def __call__(self, cache):
+        prototype = DummyClient(cache)
+        self.prototypes.append(prototype)
+        return prototype
+
+class DummyRequestsModule(object):
+    def session(self, *ignored, **ignored_kwargs):
+        return None
+
+class DummySudsSOAPWrapper(SudsSOAPWrapper):
+    """ Returns the WSDL without fetching it over HTTP, suds still reads it from a local file.
+    """
+    def get_wsdl(self):
+        return WSDL
+
+# ################################################################################################################################
+
+class WSDLCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    def test_clients_are_cloned_from_one_prototype(self):
+        cache = WSDLCache()
+        create_func = DummyCreateFunc()
+        address, wsdl = rand_string(), rand_string()
+
+        clients = [cache.get_client(address, wsdl, create_func) for x in range(5)]
+
+        eq_(len(create_func.prototypes), 1)
+        for client in clients:
+            self.assertIs(client.prototype, create_func.prototypes[0])
+
+        stats = cache.get_stats()
+        eq_(stats.misses, 1)
+        eq_(stats.hits, 4)
+        eq_(stats.size, 1)
+
+    def test_changed_wsdl_is_parsed_again(self):
+        cache = WSDLCache()
+        create_func = DummyCreateFunc()
+        address = rand_string()
+
+        client1 = cache.get_client(address, rand_string(), create_func)
+        client2 = cache.get_client(address, rand_string(), create_func)
+
+        eq_(len(create_func.prototypes), 2)
+        self.assertIsNot(client1.prototype, client2.prototype)
+        eq_(cache.get_stats().size, 1)
+
+    def test_previous_versions_are_deleted_from_disk(self):
+        cache = WSDLCache(self.cache_dir)
+        create_func = DummyCreateFunc()
+        address = rand_string()
+
+        client1 = cache.get_client(address, rand_string(), create_func)
+        location1 = client1.cache.location
+        self.assertTrue(os.path.exists(location1))
+
+        client2 = cache.get_client(address, rand_string(), create_func)
+        self.assertFalse(os.path.exists(location1))
+        self.assertTrue(os.path.exists(client2.cache.location))
+
+    def get_wrapper(self, wsdl_cache, wsdl_path, sec_type, username, password):
+        config = {'name':rand_string(), 'is_active':True, 'sec_type':sec_type, 'address_host':'file://',
+            'address_url_path':wsdl_path, 'ping_method':'HEAD', 'soap_version':'1.1', 'pool_size':1, 'queue_build_cap':1,
+            'serialization_type':HTTP_SOAP_SERIALIZATION_TYPE.SUDS.id, 'timeout':rand_int(), 'username':username,
+            'password':password}
+
+        return DummySudsSOAPWrapper(config, wsdl_cache, requests_module=DummyRequestsModule())
+
+    def test_clients_do_not_share_credentials(self):
+        wsdl_path = os.path.join(self.cache_dir, 'dummy.wsdl')
+        with open(wsdl_path, 'wb') as f:
+            f.write(WSDL)
+
+        cache = WSDLCache()
+        username, password = rand_string(), rand_string()
+
+        # Both connections use the same WSDL so the one without security gets a clone of a prototype
+        # that was created with credentials of the other one.
+        with_sec = self.get_wrapper(cache, wsdl_path, SEC_DEF_TYPE.BASIC_AUTH, username, password)
+        with_sec.add_client()
+
+        no_sec = self.get_wrapper(cache, wsdl_path, None, None, None)
+        no_sec.add_client()
+
+        eq_(cache.get_stats().hits, 1)
+
+        with_sec_client = with_sec.client.queue.get()
+        no_sec_client = no_sec.client.queue.get()
+
+        eq_(with_sec_client.options.transport.options.username, username)
+        eq_(with_sec_client.options.transport.options.password, password)
+
+        self.assertIsNone(no_sec_client.options.transport.options.username)
+        self.assertIsNone(no_sec_client.options.transport.options.password)
+        self.assertIsNone(no_sec_client.options.wsse)
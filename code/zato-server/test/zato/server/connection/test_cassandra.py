@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# Cassandra
+from cassandra.query import BatchStatement, BoundStatement
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.test import rand_string
+from zato.server.connection.cassandra import CassandraClient
+
+# ################################################################################################################################
+
+class DummyBoundStatement(BoundStatement):
+
+    # Shadows the parent class' property so that tests can decide which partition a statement belongs to
+    routing_key = None
+
+    def __init__(self, prepared_statement, values):
+        self.prepared_statement = prepared_statement
+        self.values = values
+        self.fetch_size = None
+
+        # The first value stands for the partition key, unless the statement is told it doesn't bind it
+        if prepared_statement.has_routing_key:
+            self.routing_key = values[0]
+
+class DummyPreparedStatement(object):
+    def __init__(self, cql, has_routing_key):
+        self.query_id = rand_string()
+        self.cql = cql
+        self.has_routing_key = has_routing_key
+
+    def bind(self, values):
+        return DummyBoundStatement(self, values)
+
+class DummyFuture(object):
+    def __init__(self, result, error):
+        self.result = result
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None, errback_args=(),
+            errback_kwargs=None):
+        if self.error:
+            errback(self.error, *errback_args, **(errback_kwargs or {}))
+        else:
+            callback(self.result, *callback_args, **(callback_kwargs or {}))
+
+class DummySession(object):
+    """ An in-process session whose statements return their own values as rows, or fail if the values say so.
+    """
+    def __init__(self, has_routing_key=True):
+        self.has_routing_key = has_routing_key
+        self.prepared = []
+        self.executed = []
+
+    def prepare(self, cql):
+        self.prepared.append(cql)
+        return DummyPreparedStatement(cql, self.has_routing_key)
+
+    def _execute(self, statement):
+        self.executed.append(statement)
+
+        if isinstance(statement, BatchStatement):
+            return None, None
+
+        if statement.values and statement.values[-1] == 'error':
+            return None, Exception('Dummy error')
+
+        return [Bunch(bound_values=statement.values, fetch_size=statement.fetch_size)], None
+
+    def execute(self, statement, parameters=None):
+        result, error = self._execute(statement)
+        if error:
+            raise error
+        return result
+
+    def execute_async(self, statement, parameters=None):
+        return DummyFuture(*self._execute(statement))
+
+# ################################################################################################################################
+
+class CassandraClientTestCase(TestCase):
+
+    def test_prepared_statement_cache(self):
+        session = DummySession()
+        client = CassandraClient(rand_string(), session, {'statement_cache_size':2})
+
+        client.prepare('a')
+        client.prepare('b')
+        client.prepare('a')
+
+        # 'b' is the least recently used one
+        client.prepare('c')
+        client.prepare('a')
+        client.prepare('b')
+
+        eq_(session.prepared, ['a', 'b', 'c', 'b'])
+        eq_(client.prepared.keys(), ['a', 'b'])
+        eq_(client.evictions, 2)
+
+        stats = dict((item.cql, item) for item in client.get_stats())
+        eq_(stats['a'].hits, 2)
+        eq_(stats['a'].misses, 1)
+        eq_(stats['b'].hits, 0)
+        eq_(stats['b'].misses, 2)
+
+    def test_stats_evicted(self):
+        client = CassandraClient(rand_string(), DummySession(), {'stats_size':2})
+
+        client.execute('a', [1])
+        client.execute('b', [1])
+        client.execute('a', [1])
+
+        # 'b' is the least recently used one
+        client.execute('c', [1])
+
+        eq_(client.stats.keys(), ['a', 'c'])
+        eq_(client.stats_evictions, 1)
+
+        stats = dict((item.cql, item) for item in client.get_stats())
+        eq_(stats['a'].calls, 2)
+        eq_(stats['c'].calls, 1)
+
+        # Statistics of an evicted statement start anew
+        client.execute('b', [1])
+        eq_(dict((item.cql, item) for item in client.get_stats())['b'].calls, 1)
+        eq_(client.stats_evictions, 2)
+
+    def test_no_stats(self):
+        client = CassandraClient(rand_string(), DummySession(), {'stats_size':0})
+
+        client.execute('a', [1])
+        eq_(client.get_stats(), [])
+
+    def test_no_cache(self):
+        session = DummySession()
+        client = CassandraClient(rand_string(), session, {'statement_cache_size':0})
+
+        client.prepare('a')
+        client.prepare('a')
+
+        eq_(session.prepared, ['a', 'a'])
+        eq_(len(client.prepared), 0)
+
+    def test_execute(self):
+        client = CassandraClient(rand_string(), DummySession())
+
+        eq_(client.execute('a', (1, 2))[0].bound_values, (1, 2))
+        self.assertRaises(Exception, client.execute, 'a', (1, 'error'))
+
+        stats = client.get_stats()[0]
+        eq_(stats.calls, 2)
+        eq_(stats.statements, 2)
+        eq_(stats.errors, 1)
+        eq_(stats.hits, 1)
+
+    def test_execute_many(self):
+        client = CassandraClient(rand_string(), DummySession())
+
+        results = client.execute_many('a', [(1,), (2,), (3, 'error')], concurrency=2, raise_on_first_error=False)
+
+        eq_([success for success, _ in results], [True, True, False])
+        eq_(results[1][1][0].bound_values, (2,))
+
+        stats = client.get_stats()[0]
+        eq_(stats.calls, 1)
+        eq_(stats.statements, 3)
+        eq_(stats.errors, 1)
+
+    def test_execute_batch(self):
+        session = DummySession()
+        client = CassandraClient(rand_string(), session)
+
+        params_list = [('p1', 1), ('p2', 1), ('p1', 2), ('p1', 3), ('p2', 2)]
+        results = client.execute_batch('a', params_list, batch_size=2)
+
+        # p1 needs two batches because of batch_size, p2 fits in one
+        eq_(len(results), 3)
+        eq_(len(session.executed), 3)
+        self.assertTrue(all(isinstance(statement, BatchStatement) for statement in session.executed))
+
+        eq_(client.get_stats()[0].statements, 5)
+
+    def test_execute_batch_no_routing_key(self):
+        session = DummySession(False)
+        client = CassandraClient(rand_string(), session)
+
+        results = client.execute_batch('a', [('p1', 1), ('p1', 2)])
+
+        eq_(len(results), 2)
+        self.assertFalse(any(isinstance(statement, BatchStatement) for statement in session.executed))
+
+    def test_iter_rows(self):
+        client = CassandraClient(rand_string(), DummySession(), {'fetch_size':10})
+
+        rows = list(client.iter_rows('a', (1,)))
+        eq_(rows[0].fetch_size, 10)
+
+        rows = list(client.iter_rows('a', (1,), 5))
+        eq_(rows[0].fetch_size, 5)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import sqlite3
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent.queue import Queue
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import CIRCUIT_BREAKER, URL_TYPE
+from zato.common.test import rand_string
+from zato.server.connection.circuit_breaker import BulkheadFull, CircuitBreaker, CircuitBreakerOpen, CircuitBreakerStore
+from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper
+from zato.server.connection.queue import _Connection
+from zato.server.connection.sql import SQLConnectionPool
+
+# ################################################################################################################################
+
+class _StubSession(object):
+    """ Stands for a remote end which can be told to respond slowly or to fail.
+    """
+    def __init__(self, *ignored, **kwargs):
+        self.latency = 0
+        self.status_code = 200
+        self.text = ''
+        self.needs_error = False
+        self.requests = []
+
+    def request(self, *args, **kwargs):
+        self.requests.append(kwargs)
+        gevent.sleep(self.latency)
+
+        if self.needs_error:
+            raise Exception('Dummy error')
+
+        return Bunch(status_code=self.status_code, text=self.text)
+
+class _StubRequestsModule(object):
+    def session(self, *args, **kwargs):
+        self.session_obj = _StubSession(*args, **kwargs)
+        return self.session_obj
+
+def get_wrapper(transport=URL_TYPE.PLAIN_HTTP, **kwargs):
+    config = {'is_active':True, 'sec_type':None, 'address_host':'http://localhost', 'address_url_path':'/', 'name':rand_string(),
+        'ping_method':'HEAD', 'soap_version':'1.1', 'pool_size':1, 'serialization_type':'string', 'timeout':10,
+        'transport':transport, 'data_format':None}
+    options = {'min_calls':4, 'window_size':10, 'open_time':10, 'probes':2}
+    options.update(kwargs)
+
+    breaker = CircuitBreaker(config['name'], **options)
+    requests_module = _StubRequestsModule()
+
+    return HTTPSOAPWrapper(config, requests_module, breaker), requests_module.session_obj, breaker
+
+# ################################################################################################################################
+
+class CircuitBreakerTestCase(TestCase):
+
+    def test_opens_on_errors(self):
+        wrapper, session, breaker = get_wrapper()
+
+        for x in range(2):
+            wrapper.get(rand_string())
+
+        session.status_code = 503
+        for x in range(2):
+            wrapper.get(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+
+        # The remote end is not invoked anymore
+        self.assertRaises(CircuitBreakerOpen, wrapper.get, rand_string())
+        eq_(len(session.requests), 4)
+        eq_(breaker.get_stats().rejected_open, 1)
+
+    def test_soap_faults_are_not_failures(self):
+        wrapper, session, breaker = get_wrapper(URL_TYPE.SOAP)
+
+        session.status_code = 500
+        session.text = '<soap:Envelope><soap:Body><soap:Fault/></soap:Body></soap:Envelope>'
+        for x in range(4):
+            wrapper.post(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+        eq_(breaker.get_stats().failures, 0)
+
+        # Without a fault, it's the server that failed
+        session.text = ''
+        for x in range(4):
+            wrapper.post(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+
+    def test_opens_on_exceptions(self):
+        wrapper, session, breaker = get_wrapper()
+        session.needs_error = True
+
+        for x in range(4):
+            self.assertRaises(Exception, wrapper.get, rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+        eq_(breaker.get_stats().failures, 4)
+
+    def test_opens_on_slow_calls(self):
+        wrapper, session, breaker = get_wrapper(slow_call_time=0.01, slow_call_rate=0.5)
+        session.latency = 0.02
+
+        for x in range(4):
+            wrapper.get(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+        eq_(breaker.get_stats().slow_calls, 4)
+
+    def test_stays_closed_below_min_calls(self):
+        wrapper, session, breaker = get_wrapper()
+        session.status_code = 500
+
+        for x in range(3):
+            wrapper.get(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+
+    def test_half_open_probes_close(self):
+        wrapper, session, breaker = get_wrapper()
+        session.needs_error = True
+
+        for x in range(4):
+            self.assertRaises(Exception, wrapper.get, rand_string())
+
+        # Time passes and the remote end recovers
+        breaker.opened_at -= 10
+        session.needs_error = False
+
+        wrapper.get(rand_string())
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.HALF_OPEN)
+
+        wrapper.get(rand_string())
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+
+    def test_half_open_probe_fails(self):
+        wrapper, session, breaker = get_wrapper()
+        session.needs_error = True
+
+        for x in range(4):
+            self.assertRaises(Exception, wrapper.get, rand_string())
+
+        breaker.opened_at -= 10
+        self.assertRaises(Exception, wrapper.get, rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+        eq_(breaker.get_stats().opened, 2)
+
+    def test_half_open_limits_probes(self):
+        breaker = CircuitBreaker(rand_string(), probes=1)
+        breaker._open(0)
+
+        token = breaker.before()
+        self.assertRaises(CircuitBreakerOpen, breaker.before)
+
+        breaker.after(token, False)
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+
+    def test_bulkhead(self):
+        wrapper, session, breaker = get_wrapper(max_concurrency=1)
+        session.latency = 0.05
+
+        greenlet = gevent.spawn(wrapper.get, rand_string())
+        gevent.sleep(0.01)
+
+        self.assertRaises(BulkheadFull, wrapper.get, rand_string())
+        greenlet.join()
+
+        wrapper.get(rand_string())
+        eq_(breaker.get_stats().rejected_concurrency, 1)
+        eq_(breaker.in_progress, 0)
+
+    def test_adaptive_timeout(self):
+        wrapper, session, breaker = get_wrapper(needs_adaptive_timeout=True, min_timeout=0.5)
+
+        for x in range(4):
+            wrapper.get(rand_string())
+            eq_(session.requests[-1]['timeout'], 10)
+
+        # The stub responds immediately so it's the minimum timeout that is used now ..
+        wrapper.get(rand_string())
+        eq_(session.requests[-1]['timeout'], 0.5)
+
+        # .. unless one is given explicitly
+        wrapper.get(rand_string(), timeout=3)
+        eq_(session.requests[-1]['timeout'], 3)
+
+    def test_reset(self):
+        wrapper, session, breaker = get_wrapper()
+        breaker._open(0)
+
+        breaker.reset()
+        wrapper.get(rand_string())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+
+# ################################################################################################################################
+
+class CircuitBreakerIntegrationTestCase(TestCase):
+
+    def test_queue_connection(self):
+        breaker = CircuitBreaker(rand_string(), min_calls=1, window_size=1)
+        queue = Queue()
+        queue.put(rand_string())
+
+        with _Connection(queue, rand_string(), breaker):
+            pass
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+
+        try:
+            with _Connection(queue, rand_string(), breaker):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+        eq_(queue.qsize(), 1)
+
+    def test_queue_connection_ignored_errors(self):
+        breaker = CircuitBreaker(rand_string(), min_calls=1, window_size=1)
+        queue = Queue()
+        queue.put(rand_string())
+
+        try:
+            with _Connection(queue, rand_string(), breaker, ignored_errors=(ValueError,)):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+        eq_(breaker.get_stats().failures, 0)
+
+    def test_queue_connection_no_free_clients(self):
+        breaker = CircuitBreaker(rand_string())
+
+        self.assertRaises(Exception, _Connection(Queue(), rand_string(), breaker).__enter__)
+        eq_(breaker.in_progress, 0)
+        eq_(breaker.get_stats().calls, 0)
+
+    def get_sql_pool(self, breaker):
+        pool = SQLConnectionPool.__new__(SQLConnectionPool)
+        pool.engine = Bunch(dialect=Bunch(dbapi=sqlite3))
+        pool.circuit_breaker = breaker
+        pool.metrics = None
+
+        return pool
+
+    def test_sql_events(self):
+        breaker = CircuitBreaker(rand_string(), min_calls=2, window_size=2)
+        pool = self.get_sql_pool(breaker)
+
+        for x in range(2):
+            context = Bunch()
+            pool.on_before_cursor_execute(None, None, 'SELECT 1', None, context, False)
+            pool.on_dbapi_error(None, None, 'SELECT 1', None, context, sqlite3.OperationalError())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.OPEN)
+        self.assertRaises(CircuitBreakerOpen, pool.on_before_cursor_execute, None, None, 'SELECT 1', None, Bunch(), False)
+
+    def test_sql_statement_errors_not_failures(self):
+        breaker = CircuitBreaker(rand_string(), min_calls=2, window_size=2)
+        pool = self.get_sql_pool(breaker)
+
+        for x in range(2):
+            context = Bunch()
+            pool.on_before_cursor_execute(None, None, 'INSERT INTO foo VALUES (1)', None, context, False)
+            pool.on_dbapi_error(None, None, 'INSERT INTO foo VALUES (1)', None, context, sqlite3.IntegrityError())
+
+        eq_(breaker.state, CIRCUIT_BREAKER.STATE.CLOSED)
+        eq_(breaker.get_stats().failures, 0)
+
+# ################################################################################################################################
+
+class CircuitBreakerStoreTestCase(TestCase):
+
+    def test_get_delete(self):
+        store = CircuitBreakerStore({'is_enabled':'True', 'max_concurrency':'5'})
+        name = rand_string()
+
+        breaker = store.get(CIRCUIT_BREAKER.CONN_TYPE.SQL, name)
+        eq_(breaker.max_concurrency, 5)
+        self.assertIs(store.get(CIRCUIT_BREAKER.CONN_TYPE.SQL, name), breaker)
+        self.assertIsNot(store.get(CIRCUIT_BREAKER.CONN_TYPE.SOAP, name), breaker)
+
+        store.delete(CIRCUIT_BREAKER.CONN_TYPE.SQL, name)
+        self.assertIsNot(store.get(CIRCUIT_BREAKER.CONN_TYPE.SQL, name), breaker)
+
+    def test_disabled(self):
+        eq_(CircuitBreakerStore({'is_enabled':'False'}).get(CIRCUIT_BREAKER.CONN_TYPE.SQL, rand_string()), None)
+
+        # Breakers are opt-in
+        eq_(CircuitBreakerStore().get(CIRCUIT_BREAKER.CONN_TYPE.SQL, rand_string()), None)
+
+    def test_reset_stats(self):
+        store = CircuitBreakerStore({'is_enabled':'True'})
+        breaker1 = store.get(CIRCUIT_BREAKER.CONN_TYPE.PLAIN_HTTP, 'a')
+        breaker2 = store.get(CIRCUIT_BREAKER.CONN_TYPE.SQL, 'b')
+        breaker1._open(0)
+        breaker2._open(0)
+
+        store.reset(CIRCUIT_BREAKER.CONN_TYPE.SQL)
+
+        stats = store.get_stats()
+        eq_([(item.conn_type, item.name, item.state) for item in stats], [
+            (CIRCUIT_BREAKER.CONN_TYPE.PLAIN_HTTP, 'a', CIRCUIT_BREAKER.STATE.OPEN),
+            (CIRCUIT_BREAKER.CONN_TYPE.SQL, 'b', CIRCUIT_BREAKER.STATE.CLOSED)])
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import sqlite3
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent.queue import Queue
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import CONN_METRICS
+from zato.common.test import rand_string
+from zato.server.connection.http_soap.outgoing import HTTPSOAPWrapper
+from zato.server.connection.metrics import ConnMetrics, ConnMetricsStore, instrument, LatencyHistogram
+from zato.server.connection.queue import _Connection
+from zato.server.connection.sql import SQLConnectionPool
+
+# ################################################################################################################################
+
+class _StubSession(object):
+    def __init__(self, *ignored, **kwargs):
+        self.status_code = 200
+        self.needs_error = False
+
+    def request(self, *args, **kwargs):
+        if self.needs_error:
+            raise Exception('Dummy error')
+
+        return Bunch(status_code=self.status_code, text='')
+
+class _StubRequestsModule(object):
+    def session(self, *args, **kwargs):
+        self.session_obj = _StubSession(*args, **kwargs)
+        return self.session_obj
+
+def get_metrics(conn_type=CONN_METRICS.CONN_TYPE.PLAIN_HTTP):
+    return ConnMetrics(conn_type, rand_string())
+
+# ################################################################################################################################
+
+class LatencyHistogramTestCase(TestCase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+
+        eq_(histogram.get_mean(), 0.0)
+        eq_(histogram.get_percentile(99), 0.0)
+        eq_(histogram.get_buckets(), [])
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram((1, 10, 100))
+
+        for x in range(90):
+            histogram.record(0.0005)
+
+        for x in range(9):
+            histogram.record(0.05)
+
+        histogram.record(0.5)
+
+        eq_(histogram.count, 100)
+        eq_(histogram.get_percentile(50), 1)
+        eq_(histogram.get_percentile(90), 1)
+        eq_(histogram.get_percentile(99), 100)
+        eq_(histogram.get_percentile(100), 500)
+        eq_(histogram.get_buckets(), [(1, 90), (100, 9), (None, 1)])
+
+    def test_percentile_below_bound(self):
+        histogram = LatencyHistogram((1, 10, 100))
+        histogram.record(0.02)
+
+        # The bucket's upper bound is 100 but nothing above 20 has been recorded
+        eq_(histogram.get_percentile(99), 20)
+
+# ################################################################################################################################
+
+class ConnMetricsTestCase(TestCase):
+
+    def test_http(self):
+        config = {'is_active':True, 'sec_type':None, 'address_host':'http://localhost', 'address_url_path':'/',
+            'name':rand_string(), 'ping_method':'HEAD', 'soap_version':'1.1', 'pool_size':1, 'serialization_type':'string',
+            'timeout':10, 'transport':'plain_http', 'data_format':None}
+
+        metrics = get_metrics()
+        requests_module = _StubRequestsModule()
+
+        wrapper = HTTPSOAPWrapper(config, requests_module, metrics=metrics)
+        session = requests_module.session_obj
+
+        wrapper.get(rand_string())
+
+        session.status_code = 503
+        wrapper.get(rand_string())
+
+        session.needs_error = True
+        self.assertRaises(Exception, wrapper.get, rand_string())
+
+        stats = metrics.get_stats()
+        eq_(stats.calls, 3)
+        eq_(stats.errors, 2)
+        eq_(stats.in_progress, 0)
+        self.assertTrue(stats.latency_buckets)
+
+    def test_queue_connection(self):
+        metrics = get_metrics(CONN_METRICS.CONN_TYPE.SOAP)
+        queue = Queue()
+        queue.put(rand_string())
+        metrics.get_idle = queue.qsize
+
+        with _Connection(queue, rand_string(), metrics=metrics):
+            stats = metrics.get_stats()
+            eq_(stats.checked_out, 1)
+            eq_(stats.idle, 0)
+
+        try:
+            with _Connection(queue, rand_string(), metrics=metrics):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        stats = metrics.get_stats()
+        eq_(stats.checked_out, 0)
+        eq_(stats.idle, 1)
+        eq_(stats.checkouts, 2)
+        eq_(stats.calls, 2)
+        eq_(stats.errors, 1)
+
+    def test_queue_connection_no_free_clients(self):
+        metrics = get_metrics(CONN_METRICS.CONN_TYPE.SOAP)
+
+        self.assertRaises(Exception, _Connection(Queue(), rand_string(), metrics=metrics).__enter__)
+
+        stats = metrics.get_stats()
+        eq_(stats.exhausted, 1)
+        eq_(stats.checkouts, 0)
+        eq_(stats.calls, 0)
+
+    def test_sql_events(self):
+        metrics = get_metrics(CONN_METRICS.CONN_TYPE.SQL)
+
+        pool = SQLConnectionPool.__new__(SQLConnectionPool)
+        pool.logger = Bunch(isEnabledFor=lambda level: False)
+        pool.engine = Bunch(dialect=Bunch(dbapi=sqlite3))
+        pool.circuit_breaker = None
+        pool.metrics = metrics
+
+        pool.on_connect(None, None)
+        pool.on_checkout(None, None, None)
+
+        context = Bunch()
+        pool.on_before_cursor_execute(None, None, 'SELECT 1', None, context, False)
+        pool.on_after_cursor_execute(None, None, 'SELECT 1', None, context, False)
+
+        context = Bunch()
+        pool.on_before_cursor_execute(None, None, 'SELECT 1', None, context, False)
+        pool.on_dbapi_error(None, None, 'SELECT 1', None, context, sqlite3.OperationalError())
+
+        pool.on_invalidate(None, None, Exception())
+        pool.on_checkin(None, None)
+
+        timed_connect = pool._get_timed_pool_connect(lambda: 'conn')
+        eq_(timed_connect(), 'conn')
+
+        stats = metrics.get_stats()
+        eq_(stats.calls, 2)
+        eq_(stats.errors, 1)
+        eq_(stats.connects, 1)
+        eq_(stats.disconnects, 1)
+        eq_(stats.checkouts, 1)
+        eq_(stats.checked_out, 0)
+        eq_(metrics.wait.count, 1)
+
+    def test_instrument(self):
+        metrics = get_metrics(CONN_METRICS.CONN_TYPE.CASSANDRA)
+
+        def func(value):
+            if value is None:
+                raise ValueError()
+            return value
+
+        func = instrument(metrics, func)
+
+        eq_(func(123), 123)
+        self.assertRaises(ValueError, func, None)
+
+        eq_(metrics.calls, 2)
+        eq_(metrics.errors, 1)
+
+# ################################################################################################################################
+
+class ConnMetricsStoreTestCase(TestCase):
+
+    def test_get_delete(self):
+        store = ConnMetricsStore()
+        name = rand_string()
+
+        metrics = store.get(CONN_METRICS.CONN_TYPE.SQL, name)
+        self.assertIs(store.get(CONN_METRICS.CONN_TYPE.SQL, name), metrics)
+        self.assertIsNot(store.get(CONN_METRICS.CONN_TYPE.SEARCH_ES, name), metrics)
+
+        store.delete(CONN_METRICS.CONN_TYPE.SQL, name)
+        self.assertIsNot(store.get(CONN_METRICS.CONN_TYPE.SQL, name), metrics)
+
+    def test_disabled(self):
+        eq_(ConnMetricsStore({'is_enabled':'False'}).get(CONN_METRICS.CONN_TYPE.SQL, rand_string()), None)
+
+    def test_reset_keeps_gauges(self):
+        store = ConnMetricsStore()
+        metrics1 = store.get(CONN_METRICS.CONN_TYPE.SQL, 'a')
+        metrics2 = store.get(CONN_METRICS.CONN_TYPE.SOAP, 'b')
+
+        for metrics in metrics1, metrics2:
+            metrics.on_checkout()
+            metrics.on_call_end(metrics.on_call_start(), True)
+            metrics.on_call_start()
+
+        store.reset(CONN_METRICS.CONN_TYPE.SQL)
+
+        stats = store.get_stats()
+        eq_([(item.conn_type, item.name, item.calls, item.in_progress, item.checked_out) for item in stats], [
+            (CONN_METRICS.CONN_TYPE.SOAP, 'b', 1, 1, 1),
+            (CONN_METRICS.CONN_TYPE.SQL, 'a', 0, 1, 1)])
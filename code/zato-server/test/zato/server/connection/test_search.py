@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.test import rand_string
+from zato.server.connection.search.bulk import BulkIndexer
+from zato.server.connection.search.es import ElasticSearchAPI
+from zato.server.connection.search.solr import SolrAPI
+
+# ################################################################################################################################
+
+class DummyConnStore(object):
+    def __init__(self, conn):
+        self.items = {'dummy': Bunch(config=Bunch(is_active=True), conn=conn)}
+
+    def get(self, name):
+        return self.items.get(name)
+
+class DummyTransport(object):
+    def __init__(self):
+        self.requests = []
+
+    def perform_request(self, method, url, body=None):
+        self.requests.append((method, url, body))
+
+class DummyES(object):
+    """ Rejects documents whose 'status' key says so and returns hits in pages of two.
+    """
+    def __init__(self, hits=None):
+        self.hits = hits or []
+        self.bulk_bodies = []
+        self.transport = DummyTransport()
+
+    def bulk(self, body, index=None, doc_type=None):
+        self.bulk_bodies.append(body)
+
+        items = []
+        for source in body[1::2]:
+            status = source.get('status', 201)
+            result = {'status': status}
+            if status >= 300:
+                result['error'] = 'Dummy error'
+            items.append({'index': result})
+
+        return {'items': items}
+
+    def search(self, **kwargs):
+        self.search_kwargs = kwargs
+        return {'_scroll_id': 0}
+
+    def scroll(self, scroll_id, scroll):
+        return {'_scroll_id': scroll_id + 1, 'hits': {'hits': self.hits[scroll_id * 2:scroll_id * 2 + 2]}}
+
+class DummySolrWrapper(object):
+    def __init__(self, docs=None):
+        self.docs = docs or []
+        self.added = []
+        self.commits = 0
+        self.selects = []
+
+    def add(self, docs, commit_within=None):
+        self.added.append(docs)
+
+    def commit(self):
+        self.commits += 1
+
+    def select(self, params):
+        self.selects.append(params)
+
+        start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+        stop = start + params['rows']
+
+        return {'response': {'docs': self.docs[start:stop]}, 'nextCursorMark': str(min(stop, len(self.docs)))}
+
+# ################################################################################################################################
+
+class BulkIndexerTestCase(TestCase):
+
+    def test_flush_by_size(self):
+        batches = []
+
+        def send(docs):
+            batches.append(docs)
+            return []
+
+        with BulkIndexer(rand_string(), send, batch_size=2, flush_interval=0) as indexer:
+            for x in range(5):
+                indexer.add(x)
+
+        eq_(batches, [[0, 1], [2, 3], [4]])
+        eq_(indexer.get_stats().indexed, 5)
+        eq_(indexer.get_stats().flushes, 3)
+
+    def test_flush_by_time(self):
+        batches = []
+
+        def send(docs):
+            batches.append(docs)
+            return []
+
+        indexer = BulkIndexer(rand_string(), send, batch_size=100, flush_interval=0.01)
+        indexer.add(1)
+        gevent.sleep(0.05)
+
+        eq_(batches, [[1]])
+        indexer.close()
+
+    def test_partial_failures_retried(self):
+        attempts = []
+
+        def send(docs):
+            attempts.append(docs)
+
+            # Odd documents fail the first time and 3 is never accepted
+            if len(attempts) == 1:
+                return [(doc, 'busy', True) for doc in docs if doc % 2]
+            return [(doc, 'busy', True) for doc in docs if doc == 3]
+
+        with BulkIndexer(rand_string(), send, flush_interval=0, retries=2, retry_delay=0) as indexer:
+            for x in range(5):
+                indexer.add(x)
+
+        eq_(attempts, [[0, 1, 2, 3, 4], [1, 3], [3]])
+        eq_(indexer.failed, [(3, 'busy')])
+
+        stats = indexer.get_stats()
+        eq_(stats.indexed, 4)
+        eq_(stats.failed, 1)
+        eq_(stats.retried, 3)
+
+    def test_not_retryable(self):
+        attempts = []
+
+        def send(docs):
+            attempts.append(docs)
+            return [(docs[0], 'invalid', False)]
+
+        with BulkIndexer(rand_string(), send, flush_interval=0, retry_delay=0) as indexer:
+            indexer.add(1)
+
+        eq_(len(attempts), 1)
+        eq_(indexer.failed, [(1, 'invalid')])
+
+    def test_exception_retried(self):
+        attempts = []
+
+        def send(docs):
+            attempts.append(docs)
+            if len(attempts) == 1:
+                raise Exception('Dummy error')
+            return []
+
+        with BulkIndexer(rand_string(), send, flush_interval=0, retry_delay=0) as indexer:
+            indexer.add(1)
+            indexer.add(2)
+
+        eq_(attempts, [[1, 2], [1, 2]])
+        eq_(indexer.get_stats().indexed, 2)
+
+    def test_closed(self):
+        closed = []
+
+        indexer = BulkIndexer(rand_string(), lambda docs: [], flush_interval=0, close_func=lambda: closed.append(True))
+        indexer.close()
+        indexer.close()
+
+        eq_(closed, [True])
+        self.assertRaises(ValueError, indexer.add, 1)
+
+# ################################################################################################################################
+
+class ElasticSearchAPITestCase(TestCase):
+
+    def test_bulk_indexer(self):
+        es = DummyES()
+        api = ElasticSearchAPI(DummyConnStore(es))
+
+        with api.bulk_indexer('dummy', 'my-index', 'my-type', flush_interval=0, retries=1, retry_delay=0) as indexer:
+            indexer.add({'_id': 'a', 'value': 1})
+            indexer.add({'_index': 'other', 'value': 2})
+            indexer.add({'value': 3, 'status': 400})
+
+        eq_(es.bulk_bodies[0][:4], [{'index': {'_id': 'a'}}, {'value': 1}, {'index': {'_index': 'other'}}, {'value': 2}])
+
+        # The rejected document is not sent again
+        eq_(len(es.bulk_bodies), 1)
+        eq_(indexer.get_stats().indexed, 2)
+        eq_(indexer.failed, [({'value': 3, 'status': 400}, 'Dummy error')])
+
+    def test_bulk_indexer_retryable(self):
+        es = DummyES()
+        api = ElasticSearchAPI(DummyConnStore(es))
+
+        with api.bulk_indexer('dummy', flush_interval=0, retries=2, retry_delay=0) as indexer:
+            indexer.add({'status': 429})
+
+        eq_(len(es.bulk_bodies), 3)
+        eq_(indexer.get_stats().retried, 2)
+
+    def test_scroll(self):
+        es = DummyES(range(5))
+        api = ElasticSearchAPI(DummyConnStore(es), {'scroll_size':'10', 'es_scroll_keep_alive':'2m'})
+
+        eq_(list(api.scroll('dummy', {'query': {'match_all': {}}}, 'my-index')), range(5))
+        eq_(es.search_kwargs['size'], 10)
+        eq_(es.search_kwargs['scroll'], '2m')
+        eq_(es.transport.requests, [('DELETE', '/_search/scroll', 4)])
+
+# ################################################################################################################################
+
+class SolrAPITestCase(TestCase):
+
+    def test_bulk_indexer(self):
+        wrapper = DummySolrWrapper()
+        api = SolrAPI(DummyConnStore(wrapper))
+
+        with api.bulk_indexer('dummy', batch_size=2, flush_interval=0) as indexer:
+            for x in range(3):
+                indexer.add({'id': x})
+
+        eq_(wrapper.added, [[{'id': 0}, {'id': 1}], [{'id': 2}]])
+        eq_(wrapper.commits, 1)
+
+    def test_bulk_indexer_no_commit(self):
+        wrapper = DummySolrWrapper()
+        api = SolrAPI(DummyConnStore(wrapper))
+
+        with api.bulk_indexer('dummy', commit=False, flush_interval=0) as indexer:
+            indexer.add({'id': 1})
+
+        eq_(wrapper.commits, 0)
+
+    def test_iter_docs(self):
+        docs = [{'id': x} for x in range(5)]
+        wrapper = DummySolrWrapper(docs)
+        api = SolrAPI(DummyConnStore(wrapper))
+
+        eq_(list(api.iter_docs('dummy', '*:*', rows=2, fq='type:a')), docs)
+
+        eq_([params['cursorMark'] for params in wrapper.selects], ['*', '2', '4', '5'])
+        eq_(wrapper.selects[0]['fq'], 'type:a')
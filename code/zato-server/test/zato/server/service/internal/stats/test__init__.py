@@ -15,7 +15,7 @@ from bunch import Bunch
 from zato.common import zato_namespace
 from zato.common.test import rand_float, rand_int, rand_string, ServiceTestCase
 from zato.server.service import Integer, UTC
-from zato.server.service.internal.stats import Delete, StatsReturningService, GetByService
+from zato.server.service.internal.stats import ApplyRetention, Delete, StatsReturningService, GetByService
 
 ################################################################################
 
@@ -47,6 +47,30 @@ class DeleteTestCase(ServiceTestCase):
    
 ###############################################################################
 
+class ApplyRetentionTestCase(ServiceTestCase):
+
+    def setUp(self):
+        self.service_class = ApplyRetention
+        self.sio = self.service_class.SimpleIO
+
+    def get_request_data(self):
+        return {}
+
+    def get_response_data(self):
+        return Bunch({})
+
+    def test_sio(self):
+        self.assertEquals(self.sio.request_elem, 'zato_stats_apply_retention_request')
+        self.assertEquals(self.sio.response_elem, 'zato_stats_apply_retention_response')
+        self.assertEquals(self.sio.namespace, zato_namespace)
+        self.assertRaises(AttributeError, getattr, self.sio, 'input_required')
+        self.assertRaises(AttributeError, getattr, self.sio, 'output_required')
+
+    def test_impl(self):
+        self.assertEquals(self.service_class.get_name(), 'zato.stats.apply-retention')
+
+###############################################################################
+
 class StatsReturningServiceTestCase(ServiceTestCase):
     
     def setUp(self):
@@ -68,7 +92,8 @@ class StatsReturningServiceTestCase(ServiceTestCase):
         self.assertEquals(self.sio.input_optional, ('service_name', self.wrap_force_type(Integer('n')), 'n_type'))
         self.assertEquals(self.sio.output_optional, ('service_name', 'usage', 'mean', 'rate', 'time', 'usage_trend', 'mean_trend',
                                                      'min_resp_time', 'max_resp_time', 'all_services_usage', 'all_services_time',
-                                                     'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services'))
+                                                     'mean_all_services', 'usage_perc_all_services', 'time_perc_all_services',
+                                                     'p50_resp_time', 'p90_resp_time', 'p99_resp_time', 'p99_9_resp_time'))
         self.assertEquals(self.sio.namespace, zato_namespace)
         self.assertRaises(AttributeError, getattr, self.sio, 'output_required')
         self.assertRaises(AttributeError, getattr, self.sio, 'output_repeated')
@@ -15,8 +15,10 @@ from dateutil.parser import parse
 from nose.tools import eq_
 
 # Zato
+from zato.common import KVDB, StatsElem
 from zato.common.test import ServiceTestCase
-from zato.server.service.internal.stats.summary import GetSummaryByRange
+from zato.server.service.internal.stats.summary import GetSummaryByRange, SliceStats
+from zato.server.stats import Histogram
 
 class GetSummaryByRangeTestCase(ServiceTestCase):
     
@@ -80,3 +82,31 @@ class GetSummaryByRangeTestCase(ServiceTestCase):
         start = '208-08-11T18:01:34'
         stop = '2012-11-23T03:42:15'
         _check_expected(start, stop, False, False, False, True)
+
+    def test_merge_slices_percentiles(self):
+
+        def _get_slice(values):
+            stats_elem = StatsElem('my.service')
+            stats_elem.usage = len(values)
+            stats_elem.mean = sum(values) / len(values)
+            stats_elem.min_resp_time = min(values)
+            stats_elem.max_resp_time = max(values)
+            stats_elem.temp_histogram = Histogram()
+
+            for value in values:
+                stats_elem.temp_histogram.record(value)
+
+            return SliceStats(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, [stats_elem], None, None, 60)
+
+        # 90 fast invocations in one slice and 10 slow ones in the other, percentiles are computed
+        # out of both so they don't depend on how the range was sliced up.
+        service = GetSummaryByRange()
+        merged = list(service.merge_slices([_get_slice([10] * 90), _get_slice([500] * 9 + [1000])]))[0]
+
+        eq_(merged.usage, 100)
+        eq_(merged.p50_resp_time, 10)
+        eq_(merged.p90_resp_time, 10)
+        eq_(merged.p99_resp_time, 503)
+
+        # No percentile is greater than the maximum actually recorded
+        eq_(merged.p99_9_resp_time, 1000)
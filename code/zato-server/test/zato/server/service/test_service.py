@@ -9,7 +9,8 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
-import ast
+import ast, sys
+from imp import new_module
 from json import loads
 from logging import getLogger, INFO
 from time import time
@@ -35,7 +36,8 @@ from retools.lock import LockTimeout
 from zato.common import CHANNEL, DATA_FORMAT, KVDB, PARAMS_PRIORITY, \
      SCHEDULER, URL_TYPE
 from zato.common.test import FakeKVDB, rand_string, rand_int, ServiceTestCase
-from zato.server.service import List, Service
+from zato.server.service import List, Service, WorkerFacades
+from zato.server.service.store import ServiceStore
 from zato.server.service.reqresp import HTTPRequestData, Request
 
 logger = getLogger(__name__)
@@ -448,4 +450,190 @@ class TestNav(TestCase):
         eq_(service.response.payload['has_path'], True)
 
     def test_listnav(self):
-        self.test_dictnav() # Right now dictnav and listnav do the same thing
\ No newline at end of file
+        self.test_dictnav() # Right now dictnav and listnav do the same thing
+# ################################################################################################################################
+
+class TestInstancePool(TestCase):
+
+    def _get_store(self, *service_classes):
+        store = ServiceStore({})
+        for service_class in service_classes:
+            store.services[service_class.get_impl_name()] = {'service_class': service_class}
+
+        return store
+
+    def test_no_pooling_by_default(self):
+
+        class MyService(Service):
+            pass
+
+        impl_name = MyService.get_impl_name()
+        store = self._get_store(MyService)
+
+        instance1 = store.new_instance(impl_name)
+        store.release_instance(instance1)
+        instance2 = store.new_instance(impl_name)
+
+        self.assertIsNot(instance1, instance2)
+
+    def test_reuse_after_reset(self):
+
+        class MyService(Service):
+            instance_pool_size = 2
+
+        impl_name = MyService.get_impl_name()
+        store = self._get_store(MyService)
+
+        instance1 = store.new_instance(impl_name)
+        request1, response1 = instance1.request, instance1.response
+
+        instance1.cid = rand_string()
+        instance1.environ[rand_string()] = rand_string()
+        instance1.SimpleIO = object()
+        instance1.msg = object()
+
+        store.release_instance(instance1)
+        instance2 = store.new_instance(impl_name)
+
+        self.assertIs(instance1, instance2)
+        eq_(instance2.cid, None)
+        eq_(instance2.environ, {})
+        self.assertFalse(hasattr(instance2, 'SimpleIO'))
+        self.assertIsNot(instance2.request, request1)
+        self.assertIsNot(instance2.response, response1)
+        eq_(instance2._msg, None)
+
+    def test_pool_size_is_observed(self):
+
+        class MyService(Service):
+            instance_pool_size = 1
+
+        impl_name = MyService.get_impl_name()
+        store = self._get_store(MyService)
+
+        instance1 = store.new_instance(impl_name)
+        instance2 = store.new_instance(impl_name)
+
+        store.release_instance(instance1)
+        store.release_instance(instance2)
+
+        eq_(len(store.instance_pools[impl_name]), 1)
+        self.assertIs(store.new_instance(impl_name), instance1)
+        self.assertIsNot(store.new_instance(impl_name), instance1)
+
+    def test_redeployed_service_instances_are_discarded(self):
+
+        class MyService(Service):
+            instance_pool_size = 1
+
+        impl_name = MyService.get_impl_name()
+        store = self._get_store(MyService)
+        instance = store.new_instance(impl_name)
+
+        class MyService(Service):
+            instance_pool_size = 1
+
+        store.services[impl_name]['service_class'] = MyService
+        store.release_instance(instance)
+
+        self.assertFalse(store.instance_pools.get(impl_name))
+
+# ################################################################################################################################
+
+class TestWorkerFacades(TestCase):
+    def test_facades_are_lazy_and_shared(self):
+
+        worker_store = Bunch()
+        worker_store.email_smtp_api = rand_string()
+        worker_store.email_imap_api = rand_string()
+        worker_store.search_es_api = rand_string()
+        worker_store.search_solr_api = rand_string()
+        worker_store.worker_facades = WorkerFacades(worker_store)
+
+        eq_(worker_store.worker_facades._email, None)
+        eq_(worker_store.worker_facades._search, None)
+
+        service1, service2 = Service(), Service()
+        service1.worker_store = service2.worker_store = worker_store
+
+        self.assertIs(service1.email, service2.email)
+        self.assertIs(service1.search, service2.search)
+
+        eq_(service1.email.smtp, worker_store.email_smtp_api)
+        eq_(service1.search.es, worker_store.search_es_api)
+
+# ################################################################################################################################
+
+class DummyODB(object):
+    def __init__(self):
+        self.add_service_calls = []
+        self.add_services_calls = []
+
+    def add_service(self, name, *ignored):
+        self.add_service_calls.append(name)
+        return rand_int(), True, rand_int()
+
+    def add_services(self, items):
+        self.add_services_calls.append([item.name for item in items])
+        return dict((item.name, [rand_int(), True, rand_int()]) for item in items)
+
+class TestBulkDeployment(TestCase):
+
+    def setUp(self):
+        self.mod_name = 'zato_test_{}'.format(rand_string())
+
+        class MyService1(Service):
+            pass
+
+        class MyService2(Service):
+            pass
+
+        mod = new_module(self.mod_name)
+        mod.__file__ = '{}.py'.format(self.mod_name)
+
+        for service_class in MyService1, MyService2:
+            service_class.__module__ = self.mod_name
+            setattr(mod, service_class.__name__, service_class)
+
+        sys.modules[self.mod_name] = mod
+        self.names = sorted([MyService1.get_name(), MyService2.get_name()])
+
+    def tearDown(self):
+        sys.modules.pop(self.mod_name, None)
+
+    def test_import_services_in_bulk(self):
+        odb = DummyODB()
+        store = ServiceStore({}, odb=odb)
+
+        catalogue = store.import_services_in_bulk([self.mod_name], None)
+
+        eq_(odb.add_service_calls, [])
+        eq_(len(odb.add_services_calls), 1)
+        eq_(sorted(odb.add_services_calls[0]), self.names)
+        eq_(sorted(catalogue), self.names)
+        eq_(store.pending, None)
+
+        for name, (service_id, is_active, slow_threshold) in catalogue.items():
+            impl_name = store.name_to_impl_name[name]
+            eq_(store.id_to_impl_name[service_id], impl_name)
+            eq_(store.services[impl_name]['is_active'], is_active)
+            eq_(store.services[impl_name]['slow_threshold'], slow_threshold)
+
+    def test_import_services_from_catalogue(self):
+        odb = DummyODB()
+        store = ServiceStore({}, odb=odb)
+
+        known, missing = self.names
+        service_id, slow_threshold = rand_int(), rand_int()
+
+        store.import_services_from_catalogue([self.mod_name], None, {known: [service_id, False, slow_threshold]})
+
+        # Only the service that is not in the catalogue is added to the ODB
+        eq_(odb.add_service_calls, [missing])
+        eq_(odb.add_services_calls, [])
+
+        impl_name = store.name_to_impl_name[known]
+        eq_(store.id_to_impl_name[service_id], impl_name)
+        eq_(store.services[impl_name]['is_active'], False)
+        eq_(store.services[impl_name]['slow_threshold'], slow_threshold)
+        self.assertIn(missing, store.name_to_impl_name)
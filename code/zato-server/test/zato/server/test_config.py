@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+# Bunch
+from bunch import Bunch
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common.test import rand_int, rand_string
+from zato.server.config import ConfigDict, ConfigSnapshot
+
+# ################################################################################################################################
+
+class DummyODB(object):
+    def __init__(self):
+        self.calls = []
+        self.rows = [Bunch(name=rand_string(), id=rand_int()) for x in range(3)]
+
+    def get_out_ftp_list(self, cluster_id, needs_columns=False):
+        self.calls.append(cluster_id)
+        return self.rows, Bunch.fromkeys(['name', 'id'])
+
+# ################################################################################################################################
+
+class ConfigSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.cache_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    def test_queries_are_run_once(self):
+        odb = DummyODB()
+        snapshot = ConfigSnapshot(odb, rand_int())
+
+        cluster_id = rand_int()
+
+        result1 = snapshot.get_out_ftp_list(cluster_id, True)
+        result2 = snapshot.get_out_ftp_list(cluster_id, True)
+
+        eq_(odb.calls, [cluster_id])
+        eq_(snapshot.query_count, 1)
+        self.assertIs(result1, result2)
+
+        config = ConfigDict.from_query('out_ftp', result1)
+        eq_(sorted(config.keys()), sorted(row.name for row in odb.rows))
+
+    def test_save_load(self):
+        cluster_id, version = rand_int(), rand_int()
+
+        snapshot1 = ConfigSnapshot(DummyODB(), version, self.cache_dir)
+        self.assertFalse(snapshot1.load())
+
+        result1 = snapshot1.get_out_ftp_list(cluster_id, True)
+        snapshot1.save()
+
+        odb = DummyODB()
+        snapshot2 = ConfigSnapshot(odb, version, self.cache_dir)
+
+        self.assertTrue(snapshot2.load())
+        eq_(snapshot2.get_out_ftp_list(cluster_id, True), result1)
+        eq_(odb.calls, [])
+        eq_(snapshot2.query_count, 0)
+
+    def test_previous_versions_are_deleted(self):
+        version1, version2 = 1, 2
+
+        snapshot1 = ConfigSnapshot(DummyODB(), version1, self.cache_dir)
+        snapshot1.save()
+
+        snapshot2 = ConfigSnapshot(DummyODB(), version2, self.cache_dir)
+        self.assertFalse(snapshot2.load())
+        snapshot2.save()
+
+        eq_(os.listdir(self.cache_dir), [os.path.basename(snapshot2.path)])
+        self.assertFalse(ConfigSnapshot(DummyODB(), version1, self.cache_dir).load())
+
+    def test_non_getter_attributes(self):
+        snapshot = ConfigSnapshot(DummyODB(), rand_int())
+        self.assertRaises(AttributeError, getattr, snapshot, rand_string())
+
+# ################################################################################################################################
+
+class ConfigDictTestCase(TestCase):
+
+    def test_iteration_is_not_affected_by_writes(self):
+        config_dict = ConfigDict(rand_string(), Bunch.fromkeys(range(5)))
+
+        keys = []
+        for key in config_dict:
+            config_dict[rand_string()] = rand_int()
+            config_dict.pop(key, None)
+            keys.append(key)
+
+        eq_(keys, list(range(5)))
+        eq_(len(config_dict.keys()), 5)
+
+    def test_pop(self):
+        name, value, default = rand_string(), rand_int(), rand_int()
+
+        config_dict = ConfigDict(rand_string(), Bunch({name: value}))
+        snapshot = config_dict.get_snapshot()
+
+        # Attributes of the underlying Bunch are not keys
+        eq_(config_dict.pop('values', default), default)
+        self.assertIs(config_dict.get_snapshot(), snapshot)
+
+        eq_(config_dict.pop(name, default), value)
+        eq_(config_dict.keys(), [])
+        eq_(snapshot.keys(), [name])
+
+    def test_snapshot_is_not_modified(self):
+        name = rand_string()
+        config_dict = ConfigDict(rand_string(), Bunch({name: rand_int()}))
+        snapshot = config_dict.get_snapshot()
+
+        del config_dict[name]
+        config_dict.set(rand_string(), rand_int())
+
+        eq_(snapshot.keys(), [name])
+        self.assertIsNot(config_dict.get_snapshot(), snapshot)
+
+    def test_copy(self):
+        name1, name2, value1, value2 = rand_string(), rand_string(), rand_int(), rand_int()
+
+        config_dict1 = ConfigDict(rand_string(), Bunch({name1: value1}))
+        config_dict2 = config_dict1.copy()
+
+        # Nothing is copied until either of the two is written to
+        self.assertIs(config_dict1.get_snapshot(), config_dict2.get_snapshot())
+
+        config_dict2[name2] = value2
+
+        eq_(config_dict1.keys(), [name1])
+        eq_(sorted(config_dict2.items()), sorted([(name1, value1), (name2, value2)]))
+        eq_(config_dict1.pop(name2, None), None)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from time import time
+from unittest import TestCase
+
+# gevent
+import gevent
+from gevent.event import Event
+from gevent.monkey import get_original
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import HUB_MONITOR
+from zato.common.test import rand_string
+from zato.server.hub_monitor import HubMonitor
+
+# Blocks the whole worker, unlike gevent.sleep
+blocking_sleep = get_original('time', 'sleep')
+
+# ################################################################################################################################
+
+def busy(seconds):
+    start = time()
+    while time() - start < seconds:
+        pass
+
+def get_monitor(**config):
+    config.setdefault('interval', 0.005)
+    config.setdefault('threshold', 0.05)
+
+    return HubMonitor(rand_string(), config)
+
+# ################################################################################################################################
+
+class HubMonitorTestCase(TestCase):
+
+    def test_blocking_call(self):
+        monitor = get_monitor()
+        monitor.start()
+
+        def blocking():
+            blocking_sleep(0.2)
+
+        try:
+            gevent.sleep(0.02)
+            monitor.run('my.service', blocking)
+            gevent.sleep(0.02)
+        finally:
+            monitor.stop()
+
+        eq_(monitor.blocked, 1)
+        self.assertTrue(monitor.lag.max >= 150)
+
+        stats = monitor.get_lag_stats()
+        eq_(stats.blocked, 1)
+        self.assertTrue(stats.checks > 1)
+        self.assertTrue(stats.lag_p50 < 50)
+
+        blocks = monitor.get_blocks()
+        eq_(len(blocks), 1)
+        eq_(blocks[0].service_name, 'my.service')
+        self.assertTrue(blocks[0].duration >= 150)
+        self.assertTrue('in blocking' in blocks[0].stack)
+
+    def test_busy_service(self):
+        monitor = get_monitor()
+        monitor.start()
+
+        try:
+            gevent.sleep(0.02)
+            monitor.run('my.service', lambda: busy(0.2))
+            gevent.sleep(0.02)
+        finally:
+            monitor.stop()
+
+        blocks = monitor.get_blocks()
+        eq_(len(blocks), 1)
+        eq_(blocks[0].service_name, 'my.service')
+        self.assertTrue('in busy' in blocks[0].stack)
+
+    def test_hub_time(self):
+        monitor = get_monitor(hub_time='True')
+        monitor.start()
+
+        def outer():
+            busy(0.03)
+            monitor.run('inner', inner)
+
+        def inner():
+            busy(0.05)
+            gevent.sleep(0.1) # Other greenlets run meanwhile so it is not hub time
+            busy(0.05)
+
+        try:
+            monitor.run('outer', outer)
+        finally:
+            monitor.stop()
+
+        hub_time = dict((item.service_name, item) for item in monitor.get_hub_time())
+
+        eq_(hub_time['inner'].calls, 1)
+        self.assertTrue(100 <= hub_time['inner'].hub_time < 150)
+        self.assertTrue(50 <= hub_time['inner'].max_slice < 100)
+
+        eq_(hub_time['outer'].calls, 1)
+        self.assertTrue(30 <= hub_time['outer'].hub_time < 80)
+
+        eq_(monitor.services, {})
+
+    def test_census(self):
+        monitor = get_monitor()
+        event = Event()
+
+        def waiting():
+            event.wait()
+
+        greenlets = [gevent.spawn(waiting) for _ in range(3)]
+        gevent.sleep(0)
+
+        try:
+            census = monitor.get_census()
+        finally:
+            event.set()
+            gevent.joinall(greenlets)
+
+        name = '{}:waiting'.format(__name__)
+        waiting_items = [item for item in census if item.func == name]
+
+        eq_(len(waiting_items), 1)
+        eq_(waiting_items[0].waiting_in, name)
+        eq_(waiting_items[0].count, 3)
+
+        running = [item for item in census if item.waiting_in == HUB_MONITOR.RUNNING_FRAME]
+        eq_(len(running), 1)
+
+    def test_hub_time_is_opt_in(self):
+        monitor = get_monitor()
+        monitor.start()
+
+        try:
+            monitor.run('my.service', lambda: busy(0.01))
+        finally:
+            monitor.stop()
+
+        eq_(monitor.get_hub_time(), [])
+
+    def test_stop_waits_for_watchdog(self):
+        monitor = get_monitor()
+        monitor.start()
+
+        watch_done = monitor._watch_done
+        self.assertFalse(watch_done.acquire(False))
+
+        monitor.stop()
+
+        # The watchdog thread has already returned
+        self.assertTrue(watch_done.acquire(False))
+
+    def test_reset(self):
+        monitor = get_monitor()
+        monitor.start()
+
+        try:
+            monitor.run('my.service', lambda: blocking_sleep(0.1))
+            gevent.sleep(0.02)
+        finally:
+            monitor.stop()
+
+        monitor.reset()
+
+        eq_(monitor.blocked, 0)
+        eq_(monitor.lag.count, 0)
+        eq_(monitor.get_blocks(), [])
+        eq_(monitor.get_hub_time(), [])
@@ -354,3 +354,69 @@ class TestMapper(TestCase):
         self.assertEquals(target.bb, '123')
         self.assertEquals(target.cc.dd, 123)
         self.assertEquals(target.cc.ee.ff, [None] * 19 + [123])
+
+    def _get_rules(self):
+        return [
+            ('/aa', '/a/b'),
+            ('/bb', '/a/c/d'),
+            ('/cc/dd', 'int:/a/c/d'),
+            ('/cc/ee', 'bool:/a/c/e'),
+            ('/dd/ee/ff', '/a/missing'),
+        ]
+
+    def _get_source(self):
+        return {
+            'a': {
+                'b': [1, 2, rand_string(), 4],
+                'c': {'d':'123', 'e':'true'}
+        }}
+
+    def test_compile_same_as_map(self):
+        source = self._get_source()
+        rules = self._get_rules()
+
+        m1 = Mapper(source)
+        m1.map_many(rules)
+
+        m2 = Mapper(source)
+        m2.run(m2.compile(rules))
+
+        self.assertDictEqual(m1.target, m2.target)
+        self.assertNotIn('dd', m2.target)
+
+    def test_compile_defaults(self):
+        source = self._get_source()
+        rules = self._get_rules()
+        default = rand_string()
+
+        m1 = Mapper(source)
+        m1.map_many(rules, skip_missing=False, default=default)
+
+        m2 = Mapper(source)
+        m2.run(m2.compile(rules, skip_missing=False, default=default))
+
+        self.assertDictEqual(m1.target, m2.target)
+        self.assertEquals(m2.target['dd']['ee']['ff'], default)
+
+    def test_compile_lists_in_target(self):
+        source = self._get_source()
+
+        m = Mapper(source)
+        m.set('/cc/ee/ff', [])
+        m.run(m.compile([('/cc/ee/ff/19', 'int:/a/c/d')]))
+
+        self.assertEquals(m.target['cc']['ee']['ff'], [None] * 19 + [123])
+
+    def test_run_many(self):
+        sources = [self._get_source() for x in range(3)]
+        rules = self._get_rules()
+
+        program = Mapper(None).compile(rules)
+        targets = program.run_many(sources)
+
+        self.assertEquals(len(targets), 3)
+
+        for source, target in zip(sources, targets):
+            m = Mapper(source)
+            m.map_many(rules)
+            self.assertDictEqual(target, m.target)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import signal
+import sys
+from time import time
+from unittest import TestCase
+
+# anyjson
+from anyjson import loads
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+import gevent
+from gevent.event import Event
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB, PROFILER
+from zato.common.test import rand_string
+from zato.server.profiler import get_top_functions, SamplingProfiler
+
+# ################################################################################################################################
+
+class DummyPipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def hincrby(self, key, field, value):
+        hash = self.conn.hashes.setdefault(key, {})
+        hash[field] = hash.get(field, 0) + value
+
+    def hset(self, key, field, value):
+        self.conn.hashes.setdefault(key, {})[field] = value
+
+    def expire(self, key, ttl):
+        self.conn.ttls[key] = ttl
+
+    def execute(self):
+        pass
+
+class DummyConn(object):
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return DummyPipeline(self)
+
+def get_profiler(kvdb=None, service_name='my.service', sample_rate=1.0):
+    profiler = SamplingProfiler(kvdb or Bunch(conn=DummyConn()), rand_string())
+    profiler.session_id = rand_string()
+    profiler.service_name = service_name
+    profiler.sample_rate = sample_rate
+    profiler.until = time() + 60
+    profiler.is_active = True
+
+    return profiler
+
+# ################################################################################################################################
+
+class SamplingProfilerTestCase(TestCase):
+
+    def test_sample(self):
+        profiler = get_profiler()
+        event = Event()
+
+        def waiting():
+            event.wait()
+
+        def running():
+            profiler._sample(signal.SIGALRM, sys._getframe())
+
+        greenlet = gevent.spawn(profiler.run, 'my.service', waiting)
+        gevent.sleep(0)
+
+        profiler.run('my.service', running)
+
+        event.set()
+        greenlet.join()
+
+        eq_(profiler.samples, 2)
+        eq_(profiler.greenlets, {})
+        eq_(profiler.profiled_calls, 2)
+
+        # The running greenlet's stack starts at the service's handle method ..
+        eq_(profiler.stacks['my.service;{}:running'.format(__name__)], 1)
+
+        # .. and the suspended one is waiting in gevent
+        waiting_stacks = [stack for stack in profiler.stacks if stack.startswith('my.service;{}:waiting;'.format(__name__))]
+        eq_(len(waiting_stacks), 1)
+        self.assertTrue(waiting_stacks[0].endswith(';' + PROFILER.WAIT_FRAME))
+
+    def test_other_services_not_profiled(self):
+        profiler = get_profiler()
+
+        eq_(profiler.run('other.service', lambda: 123), 123)
+        eq_(profiler.profiled_calls, 0)
+        eq_(profiler.unprofiled_calls, 0)
+
+    def test_sample_rate(self):
+        profiler = get_profiler(sample_rate=0.0)
+
+        def func():
+            eq_(profiler.greenlets, {})
+
+        profiler.run('my.service', func)
+
+        eq_(profiler.profiled_calls, 0)
+        eq_(profiler.unprofiled_calls, 1)
+
+    def test_flush_merges_workers(self):
+        kvdb = Bunch(conn=DummyConn())
+        profiler1, profiler2 = get_profiler(kvdb), get_profiler(kvdb)
+        profiler2.session_id = profiler1.session_id
+
+        profiler1.stacks = {'my.service;a': 2, 'my.service;a;b': 1}
+        profiler2.stacks = {'my.service;a': 3}
+
+        profiler1.flush()
+        profiler2.flush()
+
+        eq_(kvdb.conn.hashes[KVDB.PROFILER_STACKS + profiler1.session_id], {'my.service;a': 5, 'my.service;a;b': 1})
+        eq_(profiler1.stacks, {})
+
+        workers = kvdb.conn.hashes[KVDB.PROFILER_WORKERS + profiler1.session_id]
+        eq_(sorted(workers), sorted([profiler1.worker_name, profiler2.worker_name]))
+        eq_(loads(workers[profiler1.worker_name])['session_id'], profiler1.session_id)
+        eq_(kvdb.conn.ttls[KVDB.PROFILER_STACKS + profiler1.session_id], PROFILER.RESULT_TTL)
+
+    def test_start_stop(self):
+        kvdb = Bunch(conn=DummyConn())
+        profiler = SamplingProfiler(kvdb, rand_string())
+
+        def busy():
+            start = time()
+            while time() - start < 0.1:
+                pass
+
+        profiler.start(rand_string(), 'my.service', 10, 1.0, 0.001)
+        profiler.run('my.service', busy)
+        profiler.stop()
+
+        self.assertFalse(profiler.is_active)
+        self.assertTrue(profiler.samples)
+        self.assertIs(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+
+        stats = profiler.get_stats()
+        self.assertTrue(0 < stats.overhead < 100)
+        eq_(stats.profiled_calls, 1)
+
+        stacks = kvdb.conn.hashes[KVDB.PROFILER_STACKS + profiler.session_id]
+        self.assertTrue(all(stack.startswith('my.service;{}:busy'.format(__name__)) for stack in stacks))
+
+# ################################################################################################################################
+
+class GetTopFunctionsTestCase(TestCase):
+
+    def test_get_top_functions(self):
+        stacks = {'my.service;a;b': 3, 'my.service;a': 1, 'my.service;a;c;a': 2, 'my.service': 4}
+
+        top = get_top_functions(stacks)
+
+        eq_([(item.name, item.self_samples, item.total_samples) for item in top], [('a', 3, 6), ('b', 3, 3), ('c', 0, 2)])
+        eq_(top[0].self_perc, 30.0)
+        eq_(top[0].total_perc, 60.0)
+
+        eq_(len(get_top_functions(stacks, 1)), 1)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2014 Dariusz Suchojad <dsuch at zato.io>
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from fnmatch import fnmatch
+from unittest import TestCase
+
+# nose
+from nose.tools import eq_
+
+# Zato
+from zato.common import KVDB
+from zato.server.stats import get_tier, get_tiers, Histogram, MaintenanceTool
+
+# ################################################################################################################################
+
+MINUTE, HOUR, DAY, MONTH = (KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, KVDB.SERVICE_TIME_AGGREGATED_BY_HOUR,
+    KVDB.SERVICE_TIME_AGGREGATED_BY_DAY, KVDB.SERVICE_TIME_AGGREGATED_BY_MONTH)
+
+class DummyPipeline(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def expire(self, key, ttl):
+        self.conn.ttls[key] = ttl
+
+    def delete(self, *keys):
+        self.conn.delete(*keys)
+
+    def execute(self):
+        pass
+
+class DummyConn(object):
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.ttls = {}
+        self.scans = []
+        self.cursors = {} # cursor -> last key returned so far, so deleting keys in between does not make SCAN skip any
+
+    def scan(self, cursor=0, match=None, count=None):
+        """ Same as in redis-py, returns a cursor, as a string, and up to count keys, some of which may not match.
+        """
+        self.scans.append(match)
+
+        last_key = self.cursors.pop(int(cursor), None)
+        keys = [key for key in sorted(self.keys) if last_key is None or key > last_key]
+
+        if len(keys) > count:
+            keys = keys[:count]
+            cursor = len(self.scans)
+            self.cursors[cursor] = keys[-1]
+        else:
+            cursor = 0
+
+        return str(cursor), [key for key in keys if fnmatch(key, match)]
+
+    def delete(self, *keys):
+        self.keys.difference_update(keys)
+
+    def pipeline(self):
+        return DummyPipeline(self)
+
+# ################################################################################################################################
+
+class HistogramTestCase(TestCase):
+
+    def test_buckets(self):
+        histogram = Histogram()
+
+        # Each value below 64 has a bucket of its own
+        for value in range(64):
+            eq_(histogram.get_lower_bound(histogram.get_index(value)), value)
+            eq_(histogram.get_upper_bound(histogram.get_index(value)), value)
+
+        # Above that, a bucket's width is at most 1/32 of the values it holds
+        for value in (64, 65, 127, 128, 1000, 65535, 10 ** 7):
+            index = histogram.get_index(value)
+            lower, upper = histogram.get_lower_bound(index), histogram.get_upper_bound(index)
+
+            self.assertTrue(lower <= value <= upper)
+            self.assertTrue(upper - lower < value / 32.0)
+            eq_(histogram.get_index(upper + 1), index + 1)
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        eq_(histogram.get_percentile(99), 0)
+
+        for value in range(1, 1001):
+            histogram.record(value)
+
+        eq_(histogram.count, 1000)
+        eq_(histogram.get_percentile(50), 503)
+        eq_(histogram.get_percentile(90), 911)
+        eq_(histogram.get_percentile(99), 991)
+
+        # A bucket's highest value, rather than the highest value recorded
+        eq_(histogram.get_percentile(99.9), 1007)
+        eq_(histogram.get_percentile(100), 1007)
+
+    def test_merge_string(self):
+        histogram1, histogram2, expected = Histogram(), Histogram(), Histogram()
+
+        for value in range(0, 500):
+            histogram1.record(value)
+            expected.record(value)
+
+        for value in range(300, 2000, 3):
+            histogram2.record(value)
+            expected.record(value)
+
+        merged = Histogram.from_string(histogram1.to_string()).merge(Histogram.from_string(histogram2.to_string()))
+
+        eq_(merged.counts, expected.counts)
+        eq_(merged.to_string(), expected.to_string())
+        eq_(Histogram().to_string(), '')
+        self.assertFalse(Histogram.from_string(''))
+
+# ################################################################################################################################
+
+class TierTestCase(TestCase):
+
+    def test_retention_config(self):
+        tiers = get_tiers({'retention_by_minute':'1', 'retention_by_month':'365'})
+
+        eq_(tiers.keys(), [MINUTE, HOUR, DAY, MONTH])
+        eq_([tier.retention for tier in tiers.values()], [1, 90, 1095, 365])
+
+    def test_suffixes(self):
+        tiers = get_tiers()
+
+        eq_(tiers[HOUR].get_suffixes(datetime(2014, 5, 1, 22), datetime(2014, 5, 2, 1)),
+            ['2014:05:01:22', '2014:05:01:23', '2014:05:02:00'])
+        eq_(tiers[MONTH].get_suffixes(datetime(2013, 1, 1), datetime(2014, 1, 1)),
+            ['2013:{:0>2}'.format(month) for month in range(1, 13)])
+
+    def test_parse_key_ttl(self):
+        tier = get_tiers({'retention_by_day':'2'})[DAY]
+        period_start = tier.parse_key('{}my.service:with:colons:2014:05:01'.format(DAY))
+
+        eq_(period_start, datetime(2014, 5, 1))
+        eq_(tier.get_ttl(period_start, datetime(2014, 5, 2)), 2 * 86400)
+        eq_(get_tiers()[MONTH].get_ttl(period_start), None)
+
+    def test_get_tier(self):
+        tiers = get_tiers()
+        now = datetime(2014, 6, 15, 12, 30)
+
+        # A whole year, already aggregated
+        eq_(get_tier(tiers, datetime(2013, 1, 1), datetime(2014, 1, 1), now).prefix, MONTH)
+
+        # Whole days only
+        eq_(get_tier(tiers, datetime(2014, 5, 3), datetime(2014, 6, 1), now).prefix, DAY)
+
+        # The current month hasn't been aggregated yet
+        eq_(get_tier(tiers, datetime(2014, 5, 1), datetime(2014, 6, 1), now).prefix, DAY)
+
+        # Whole hours only
+        eq_(get_tier(tiers, datetime(2014, 6, 15, 8), datetime(2014, 6, 15, 10), now).prefix, HOUR)
+
+        # Not aligned at all
+        eq_(get_tier(tiers, datetime(2014, 6, 15, 8, 1), datetime(2014, 6, 15, 10), now).prefix, MINUTE)
+
+# ################################################################################################################################
+
+class MaintenanceToolTestCase(TestCase):
+
+    def test_delete(self):
+        keys = [
+            '{}a:2014:05:01:10:59'.format(MINUTE),
+            '{}a:2014:05:01:11:00'.format(MINUTE),
+            '{}b:2014:05:01:12:59'.format(MINUTE),
+            '{}a:2014:05:01:13:00'.format(MINUTE),
+            '{}a:2014:05:01:11'.format(HOUR),
+            '{}a:2014:05:01:12'.format(HOUR),
+            '{}a:2014:05:01'.format(DAY),
+            '{}a:2014:05'.format(MONTH),
+        ]
+        conn = DummyConn(keys)
+
+        deleted = MaintenanceTool(conn).delete(datetime(2014, 5, 1, 11, 0, 30), datetime(2014, 5, 1, 12, 59))
+
+        eq_(deleted, 4)
+        eq_(sorted(conn.keys), sorted([keys[0], keys[3], keys[6], keys[7]]))
+
+        # Each tier is scanned once
+        eq_(len(conn.scans), 4)
+
+    def test_delete_many_batches(self):
+        keys = ['{}a:2014:05:01:11:{:02}'.format(MINUTE, minute) for minute in range(10)]
+        conn = DummyConn(keys)
+
+        tool = MaintenanceTool(conn)
+        tool.batch_size = 3
+
+        deleted = tool.delete(datetime(2014, 5, 1, 11, 2), datetime(2014, 5, 1, 11, 7))
+
+        eq_(deleted, 6)
+        eq_(sorted(conn.keys), keys[:2] + keys[8:])
+
+        # Keys were iterated over in more than one call per tier
+        self.assertTrue(len(conn.scans) > 4)
+
+    def test_apply_retention(self):
+        keys = [
+            '{}a:2014:05:01:10:59'.format(MINUTE),
+            '{}a:2014:06:15:10:59'.format(MINUTE),
+            '{}a:2014:05'.format(MONTH),
+            '{}a:2014:05:01'.format(DAY),
+        ]
+        conn = DummyConn(keys)
+
+        result = MaintenanceTool(conn, {'retention_by_minute':'7'}).apply_retention(datetime(2014, 6, 15, 11))
+
+        eq_(result.deleted, 1)
+        eq_(result.expired, 2)
+        eq_(conn.ttls, {
+            keys[1]: 7 * 86400,
+            keys[3]: 1095 * 86400 - 44 * 86400 - 11 * 3600})
+
+        # Monthly statistics are kept forever by default
+        self.assertIn(keys[2], conn.keys)
+        self.assertNotIn(keys[0], conn.keys)
@@ -56,6 +56,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
     var merge_url_params_req_tr = '';
     var url_params_pri_tr = '';
     var params_pri_tr = '';
+    var limits_tr = '';
     var serialization_type = item.serialization_type ? item.serialization_type : 'string';
 
     if(is_soap) {
@@ -71,6 +72,15 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         url_params_pri_tr += String.format('<td class="ignore">{0}</td>', item.url_params_pri);
         params_pri_tr += String.format('<td class="ignore">{0}</td>', item.params_pri);
 
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.needs_streaming == true);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.max_body_size);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.cache_ttl);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.cache_query_params);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.cache_headers);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.rate_limit);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.rate_limit_period);
+        limits_tr += String.format('<td class="ignore">{0}</td>', item.rate_limit_per_client == true);
+
     }
 
     if(is_outgoing) {
@@ -129,6 +139,7 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         row += merge_url_params_req_tr;
         row += url_params_pri_tr;
         row += params_pri_tr;
+        row += limits_tr;
     }
 
     row += String.format('<td>{0}</td>', String.format("<a href=\"javascript:$.fn.zato.http_soap.edit('{0}')\">Edit</a>", item.id));
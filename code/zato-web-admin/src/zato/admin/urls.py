@@ -977,6 +977,22 @@ urlpatterns += patterns('',
         login_required(stats.maintenance), name='stats-maintenance'),
     url(r'^zato/stats/maintenance/delete/$',
         login_required(stats.maintenance_delete), name='stats-maintenance-delete'),
+    url(r'^zato/stats/connections/$',
+        login_required(stats.connections), name='stats-connections'),
+    url(r'^zato/stats/connections/reset/$',
+        login_required(stats.connections_reset), name='stats-connections-reset'),
+    url(r'^zato/stats/profiler/$',
+        login_required(stats.profiler), name='stats-profiler'),
+    url(r'^zato/stats/profiler/start/$',
+        login_required(stats.profiler_start), name='stats-profiler-start'),
+    url(r'^zato/stats/profiler/stop/(?P<session_id>.*)/$',
+        login_required(stats.profiler_stop), name='stats-profiler-stop'),
+    url(r'^zato/stats/profiler/stacks/(?P<session_id>.*)/$',
+        login_required(stats.profiler_stacks), name='stats-profiler-stacks'),
+    url(r'^zato/stats/hub-monitor/$',
+        login_required(stats.hub_monitor), name='stats-hub-monitor'),
+    url(r'^zato/stats/hub-monitor/reset/$',
+        login_required(stats.hub_monitor_reset), name='stats-hub-monitor-reset'),
     )
 
 # ################################################################################################################################
@@ -42,6 +42,14 @@ class CreateForm(DataFormatForm):
     ping_method = forms.CharField(widget=forms.TextInput(attrs={'style':'width:20%'}))
     pool_size = forms.CharField(widget=forms.TextInput(attrs={'style':'width:10%'}))
     timeout = forms.CharField(widget=forms.TextInput(attrs={'style':'width:10%'}), initial=MISC.DEFAULT_HTTP_TIMEOUT)
+    needs_streaming = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    max_body_size = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:20%'}))
+    cache_ttl = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:10%'}))
+    cache_query_params = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:100%'}))
+    cache_headers = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:100%'}))
+    rate_limit = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:10%'}))
+    rate_limit_period = forms.CharField(required=False, widget=forms.TextInput(attrs={'style':'width:10%'}))
+    rate_limit_per_client = forms.BooleanField(required=False, widget=forms.CheckboxInput())
     security = forms.ChoiceField(widget=forms.Select())
     connection = forms.CharField(widget=forms.HiddenInput())
     transport = forms.CharField(widget=forms.HiddenInput())
@@ -13,6 +13,7 @@ from django import forms
 
 # Zato
 from zato.admin.web.forms import INITIAL_CHOICES
+from zato.common import PROFILER
 
 class NForm(forms.Form):
     n = forms.IntegerField(widget=forms.TextInput(attrs={'style':'width:30px', 'id':'n'}))
@@ -45,3 +46,10 @@ class MaintenanceForm(forms.Form):
     """
     start = forms.CharField(widget=forms.TextInput(attrs={'class':'required', 'style':'width:150px; height:19px'}))
     stop = forms.CharField(widget=forms.TextInput(attrs={'class':'required', 'style':'width:150px; height:19px'}))
+
+class ProfilerForm(forms.Form):
+    """ Starts profiling a service.
+    """
+    service_name = forms.CharField(widget=forms.TextInput(attrs={'class':'required', 'style':'width:90%'}))
+    duration = forms.IntegerField(initial=PROFILER.DURATION, widget=forms.TextInput(attrs={'style':'width:50px'}))
+    sample_rate = forms.FloatField(initial=PROFILER.SAMPLE_RATE, widget=forms.TextInput(attrs={'style':'width:50px'}))
@@ -31,7 +31,7 @@ from zato.admin.web.views import get_js_dt_format, get_security_id_from_select,
 from zato.common import BATCH_DEFAULTS, DEFAULT_HTTP_PING_METHOD, DEFAULT_HTTP_POOL_SIZE, HTTP_SOAP_SERIALIZATION_TYPE, \
      MSG_PATTERN_TYPE, PARAMS_PRIORITY, SEC_DEF_TYPE_NAME, SOAP_CHANNEL_VERSIONS, SOAP_VERSIONS, URL_PARAMS_PRIORITY, URL_TYPE, \
      ZatoException, ZATO_NONE
-from zato.common import MISC, SEC_DEF_TYPE
+from zato.common import MISC, RATE_LIMIT, SEC_DEF_TYPE
 from zato.common.odb.model import HTTPSOAP
 
 logger = logging.getLogger(__name__)
@@ -79,6 +79,14 @@ def _get_edit_create_message(params, prefix=''):
         'ping_method': params.get(prefix + 'ping_method'),
         'pool_size': params.get(prefix + 'pool_size'),
         'timeout': params.get(prefix + 'timeout'),
+        'needs_streaming': bool(params.get(prefix + 'needs_streaming')),
+        'max_body_size': params.get(prefix + 'max_body_size'),
+        'cache_ttl': params.get(prefix + 'cache_ttl'),
+        'cache_query_params': params.get(prefix + 'cache_query_params'),
+        'cache_headers': params.get(prefix + 'cache_headers'),
+        'rate_limit': params.get(prefix + 'rate_limit'),
+        'rate_limit_period': params.get(prefix + 'rate_limit_period'),
+        'rate_limit_per_client': bool(params.get(prefix + 'rate_limit_per_client')),
         'security_id': security_id,
     }
 
@@ -158,7 +166,10 @@ def index(req):
                     item.soap_version, item.data_format, item.ping_method, 
                     item.pool_size, item.merge_url_params_req, item.url_params_pri, item.params_pri, 
                     item.serialization_type, item.timeout, service_id=item.service_id, service_name=item.service_name,
-                    security_id=security_id, security_name=security_name)
+                    security_id=security_id, security_name=security_name, needs_streaming=item.needs_streaming,
+                    max_body_size=item.max_body_size, cache_ttl=item.cache_ttl, cache_query_params=item.cache_query_params,
+                    cache_headers=item.cache_headers, rate_limit=item.rate_limit, rate_limit_period=item.rate_limit_period,
+                    rate_limit_per_client=item.rate_limit_per_client)
             items.append(item)
 
     return_data = {'zato_clusters':req.zato.clusters,
@@ -176,6 +187,7 @@ def index(req):
         'default_http_ping_method':DEFAULT_HTTP_PING_METHOD,
         'default_http_pool_size':DEFAULT_HTTP_POOL_SIZE,
         'default_http_timeout':MISC.DEFAULT_HTTP_TIMEOUT,
+        'default_rate_limit_period':RATE_LIMIT.PERIOD,
         }
 
     return TemplateResponse(req, 'zato/http_soap/index.html', return_data)
@@ -41,7 +41,7 @@ from pytz import timezone, utc
 
 # Zato
 from zato.admin.web import from_user_to_utc, from_utc_to_user
-from zato.admin.web.forms.stats import MaintenanceForm, NForm, SettingsForm
+from zato.admin.web.forms.stats import MaintenanceForm, NForm, ProfilerForm, SettingsForm
 from zato.admin.web.views import get_js_dt_format, get_sample_dt, method_allowed
 from zato.common import DEFAULT_STATS_SETTINGS, StatsElem
 from zato.common.util import from_local_to_utc, make_repr, now, utcnow
@@ -354,7 +354,8 @@ def _stats_data_csv(user_profile, req_input, client, ignored, stats_type, is_cus
     
     n_type_keys = {
         'mean': ['start', 'stop', 'service_name', 'mean', 'mean_all_services', 
-                  'usage_perc_all_services', 'time_perc_all_services', 'all_services_usage', 'mean_trend'],
+                  'usage_perc_all_services', 'time_perc_all_services', 'all_services_usage', 'mean_trend',
+                  'p50_resp_time', 'p90_resp_time', 'p99_resp_time', 'p99_9_resp_time'],
         'usage': ['start', 'stop', 'service_name', 'usage', 'rate', 'usage_perc_all_services', 
                   'time_perc_all_services', 'all_services_usage', 'usage_trend'],
         }
@@ -664,3 +665,145 @@ def maintenance_delete(req):
     return redirect('{}?cluster={}'.format(reverse('stats-maintenance'), req.zato.cluster_id))
 
 # ##############################################################################
+
+@method_allowed('GET')
+def connections(req):
+    items = []
+
+    if req.zato.cluster_id:
+        response = req.zato.client.invoke('zato.stats.connections.get-list', {})
+        if response.has_data:
+            items = response.data
+
+    return_data = {
+        'zato_clusters': req.zato.clusters,
+        'cluster_id': req.zato.cluster_id,
+        'choose_cluster_form':req.zato.choose_cluster_form,
+        'items': items,
+    }
+
+    return TemplateResponse(req, 'zato/stats/connections.html', return_data)
+
+@method_allowed('POST')
+def connections_reset(req):
+    req.zato.client.invoke('zato.stats.connections.reset', {})
+    messages.add_message(req, messages.INFO, 'Connection metrics reset', extra_tags='success')
+
+    return redirect('{}?cluster={}'.format(reverse('stats-connections'), req.zato.cluster_id))
+
+# ##############################################################################
+
+@method_allowed('GET')
+def profiler(req):
+    sessions = []
+    session = None
+    top_functions = []
+    overhead = []
+
+    if req.zato.cluster_id:
+        response = req.zato.client.invoke('zato.profiler.get-list', {})
+        if response.has_data:
+            sessions = response.data
+
+        # The most recent session is shown unless another one is selected
+        session_id = req.GET.get('session_id')
+        for item in sessions:
+            if not session_id or item.session_id == session_id:
+                session = item
+                break
+
+        if session:
+            response = req.zato.client.invoke('zato.profiler.get-top-functions', {'session_id':session.session_id})
+            if response.has_data:
+                top_functions = response.data
+
+            response = req.zato.client.invoke('zato.profiler.get-overhead', {'session_id':session.session_id})
+            if response.has_data:
+                overhead = response.data
+
+    return_data = {
+        'zato_clusters': req.zato.clusters,
+        'cluster_id': req.zato.cluster_id,
+        'choose_cluster_form':req.zato.choose_cluster_form,
+        'form': ProfilerForm(),
+        'sessions': sessions,
+        'session': session,
+        'top_functions': top_functions,
+        'overhead': overhead,
+    }
+
+    return TemplateResponse(req, 'zato/stats/profiler.html', return_data)
+
+@method_allowed('POST')
+def profiler_start(req):
+    input_dict = {'service_name': req.POST['service_name']}
+    for name in('duration', 'sample_rate'):
+        if req.POST.get(name):
+            input_dict[name] = req.POST[name]
+
+    response = req.zato.client.invoke('zato.profiler.start', input_dict)
+
+    msg = 'Started profiling [{}] in session [{}]'.format(input_dict['service_name'], response.data.session_id)
+    messages.add_message(req, messages.INFO, msg, extra_tags='success')
+
+    return redirect('{}?cluster={}&session_id={}'.format(
+        reverse('stats-profiler'), req.zato.cluster_id, response.data.session_id))
+
+@method_allowed('POST')
+def profiler_stop(req, session_id):
+    req.zato.client.invoke('zato.profiler.stop', {'session_id':session_id})
+    messages.add_message(req, messages.INFO, 'Stopped profiling session [{}]'.format(session_id), extra_tags='success')
+
+    return redirect('{}?cluster={}&session_id={}'.format(reverse('stats-profiler'), req.zato.cluster_id, session_id))
+
+@method_allowed('GET')
+def profiler_stacks(req, session_id):
+    """ Returns stacks of a session in the collapsed format, ready to be turned into a flame graph.
+    """
+    response = req.zato.client.invoke('zato.profiler.get-stacks', {'session_id':session_id})
+
+    response = HttpResponse(response.data.stacks, mimetype='text/plain')
+    response['Content-Disposition'] = 'attachment; filename={}'.format('zato-profile-{}.txt'.format(session_id))
+
+    return response
+
+# ##############################################################################
+
+@method_allowed('GET')
+def hub_monitor(req):
+    lag = None
+    hub_time = []
+    blocks = []
+    greenlets = []
+
+    if req.zato.cluster_id:
+        response = req.zato.client.invoke('zato.stats.hub-monitor.get-lag', {})
+        if response.has_data:
+            lag = response.data
+
+        for service_name, items in (('zato.stats.hub-monitor.get-hub-time', hub_time),
+                ('zato.stats.hub-monitor.get-blocks', blocks), ('zato.stats.hub-monitor.get-greenlets', greenlets)):
+            response = req.zato.client.invoke(service_name, {})
+            if response.has_data:
+                items.extend(response.data)
+
+    return_data = {
+        'zato_clusters': req.zato.clusters,
+        'cluster_id': req.zato.cluster_id,
+        'choose_cluster_form':req.zato.choose_cluster_form,
+        'lag': lag,
+        'hub_time': hub_time,
+        'blocks': blocks,
+        'greenlets': greenlets,
+    }
+
+    return TemplateResponse(req, 'zato/stats/hub-monitor.html', return_data)
+
+@method_allowed('POST')
+def hub_monitor_reset(req):
+    req.zato.client.invoke('zato.stats.hub-monitor.reset', {})
+    messages.add_message(req, messages.INFO, 'Hub monitor statistics reset', extra_tags='success')
+
+    return redirect('{}?cluster={}'.format(reverse('stats-hub-monitor'), req.zato.cluster_id))
+
+# ##############################################################################